@@ -11,11 +11,18 @@ import SOPEditor from '@/components/SOPEditor';
 import SOPExporter from '@/components/SOPExporter';
 import LanguageSwitcher from '@/components/LanguageSwitcher';
 import { useWebSocket } from '@/hooks/useWebSocket';
-import { SOPBlock } from '@/types/sop';
+import { SOPBlock, SOPStreamBlock } from '@/types/sop';
 import { notificationManager } from '@/utils/notifications';
 import { API_ENDPOINTS } from '@/config/api';
 import Icon from '@/components/Icon';
 
+interface SpeechSentence {
+  sentence_id: number;
+  text: string;
+  begin_time: number;
+  end_time: number;
+}
+
 function AppTitle() {
   const { t } = useI18n();
   return <>{t('common.app_title')}</>;
@@ -79,6 +86,8 @@ export default function Home() {
     isEdited?: boolean;
     editedText?: string;
   }[] | null>(null);
+  // 增量语音识别过程中已返回的句子（识别完成后清空）
+  const [speechPartialResults, setSpeechPartialResults] = useState<SpeechSentence[] | null>(null);
   
   const [videoUnderstandingResult, setVideoUnderstandingResult] = useState<string>('');
   const [segmentResults, setSegmentResults] = useState<{
@@ -106,8 +115,18 @@ export default function Home() {
     editedText?: string;
   }[]) => {
     setSpeechRecognitionResult(results);
-  }, []);
+    // 同步编辑后的结果到后端：请求未携带语音文本时，后端回退到这一版本而不是原始识别结果
+    fetch(API_ENDPOINTS.UPDATE_TRANSCRIPT, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ client_session_id: clientSessionId, sentences: results }),
+      mode: 'cors',
+      credentials: 'omit'
+    }).catch(err => console.error('同步语音识别编辑失败:', err));
+  }, [clientSessionId]);
   const [refinedSopBlocks, setRefinedSopBlocks] = useState<SOPBlock[]>([]);
+  // 解析/精修过程中逐块推送的区块
+  const [sopStreamBlocks, setSopStreamBlocks] = useState<SOPStreamBlock[]>([]);
   const [sopParsePrompt, setSopParsePrompt] = useState<string>('');
   const [sopRefinePrompt, setSopRefinePrompt] = useState<string>('');
   const [notificationEnabled, setNotificationEnabled] = useState(false);
@@ -149,7 +168,16 @@ export default function Home() {
         
       // 注意：不在这里添加操作记录，因为onFileRemoved回调已经处理了
       // 这避免了重复的操作记录
+    } else if (data.type === 'speech_recognition_partial') {
+      // 增量识别：合并分块句子（分块可能乱序完成，按开始时间排序）
+      const sentences = (data.sentences as SpeechSentence[]) || [];
+      setSpeechPartialResults(prev => {
+        const merged = [...(prev || []), ...sentences].sort((a, b) => a.begin_time - b.begin_time);
+        return merged.map((sentence, index) => ({ ...sentence, sentence_id: index + 1 }));
+      });
     } else if (data.type === 'speech_recognition_complete') {
+      setSpeechPartialResults(null);
+
       // 发送通知
       if (notificationEnabled) {
         notificationManager.sendNotification(
@@ -232,6 +260,14 @@ export default function Home() {
       if (typeof data.result === 'string') {
         setVideoUnderstandingResult(data.result);
       }
+    } else if (data.type === 'sop_block') {
+      // 解析/精修过程中逐块推送的区块
+      const streamBlock = {
+        operation: data.operation as SOPStreamBlock['operation'],
+        order: data.order as number[],
+        block: data.block as SOPBlock
+      };
+      setSopStreamBlocks(prev => [...prev, streamBlock]);
     } else if (data.type === 'sop_parse_complete') {
       // 发送通知
       if (notificationEnabled) {
@@ -479,8 +515,9 @@ export default function Home() {
       const controller = new AbortController();
       const timeoutId = setTimeout(() => controller.abort(), timeoutMs);
       
-      const requestBody: { client_session_id: string; vocabulary?: string[] } = {
-        client_session_id: clientSessionId
+      const requestBody: { client_session_id: string; vocabulary?: string[]; incremental: boolean } = {
+        client_session_id: clientSessionId,
+        incremental: true  // 分块识别，通过 speech_recognition_partial 消息增量返回
       };
       
       // 如果有易错词，添加到请求体中
@@ -488,6 +525,7 @@ export default function Home() {
         requestBody.vocabulary = vocabulary;
       }
       
+      setSpeechPartialResults(null);
       const response = await fetch(API_ENDPOINTS.SPEECH_RECOGNITION, {
         method: 'POST',
         headers: {
@@ -675,6 +713,7 @@ export default function Home() {
       message: '开始SOP拆解',
     };
     setOperationRecords(prev => [...prev, parseStartRecord]);
+    setSopStreamBlocks([]);
 
     // 从环境变量获取超时时间，默认20分钟
     const timeoutMs = parseInt(process.env.NEXT_PUBLIC_SOP_PARSE_TIMEOUT || '1200000', 10);
@@ -724,9 +763,10 @@ export default function Home() {
   };
 
   // SOP精修处理函数
-  const handleRefineSOP = async (blocks: SOPBlock[], userNotes: string) => {
+  const handleRefineSOP = async (blocks: SOPBlock[], userNotes: string, targetBlockIds?: string[]) => {
     // 从环境变量获取超时时间，默认20分钟
     const timeoutMs = parseInt(process.env.NEXT_PUBLIC_SOP_REFINE_TIMEOUT || '1200000', 10);
+    setSopStreamBlocks([]);
     
     try {
       // 保存精修提示词
@@ -744,6 +784,7 @@ export default function Home() {
         body: JSON.stringify({ 
           blocks, 
           user_notes: userNotes,
+          target_block_ids: targetBlockIds,
           client_session_id: clientSessionId
         }),
         // 添加代理绕过设置
@@ -928,6 +969,7 @@ export default function Home() {
             autoError={autoSpeechRecognitionError}
             onAddOperationRecord={(record) => setOperationRecords(prev => [...prev, record])}
             initialVocabulary={exampleVideoVocabulary}
+            partialResults={speechPartialResults}
           />
         </div>
         
@@ -952,6 +994,7 @@ export default function Home() {
             onParseSOP={handleParseSOP}
             onRefineSOP={handleRefineSOP}
             onBlocksChange={handleSopBlocksChange}
+            streamingBlocks={sopStreamBlocks}
             onRefinementApplied={() => {
               // 当精修结果被应用到编辑区时，清空精修区
               setRefinedSopBlocks([]);
@@ -15,6 +15,7 @@ interface Message {
     message?: string;
   };
   isToolResult?: boolean;
+  isStreaming?: boolean;  // 已开始接收增量内容
   uploadResult?: {
     video_url: string;
     audio_url: string;
@@ -44,7 +45,16 @@ export default function ChatSidebar() {
             const newMessages = [...prev];
             const lastMessage = newMessages[newMessages.length - 1];
             if (lastMessage && lastMessage.type === 'assistant' && data.content) {
-              lastMessage.content = data.content;
+              if (data.delta) {
+                // 增量内容：追加（第一段增量替换工具调用等占位文本）
+                newMessages[newMessages.length - 1] = {
+                  ...lastMessage,
+                  content: (lastMessage.isStreaming ? lastMessage.content : '') + data.content,
+                  isStreaming: true
+                };
+              } else {
+                lastMessage.content = data.content;
+              }
               return newMessages;
             }
             return prev;
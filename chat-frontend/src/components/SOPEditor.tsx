@@ -2,7 +2,7 @@
 
 import React, { useState, useCallback, useEffect, useRef } from 'react';
 import { useI18n } from '@/i18n';
-import { SOPBlock } from '@/types/sop';
+import { SOPBlock, SOPBlocksData, SOPStreamBlock } from '@/types/sop';
 import SOPBlockItem from './SOPBlockItem';
 import FloatingVideoPlayer from './FloatingVideoPlayer';
 import Icon from './Icon';
@@ -26,12 +26,21 @@ interface SOPEditorProps {
   manuscript?: string;
   videoUrl?: string;
   onParseSOP?: (manuscript: string) => Promise<{ blocks: SOPBlock[] }>;
-  onRefineSOP?: (blocks: SOPBlock[], userNotes: string) => Promise<{ blocks: SOPBlock[] }>;
+  onRefineSOP?: (blocks: SOPBlock[], userNotes: string, targetBlockIds?: string[]) => Promise<SOPBlocksData>;
   onBlocksChange?: (blocks: SOPBlock[]) => void;
   onRefinementApplied?: () => void;
   initialBlocks?: SOPBlock[];
+  streamingBlocks?: SOPStreamBlock[];  // 解析/精修过程中逐块推送的区块
 }
 
+// 按 order 字典序比较（即文档顺序）
+const compareStreamOrder = (a: SOPStreamBlock, b: SOPStreamBlock): number => {
+  for (let i = 0; i < Math.min(a.order.length, b.order.length); i++) {
+    if (a.order[i] !== b.order[i]) return a.order[i] - b.order[i];
+  }
+  return a.order.length - b.order.length;
+};
+
 interface SortableBlockItemProps {
   block: SOPBlock;
   index: number;
@@ -126,7 +135,8 @@ const SOPEditor: React.FC<SOPEditorProps> = ({
   onRefineSOP,
   onBlocksChange,
   onRefinementApplied,
-  initialBlocks = []
+  initialBlocks = [],
+  streamingBlocks = []
 }) => {
   const { t } = useI18n();
   // 状态管理
@@ -171,6 +181,28 @@ const SOPEditor: React.FC<SOPEditorProps> = ({
   }, [blocksA, onBlocksChange]);
 
 
+  // 解析/精修进行中时渐进显示已推送的区块，最终结果返回后被完整结果替换
+  useEffect(() => {
+    if (isParsing) {
+      const parsed = streamingBlocks.filter(item => item.operation === 'parse');
+      if (parsed.length > 0) {
+        setBlocksA([...parsed].sort(compareStreamOrder).map(item => ({
+          ...item.block,
+          id: `stream_${item.order.join('_')}`
+        })));
+      }
+    } else if (isRefining) {
+      const refined = new Map(
+        streamingBlocks.filter(item => item.operation === 'refine').map(item => [item.block.id, item.block])
+      );
+      if (refined.size > 0) {
+        setBlocksB(blocksA.map(block => refined.get(block.id) ?? block));
+      }
+    }
+    // 只在推送的区块变化时更新
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [streamingBlocks]);
+
   // 生成唯一ID
   const generateId = useCallback(() => {
     return `block_${Date.now()}_${Math.random().toString(36).substr(2, 9)}`;
@@ -181,12 +213,15 @@ const SOPEditor: React.FC<SOPEditorProps> = ({
     if (!manuscript || !onParseSOP) return;
     
     setIsParsing(true);
+    const previousBlocks = blocksA;
     try {
       const result = await onParseSOP(manuscript);
       setBlocksA(result.blocks);
       // 通知父组件blocks变化
       onBlocksChange?.(result.blocks);
     } catch (error) {
+      // 解析失败时恢复逐块推送前的区块
+      setBlocksA(previousBlocks);
       console.error('拆解SOP失败:', error);
       alert('拆解SOP失败，请重试');
     } finally {
@@ -199,10 +234,22 @@ const SOPEditor: React.FC<SOPEditorProps> = ({
     if (!onRefineSOP || blocksA.length === 0) return;
     
     setIsRefining(true);
+    const previousRefinedBlocks = blocksB;
     try {
-      const result = await onRefineSOP(blocksA, userNotes);
+      // 选中了区块时只精修选中的区块，否则由后端根据批注定位
+      const targetBlockIds = selectedBlocks.size > 0 ? Array.from(selectedBlocks) : undefined;
+      const result = await onRefineSOP(blocksA, userNotes, targetBlockIds);
       setBlocksB(result.blocks);
+      // 部分区块精修失败时提示用户（这些区块保持原内容）
+      if (result.failed_blocks && result.failed_blocks.length > 0) {
+        alert(t('sop.refine_partial_failed', {
+          count: result.failed_blocks.length,
+          ids: result.failed_blocks.map(item => item.id).join(', ')
+        }));
+      }
     } catch (error) {
+      // 精修失败时恢复逐块推送前的精修结果
+      setBlocksB(previousRefinedBlocks);
       console.error('AI精修失败:', error);
       alert('AI精修失败，请重试');
     } finally {
@@ -525,6 +572,11 @@ const SOPEditor: React.FC<SOPEditorProps> = ({
             <div className="mt-2 flex justify-between">
               <span className="text-xs text-gray-500">
                 {userNotes.length}/500 {t('sop.chars')}
+                {selectedBlocks.size > 0 && (
+                  <span className="ml-2 text-purple-600">
+                    {t('sop.refine_selected_hint', { count: selectedBlocks.size })}
+                  </span>
+                )}
               </span>
               <button
                 onClick={handleRefine}
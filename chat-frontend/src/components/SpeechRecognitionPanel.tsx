@@ -28,6 +28,7 @@ interface SpeechRecognitionPanelProps {
   autoError?: string | null;  // 新增：自动触发的错误信息
   onAddOperationRecord?: (record: OperationRecord) => void;  // 新增：添加操作记录的回调
   initialVocabulary?: string;  // 新增：初始易错词（用于示例视频）
+  partialResults?: SpeechResult[] | null;  // 增量识别过程中已返回的句子
 }
 
 export default function SpeechRecognitionPanel({ 
@@ -37,7 +38,8 @@ export default function SpeechRecognitionPanel({
   autoTriggered = false,
   autoError = null,
   onAddOperationRecord,
-  initialVocabulary
+  initialVocabulary,
+  partialResults = null
 }: SpeechRecognitionPanelProps) {
   const { t } = useI18n();
   const [isProcessing, setIsProcessing] = useState(false);
@@ -63,6 +65,13 @@ export default function SpeechRecognitionPanel({
     }
   }, [initialVocabulary, vocabularyInitialized]);
 
+  // 增量识别：识别进行中时先展示已返回的句子
+  useEffect(() => {
+    if (isProcessing && partialResults && partialResults.length > 0) {
+      setResults(partialResults);
+    }
+  }, [isProcessing, partialResults]);
+
   // 当 autoTriggered 变为 false 时，重置自动触发标记
   useEffect(() => {
     if (!autoTriggered) {
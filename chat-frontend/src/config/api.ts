@@ -33,6 +33,7 @@ export const API_ENDPOINTS = {
   
   // AI 处理
   SPEECH_RECOGNITION: `${API_BASE_URL}/speech_recognition`,
+  UPDATE_TRANSCRIPT: `${API_BASE_URL}/update_transcript`,
   VIDEO_UNDERSTANDING: `${API_BASE_URL}/video_understanding`,
   VIDEO_UNDERSTANDING_LONG: `${API_BASE_URL}/video_understanding_long`,
   GET_VIDEO_DURATION: `${API_BASE_URL}/get_video_duration`,
@@ -1,5 +1,6 @@
 import { useEffect, useRef, useState, useCallback } from 'react';
 import { WS_ENDPOINTS } from '@/config/api';
+import { decodeFrame, getSubprotocols } from '@/utils/wsCodec';
 
 interface WebSocketMessage {
   type: string;
@@ -58,11 +59,15 @@ export function useWebSocket(options: UseWebSocketOptions = {}) {
     isConnectingRef.current = true;
     
     try {
-      const ws = new WebSocket(wsUrl);
+      // 声明支持的帧编码，服务端选择 msgpack 二进制帧或 JSON 文本帧
+      const ws = new WebSocket(wsUrl, getSubprotocols());
+      ws.binaryType = 'arraybuffer';
       wsRef.current = ws;
+      // 压缩帧需异步解压，按到达顺序依次处理
+      let decodeChain: Promise<void> = Promise.resolve();
 
       ws.onopen = () => {
-        console.log('WebSocket 连接已建立');
+        console.log('WebSocket 连接已建立，帧编码:', ws.protocol || 'json');
         setIsConnected(true);
         setError(null);
         reconnectAttemptsRef.current = 0;
@@ -82,14 +87,16 @@ export function useWebSocket(options: UseWebSocketOptions = {}) {
       };
 
       ws.onmessage = (event) => {
-        try {
-          const data = JSON.parse(event.data);
-          console.log('收到消息:', data);
-          onMessage?.(data);
-        } catch (err) {
-          console.error('解析消息失败:', err);
-          setError('消息解析失败');
-        }
+        decodeChain = decodeChain.then(async () => {
+          try {
+            const data = await decodeFrame(event.data) as WebSocketMessage;
+            console.log('收到消息:', data);
+            onMessage?.(data);
+          } catch (err) {
+            console.error('解析消息失败:', err);
+            setError('消息解析失败');
+          }
+        });
       };
 
       ws.onclose = (event) => {
@@ -190,6 +190,8 @@ export const enSOP = {
     chars: 'chars',
     refining: 'Refining...',
     refine_action: 'AI Refine (Qwen-Plus)',
+    refine_selected_hint: '{count} blocks selected, only selected blocks will be refined',
+    refine_partial_failed: '{count} blocks failed to refine and were left unchanged: {ids}',
     select_this_block: 'Select this block',
     drag_to_sort: 'Drag to sort'
   }
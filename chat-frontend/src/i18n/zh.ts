@@ -190,6 +190,8 @@ export const zhSOP = {
     chars: '字符',
     refining: '精修中...',
     refine_action: 'AI精修 (Qwen-Plus)',
+    refine_selected_hint: '已选中 {count} 个区块，只精修选中的区块',
+    refine_partial_failed: '{count} 个区块精修失败，已保持原内容：{ids}',
     select_this_block: '选择此区块',
     drag_to_sort: '拖动以排序',
     tooltip: {
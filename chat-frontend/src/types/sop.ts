@@ -10,9 +10,19 @@ export interface SOPBlock {
   show_play_button: boolean;
 }
 
+// 解析/精修过程中逐块推送的区块（sop_block 消息）
+export interface SOPStreamBlock {
+  operation: 'parse' | 'refine';
+  order: number[];  // 按字典序排列即为文档顺序
+  block: SOPBlock;
+}
+
 export interface SOPBlocksData {
   blocks: SOPBlock[];
   error?: string;
+  refined_block_ids?: string[];               // 局部精修时被精修的区块
+  failed_blocks?: { id: string; error: string }[];  // 局部精修中失败的区块（保持原内容）
+  warning?: string;
 }
 
 // API请求/响应类型
@@ -28,6 +38,7 @@ export interface ParseSOPResponse {
 export interface RefineSOPRequest {
   blocks: SOPBlock[];
   user_notes: string;
+  target_block_ids?: string[];  // SOPEditor 中选中的区块，只精修这些区块
 }
 
 export interface RefineSOPResponse {
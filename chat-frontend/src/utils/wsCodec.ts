@@ -0,0 +1,121 @@
+/**
+ * WebSocket 帧解码：与后端 ws_codec 对应
+ * 握手时声明子协议 v2s.msgpack（二进制）与 v2s.json（回退），由服务端选择其一。
+ * 二进制帧首字节为标志位：0 = msgpack，1 = 原始 deflate 压缩后的 msgpack。
+ */
+
+export const BINARY_SUBPROTOCOL = 'v2s.msgpack';
+export const JSON_SUBPROTOCOL = 'v2s.json';
+
+const FLAG_DEFLATE = 1;
+
+/**
+ * 客户端声明的子协议；浏览器不支持 deflate-raw 解压时只声明 JSON
+ */
+export function getSubprotocols(): string[] {
+  if (typeof DecompressionStream === 'undefined') {
+    return [JSON_SUBPROTOCOL];
+  }
+  try {
+    new DecompressionStream('deflate-raw');
+    return [BINARY_SUBPROTOCOL, JSON_SUBPROTOCOL];
+  } catch {
+    return [JSON_SUBPROTOCOL];
+  }
+}
+
+async function inflateRaw(data: ArrayBuffer): Promise<Uint8Array> {
+  const stream = new Blob([data]).stream().pipeThrough(new DecompressionStream('deflate-raw'));
+  return new Uint8Array(await new Response(stream).arrayBuffer());
+}
+
+/**
+ * 解码服务端消息：文本帧按 JSON 解析，二进制帧按标志位解压后 msgpack 解码
+ */
+export async function decodeFrame(data: string | ArrayBuffer): Promise<unknown> {
+  if (typeof data === 'string') {
+    return JSON.parse(data);
+  }
+  const frame = new Uint8Array(data);
+  const payload = frame[0] === FLAG_DEFLATE ? await inflateRaw(data.slice(1)) : frame.subarray(1);
+  return decodeMsgpack(payload);
+}
+
+const textDecoder = new TextDecoder();
+
+/**
+ * msgpack 解码（覆盖后端由 JSON 转换而来的类型：nil/bool/整数/浮点/字符串/数组/映射，以及 bin）
+ */
+export function decodeMsgpack(bytes: Uint8Array): unknown {
+  const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+  let offset = 0;
+
+  const readString = (length: number) => {
+    const value = textDecoder.decode(bytes.subarray(offset, offset + length));
+    offset += length;
+    return value;
+  };
+  const readBinary = (length: number) => {
+    const value = bytes.slice(offset, offset + length);
+    offset += length;
+    return value;
+  };
+  const readArray = (length: number): unknown[] => {
+    const items = new Array(length);
+    for (let i = 0; i < length; i++) {
+      items[i] = read();
+    }
+    return items;
+  };
+  const readMap = (length: number): Record<string, unknown> => {
+    const result: Record<string, unknown> = {};
+    for (let i = 0; i < length; i++) {
+      const key = String(read());
+      result[key] = read();
+    }
+    return result;
+  };
+  const u8 = () => view.getUint8(offset++);
+  const u16 = () => { const v = view.getUint16(offset); offset += 2; return v; };
+  const u32 = () => { const v = view.getUint32(offset); offset += 4; return v; };
+
+  function read(): unknown {
+    const byte = u8();
+    if (byte <= 0x7f) return byte;
+    if (byte >= 0xe0) return byte - 0x100;
+    if ((byte & 0xf0) === 0x80) return readMap(byte & 0x0f);
+    if ((byte & 0xf0) === 0x90) return readArray(byte & 0x0f);
+    if ((byte & 0xe0) === 0xa0) return readString(byte & 0x1f);
+
+    let value: number;
+    switch (byte) {
+      case 0xc0: return null;
+      case 0xc2: return false;
+      case 0xc3: return true;
+      case 0xc4: return readBinary(u8());
+      case 0xc5: return readBinary(u16());
+      case 0xc6: return readBinary(u32());
+      case 0xca: value = view.getFloat32(offset); offset += 4; return value;
+      case 0xcb: value = view.getFloat64(offset); offset += 8; return value;
+      case 0xcc: return u8();
+      case 0xcd: return u16();
+      case 0xce: return u32();
+      case 0xcf: value = Number(view.getBigUint64(offset)); offset += 8; return value;
+      case 0xd0: value = view.getInt8(offset); offset += 1; return value;
+      case 0xd1: value = view.getInt16(offset); offset += 2; return value;
+      case 0xd2: value = view.getInt32(offset); offset += 4; return value;
+      case 0xd3: value = Number(view.getBigInt64(offset)); offset += 8; return value;
+      case 0xd9: return readString(u8());
+      case 0xda: return readString(u16());
+      case 0xdb: return readString(u32());
+      case 0xdc: return readArray(u16());
+      case 0xdd: return readArray(u32());
+      case 0xde: return readMap(u16());
+      case 0xdf: return readMap(u32());
+      default:
+        throw new Error(`不支持的 msgpack 类型: 0x${byte.toString(16)}`);
+    }
+  }
+
+  return read();
+}
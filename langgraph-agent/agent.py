@@ -1,9 +1,13 @@
+import asyncio
 from typing import TypedDict, List, Annotated
 from langgraph.graph import StateGraph, END
 from langchain_core.messages import BaseMessage, ToolMessage, AIMessage, HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableLambda
 from qwen_model import QwenChatModel
 from speech_tool import speech_recognition
 
+SYSTEM_PROMPT = "你是一个智能助手，能够调用工具来帮助用户。当用户询问你的能力时，请明确说明你可以调用语音识别工具来转录音频文件。"
+
 class AgentState(TypedDict):
     """Agent 状态定义"""
     messages: Annotated[List[BaseMessage], "对话消息列表"]
@@ -18,6 +22,45 @@ class QwenAgent:
         self.llm_with_tools = self.llm  # 不再绑定工具
         self.graph = self._build_graph()
     
+    @staticmethod
+    def _with_system_prompt(chat_history: List[BaseMessage]) -> List[BaseMessage]:
+        """将默认系统提示词放在首位，并合并历史中的其他系统消息（模型只接受开头的一条系统消息）"""
+        system_parts = [SYSTEM_PROMPT]
+        others = []
+        for msg in chat_history:
+            if isinstance(msg, SystemMessage):
+                if msg.content and msg.content != SYSTEM_PROMPT:
+                    system_parts.append(msg.content)
+            else:
+                others.append(msg)
+        return [SystemMessage(content="\n\n".join(system_parts))] + others
+    
+    @staticmethod
+    def _detect_tool_calls(last_message) -> list:
+        """检查用户消息中是否包含音频URL和转录关键词，返回需要执行的工具调用"""
+        tool_calls = []
+        if last_message and isinstance(last_message, HumanMessage):
+            import re
+            content = last_message.content
+            
+            # 提取所有URL
+            url_pattern = r'https?://[^\s<>"]+'
+            urls = re.findall(url_pattern, content)
+            
+            # 检查是否包含转录相关关键词
+            transcription_keywords = ['转录', '音频', '语音', '识别', '转写', '听写', '语音转文字']
+            has_transcription_keyword = any(keyword in content.lower() for keyword in transcription_keywords)
+            
+            # 如果包含URL和转录关键词，则调用语音识别工具
+            if urls and has_transcription_keyword:
+                for i, url in enumerate(urls):
+                    tool_calls.append({
+                        'name': 'speech_recognition',
+                        'args': {'file_url': url},
+                        'id': f'tool_call_{i}_{hash(url) % 10000}'
+                    })
+        return tool_calls
+    
     def _build_graph(self) -> StateGraph:
         """构建 LangGraph 状态图"""
         
@@ -29,29 +72,7 @@ class QwenAgent:
                 
                 # 检查最后一条消息是否需要工具调用
                 last_message = messages[-1] if messages else None
-                tool_calls = []
-                
-                if last_message and isinstance(last_message, HumanMessage):
-                    # 检查用户消息中是否包含音频URL和转录关键词
-                    import re
-                    content = last_message.content
-                    
-                    # 提取所有URL
-                    url_pattern = r'https?://[^\s<>"]+'
-                    urls = re.findall(url_pattern, content)
-                    
-                    # 检查是否包含转录相关关键词
-                    transcription_keywords = ['转录', '音频', '语音', '识别', '转写', '听写', '语音转文字']
-                    has_transcription_keyword = any(keyword in content.lower() for keyword in transcription_keywords)
-                    
-                    # 如果包含URL和转录关键词，则调用语音识别工具
-                    if urls and has_transcription_keyword:
-                        for i, url in enumerate(urls):
-                            tool_calls.append({
-                                'name': 'speech_recognition',
-                                'args': {'file_url': url},
-                                'id': f'tool_call_{i}_{hash(url) % 10000}'
-                            })
+                tool_calls = self._detect_tool_calls(last_message)
                 
                 if tool_calls:
                     # 如果需要工具调用，创建包含工具调用的AI消息
@@ -71,6 +92,28 @@ class QwenAgent:
                 messages.append(error_msg)
                 return {"messages": messages}
         
+        async def acall_qwen(state: AgentState) -> AgentState:
+            """call_qwen 的异步版本：通过原生异步客户端调用模型，不占用线程池"""
+            try:
+                messages = state["messages"]
+                
+                last_message = messages[-1] if messages else None
+                tool_calls = self._detect_tool_calls(last_message)
+                
+                if tool_calls:
+                    response = AIMessage(content="我来帮您转录这个音频文件。", tool_calls=tool_calls)
+                else:
+                    response = await self.llm_with_tools.ainvoke(messages)
+                
+                messages.append(response)
+                
+                return {"messages": messages}
+            except Exception as e:
+                error_msg = AIMessage(content=f"抱歉，处理您的请求时出现了错误：{str(e)}")
+                messages = state["messages"]
+                messages.append(error_msg)
+                return {"messages": messages}
+        
         def call_tools(state: AgentState) -> AgentState:
             """执行工具调用"""
             messages = state["messages"]
@@ -98,6 +141,29 @@ class QwenAgent:
             
             return {"messages": messages}
         
+        async def acall_tools(state: AgentState) -> AgentState:
+            """call_tools 的异步版本"""
+            messages = state["messages"]
+            last_message = messages[-1]
+            
+            if hasattr(last_message, 'tool_calls') and last_message.tool_calls:
+                for tool_call in last_message.tool_calls:
+                    if tool_call['name'] == 'speech_recognition':
+                        file_url = tool_call['args']['file_url']
+                        # 语音识别仍为同步SDK（轮询任务状态），放到线程中执行
+                        result = await asyncio.to_thread(speech_recognition, file_url)
+                        
+                        tool_message = ToolMessage(
+                            content=result,
+                            tool_call_id=tool_call['id']
+                        )
+                        messages.append(tool_message)
+                
+                final_response = await self.llm.ainvoke(messages)
+                messages.append(final_response)
+            
+            return {"messages": messages}
+        
         def should_continue(state: AgentState) -> str:
             """判断是否继续执行工具调用"""
             messages = state["messages"]
@@ -113,8 +179,9 @@ class QwenAgent:
         workflow = StateGraph(AgentState)
         
         # 添加节点
-        workflow.add_node("qwen", call_qwen)
-        workflow.add_node("tools", call_tools)
+        # 同时提供同步与异步实现：invoke/stream 使用同步版本，ainvoke/astream 使用异步版本
+        workflow.add_node("qwen", RunnableLambda(call_qwen, afunc=acall_qwen))
+        workflow.add_node("tools", RunnableLambda(call_tools, afunc=acall_tools))
         
         # 设置入口点
         workflow.set_entry_point("qwen")
@@ -140,10 +207,8 @@ class QwenAgent:
         if chat_history is None:
             chat_history = []
         
-        # 确保有系统消息（只在第一次对话时添加）
-        if not chat_history or not any(isinstance(msg, SystemMessage) for msg in chat_history):
-            system_message = SystemMessage(content="你是一个智能助手，能够调用工具来帮助用户。当用户询问你的能力时，请明确说明你可以调用语音识别工具来转录音频文件。")
-            chat_history = [system_message] + chat_history
+        # 确保系统消息在首位（历史摘要等附加系统消息合并进去）
+        chat_history = self._with_system_prompt(chat_history)
         
         # 添加用户消息
         from langchain_core.messages import HumanMessage
@@ -159,31 +224,36 @@ class QwenAgent:
         if chat_history is None:
             chat_history = []
         
-        # 确保有系统消息（只在第一次对话时添加）
-        if not chat_history or not any(isinstance(msg, SystemMessage) for msg in chat_history):
-            system_message = SystemMessage(content="你是一个智能助手，能够调用工具来帮助用户。当用户询问你的能力时，请明确说明你可以调用语音识别工具来转录音频文件。")
-            chat_history = [system_message] + chat_history
+        # 确保系统消息在首位（历史摘要等附加系统消息合并进去）
+        chat_history = self._with_system_prompt(chat_history)
         
         # 添加用户消息
         from langchain_core.messages import HumanMessage
         chat_history.append(HumanMessage(content=user_message))
         
-        # 流式执行图
-        async for chunk in self.graph.astream({"messages": chat_history}):
-            # 处理 qwen 节点的响应
-            if "qwen" in chunk:
-                messages = chunk["qwen"]["messages"]
-                if messages:
-                    last_message = messages[-1]
-                    yield last_message
+        # 流式执行图：通过 astream_events 获取模型的逐 token 增量
+        # 产出 AIMessageChunk（文本增量）；未经流式生成的节点输出（如工具调用消息、错误消息）以完整消息产出
+        graph_nodes = ("qwen", "tools")
+        streamed_nodes = set()
+        async for event in self.graph.astream_events({"messages": chat_history}, version="v2"):
+            kind = event["event"]
+            node = event.get("metadata", {}).get("langgraph_node")
             
-            # 处理 tools 节点的响应
-            if "tools" in chunk:
-                messages = chunk["tools"]["messages"]
-                if messages:
-                    last_message = messages[-1]
-                    if hasattr(last_message, 'content') and last_message.content:
-                        yield last_message
+            if kind == "on_chat_model_stream" and node in graph_nodes:
+                chunk = event["data"]["chunk"]
+                if chunk.content:
+                    streamed_nodes.add(node)
+                    yield chunk
+            
+            elif kind == "on_chain_end" and event["name"] in graph_nodes and node == event["name"]:
+                output = event["data"].get("output") or {}
+                messages = output.get("messages") if isinstance(output, dict) else None
+                if not messages:
+                    continue
+                last_message = messages[-1]
+                has_tool_calls = bool(getattr(last_message, 'tool_calls', None))
+                if has_tool_calls or (node not in streamed_nodes and getattr(last_message, 'content', None)):
+                    yield last_message
     
     def stream_chat(self, user_message: str, chat_history: List[BaseMessage] = None):
         """同步流式聊天方法"""
@@ -5,7 +5,7 @@
 import os
 import subprocess
 import tempfile
-from typing import Optional
+from typing import Dict, List, Optional
 
 def extract_audio_from_video(video_file_path: str, output_audio_path: Optional[str] = None) -> str:
     """
@@ -55,6 +55,45 @@ def extract_audio_from_video(video_file_path: str, output_audio_path: Optional[s
     except Exception as e:
         raise Exception(f"Audio extraction failed: {str(e)}")
 
+def split_audio_into_chunks(audio_file_path: str, chunks: List[Dict], output_dir: Optional[str] = None) -> List[str]:
+    """
+    按给定的时间窗口将音频切分为多个片段（流拷贝，不重新编码）
+
+    Args:
+        audio_file_path: 音频文件路径
+        chunks: 时间窗口列表，每项包含 chunk_index, start_time, end_time（秒）
+        output_dir: 输出目录，如果为None则使用临时目录
+
+    Returns:
+        与 chunks 一一对应的片段文件路径列表
+    """
+    if output_dir is None:
+        output_dir = tempfile.mkdtemp(prefix="audio_chunks_")
+    os.makedirs(output_dir, exist_ok=True)
+
+    chunk_paths = []
+    for chunk in chunks:
+        chunk_path = os.path.join(output_dir, f"chunk_{chunk['chunk_index']:03d}.mp3")
+        cmd = [
+            'ffmpeg',
+            '-ss', str(chunk['start_time']),
+            '-t', str(chunk['end_time'] - chunk['start_time']),
+            '-i', audio_file_path,
+            '-c', 'copy',  # mp3 可直接流拷贝，切分速度快
+            '-y',
+            chunk_path
+        ]
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+        except subprocess.TimeoutExpired:
+            raise Exception(f"Audio chunk {chunk['chunk_index']} split timed out")
+
+        if result.returncode != 0 or not os.path.exists(chunk_path):
+            raise Exception(f"Audio chunk {chunk['chunk_index']} split failed: {result.stderr}")
+        chunk_paths.append(chunk_path)
+
+    return chunk_paths
+
 def check_ffmpeg_available() -> bool:
     """
     检查ffmpeg是否可用
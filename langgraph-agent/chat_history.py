@@ -0,0 +1,246 @@
+"""
+会话历史管理：按 token 预算保留最近对话原文，较早的对话在两轮之间异步折叠为滚动摘要，
+同时限制每轮请求的提示词大小和每个会话在内存中保留的历史量。
+"""
+
+import os
+import re
+import asyncio
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from rate_limiter import PRIORITY_BACKGROUND
+
+# 最近对话原文的 token 预算
+HISTORY_RECENT_TOKENS = int(os.getenv('HISTORY_RECENT_TOKENS', '3000'))
+# 每轮请求中历史部分（摘要 + 待折叠 + 最近对话）的 token 上限
+HISTORY_PROMPT_TOKENS = int(os.getenv('HISTORY_PROMPT_TOKENS', '6000'))
+# 摘要长度上限（token）
+HISTORY_SUMMARY_TOKENS = int(os.getenv('HISTORY_SUMMARY_TOKENS', '800'))
+# 等待折叠的对话上限（摘要跟不上时丢弃最早的对话，限制内存）
+HISTORY_PENDING_TOKENS = int(os.getenv('HISTORY_PENDING_TOKENS', '8000'))
+# 无论预算多少，至少原样保留的最近消息数（一问一答为2条）
+HISTORY_MIN_RECENT_MESSAGES = 2
+
+_CJK_PATTERN = re.compile(r'[　-〿㐀-䶿一-鿿＀-￯]')
+
+SUMMARY_PROMPT = """请将以下对话整合进已有的对话摘要中，生成一份新的摘要。
+要求：保留用户的目标、偏好、已确认的事实和尚未解决的问题；删除寒暄和重复内容；不超过{max_chars}字；只输出摘要正文。
+
+【已有摘要】
+{summary}
+
+【新增对话】
+{dialogue}"""
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本 token 数：中日韩字符约1个token，其余字符约4个字符1个token"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4 + 1
+
+
+def message_tokens(message: BaseMessage) -> int:
+    """单条消息的 token 数（含角色等固定开销）"""
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    return estimate_tokens(content) + 4
+
+
+class ChatHistoryManager:
+    """单个会话的对话历史"""
+
+    def __init__(
+        self,
+        recent_tokens: int = HISTORY_RECENT_TOKENS,
+        prompt_tokens: int = HISTORY_PROMPT_TOKENS,
+        summary_tokens: int = HISTORY_SUMMARY_TOKENS,
+        pending_tokens: int = HISTORY_PENDING_TOKENS
+    ):
+        self.recent_tokens_budget = recent_tokens
+        self.prompt_tokens_budget = prompt_tokens
+        self.summary_tokens_budget = summary_tokens
+        self.pending_tokens_budget = pending_tokens
+
+        self.summary = ""
+        self.summary_tokens = 0
+        # (消息, token数)
+        self._recent: Deque[Tuple[BaseMessage, int]] = deque()
+        self._recent_tokens = 0
+        self._pending: Deque[Tuple[BaseMessage, int]] = deque()
+        self._pending_tokens = 0
+        # 待折叠消息按进入顺序编号：_pending[0] 的序号，以及摘要已覆盖到的序号（不含）
+        self.pending_start = 0
+        self.summarized_through = 0
+        self.dropped_messages = 0
+        self.total_messages = 0
+        self._summary_lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        """累计消息数（与原先 list 历史的长度一致）"""
+        return self.total_messages
+
+    @property
+    def retained_tokens(self) -> int:
+        """当前内存中保留的历史 token 数"""
+        return self.summary_tokens + self._pending_tokens + self._recent_tokens
+
+    def append(self, message: BaseMessage):
+        """追加一条消息，超出最近窗口预算的较早消息移入待折叠队列"""
+        tokens = message_tokens(message)
+        self._recent.append((message, tokens))
+        self._recent_tokens += tokens
+        self.total_messages += 1
+
+        while self._recent_tokens > self.recent_tokens_budget and len(self._recent) > HISTORY_MIN_RECENT_MESSAGES:
+            old_message, old_tokens = self._recent.popleft()
+            self._recent_tokens -= old_tokens
+            self._pending.append((old_message, old_tokens))
+            self._pending_tokens += old_tokens
+
+        # 摘要跟不上时丢弃最早的待折叠消息，保证内存有上限
+        while self._pending_tokens > self.pending_tokens_budget and self._pending:
+            _, old_tokens = self._pending.popleft()
+            self._pending_tokens -= old_tokens
+            self.pending_start += 1
+            self.dropped_messages += 1
+
+    def _drop_summarized(self):
+        """移除已被摘要覆盖的待折叠消息"""
+        while self._pending and self.pending_start < self.summarized_through:
+            _, tokens = self._pending.popleft()
+            self._pending_tokens -= tokens
+            self.pending_start += 1
+        self.pending_start = max(self.pending_start, self.summarized_through)
+
+    def prompt_messages(self) -> List[BaseMessage]:
+        """
+        生成本轮请求使用的历史消息：摘要（SystemMessage）+ 预算内的待折叠消息 + 最近对话原文。
+        """
+        budget = self.prompt_tokens_budget - self.summary_tokens - self._recent_tokens
+        # 待折叠消息从新到旧加入，直到超出预算（摘要尚未覆盖它们时仍尽量保留上下文）
+        pending: List[BaseMessage] = []
+        for message, tokens in reversed(self._pending):
+            if tokens > budget:
+                break
+            pending.append(message)
+            budget -= tokens
+        pending.reverse()
+        # 以用户消息开头，避免出现孤立的AI回复
+        while pending and not isinstance(pending[0], HumanMessage):
+            pending.pop(0)
+
+        messages: List[BaseMessage] = []
+        if self.summary:
+            messages.append(SystemMessage(content=f"以下是此前对话的摘要：\n{self.summary}"))
+        messages.extend(pending)
+        messages.extend(message for message, _ in self._recent)
+        return messages
+
+    def needs_summary(self) -> bool:
+        return bool(self._pending)
+
+    async def summarize(self, llm) -> bool:
+        """将待折叠消息合并进摘要（在两轮对话之间调用）。失败时保留待折叠消息以便下次重试"""
+        async with self._summary_lock:
+            if not self._pending:
+                return False
+            batch = list(self._pending)
+            batch_end = self.pending_start + len(batch)
+            dialogue = "\n".join(
+                f"{'用户' if isinstance(message, HumanMessage) else '助手'}: {message.content}"
+                for message, _ in batch
+            )
+            max_chars = self.summary_tokens_budget
+            try:
+                # 后台摘要使用最低优先级，不延迟用户的对话请求
+                response = await llm.ainvoke([HumanMessage(content=SUMMARY_PROMPT.format(
+                    max_chars=max_chars,
+                    summary=self.summary or "（无）",
+                    dialogue=dialogue
+                ))], priority=PRIORITY_BACKGROUND)
+            except Exception as e:
+                print(f"对话摘要生成失败: {e}")
+                return False
+
+            summary = (response.content or "").strip()
+            # 硬性截断，防止模型不遵守长度要求（每个字符至多约1个token）
+            if estimate_tokens(summary) > self.summary_tokens_budget:
+                summary = summary[:self.summary_tokens_budget]
+            self.summary = summary
+            self.summary_tokens = estimate_tokens(summary)
+
+            # 按序号只移除本批已折叠的消息：摘要期间可能有新消息进入待折叠队列，
+            # 也可能有本批消息已因内存上限被丢弃
+            self.summarized_through = max(self.summarized_through, batch_end)
+            self._drop_summarized()
+            return True
+
+    def merge_summary(self, other: "ChatHistoryManager") -> bool:
+        """
+        从同一会话的另一份副本合并更新的摘要（只合并摘要相关字段，不影响本副本中更新的对话）。
+        共享状态后端下，后台摘要完成时会话可能已写入新的对话，需在最新副本上合并后写回。返回是否有变化
+        """
+        if other is self or other.summarized_through <= self.summarized_through:
+            return False
+        self.summary = other.summary
+        self.summary_tokens = other.summary_tokens
+        self.summarized_through = other.summarized_through
+        self._drop_summarized()
+        return True
+
+    def to_dict(self) -> Dict[str, Any]:
+        """序列化为可 JSON 保存的字典（用于共享状态后端）"""
+        def dump(entries):
+            return [[_message_role(message), message.content, tokens] for message, tokens in entries]
+
+        return {
+            "budgets": [self.recent_tokens_budget, self.prompt_tokens_budget,
+                        self.summary_tokens_budget, self.pending_tokens_budget],
+            "summary": self.summary,
+            "recent": dump(self._recent),
+            "pending": dump(self._pending),
+            "pending_start": self.pending_start,
+            "summarized_through": self.summarized_through,
+            "dropped_messages": self.dropped_messages,
+            "total_messages": self.total_messages
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ChatHistoryManager":
+        history = cls(*data["budgets"])
+        history.summary = data["summary"]
+        history.summary_tokens = estimate_tokens(history.summary)
+        history._recent = deque((_MESSAGE_TYPES[role](content=content), tokens) for role, content, tokens in data["recent"])
+        history._recent_tokens = sum(tokens for _, tokens in history._recent)
+        history._pending = deque((_MESSAGE_TYPES[role](content=content), tokens) for role, content, tokens in data["pending"])
+        history._pending_tokens = sum(tokens for _, tokens in history._pending)
+        history.pending_start = data.get("pending_start", 0)
+        history.summarized_through = data.get("summarized_through", 0)
+        history.dropped_messages = data["dropped_messages"]
+        history.total_messages = data["total_messages"]
+        return history
+
+    def stats(self) -> dict:
+        return {
+            "total_messages": self.total_messages,
+            "recent_messages": len(self._recent),
+            "pending_messages": len(self._pending),
+            "dropped_messages": self.dropped_messages,
+            "has_summary": bool(self.summary),
+            "retained_tokens": self.retained_tokens
+        }
+
+
+_MESSAGE_TYPES = {"human": HumanMessage, "ai": AIMessage, "system": SystemMessage}
+
+
+def _message_role(message: BaseMessage) -> str:
+    if isinstance(message, HumanMessage):
+        return "human"
+    if isinstance(message, SystemMessage):
+        return "system"
+    return "ai"
@@ -0,0 +1,385 @@
+"""
+WebSocket 连接管理器：连接与会话双向索引，每个连接一个有界发送队列，由独立的写任务按顺序发送。
+
+- 发送方（流水线协程、压缩进度回调等）只把消息放入队列，不等待客户端接收，慢客户端不会拖住生产者
+- 队列满时按溢出策略处理：drop_oldest（丢弃最早的消息，默认）/ drop_newest（丢弃新消息）/ disconnect（断开该客户端）
+- 单条消息发送超过 WS_SEND_TIMEOUT_SECONDS 视为客户端失联并断开
+- 可合并的消息（进度、阶段状态、心跳响应等）带合并键：队列中尚未发出的同键消息被最新一条原位替换
+- 可按消息类型设置最短发送间隔：间隔内只保留最新一条，到期后发出；其他消息入队前先发出这些待发消息，保持先后顺序
+- 握手时协商帧编码（见 ws_codec）：支持的客户端收到 msgpack 二进制帧（大消息 deflate 压缩），其余为 JSON 文本帧
+- 不在本 worker 上的会话经消息总线转发给持有连接的 worker
+- 指标：发送延迟（入队到发出）、单次发送耗时、队列深度、丢弃与断开次数、各编码的发送字节数
+"""
+
+import os
+import json
+import math
+import time
+import asyncio
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import ws_codec
+from ws_bus import MessageBus
+
+# 每个连接的发送队列上限（条）
+WS_SEND_QUEUE_SIZE = int(os.getenv('WS_SEND_QUEUE_SIZE', '256'))
+# 队列满时的处理策略：drop_oldest / drop_newest / disconnect
+WS_OVERFLOW_POLICY = os.getenv('WS_OVERFLOW_POLICY', 'drop_oldest')
+# 单条消息的发送超时（秒），超时视为客户端失联
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv('WS_SEND_TIMEOUT_SECONDS', '10'))
+# 二进制连接上超过该字节数的消息在线程中编码（解析 + msgpack + 压缩，避免占用事件循环）
+WS_ENCODE_OFFLOAD_BYTES = int(os.getenv('WS_ENCODE_OFFLOAD_BYTES', '65536'))
+# 延迟统计保留的样本数
+WS_LATENCY_SAMPLES = 5000
+# 可合并的消息类型（逗号分隔）：同一连接上尚未发出的同类消息只保留最新一条
+WS_COALESCE_TYPES = os.getenv('WS_COALESCE_TYPES', 'compression_progress,status,job_update,pong')
+# 各消息类型的最短发送间隔（秒），格式 "类型=秒,类型=秒"，仅对可合并的类型生效
+WS_MIN_SEND_INTERVALS = os.getenv('WS_MIN_SEND_INTERVALS', 'compression_progress=0.5,job_update=0.5')
+
+# 合并键附加字段：不同阶段的状态、不同任务的状态分别合并；缺少该字段的消息不合并
+_COALESCE_FIELDS = {"status": "stage", "job_update": "job_id"}
+_TYPE_PREFIX = '{"type": "'
+
+
+def parse_min_intervals(spec: str) -> Dict[str, float]:
+    """解析 "类型=秒,类型=秒" 形式的最短发送间隔配置"""
+    intervals = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, seconds = item.split("=", 1)
+            intervals[name.strip()] = float(seconds)
+    return intervals
+
+
+class _Connection:
+    """单个 WebSocket 连接的发送状态"""
+
+    __slots__ = ("websocket", "session_id", "queue", "keyed", "throttled", "timers", "last_released",
+                 "ready", "writer", "closed", "sent", "binary")
+
+    def __init__(self, websocket: Any, binary: bool = False):
+        self.websocket = websocket
+        # 是否使用二进制帧（握手时协商）
+        self.binary = binary
+        self.session_id: Optional[str] = None
+        # [消息, 入队时间, 合并键]；合并时原位替换消息，保留排队位置
+        self.queue: Deque[list] = deque()
+        # 合并键 -> 队列中尚未发出的条目
+        self.keyed: Dict[str, list] = {}
+        # 合并键 -> 因最短发送间隔暂存的最新消息，及其到期定时器
+        self.throttled: Dict[str, str] = {}
+        self.timers: Dict[str, asyncio.TimerHandle] = {}
+        # 合并键 -> 上次放入发送队列的时间
+        self.last_released: Dict[str, float] = {}
+        self.ready = asyncio.Event()
+        self.writer: Optional[asyncio.Task] = None
+        # 取消写任务之外再置标志：wait_for 在发送恰好完成时可能吞掉取消
+        self.closed = False
+        self.sent = 0
+
+
+def _percentile_ms(samples: Deque[float], q: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000, 3)
+
+
+class ConnectionManager:
+    """WebSocket 连接管理器；不在本 worker 上的会话经消息总线转发给持有连接的 worker"""
+
+    def __init__(self, bus: Optional[MessageBus] = None,
+                 on_session_disconnected: Optional[Callable[[str], None]] = None,
+                 queue_size: int = WS_SEND_QUEUE_SIZE, overflow_policy: str = WS_OVERFLOW_POLICY,
+                 send_timeout: float = WS_SEND_TIMEOUT_SECONDS, coalesce_types: str = WS_COALESCE_TYPES,
+                 min_intervals: str = WS_MIN_SEND_INTERVALS):
+        if overflow_policy not in ("drop_oldest", "drop_newest", "disconnect"):
+            raise ValueError(f"未知溢出策略: {overflow_policy}")
+        # 连接 -> 发送状态（含该连接注册的会话）
+        self.connections: Dict[Any, _Connection] = {}
+        # 维护 client_session_id 到 WebSocket 连接的映射
+        self.client_sessions: Dict[str, Any] = {}
+        self.bus = bus
+        self.on_session_disconnected = on_session_disconnected
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.send_timeout = send_timeout
+        self.coalesce_types = {t.strip() for t in coalesce_types.split(",") if t.strip()}
+        self.min_intervals = parse_min_intervals(min_intervals)
+        self._latencies: Deque[float] = deque(maxlen=WS_LATENCY_SAMPLES)
+        self._send_durations: Deque[float] = deque(maxlen=WS_LATENCY_SAMPLES)
+        self._counts = {"enqueued": 0, "sent": 0, "dropped": 0, "overflow_disconnects": 0, "send_failures": 0,
+                        "coalesced": 0, "throttled": 0,
+                        "json_bytes": 0, "binary_bytes": 0, "binary_payload_json_bytes": 0}
+
+    @property
+    def active_connections(self) -> List[Any]:
+        return list(self.connections)
+
+    async def connect(self, websocket: Any):
+        subprotocol = ws_codec.negotiate(getattr(websocket, "scope", {}).get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
+        self.attach(websocket, ws_codec.is_binary(subprotocol))
+        print(f"客户端已连接（{subprotocol or 'json'}），当前连接数: {len(self.connections)}")
+
+    def attach(self, websocket: Any, binary: bool = False) -> _Connection:
+        """登记已接受的连接并启动其写任务"""
+        conn = _Connection(websocket, binary)
+        conn.writer = asyncio.get_running_loop().create_task(self._write_loop(conn))
+        self.connections[websocket] = conn
+        return conn
+
+    def disconnect(self, websocket: Any):
+        conn = self.connections.pop(websocket, None)
+        if conn is None:
+            return
+        conn.closed = True
+        conn.ready.set()
+        if conn.writer is not None and conn.writer is not asyncio.current_task():
+            conn.writer.cancel()
+        for timer in conn.timers.values():
+            timer.cancel()
+        conn.timers.clear()
+        conn.throttled.clear()
+        conn.keyed.clear()
+        conn.queue.clear()
+
+        session_id = conn.session_id
+        if session_id and self.client_sessions.get(session_id) is websocket:
+            del self.client_sessions[session_id]
+            if self.bus:
+                self.bus.unsubscribe(session_id)
+            # 记录断连时间，而非立即清理
+            if self.on_session_disconnected:
+                self.on_session_disconnected(session_id)
+            print(f"客户端断开，开始5分钟宽限期: {session_id}")
+
+        print(f"客户端已断开，当前连接数: {len(self.connections)}")
+
+    def register_client(self, client_session_id: str, websocket: Any):
+        """注册客户端会话（同一会话重连时指向新连接，同一连接换会话时移除旧索引）"""
+        conn = self.connections.get(websocket) or self.attach(websocket)
+        if conn.session_id and conn.session_id != client_session_id \
+                and self.client_sessions.get(conn.session_id) is websocket:
+            del self.client_sessions[conn.session_id]
+            if self.bus:
+                self.bus.unsubscribe(conn.session_id)
+        previous = self.client_sessions.get(client_session_id)
+        if previous is not None and previous is not websocket and previous in self.connections:
+            self.connections[previous].session_id = None
+        conn.session_id = client_session_id
+        self.client_sessions[client_session_id] = websocket
+        if self.bus:
+            self.bus.subscribe(client_session_id)
+        print(f"客户端会话已注册: {client_session_id}")
+
+    # ---------- 发送 ----------
+
+    def coalesce_key(self, message: str) -> Optional[str]:
+        """从消息的 type 字段得到合并键；不可合并时返回 None（只看消息开头，不解析整条消息）"""
+        if not message.startswith(_TYPE_PREFIX):
+            return None
+        end = message.find('"', len(_TYPE_PREFIX))
+        message_type = message[len(_TYPE_PREFIX):end]
+        if message_type not in self.coalesce_types:
+            return None
+        field = _COALESCE_FIELDS.get(message_type)
+        if field is None:
+            return message_type
+        try:
+            value = json.loads(message).get(field)
+        except ValueError:
+            return None
+        return None if value is None else f"{message_type}:{value}"
+
+    def enqueue(self, websocket: Any, message: str, coalesce_key: Optional[str] = None) -> bool:
+        """放入连接的发送队列（不等待发送）；被丢弃时返回 False
+
+        coalesce_key 为空时按消息类型推断；有合并键的消息替换队列中同键的旧消息，
+        该类型设置了最短发送间隔时，间隔内的消息暂存为最新一条，到期后再入队。
+        """
+        conn = self.connections.get(websocket)
+        if conn is None:
+            return False
+        key = coalesce_key or self.coalesce_key(message)
+        if key is None:
+            # 暂存的消息先入队，避免排到之后的消息后面
+            if conn.throttled:
+                self._release_all(conn)
+            return self._push(conn, message, None)
+
+        interval = self.min_intervals.get(key.split(":", 1)[0], 0)
+        if interval > 0:
+            now = time.monotonic()
+            due = conn.last_released.get(key, -math.inf) + interval
+            if key in conn.throttled or now < due:
+                if key in conn.throttled:
+                    self._counts["coalesced"] += 1
+                else:
+                    self._counts["throttled"] += 1
+                conn.throttled[key] = message
+                if key not in conn.timers:
+                    conn.timers[key] = asyncio.get_running_loop().call_later(
+                        max(0.0, due - now), self._release, conn, key)
+                return True
+            conn.last_released[key] = now
+        return self._push(conn, message, key)
+
+    def _push(self, conn: _Connection, message: str, key: Optional[str]) -> bool:
+        if key is not None:
+            entry = conn.keyed.get(key)
+            if entry is not None:
+                entry[0] = message
+                self._counts["coalesced"] += 1
+                return True
+        if len(conn.queue) >= self.queue_size:
+            if self.overflow_policy == "drop_newest":
+                self._counts["dropped"] += 1
+                return False
+            if self.overflow_policy == "disconnect":
+                self._counts["overflow_disconnects"] += 1
+                print(f"客户端 {conn.session_id} 发送队列已满，断开连接")
+                self._close(conn.websocket)
+                return False
+            self._forget(conn, conn.queue.popleft())
+            self._counts["dropped"] += 1
+        entry = [message, time.monotonic(), key]
+        conn.queue.append(entry)
+        if key is not None:
+            conn.keyed[key] = entry
+        conn.ready.set()
+        self._counts["enqueued"] += 1
+        return True
+
+    @staticmethod
+    def _forget(conn: _Connection, entry: list):
+        """条目离开队列时移除其合并键索引"""
+        key = entry[2]
+        if key is not None and conn.keyed.get(key) is entry:
+            del conn.keyed[key]
+
+    def _release(self, conn: _Connection, key: str):
+        """最短发送间隔到期：把暂存的最新消息放入发送队列"""
+        conn.timers.pop(key, None)
+        message = conn.throttled.pop(key, None)
+        if message is None or conn.closed:
+            return
+        conn.last_released[key] = time.monotonic()
+        self._push(conn, message, key)
+
+    def _release_all(self, conn: _Connection):
+        for key in list(conn.throttled):
+            timer = conn.timers.pop(key, None)
+            if timer is not None:
+                timer.cancel()
+            self._release(conn, key)
+
+    async def send_message(self, websocket: Any, message: str, coalesce_key: Optional[str] = None):
+        self.enqueue(websocket, message, coalesce_key)
+
+    async def send_to_client(self, client_session_id: str, message: str, coalesce_key: Optional[str] = None):
+        """向特定客户端发送消息"""
+        websocket = self.client_sessions.get(client_session_id)
+        if websocket is not None:
+            self.enqueue(websocket, message, coalesce_key)
+        elif self.bus and self.bus.publish(client_session_id, message):
+            # 连接在其他 worker 上，由其订阅后转发
+            pass
+        else:
+            print(f"客户端 {client_session_id} 未找到或已断开连接")
+
+    async def deliver_from_bus(self, client_session_id: str, message: str):
+        """总线收到的消息：仅发给本 worker 持有的连接（不再发布，避免循环）"""
+        websocket = self.client_sessions.get(client_session_id)
+        if websocket is not None:
+            self.enqueue(websocket, message)
+
+    async def _write_loop(self, conn: _Connection):
+        """按入队顺序逐条发送；发送失败或超时时关闭连接"""
+        websocket = conn.websocket
+        while not conn.closed:
+            if not conn.queue:
+                conn.ready.clear()
+                await conn.ready.wait()
+                continue
+            entry = conn.queue.popleft()
+            self._forget(conn, entry)
+            message, enqueued_at, _ = entry
+            started = time.monotonic()
+            if conn.binary and len(message) > WS_ENCODE_OFFLOAD_BYTES:
+                frame = await asyncio.to_thread(self._encode, conn, message)
+            else:
+                frame = self._encode(conn, message)
+            try:
+                if isinstance(frame, bytes):
+                    await asyncio.wait_for(websocket.send_bytes(frame), self.send_timeout)
+                else:
+                    await asyncio.wait_for(websocket.send_text(frame), self.send_timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._counts["send_failures"] += 1
+                print(f"向客户端 {conn.session_id} 发送消息失败: {e!r}")
+                # 关闭套接字：接收循环随之结束，客户端重连后恢复推送
+                self._close(websocket)
+                return
+            finished = time.monotonic()
+            self._latencies.append(finished - enqueued_at)
+            self._send_durations.append(finished - started)
+            self._counts["sent"] += 1
+            conn.sent += 1
+
+    def _encode(self, conn: _Connection, message: str):
+        """二进制连接编码为 bytes；不是 JSON 的消息仍按文本发送（前端两种帧都能处理）"""
+        if conn.binary:
+            try:
+                frame = ws_codec.encode_frame(message)
+                self._counts["binary_bytes"] += len(frame)
+                self._counts["binary_payload_json_bytes"] += len(message.encode("utf-8"))
+                return frame
+            except (ValueError, TypeError, OverflowError):
+                pass
+        self._counts["json_bytes"] += len(message.encode("utf-8"))
+        return message
+
+    def _close(self, websocket: Any):
+        """服务端主动断开（移除索引并关闭套接字）"""
+        self.disconnect(websocket)
+
+        async def close():
+            try:
+                await websocket.close()
+            except Exception:
+                pass
+
+        asyncio.get_running_loop().create_task(close())
+
+    async def close_all(self):
+        """停止全部写任务（服务关闭时）"""
+        writers = []
+        for conn in self.connections.values():
+            conn.closed = True
+            conn.ready.set()
+            if conn.writer is not None:
+                conn.writer.cancel()
+                writers.append(conn.writer)
+        await asyncio.gather(*writers, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        depths = [len(conn.queue) for conn in self.connections.values()]
+        return {
+            "connections": len(self.connections),
+            "registered_sessions": len(self.client_sessions),
+            "binary_connections": sum(1 for conn in self.connections.values() if conn.binary),
+            "queue_size": self.queue_size,
+            "overflow_policy": self.overflow_policy,
+            "queued_messages": sum(depths),
+            "throttled_messages": sum(len(conn.throttled) for conn in self.connections.values()),
+            "max_queue_depth": max(depths, default=0),
+            **self._counts,
+            "send_latency_ms": {"p50": _percentile_ms(self._latencies, 0.5),
+                                "p99": _percentile_ms(self._latencies, 0.99)},
+            "send_duration_ms": {"p50": _percentile_ms(self._send_durations, 0.5),
+                                 "p99": _percentile_ms(self._send_durations, 0.99)}
+        }
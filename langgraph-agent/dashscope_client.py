@@ -0,0 +1,283 @@
+"""
+DashScope 原生异步客户端：基于 httpx 共享连接池（keep-alive，可用时启用 HTTP/2），
+提供 Generation 与 MultiModalConversation 的异步调用和 SSE 流式调用。
+
+返回对象与 dashscope SDK 的响应结构一致（status_code / message / output.choices[0].message.content），
+调用方无需修改结果解析逻辑。
+
+所有调用经过 rate_limiter 的按模型限流与优先级排队，限流（429）和瞬时错误自动退避重试。
+"""
+
+import os
+import json
+import asyncio
+import importlib.util
+import weakref
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+from rate_limiter import (
+    MAX_RETRIES,
+    RETRYABLE_STATUS_CODES,
+    backoff_delay,
+    current_priority,
+    estimate_request_tokens,
+    get_limiter,
+)
+
+load_dotenv()
+
+# 连接池配置（可通过环境变量调整）
+DASHSCOPE_BASE_URL = os.getenv('DASHSCOPE_BASE_URL', 'https://dashscope.aliyuncs.com/api/v1')
+MAX_CONNECTIONS = int(os.getenv('DASHSCOPE_MAX_CONNECTIONS', '64'))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('DASHSCOPE_MAX_KEEPALIVE_CONNECTIONS', '32'))
+KEEPALIVE_EXPIRY = float(os.getenv('DASHSCOPE_KEEPALIVE_EXPIRY', '120'))
+CONNECT_TIMEOUT = float(os.getenv('DASHSCOPE_CONNECT_TIMEOUT', '10'))
+READ_TIMEOUT = float(os.getenv('DASHSCOPE_READ_TIMEOUT', '1800'))  # 视频理解可能持续很久
+# HTTP/2 需要安装 h2；未安装时自动回退到 HTTP/1.1
+HTTP2_ENABLED = os.getenv('DASHSCOPE_HTTP2', 'auto').lower() in ('1', 'true', 'auto') and \
+    importlib.util.find_spec('h2') is not None
+
+GENERATION_PATH = '/services/aigc/text-generation/generation'
+MULTIMODAL_PATH = '/services/aigc/multimodal-generation/generation'
+
+# 每个事件循环一个连接池（httpx.AsyncClient 不能跨事件循环使用）
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+class _AttrDict(dict):
+    """同时支持属性访问和下标访问的字典（与 dashscope SDK 响应对象行为一致）"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def _wrap(value: Any) -> Any:
+    if isinstance(value, dict):
+        return _AttrDict({k: _wrap(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [_wrap(v) for v in value]
+    return value
+
+
+class DashScopeResponse:
+    """DashScope HTTP 响应"""
+
+    def __init__(self, status_code: int, body: Dict[str, Any]):
+        self.status_code = status_code
+        self.request_id = body.get('request_id', '')
+        self.code = body.get('code', '')
+        self.message = body.get('message', '')
+        self.output = _wrap(body.get('output') or {})
+        self.usage = _wrap(body.get('usage') or {})
+
+    def __repr__(self) -> str:
+        return f"DashScopeResponse(status_code={self.status_code}, code={self.code!r}, message={self.message!r})"
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """获取当前事件循环的共享连接池"""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            base_url=DASHSCOPE_BASE_URL,
+            http2=HTTP2_ENABLED,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+        )
+        _clients[loop] = client
+    return client
+
+
+async def close_http_client():
+    """关闭当前事件循环的连接池（应用关闭时调用）"""
+    loop = asyncio.get_running_loop()
+    client = _clients.pop(loop, None)
+    if client is not None and not client.is_closed:
+        await client.aclose()
+
+
+def run_sync(coro):
+    """在没有事件循环的同步上下文（脚本、测试）中运行异步调用，结束后释放连接池"""
+    async def _runner():
+        try:
+            return await coro
+        finally:
+            await close_http_client()
+    return asyncio.run(_runner())
+
+
+def _headers(api_key: Optional[str], stream: bool) -> Dict[str, str]:
+    headers = {
+        'Authorization': f"Bearer {api_key or os.getenv('DASHSCOPE_API_KEY')}",
+        'Content-Type': 'application/json',
+    }
+    if stream:
+        headers['Accept'] = 'text/event-stream'
+        headers['X-DashScope-SSE'] = 'enable'
+    return headers
+
+
+def _payload(model: str, messages: List[Dict], parameters: Dict[str, Any]) -> Dict[str, Any]:
+    # 与 SDK 一致：None 值不发送
+    return {
+        'model': model,
+        'input': {'messages': messages},
+        'parameters': {k: v for k, v in parameters.items() if v is not None},
+    }
+
+
+async def _post_once(path: str, model: str, messages: List[Dict], api_key: Optional[str], parameters: Dict[str, Any]) -> DashScopeResponse:
+    client = get_http_client()
+    response = await client.post(path, headers=_headers(api_key, False), json=_payload(model, messages, parameters))
+    try:
+        body = response.json()
+    except ValueError:
+        body = {'code': 'InvalidResponse', 'message': response.text[:500]}
+    return DashScopeResponse(response.status_code, body)
+
+
+def _usage_tokens(response: DashScopeResponse) -> Optional[int]:
+    usage = response.usage or {}
+    total = usage.get('total_tokens')
+    if total is None and ('input_tokens' in usage or 'output_tokens' in usage):
+        total = (usage.get('input_tokens') or 0) + (usage.get('output_tokens') or 0)
+    return total
+
+
+async def _post(path: str, model: str, messages: List[Dict], api_key: Optional[str], parameters: Dict[str, Any]) -> DashScopeResponse:
+    """限流排队后发送请求；429/5xx 与网络错误按指数退避重试"""
+    priority = parameters.pop('priority', None)
+    priority = current_priority.get() if priority is None else priority
+    limiter = get_limiter(model)
+    tokens = estimate_request_tokens(messages, parameters)
+    attempt = 0
+    while True:
+        await limiter.acquire(tokens, priority)
+        response = None
+        try:
+            response = await _post_once(path, model, messages, api_key, parameters)
+        except httpx.TransportError as e:
+            if attempt >= MAX_RETRIES:
+                limiter.failed += 1
+                raise
+            print(f"DashScope 请求网络错误（{model}），准备重试: {e}")
+        finally:
+            limiter.release(tokens, _usage_tokens(response) if response is not None else None)
+
+        if response is not None:
+            if response.status_code == 429:
+                limiter.throttled += 1
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                return response
+            if attempt >= MAX_RETRIES:
+                limiter.failed += 1
+                return response
+            print(f"DashScope 请求失败（{model}，status={response.status_code}），准备重试")
+
+        delay = backoff_delay(attempt)
+        attempt += 1
+        limiter.retries += 1
+        await asyncio.sleep(delay)
+
+
+async def _stream_once(path: str, model: str, messages: List[Dict], api_key: Optional[str], parameters: Dict[str, Any]) -> AsyncIterator[DashScopeResponse]:
+    client = get_http_client()
+    async with client.stream('POST', path, headers=_headers(api_key, True), json=_payload(model, messages, parameters)) as response:
+        if response.status_code != 200:
+            raw = await response.aread()
+            try:
+                body = json.loads(raw)
+            except ValueError:
+                body = {'code': 'InvalidResponse', 'message': raw.decode('utf-8', 'replace')[:500]}
+            yield DashScopeResponse(response.status_code, body)
+            return
+
+        status_code = 200
+        async for line in response.aiter_lines():
+            # SSE 行格式: id:/event:/:HTTP_STATUS/200/data:{...}
+            if line.startswith(':HTTP_STATUS/'):
+                try:
+                    status_code = int(line.split('/', 1)[1])
+                except ValueError:
+                    pass
+            elif line.startswith('data:'):
+                data = line[5:].strip()
+                if not data:
+                    continue
+                body = json.loads(data)
+                yield DashScopeResponse(status_code if not body.get('code') else max(status_code, 400), body)
+
+
+async def _stream(path: str, model: str, messages: List[Dict], api_key: Optional[str], parameters: Dict[str, Any]) -> AsyncIterator[DashScopeResponse]:
+    """限流排队后发起流式请求；尚未产出任何内容时遇到 429/5xx 或网络错误则退避重试"""
+    priority = parameters.pop('priority', None)
+    priority = current_priority.get() if priority is None else priority
+    limiter = get_limiter(model)
+    tokens = estimate_request_tokens(messages, parameters)
+    attempt = 0
+    while True:
+        await limiter.acquire(tokens, priority)
+        started = False
+        usage = None
+        retry = False
+        stream = _stream_once(path, model, messages, api_key, parameters)
+        try:
+            async for response in stream:
+                if not started and response.status_code in RETRYABLE_STATUS_CODES:
+                    if response.status_code == 429:
+                        limiter.throttled += 1
+                    if attempt < MAX_RETRIES:
+                        print(f"DashScope 流式请求失败（{model}，status={response.status_code}），准备重试")
+                        retry = True
+                        break
+                    limiter.failed += 1
+                started = True
+                usage = _usage_tokens(response) or usage
+                yield response
+        except httpx.TransportError as e:
+            if started or attempt >= MAX_RETRIES:
+                limiter.failed += 1
+                raise
+            print(f"DashScope 流式请求网络错误（{model}），准备重试: {e}")
+            retry = True
+        finally:
+            await stream.aclose()
+            limiter.release(tokens, usage)
+
+        if not retry:
+            return
+        delay = backoff_delay(attempt)
+        attempt += 1
+        limiter.retries += 1
+        await asyncio.sleep(delay)
+
+
+async def generation_call(model: str, messages: List[Dict], api_key: Optional[str] = None, **parameters) -> DashScopeResponse:
+    """异步调用文本生成（等价于 dashscope.Generation.call）；可传 priority 覆盖当前上下文的调用优先级"""
+    return await _post(GENERATION_PATH, model, messages, api_key, parameters)
+
+
+def generation_stream(model: str, messages: List[Dict], api_key: Optional[str] = None, **parameters) -> AsyncIterator[DashScopeResponse]:
+    """异步流式文本生成（等价于 dashscope.Generation.call(stream=True)）"""
+    return _stream(GENERATION_PATH, model, messages, api_key, parameters)
+
+
+async def multimodal_call(model: str, messages: List[Dict], api_key: Optional[str] = None, **parameters) -> DashScopeResponse:
+    """异步调用多模态对话（等价于 dashscope.MultiModalConversation.call）"""
+    return await _post(MULTIMODAL_PATH, model, messages, api_key, parameters)
+
+
+def multimodal_stream(model: str, messages: List[Dict], api_key: Optional[str] = None, **parameters) -> AsyncIterator[DashScopeResponse]:
+    """异步流式多模态对话"""
+    return _stream(MULTIMODAL_PATH, model, messages, api_key, parameters)
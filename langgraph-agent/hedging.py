@@ -0,0 +1,153 @@
+"""
+对冲请求（hedged request）：调用耗时超过近期延迟的指定分位数时，再发起一份相同的请求，
+取先成功返回的结果并取消另一份，用于避免单个慢请求拖慢整批片段理解。
+
+额外开销受两方面限制：对冲次数不超过主请求数的固定比例，且同时进行的对冲请求数有上限。
+"""
+
+import os
+import time
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+# 触发对冲的延迟分位数
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', '0.9'))
+# 统计分位数所需的最少样本数（样本不足时不对冲）
+HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', '5'))
+# 对冲等待时间下限（秒），避免对本来就很快的请求对冲
+HEDGE_MIN_DELAY_SECONDS = float(os.getenv('HEDGE_MIN_DELAY_SECONDS', '30'))
+# 对冲请求数占主请求数的比例上限（额外开销上限）
+HEDGE_MAX_RATIO = float(os.getenv('HEDGE_MAX_RATIO', '0.1'))
+# 同时进行的对冲请求数上限
+HEDGE_MAX_CONCURRENT = int(os.getenv('HEDGE_MAX_CONCURRENT', '2'))
+# 保留的近期延迟样本数
+HEDGE_WINDOW = 200
+
+
+class LatencyTracker:
+    """近期成功请求的延迟样本（秒）"""
+
+    def __init__(self, window: int = HEDGE_WINDOW):
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+        return ordered[index]
+
+
+class Hedger:
+    """按延迟分位数触发对冲请求，并统计对冲次数与效果"""
+
+    def __init__(self, name: str, percentile: float = HEDGE_PERCENTILE, min_samples: int = HEDGE_MIN_SAMPLES,
+                 min_delay: float = HEDGE_MIN_DELAY_SECONDS, max_ratio: float = HEDGE_MAX_RATIO,
+                 max_concurrent: int = HEDGE_MAX_CONCURRENT):
+        self.name = name
+        self.latency = LatencyTracker()
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_ratio = max_ratio
+        self.max_concurrent = max_concurrent
+        self.primary_calls = 0
+        self.hedges_issued = 0
+        self.hedges_won = 0
+        self.hedges_skipped = 0
+        self.active_hedges = 0
+
+    def hedge_delay(self) -> Optional[float]:
+        """当前的对冲触发时间；样本不足时返回 None"""
+        if len(self.latency) < self.min_samples:
+            return None
+        return max(self.min_delay, self.latency.percentile(self.percentile))
+
+    def _can_hedge(self) -> bool:
+        # 至少允许一次对冲，之后按比例累积额度
+        budget = max(1.0, self.primary_calls * self.max_ratio)
+        return self.hedges_issued < budget and self.active_hedges < self.max_concurrent
+
+    async def call(self, factory: Callable[[], Awaitable[Any]],
+                   is_error: Callable[[Any], bool] = lambda result: False) -> Any:
+        """
+        执行 factory() 创建的请求，超过对冲触发时间仍未完成时再执行一次，返回先成功完成的结果。
+
+        Args:
+            factory: 每次调用创建一个新的请求协程
+            is_error: 判断结果是否为失败（失败结果不会胜出，除非两份请求都失败）
+        """
+        self.primary_calls += 1
+        started = time.monotonic()
+        primary = asyncio.ensure_future(factory())
+        hedge = None
+        # 调用方取消或任何异常时，取消尚未完成的主请求和对冲请求
+        try:
+            delay = self.hedge_delay()
+            if delay is not None:
+                done, _ = await asyncio.wait({primary}, timeout=delay)
+                if done:
+                    return self._finish(primary, started, False, is_error)
+            else:
+                await asyncio.wait({primary})
+                return self._finish(primary, started, False, is_error)
+
+            if not self._can_hedge():
+                self.hedges_skipped += 1
+                await asyncio.wait({primary})
+                return self._finish(primary, started, False, is_error)
+
+            self.hedges_issued += 1
+            self.active_hedges += 1
+            print(f"[{self.name}] 请求已耗时 {time.monotonic() - started:.1f}s，超过 p{int(self.percentile * 100)} 延迟，发起对冲请求")
+            hedge = asyncio.ensure_future(factory())
+            pending = {primary, hedge}
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((t for t in done if not t.exception() and not is_error(t.result())), None)
+                if winner is not None or not pending:
+                    if winner is None:
+                        # 两份都失败：返回主请求的结果（或异常）
+                        winner = primary
+                    if winner is hedge:
+                        self.hedges_won += 1
+                    return self._finish(winner, started, True, is_error)
+        finally:
+            if hedge is not None:
+                self.active_hedges -= 1
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def _finish(self, task: "asyncio.Future", started: float, hedged: bool,
+                is_error: Callable[[Any], bool]) -> Any:
+        result = task.result()  # 异常原样抛出
+        # 对冲后的延迟被截断、失败请求的延迟不具代表性，均不计入样本
+        if not hedged and not is_error(result):
+            self.latency.record(time.monotonic() - started)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        delay = self.hedge_delay()
+        return {
+            "primary_calls": self.primary_calls,
+            "hedges_issued": self.hedges_issued,
+            "hedges_won": self.hedges_won,
+            "hedges_skipped_budget": self.hedges_skipped,
+            "active_hedges": self.active_hedges,
+            "latency_samples": len(self.latency),
+            "latency_p50_seconds": round(self.latency.percentile(0.5) or 0.0, 2),
+            f"latency_p{int(self.percentile * 100)}_seconds": round(self.latency.percentile(self.percentile) or 0.0, 2),
+            "hedge_delay_seconds": round(delay, 2) if delay is not None else None
+        }
+
+
+# 长视频片段理解共用的对冲器
+segment_hedger = Hedger("segment_understanding")
@@ -0,0 +1,132 @@
+"""
+长视频任务断点：按会话保存提示词拆分结果、片段列表与URL、每个已完成片段的理解结果和整合结果。
+
+相同输入重试时从断点继续：已完成的片段不再切割/上传/理解，提示词不再拆分，整合结果在片段结果未变化时直接复用。
+任务成功完成后断点标记为已完成，相同输入再次提交时重新处理。断点文件保存在会话本地目录中，随会话文件一起清理。
+"""
+
+import os
+import json
+import time
+import hashlib
+from typing import Any, Dict, List, Optional
+
+# 断点格式版本（结构变化时旧断点自动失效）
+CHECKPOINT_VERSION = 1
+# 已上传片段URL的复用时限（秒）：OSS会话文件会被定期清理，超时后重新切割上传
+LONG_VIDEO_CHECKPOINT_SEGMENT_TTL = int(os.getenv('LONG_VIDEO_CHECKPOINT_SEGMENT_TTL', '3600'))
+CHECKPOINT_FILENAME = "long_video_checkpoint.json"
+
+
+def _results_digest(segment_results: List[Dict]) -> str:
+    payload = json.dumps(segment_results, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class JobCheckpoint:
+    """单个会话的长视频任务断点；key 不一致（输入变化）或上次任务已完成时从头开始"""
+
+    def __init__(self, path: str, key: str):
+        self.path = path
+        self.key = key
+        self.data = self._empty()
+        loaded = self._load()
+        self.resumed = bool(loaded and loaded.get("key") == key and loaded.get("version") == CHECKPOINT_VERSION
+                            and not loaded.get("completed"))
+        if self.resumed:
+            self.data = loaded
+
+    def _empty(self) -> Dict[str, Any]:
+        return {
+            "version": CHECKPOINT_VERSION,
+            "key": self.key,
+            "created_at": time.time(),
+            "prompt_split": None,
+            "segments": {},
+            "segments_complete": False,
+            "segment_results": {},
+            "integrated": None,
+            "integrated_digest": None,
+            "completed": False
+        }
+
+    def _load(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self):
+        """原子写入，避免进程中断留下损坏的断点"""
+        self.data["updated_at"] = time.time()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    # ---------- 提示词拆分 ----------
+
+    @property
+    def prompt_split(self) -> Optional[Dict[str, str]]:
+        return self.data["prompt_split"]
+
+    def save_prompt_split(self, segment_prompt: str, integration_prompt: str):
+        self.data["prompt_split"] = {"segment_prompt": segment_prompt, "integration_prompt": integration_prompt}
+        self.save()
+
+    # ---------- 片段 ----------
+
+    def reusable_segments(self) -> Dict[int, Dict]:
+        """可直接复用（无需重新切割上传）的片段：已有理解结果，或URL仍在有效期内"""
+        now = time.time()
+        return {
+            int(seg_id): seg for seg_id, seg in self.data["segments"].items()
+            if seg_id in self.data["segment_results"]
+            or now - seg.get("uploaded_at", 0) < LONG_VIDEO_CHECKPOINT_SEGMENT_TTL
+        }
+
+    def save_segment(self, seg: Dict):
+        saved = self.data["segments"].get(str(seg["segment_id"]))
+        if saved and saved.get("url") == seg.get("url"):
+            return
+        self.data["segments"][str(seg["segment_id"])] = {**seg, "uploaded_at": time.time()}
+        self.save()
+
+    def mark_segments_complete(self):
+        if not self.data["segments_complete"]:
+            self.data["segments_complete"] = True
+            self.save()
+
+    def segment_result(self, segment_id: int) -> Optional[Dict]:
+        return self.data["segment_results"].get(str(segment_id))
+
+    def save_segment_result(self, result: Dict):
+        """保存片段理解结果（失败结果不保存，重试时重新理解）"""
+        if str(result.get("result", "")).startswith("[error]"):
+            return
+        self.data["segment_results"][str(result["segment_id"])] = result
+        self.save()
+
+    @property
+    def completed_segment_count(self) -> int:
+        return len(self.data["segment_results"])
+
+    # ---------- 整合 ----------
+
+    def integrated_for(self, segment_results: List[Dict]) -> Optional[str]:
+        """片段结果与上次整合时一致时返回已保存的整合结果"""
+        if self.data["integrated"] and self.data["integrated_digest"] == _results_digest(segment_results):
+            return self.data["integrated"]
+        return None
+
+    def save_integrated(self, segment_results: List[Dict], integrated: str):
+        self.data["integrated"] = integrated
+        self.data["integrated_digest"] = _results_digest(segment_results)
+        self.save()
+
+    def mark_completed(self):
+        """任务成功完成：之后不再从该断点继续"""
+        self.data["completed"] = True
+        self.save()
@@ -0,0 +1,462 @@
+"""
+持久化后台任务队列：长耗时请求（长视频理解、压缩、语音识别、SOP解析/精修）提交后立即返回任务ID，
+由固定数量的异步 worker 依次执行，任务状态、进度与结果保存在 SQLite 中，可通过 REST 查询。
+
+- 任务按类型注册处理函数：async handler(params) -> 结果（可 JSON 序列化）
+- 任务类型可注册到独立的 worker 通道（如视频压缩），不与其他类型争抢 worker
+- 处理函数内通过 report_progress() 上报进度（不在任务中执行时为空操作）
+- 服务重启后，未完成的任务重新入队（处理函数需可重复执行，如长视频任务依靠断点续跑）
+- 多个服务 worker 共用同一数据库：任务以条件更新原子领取，执行者定期写入心跳，
+  只有心跳超时（执行者已退出）的任务才被其他 worker 重新入队；取消请求经共享状态后端转达给执行者
+- 任务执行期间的 WebSocket 推送保持不变，另在任务状态变化时推送 job_update 消息
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from state_backend import MemoryStateBackend, SharedCancelFlag, SharedDict, request_cancel
+
+# 任务数据库路径
+JOB_QUEUE_DB_PATH = os.getenv('JOB_QUEUE_DB_PATH', '/root/video2sop/temp/jobs.db')
+# 并发执行任务的 worker 数量
+JOB_QUEUE_WORKERS = int(os.getenv('JOB_QUEUE_WORKERS', '4'))
+# 视频压缩独立通道的 worker 数量（压缩是后续处理的前提，不与长视频理解等任务争抢 worker）
+JOB_QUEUE_COMPRESSION_WORKERS = int(os.getenv('JOB_QUEUE_COMPRESSION_WORKERS', '1'))
+# 执行中任务的进度最短落盘间隔（秒），查询接口优先读取内存中的最新进度
+JOB_PROGRESS_PERSIST_INTERVAL = float(os.getenv('JOB_PROGRESS_PERSIST_INTERVAL', '2'))
+# 已结束任务的保留时长（小时）
+JOB_RETENTION_HOURS = int(os.getenv('JOB_RETENTION_HOURS', '24'))
+# 重启后重新入队的最大次数（超过则标记失败，避免反复崩溃的任务无限重试）
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+# 任务心跳间隔（秒）：执行者定期刷新所持任务的心跳，并检查其他 worker 遗留的任务
+JOB_HEARTBEAT_SECONDS = float(os.getenv('JOB_HEARTBEAT_SECONDS', '10'))
+# 心跳超时（秒）：超过该时长未刷新心跳的任务视为执行者已退出，可由其他 worker 重新入队
+JOB_HEARTBEAT_TIMEOUT = float(os.getenv('JOB_HEARTBEAT_TIMEOUT', '60'))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+# 未指定通道的任务类型共用的 worker 通道
+DEFAULT_LANE = "default"
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Any]]
+NotifyCallback = Callable[[str, str], Awaitable[None]]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    client_session_id TEXT,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    params TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    owner TEXT,
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_session ON jobs (client_session_id, created_at);
+"""
+
+_JSON_COLUMNS = ("params", "result", "error")
+# 旧版数据库缺少的列（启动时补齐）
+_ADDED_COLUMNS = (("owner", "TEXT"), ("heartbeat_at", "REAL"))
+# 执行者已退出（未持有或心跳超时）的任务
+_ORPHANED = "(owner IS NULL OR heartbeat_at IS NULL OR heartbeat_at < ?)"
+
+# 当前执行中的任务（report_progress 据此定位任务）
+current_job: ContextVar[Optional["_RunningJob"]] = ContextVar("current_job", default=None)
+
+
+async def report_progress(progress: Optional[float] = None, message: Optional[str] = None):
+    """上报当前任务进度（0~100，None 表示只更新进度说明）；不在任务中执行时忽略"""
+    job = current_job.get()
+    if job is not None:
+        await job.queue._update_progress(job, progress, message)
+
+
+class _RunningJob:
+    def __init__(self, queue: "JobQueue", job_id: str, kind: str, client_session_id: Optional[str]):
+        self.queue = queue
+        self.id = job_id
+        self.kind = kind
+        self.client_session_id = client_session_id
+        self.progress = 0.0
+        self.message: Optional[str] = None
+        self.persisted_at = 0.0
+        self.task: Optional[asyncio.Task] = None
+        self.cancel_requested = False
+        self.cancel_flag: Optional[SharedCancelFlag] = None
+
+
+def _error_text(e: BaseException) -> Any:
+    """HTTPException 取 detail（可能为 dict），其他异常取字符串"""
+    detail = getattr(e, "detail", None)
+    return detail if detail is not None else str(e) or type(e).__name__
+
+
+class JobQueue:
+    """SQLite 持久化的任务队列与异步 worker 池"""
+
+    def __init__(self, db_path: str = JOB_QUEUE_DB_PATH, workers: int = JOB_QUEUE_WORKERS,
+                 notify: Optional[NotifyCallback] = None, lanes: Optional[Dict[str, int]] = None,
+                 cancel_flags: Optional[SharedDict] = None):
+        """
+        lanes: 独立 worker 通道 {通道名: worker 数}，注册到通道的任务类型只由该通道的 worker 执行
+        cancel_flags: 任务取消标志表，多个服务 worker 时需使用共享状态后端上的 SharedDict
+        """
+        self.db_path = db_path
+        self.workers = max(1, workers)
+        self.lane_workers: Dict[str, int] = {DEFAULT_LANE: self.workers}
+        for lane, count in (lanes or {}).items():
+            self.lane_workers[lane] = max(1, count)
+        self.notify = notify
+        self.cancel_flags = cancel_flags if cancel_flags is not None else SharedDict(MemoryStateBackend(), "job_cancel_flags")
+        # 本实例的持有者标识，写入所领取任务的 owner 列
+        self.owner = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.handlers: Dict[str, JobHandler] = {}
+        self._kind_lanes: Dict[str, str] = {}
+        self.running: Dict[str, _RunningJob] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._worker_tasks: List[asyncio.Task] = []
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._counts = {"submitted": 0, SUCCEEDED: 0, FAILED: 0, CANCELLED: 0, "recovered": 0}
+        self._run_seconds = 0.0
+
+    # ---------- 数据库 ----------
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if os.path.dirname(self.db_path):
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in _ADDED_COLUMNS:
+                if column not in columns:
+                    try:
+                        conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+                    except sqlite3.OperationalError:
+                        pass  # 其他 worker 已补齐
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql: str, args: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._connect().execute(sql, args).fetchall()
+
+    async def _db(self, sql: str, args: tuple = ()) -> List[sqlite3.Row]:
+        return await asyncio.to_thread(self._execute, sql, args)
+
+    async def _update(self, sql: str, args: tuple = ()) -> int:
+        """执行更新语句，返回受影响的行数（用于条件更新判断是否成功）"""
+        def update() -> int:
+            with self._lock:
+                return self._connect().execute(sql, args).rowcount
+
+        return await asyncio.to_thread(update)
+
+    def _row_to_job(self, row: sqlite3.Row, include_params: bool = False) -> Dict[str, Any]:
+        job = dict(row)
+        for column in _JSON_COLUMNS:
+            if job.get(column) is not None:
+                job[column] = json.loads(job[column])
+        if not include_params:
+            job.pop("params", None)
+        running = self.running.get(job["id"])
+        if running is not None:
+            job["progress"] = running.progress
+            job["message"] = running.message
+        return job
+
+    # ---------- 生命周期 ----------
+
+    def register(self, kind: str, handler: JobHandler, lane: str = DEFAULT_LANE):
+        """注册任务类型的处理函数及其执行通道"""
+        if lane not in self.lane_workers:
+            raise ValueError(f"未知任务通道: {lane}")
+        self.handlers[kind] = handler
+        self._kind_lanes[kind] = lane
+
+    def _enqueue(self, job_id: str, kind: str):
+        queue = self._queues.get(self._kind_lanes.get(kind, DEFAULT_LANE))
+        if queue is not None:
+            queue.put_nowait(job_id)
+
+    async def start(self):
+        """恢复未完成任务并启动 worker"""
+        if self._worker_tasks:
+            return
+        self._queues = {lane: asyncio.Queue() for lane in self.lane_workers}
+        await self._recover()
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(lane, i))
+            for lane, count in self.lane_workers.items() for i in range(count)
+        ]
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        print(f"任务队列已启动: worker {self.lane_workers}，数据库 {self.db_path}，持有者 {self.owner}")
+
+    async def stop(self):
+        """停止 worker；执行中的任务保持 running 状态并清除心跳，由下次启动或其他 worker 重新入队"""
+        tasks = self._worker_tasks + ([self._heartbeat_task] if self._heartbeat_task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._heartbeat_task = None
+        await self._update("UPDATE jobs SET heartbeat_at=NULL WHERE owner=? AND status IN (?, ?)",
+                           (self.owner, QUEUED, RUNNING))
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+                self._conn = None
+
+    async def _recover(self):
+        """接管执行者已退出的未完成任务；仍在其他 worker 上执行（心跳未超时）的任务不受影响"""
+        stale_before = time.time() - JOB_HEARTBEAT_TIMEOUT
+        rows = await self._db(
+            f"SELECT id, kind, status, attempts FROM jobs WHERE status IN (?, ?) AND {_ORPHANED} ORDER BY created_at",
+            (QUEUED, RUNNING, stale_before))
+        recovered = 0
+        for row in rows:
+            if row["status"] == RUNNING and row["attempts"] >= JOB_MAX_ATTEMPTS:
+                await self._update(
+                    f"UPDATE jobs SET status=?, error=?, finished_at=? WHERE id=? AND status=? AND {_ORPHANED}",
+                    (FAILED, json.dumps("任务多次中断，已放弃重试", ensure_ascii=False), time.time(),
+                     row["id"], RUNNING, stale_before))
+                continue
+            # 条件更新接管任务：多个 worker 同时恢复时只有一个成功
+            taken = await self._update(
+                f"UPDATE jobs SET status=?, owner=?, heartbeat_at=? WHERE id=? AND status=? AND {_ORPHANED}",
+                (QUEUED, self.owner, time.time(), row["id"], row["status"], stale_before))
+            if not taken:
+                continue
+            if row["status"] == RUNNING:
+                self._counts["recovered"] += 1
+            recovered += 1
+            self._enqueue(row["id"], row["kind"])
+        if recovered:
+            print(f"任务队列恢复 {recovered} 个未完成任务")
+
+    async def _heartbeat(self):
+        """定期刷新本实例持有任务的心跳，并接管心跳超时的任务"""
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                await self._update("UPDATE jobs SET heartbeat_at=? WHERE owner=? AND status IN (?, ?)",
+                                   (time.time(), self.owner, QUEUED, RUNNING))
+                await self._recover()
+            except Exception as e:
+                print(f"任务心跳更新失败: {e}")
+
+    # ---------- 提交与查询 ----------
+
+    async def submit(self, kind: str, params: Dict[str, Any], client_session_id: Optional[str] = None) -> str:
+        """提交任务，返回任务ID"""
+        if kind not in self.handlers:
+            raise ValueError(f"未知任务类型: {kind}")
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        await self._db(
+            "INSERT INTO jobs (id, kind, client_session_id, status, params, created_at, owner, heartbeat_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, client_session_id, QUEUED, json.dumps(params, ensure_ascii=False), now, self.owner, now))
+        self._counts["submitted"] += 1
+        self._enqueue(job_id, kind)
+        return job_id
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        rows = await self._db("SELECT * FROM jobs WHERE id=?", (job_id,))
+        return self._row_to_job(rows[0]) if rows else None
+
+    async def list(self, client_session_id: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        if client_session_id:
+            rows = await self._db(
+                "SELECT * FROM jobs WHERE client_session_id=? ORDER BY created_at DESC LIMIT ?", (client_session_id, limit))
+        else:
+            rows = await self._db("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,))
+        jobs = [self._row_to_job(row) for row in rows]
+        for job in jobs:
+            job.pop("result", None)  # 列表不返回结果，按ID查询获取
+        return jobs
+
+    async def cancel(self, job_id: str) -> bool:
+        """取消排队中或执行中的任务（含其他 worker 上执行的任务）；已结束的任务返回 False"""
+        running = self.running.get(job_id)
+        if running is not None and running.task is not None:
+            running.cancel_requested = True
+            running.task.cancel()
+            return True
+        cancelled = await self._update("UPDATE jobs SET status=?, finished_at=? WHERE id=? AND status=?",
+                                       (CANCELLED, time.time(), job_id, QUEUED))
+        if cancelled:
+            self._counts[CANCELLED] += 1
+            return True
+        # 在其他 worker 上执行：设置共享取消标志，由执行者中断任务并记录状态
+        return await asyncio.to_thread(request_cancel, self.cancel_flags, job_id)
+
+    async def cancel_session_jobs(self, client_session_id: str, kind: Optional[str] = None) -> int:
+        """取消会话的全部未结束任务（可限定类型），返回取消数量"""
+        rows = await self._db("SELECT id, kind FROM jobs WHERE client_session_id=? AND status IN (?, ?)",
+                              (client_session_id, QUEUED, RUNNING))
+        cancelled = 0
+        for row in rows:
+            if (kind is None or row["kind"] == kind) and await self.cancel(row["id"]):
+                cancelled += 1
+        return cancelled
+
+    async def cleanup(self, hours: int = JOB_RETENTION_HOURS) -> int:
+        """删除结束超过指定时长的任务记录"""
+        cutoff = time.time() - hours * 3600
+
+        return await self._update(
+            f"DELETE FROM jobs WHERE status IN ({','.join('?' * len(FINISHED_STATUSES))}) AND finished_at < ?",
+            (*FINISHED_STATUSES, cutoff))
+
+    def stats(self) -> Dict[str, Any]:
+        finished = self._counts[SUCCEEDED] + self._counts[FAILED]
+        return {
+            "workers": self.workers,
+            "lanes": {
+                lane: {"workers": count, "queued": self._queues[lane].qsize() if lane in self._queues else 0}
+                for lane, count in self.lane_workers.items()
+            },
+            "queued": sum(queue.qsize() for queue in self._queues.values()),
+            "running": len(self.running),
+            "running_by_kind": {
+                kind: sum(1 for job in self.running.values() if job.kind == kind)
+                for kind in sorted({job.kind for job in self.running.values()})
+            },
+            **self._counts,
+            "avg_run_seconds": round(self._run_seconds / finished, 3) if finished else None
+        }
+
+    # ---------- 执行 ----------
+
+    async def _notify(self, job: _RunningJob, status: str, **extra):
+        if self.notify and job.client_session_id:
+            try:
+                await self.notify(job.client_session_id, json.dumps({
+                    "type": "job_update",
+                    "job_id": job.id,
+                    "kind": job.kind,
+                    "status": status,
+                    "progress": job.progress,
+                    **extra
+                }, ensure_ascii=False))
+            except Exception as e:
+                print(f"推送任务状态失败: {e}")
+
+    async def _update_progress(self, job: _RunningJob, progress: Optional[float], message: Optional[str]):
+        if progress is not None:
+            job.progress = round(max(0.0, min(100.0, progress)), 1)
+        if message is not None:
+            job.message = message
+        now = time.monotonic()
+        if now - job.persisted_at >= JOB_PROGRESS_PERSIST_INTERVAL:
+            job.persisted_at = now
+            await self._db("UPDATE jobs SET progress=?, message=? WHERE id=?", (job.progress, job.message, job.id))
+
+    async def _finish(self, job_id: str, status: str, result: Any = None, error: Any = None,
+                      progress: Optional[float] = None):
+        await self._db(
+            "UPDATE jobs SET status=?, result=?, error=?, finished_at=?, progress=COALESCE(?, progress) WHERE id=?",
+            (status,
+             json.dumps(result, ensure_ascii=False) if result is not None else None,
+             json.dumps(error, ensure_ascii=False) if error is not None else None,
+             time.time(), progress, job_id))
+        self._counts[status] += 1
+
+    async def _worker(self, lane: str, index: int):
+        queue = self._queues[lane]
+        while True:
+            job_id = await queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"任务 worker {lane}-{index} 执行 {job_id} 异常: {e}")
+            finally:
+                queue.task_done()
+
+    async def _watch_cancel(self, job: _RunningJob):
+        """执行期间轮询共享取消标志：其他 worker 收到的取消请求经状态后端转达"""
+        while True:
+            await asyncio.sleep(job.cancel_flag.poll_seconds)
+            if await asyncio.to_thread(lambda: job.cancel_flag.cancelled):
+                job.cancel_requested = True
+                job.task.cancel()
+                return
+
+    async def _run(self, job_id: str):
+        # 条件更新原子领取：排队期间已取消或已被其他 worker 领取时放弃
+        now = time.time()
+        claimed = await self._update(
+            "UPDATE jobs SET status=?, owner=?, heartbeat_at=?, started_at=?, attempts=attempts+1 WHERE id=? AND status=?",
+            (RUNNING, self.owner, now, now, job_id, QUEUED))
+        if not claimed:
+            return
+        row = (await self._db("SELECT * FROM jobs WHERE id=?", (job_id,)))[0]
+        handler = self.handlers.get(row["kind"])
+        job = _RunningJob(self, job_id, row["kind"], row["client_session_id"])
+        if handler is None:
+            await self._finish(job_id, FAILED, error=f"未知任务类型: {row['kind']}")
+            return
+
+        job.cancel_flag = await asyncio.to_thread(SharedCancelFlag, self.cancel_flags, job_id)
+        self.running[job_id] = job
+        await self._notify(job, RUNNING)
+        started = time.monotonic()
+        token = current_job.set(job)
+        watcher: Optional[asyncio.Task] = None
+        try:
+            job.task = asyncio.create_task(handler(json.loads(row["params"])))
+            watcher = asyncio.create_task(self._watch_cancel(job))
+            try:
+                result = await asyncio.shield(job.task)
+            except asyncio.CancelledError:
+                if not job.cancel_requested:
+                    # worker 自身被取消（服务关闭）：中断任务，保持 running 状态以便重启后恢复
+                    job.task.cancel()
+                    raise
+                await self._finish(job_id, CANCELLED)
+                await self._notify(job, CANCELLED)
+                return
+            except Exception as e:
+                error = _error_text(e)
+                print(f"任务 {row['kind']}:{job_id} 失败: {error}")
+                await self._finish(job_id, FAILED, error=error)
+                await self._notify(job, FAILED, error=error)
+                return
+            job.progress = 100.0
+            await self._finish(job_id, SUCCEEDED, result=result, progress=100.0)
+            await self._notify(job, SUCCEEDED)
+        finally:
+            current_job.reset(token)
+            self.running.pop(job_id, None)
+            self._run_seconds += time.monotonic() - started
+            if watcher is not None:
+                watcher.cancel()
+            await asyncio.to_thread(job.cancel_flag.release)
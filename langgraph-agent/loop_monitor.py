@@ -0,0 +1,145 @@
+"""
+事件循环延迟监控：定时探测协程的实际唤醒时间与预期时间之差（调度延迟），记入直方图与最近样本，
+用于在生产环境发现阻塞事件循环的回归。
+
+- 探测间隔 LOOP_LAG_INTERVAL_SECONDS，延迟分桶统计并计算 p50/p90/p99/max
+- 调试模式（LOOP_DEBUG=true）下，独立的看门狗线程在事件循环超过 LOOP_SLOW_CALLBACK_SECONDS 未响应时，
+  记录事件循环线程当前的调用栈（即正在阻塞的回调），每次卡顿只记录一次
+"""
+
+import os
+import sys
+import time
+import asyncio
+import threading
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+# 探测间隔（秒）
+LOOP_LAG_INTERVAL_SECONDS = float(os.getenv('LOOP_LAG_INTERVAL_SECONDS', '0.1'))
+# 调试模式：记录阻塞事件循环的调用栈
+LOOP_DEBUG = os.getenv('LOOP_DEBUG', 'false').lower() == 'true'
+# 调试模式下，事件循环超过该时长（秒）未响应即记录调用栈
+LOOP_SLOW_CALLBACK_SECONDS = float(os.getenv('LOOP_SLOW_CALLBACK_SECONDS', '0.1'))
+# 延迟样本保留数（用于计算分位数）
+LOOP_LAG_SAMPLES = 3000
+# 直方图分桶上界（毫秒）
+LOOP_LAG_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+# 保留最近几次卡顿的调用栈
+LOOP_STALL_HISTORY = 20
+
+
+def _percentile(samples: List[float], q: float) -> Optional[float]:
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+class LoopLagMonitor:
+    """事件循环调度延迟监控与卡顿调用栈记录"""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL_SECONDS, debug: bool = LOOP_DEBUG,
+                 slow_callback_seconds: float = LOOP_SLOW_CALLBACK_SECONDS):
+        self.interval = interval
+        self.debug = debug
+        self.slow_callback_seconds = slow_callback_seconds
+        self.buckets = [0] * (len(LOOP_LAG_BUCKETS_MS) + 1)
+        self.samples: Deque[float] = deque(maxlen=LOOP_LAG_SAMPLES)
+        self.count = 0
+        self.stalls: Deque[Dict[str, Any]] = deque(maxlen=LOOP_STALL_HISTORY)
+        self.stall_count = 0
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+        # 事件循环最近一次响应的时间（time.monotonic），看门狗线程读取
+        self._last_tick = time.monotonic()
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._probe())
+        if self.debug:
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
+
+    async def _probe(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self._last_tick = time.monotonic()
+            self.record(max(0.0, loop.time() - expected))
+
+    def record(self, lag_seconds: float):
+        lag_ms = lag_seconds * 1000
+        index = len(LOOP_LAG_BUCKETS_MS)
+        for i, bound in enumerate(LOOP_LAG_BUCKETS_MS):
+            if lag_ms <= bound:
+                index = i
+                break
+        self.buckets[index] += 1
+        self.samples.append(lag_ms)
+        self.count += 1
+
+    def _watch(self):
+        """看门狗线程：事件循环超时未响应时记录其调用栈"""
+        reported_tick = None
+        threshold = self.interval + self.slow_callback_seconds
+        while not self._stopped.wait(min(self.slow_callback_seconds / 2, 0.05)):
+            last_tick = self._last_tick
+            blocked = time.monotonic() - last_tick
+            if blocked < threshold or reported_tick == last_tick:
+                continue
+            reported_tick = last_tick
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame))
+            self.stall_count += 1
+            self.stalls.append({
+                "detected_at": datetime.now().isoformat(),
+                "blocked_ms": round(blocked * 1000, 1),
+                "stack": stack
+            })
+            print(f"事件循环已阻塞 {blocked * 1000:.0f}ms，当前调用栈:\n{stack}")
+
+    def stats(self) -> Dict[str, Any]:
+        ordered = sorted(self.samples)
+        histogram = {f"le_{bound}ms": n for bound, n in zip(LOOP_LAG_BUCKETS_MS, self.buckets)}
+        histogram[f"gt_{LOOP_LAG_BUCKETS_MS[-1]}ms"] = self.buckets[-1]
+        return {
+            "interval_seconds": self.interval,
+            "probes": self.count,
+            "lag_ms": {
+                "p50": _percentile(ordered, 0.5),
+                "p90": _percentile(ordered, 0.9),
+                "p99": _percentile(ordered, 0.99),
+                "max": ordered[-1] if ordered else None
+            },
+            "histogram": histogram,
+            "debug": self.debug,
+            "stall_count": self.stall_count,
+            "recent_stalls": list(self.stalls)
+        }
+
+
+loop_monitor = LoopLagMonitor()
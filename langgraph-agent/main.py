@@ -1,44 +1,62 @@
 import os
 import json
 import asyncio
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from datetime import datetime, timedelta
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 from agent import QwenAgent
-from langchain_core.messages import BaseMessage
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, AIMessageChunk
 from oss_api import setup_oss_routes
-from speech_tool import speech_recognition
-from video_understanding_tool import video_understanding
+from speech_tool import (
+    speech_recognition,
+    create_vocabulary,
+    delete_vocabulary,
+    transcribe_file,
+    plan_audio_chunks,
+    select_chunk_sentences,
+    merge_chunk_sentences,
+    prepare_audio_chunks,
+)
+from dashscope.audio.asr import VocabularyService
+from video_understanding_tool import video_understanding_async
 from video_processor import (
     get_video_duration,
     add_timestamp_overlay,
-    split_video_segments,
+    plan_segment_ranges,
+    stream_video_segments,
+)
+from sop_integration_tool import integrate_sop_segments_async
+from prompt_splitter_tool import (
+    split_prompt_for_long_video_async,
+    warm_prompt_split_cache,
+    normalize_lang,
+    DEFAULT_LONG_VIDEO_PROMPTS
 )
-from sop_integration_tool import integrate_sop_segments
-from sop_parser_tool import sop_parser
-from sop_refine_tool import sop_refine
-import dashscope
-import psutil
+from sop_parser_tool import sop_parser_async
+from sop_refine_tool import refine_sop_blocks_async
+from transcript import Transcript
+from chat_history import ChatHistoryManager
+from dashscope_client import close_http_client
+from rate_limiter import PRIORITY_BATCH, current_priority, get_rate_limit_stats
+from hedging import segment_hedger
+from singleflight import SingleFlight, request_key
+from pipeline_dag import StageDAG
+from job_checkpoint import CHECKPOINT_FILENAME, JobCheckpoint
+from job_queue import JOB_QUEUE_COMPRESSION_WORKERS, JobQueue, report_progress
+from state_backend import SharedDict, SharedSet, get_state_backend
+from ws_bus import create_message_bus
+from connection_manager import ConnectionManager
+from system_metrics import system_metrics
+from loop_monitor import loop_monitor
 
 # 加载环境变量
 load_dotenv('../.env')
 
 def get_system_resources():
-    """获取系统资源信息"""
-    cpu_count = os.cpu_count() or 1
-    cpu_percent = psutil.cpu_percent(interval=0.1)  # 短采样提高响应速度
-    memory = psutil.virtual_memory()
-    memory_total_gb = round(memory.total / (1024**3))
-    memory_percent = round(memory.percent, 1)
-    
-    return {
-        "cpu_count": cpu_count,
-        "cpu_percent": round(cpu_percent, 1),
-        "memory_total_gb": memory_total_gb,
-        "memory_percent": memory_percent
-    }
+    """获取系统资源信息（后台采样的最近一次结果，不阻塞事件循环）"""
+    return system_metrics.resources()
 
 # 配置 LangSmith 追踪（如果设置了环境变量）
 if os.getenv('LANGSMITH_TRACING'):
@@ -74,38 +92,69 @@ app.add_middleware(
 agent_pool = [QwenAgent() for _ in range(3)]
 next_agent_index = 0
 
-# 会话管理
-session_histories: Dict[str, Dict[str, Any]] = {}
+# 协调状态保存在状态后端（STATE_BACKEND），多个 worker 共享会话、保留标记与断连计时
+state_backend = get_state_backend()
+
+def _encode_datetime(value: datetime) -> float:
+    return value.timestamp()
+
+def _encode_session(session: Dict[str, Any]) -> Dict[str, Any]:
+    return {"history": session["history"].to_dict(), "agent_index": session["agent_index"]}
+
+def _decode_session(data: Dict[str, Any]) -> Dict[str, Any]:
+    return {"history": ChatHistoryManager.from_dict(data["history"]), "agent_index": data["agent_index"]}
+
+# 会话管理（共享后端下读取得到副本，修改后需写回）
+session_histories = SharedDict(state_backend, "session_histories", _encode_session, _decode_session)
 # 结构: {
 #   "client_session_id": {
-#     "history": List[BaseMessage],
-#     "last_active": datetime,
+#     "history": ChatHistoryManager,  # 按 token 预算保留最近对话，较早对话折叠为摘要
 #     "agent_index": int
 #   }
 # }
+# 会话最近活跃时间（与历史分开保存，更新活跃时间与清理过期会话时无需读取历史）
+session_last_active = SharedDict(state_backend, "session_last_active", _encode_datetime, datetime.fromtimestamp)
 SESSION_TIMEOUT_HOURS = 1  # 1小时超时
+# 会话写回锁（本进程内）：对话轮次写回与后台摘要写回互斥，避免用过期副本覆盖新内容
+session_write_locks: Dict[str, asyncio.Lock] = {}
+# 各会话进行中的后台摘要任务（共享后端下会话是解码得到的副本，不能在副本上记录任务）
+session_summary_tasks: Dict[str, asyncio.Task] = {}
 
 # 视频保留标记集合
-keep_sessions: set = set()
+keep_sessions = SharedSet(state_backend, "keep_sessions")
+
+# 会话语音识别结果（状态后端中以列式字典保存，任一 worker 可读取），视频理解请求未携带 audio_transcript 时使用
+session_transcripts = SharedDict(state_backend, "session_transcripts", Transcript.to_columns, Transcript.from_columns)
+
+def resolve_audio_transcript(client_session_id: Optional[str], audio_transcript: Optional[str]) -> Optional[str]:
+    """优先使用请求中的语音文本，否则回退到服务端保存的该会话识别结果（含用户通过 /api/update_transcript 保存的编辑）"""
+    if audio_transcript:
+        return audio_transcript
+    transcript = session_transcripts.get(client_session_id) if client_session_id else None
+    if transcript:
+        return transcript.to_text()
+    return audio_transcript
 
 # WebSocket断连追踪
-websocket_disconnect_tracker: Dict[str, datetime] = {}
+websocket_disconnect_tracker = SharedDict(state_backend, "websocket_disconnect_tracker", _encode_datetime, datetime.fromtimestamp)
 DISCONNECT_GRACE_PERIOD = timedelta(minutes=5)
 
 def update_session_activity(client_session_id: str):
     """更新会话活跃时间"""
-    if client_session_id in session_histories:
-        session_histories[client_session_id]["last_active"] = datetime.now()
+    if client_session_id in session_last_active:
+        session_last_active[client_session_id] = datetime.now()
 
 def cleanup_expired_sessions():
     """清理过期会话"""
     now = datetime.now()
     expired_sessions = [
-        sid for sid, session in session_histories.items()
-        if now - session["last_active"] > timedelta(hours=SESSION_TIMEOUT_HOURS)
+        sid for sid, last_active in session_last_active.items()
+        if now - last_active > timedelta(hours=SESSION_TIMEOUT_HOURS)
     ]
     for sid in expired_sessions:
-        del session_histories[sid]
+        session_histories.pop(sid, None)
+        session_last_active.pop(sid, None)
+        session_write_locks.pop(sid, None)
         print(f"清理过期会话: {sid}")
     
     if expired_sessions:
@@ -119,83 +168,75 @@ def get_or_create_session(client_session_id: str) -> Dict[str, Any]:
     cleanup_expired_sessions()
     
     # 获取或创建会话
-    if client_session_id not in session_histories:
-        session_histories[client_session_id] = {
-            "history": [],
-            "last_active": datetime.now(),
+    session = session_histories.get(client_session_id)
+    if session is None:
+        session = {
+            "history": ChatHistoryManager(),
             "agent_index": next_agent_index % len(agent_pool)
         }
+        session_histories[client_session_id] = session
         next_agent_index += 1
-        print(f"创建新会话: {client_session_id}, 分配Agent实例: {session_histories[client_session_id]['agent_index']}")
-    else:
-        session_histories[client_session_id]["last_active"] = datetime.now()
+        print(f"创建新会话: {client_session_id}, 分配Agent实例: {session['agent_index']}")
+    session_last_active[client_session_id] = datetime.now()
     
-    return session_histories[client_session_id]
+    return session
+
+async def save_session_turn(client_session_id: str, session: Dict[str, Any]):
+    """写回本轮对话：先合并状态后端中可能已更新的摘要，再整体写回"""
+    async with session_write_locks.setdefault(client_session_id, asyncio.Lock()):
+        latest = session_histories.get(client_session_id)
+        if latest is not None:
+            session["history"].merge_summary(latest["history"])
+        session_histories[client_session_id] = session
+
+async def _summarize_session(client_session_id: str, history: ChatHistoryManager, llm):
+    """折叠较早的对话；完成后重新读取会话，只写回摘要相关字段，不覆盖摘要期间新增的对话"""
+    try:
+        if not await history.summarize(llm):
+            return
+        async with session_write_locks.setdefault(client_session_id, asyncio.Lock()):
+            latest = session_histories.get(client_session_id)
+            if latest is not None and latest["history"].merge_summary(history):
+                session_histories[client_session_id] = latest
+    finally:
+        if session_summary_tasks.get(client_session_id) is asyncio.current_task():
+            session_summary_tasks.pop(client_session_id, None)
+
+def schedule_session_summary(client_session_id: str, history: ChatHistoryManager, llm):
+    """两轮对话之间在后台将较早的对话折叠为摘要，不阻塞当前回复；同一会话同时只运行一个摘要任务"""
+    if not history.needs_summary():
+        return
+    task = session_summary_tasks.get(client_session_id)
+    if task is not None and not task.done():
+        return
+    session_summary_tasks[client_session_id] = asyncio.create_task(
+        _summarize_session(client_session_id, history, llm)
+    )
 
 def get_agent_for_session(session: Dict[str, Any]) -> QwenAgent:
     """获取会话对应的Agent实例"""
     return agent_pool[session["agent_index"]]
 
-class ConnectionManager:
-    """WebSocket 连接管理器"""
-    
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-        # 维护 client_session_id 到 WebSocket 连接的映射
-        self.client_sessions: Dict[str, WebSocket] = {}
-    
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-        print(f"客户端已连接，当前连接数: {len(self.active_connections)}")
-    
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-        
-        client_session_id_to_remove = None
-        for client_session_id, ws in self.client_sessions.items():
-            if ws == websocket:
-                client_session_id_to_remove = client_session_id
-                break
-        
-        if client_session_id_to_remove:
-            # 记录断连时间，而非立即清理
-            websocket_disconnect_tracker[client_session_id_to_remove] = datetime.now()
-            del self.client_sessions[client_session_id_to_remove]
-            print(f"客户端断开，开始5分钟宽限期: {client_session_id_to_remove}")
-        
-        print(f"客户端已断开，当前连接数: {len(self.active_connections)}")
-    
-    async def send_message(self, websocket: WebSocket, message: str):
-        try:
-            await websocket.send_text(message)
-        except Exception as e:
-            print(f"发送消息失败: {e}")
-            self.disconnect(websocket)
-    
-    def register_client(self, client_session_id: str, websocket: WebSocket):
-        """注册客户端会话"""
-        self.client_sessions[client_session_id] = websocket
-        print(f"客户端会话已注册: {client_session_id}")
-    
-    async def send_to_client(self, client_session_id: str, message: str):
-        """向特定客户端发送消息"""
-        if client_session_id in self.client_sessions:
-            websocket = self.client_sessions[client_session_id]
-            try:
-                await websocket.send_text(message)
-                print(f"已向客户端 {client_session_id} 发送消息")
-            except Exception as e:
-                print(f"向客户端 {client_session_id} 发送消息失败: {e}")
-                self.disconnect(websocket)
-        else:
-            print(f"客户端 {client_session_id} 未找到或已断开连接")
+# WS_BUS 选择消息总线：多 worker 部署时使用 unix（同机）或 redis（跨机）
+manager = ConnectionManager(
+    create_message_bus(),
+    # 断连时记录时间，宽限期后由定时任务清理会话
+    on_session_disconnected=lambda sid: websocket_disconnect_tracker.__setitem__(sid, datetime.now())
+)
+
+# 相同请求合并：重复提交（重连、双击）的相同请求共享一次执行，通知发给所有等待的会话
+singleflight = SingleFlight(manager.send_to_client)
 
-manager = ConnectionManager()
+# 持久化后台任务队列：长耗时请求提交后立即返回任务ID，任务类型在各端点定义后注册；视频压缩使用独立通道。
+# 取消标志保存在状态后端，取消请求可由任一 worker 受理
+job_queue = JobQueue(
+    notify=manager.send_to_client,
+    lanes={"compression": JOB_QUEUE_COMPRESSION_WORKERS},
+    cancel_flags=SharedDict(state_backend, "job_cancel_flags")
+)
 
 # 设置 OSS 相关路由
-setup_oss_routes(app, manager)
+setup_oss_routes(app, manager, job_queue)
 
 @app.get("/api/health")
 async def health_check():
@@ -258,11 +299,10 @@ async def websocket_endpoint(websocket: WebSocket):
                 
                 try:
                     # 流式调用 Agent（使用会话独立的历史）
-                    final_message = None
+                    # AIMessageChunk 为逐 token 增量，直接作为 chunk 转发；完整消息（工具调用提示等）替换当前回复
+                    full_content = ""
                     
-                    async for message in agent.astream_chat(user_message, session_history.copy()):
-                        final_message = message
-                        
+                    async for message in agent.astream_chat(user_message, session_history.prompt_messages()):
                         # 检查是否包含工具调用
                         if hasattr(message, 'tool_calls') and message.tool_calls:
                             for tool_call in message.tool_calls:
@@ -274,28 +314,41 @@ async def websocket_endpoint(websocket: WebSocket):
                                         "status": "running",
                                         "message": "正在转录音频..."
                                     }))
+                            # 工具执行后的回复重新开始累计
+                            full_content = ""
                         
-                        # 发送普通消息内容
+                        # 发送增量内容
+                        elif isinstance(message, AIMessageChunk):
+                            full_content += message.content
+                            await manager.send_message(websocket, json.dumps({
+                                "type": "chunk",
+                                "content": message.content,
+                                "delta": True
+                            }))
+                        
+                        # 未流式生成的完整消息（如错误提示）
                         elif hasattr(message, 'content') and message.content:
+                            full_content = message.content
                             await manager.send_message(websocket, json.dumps({
                                 "type": "chunk",
                                 "content": message.content
                             }))
                     
                     # 发送完成信号
-                    if final_message and hasattr(final_message, 'content'):
+                    if full_content:
                         await manager.send_message(websocket, json.dumps({
                             "type": "complete",
-                            "content": final_message.content
+                            "content": full_content
                         }))
                     
-                    # 更新会话历史（而非全局历史）
-                    from langchain_core.messages import HumanMessage, AIMessage
+                    # 更新会话历史（而非全局历史），并写回状态后端
                     session_history.append(HumanMessage(content=user_message))
-                    if final_message and hasattr(final_message, 'content'):
-                        session_history.append(AIMessage(content=final_message.content))
+                    if full_content:
+                        session_history.append(AIMessage(content=full_content))
+                    await save_session_turn(client_session_id, session)
+                    schedule_session_summary(client_session_id, session_history, agent.llm)
                     
-                    print(f"AI 响应完成 (会话: {client_session_id}): {final_message.content[:100] if final_message and hasattr(final_message, 'content') else 'No content'}...")
+                    print(f"AI 响应完成 (会话: {client_session_id}): {full_content[:100] if full_content else 'No content'}...")
                     
                 except Exception as e:
                     error_msg = f"处理消息时出现错误: {str(e)}"
@@ -320,8 +373,7 @@ async def websocket_endpoint(websocket: WebSocket):
                     manager.register_client(client_session_id, websocket)
                     
                     # 检查是否在宽限期内重连
-                    if client_session_id in websocket_disconnect_tracker:
-                        del websocket_disconnect_tracker[client_session_id]
+                    if websocket_disconnect_tracker.pop(client_session_id, None) is not None:
                         print(f"客户端重连，取消清理: {client_session_id}")
                     
                     await manager.send_message(websocket, json.dumps({
@@ -445,14 +497,14 @@ async def load_example_video_endpoint(request: dict):
         
         # 1 & 2. 高效复制示例视频到本地存储
         from local_storage_manager import save_video_locally_file
-        local_video_path = save_video_locally_file(example_video_path, client_session_id)
+        local_video_path = await asyncio.to_thread(save_video_locally_file, example_video_path, client_session_id)
         
-        # 3. 提取音频
-        audio_path = extract_audio_from_video(local_video_path)
+        # 3. 提取音频（ffmpeg 子进程，在线程中等待）
+        audio_path = await asyncio.to_thread(extract_audio_from_video, local_video_path)
         
         # 4. 上传音频到OSS
         audio_oss_key = f"{client_session_id}/audio/extracted_audio.mp3"
-        audio_url = upload_file_to_oss(audio_path, audio_oss_key)
+        audio_url = await asyncio.to_thread(upload_file_to_oss, audio_path, audio_oss_key)
         
         # 5. 删除临时音频文件
         if os.path.exists(audio_path):
@@ -490,7 +542,7 @@ async def load_example_video_endpoint(request: dict):
             
             # 8. 触发视频压缩任务（与正常上传流程一致）
             from oss_api import start_compression_task
-            await start_compression_task(client_session_id, local_video_path, "720p", manager)
+            await start_compression_task(client_session_id, local_video_path, "720p", manager, job_queue)
         
         response = {
             "success": True,
@@ -510,6 +562,81 @@ async def load_example_video_endpoint(request: dict):
         print(error_msg)
         raise HTTPException(status_code=500, detail=error_msg)
 
+# 增量语音识别分块参数（秒）
+SPEECH_CHUNK_SECONDS = 300
+SPEECH_CHUNK_OVERLAP_SECONDS = 10
+
+async def run_incremental_speech_recognition(
+    client_session_id: str,
+    audio_url: str,
+    vocabulary: Optional[List[str]] = None,
+    chunk_seconds: int = SPEECH_CHUNK_SECONDS,
+    overlap_seconds: int = SPEECH_CHUNK_OVERLAP_SECONDS
+):
+    """分块并行语音识别，每个分块完成后推送该分块的句子，返回合并去重后的完整句子列表"""
+    from audio_extractor import get_video_duration as get_media_duration
+
+    # ffprobe 可直接读取远程音频时长
+    duration_sec = await asyncio.to_thread(get_media_duration, audio_url)
+    chunks = plan_audio_chunks(duration_sec, chunk_seconds, overlap_seconds)
+
+    # 音频较短（或时长未知）时不分块，直接整段识别
+    if len(chunks) <= 1:
+        result_json = await asyncio.to_thread(speech_recognition, audio_url, vocabulary)
+        return json.loads(result_json)
+
+    chunks = await asyncio.to_thread(prepare_audio_chunks, audio_url, client_session_id, chunks)
+
+    service = VocabularyService()
+    vocabulary_id = await asyncio.to_thread(create_vocabulary, service, vocabulary)
+    tasks = []
+    transcribe_tasks = []
+    try:
+        async def recognize_chunk(chunk):
+            # 线程中的转录无法中途取消：单独保留，取消分块任务时仍能等它结束
+            transcribe_task = asyncio.ensure_future(asyncio.to_thread(transcribe_file, chunk["url"], vocabulary_id))
+            transcribe_tasks.append(transcribe_task)
+            chunk_result = await asyncio.shield(transcribe_task)
+            return chunk, chunk_result
+
+        tasks = [asyncio.create_task(recognize_chunk(chunk)) for chunk in chunks]
+        batches = []
+        completed = 0
+        for next_done in asyncio.as_completed(tasks):
+            chunk, chunk_result = await next_done
+            if "error" in chunk_result:
+                return {"error": f"分块 {chunk['chunk_index'] + 1} 识别失败: {chunk_result['error']}"}
+
+            sentences = select_chunk_sentences(chunk_result["sentences"], chunk)
+            batches.append(sentences)
+            completed += 1
+            await report_progress(completed * 100 / len(chunks), f"已识别 {completed}/{len(chunks)} 个分块")
+
+            await manager.send_to_client(client_session_id, json.dumps({
+                "type": "speech_recognition_partial",
+                "chunk_index": chunk["chunk_index"],
+                "completed_chunks": completed,
+                "total_chunks": len(chunks),
+                "sentences": sentences
+            }))
+
+        return merge_chunk_sentences(batches)
+    finally:
+        # 提前返回或出错时取消其余分块
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        # 已提交的转录仍在使用热词表：全部结束后再删除（仍有未结束的转录时在后台等待，不拖慢返回）
+        async def delete_vocabulary_when_idle():
+            await asyncio.gather(*transcribe_tasks, return_exceptions=True)
+            await asyncio.to_thread(delete_vocabulary, service, vocabulary_id)
+
+        if all(task.done() for task in transcribe_tasks):
+            await delete_vocabulary_when_idle()
+        else:
+            asyncio.create_task(delete_vocabulary_when_idle())
+
 @app.post("/api/speech_recognition")
 async def speech_recognition_endpoint(request: dict):
     """语音识别API端点"""
@@ -532,7 +659,7 @@ async def speech_recognition_endpoint(request: dict):
         # 验证音频URL可访问性（避免后续模型调用直接500）
         try:
             import requests
-            head_resp = requests.head(audio_url, timeout=10)
+            head_resp = await asyncio.to_thread(requests.head, audio_url, timeout=10)
             if head_resp.status_code != 200:
                 raise HTTPException(status_code=404, detail=f"音频文件不可访问，状态码: {head_resp.status_code}")
         except HTTPException:
@@ -540,15 +667,32 @@ async def speech_recognition_endpoint(request: dict):
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"音频URL验证失败: {str(e)}")
         
-        # 使用线程池执行同步调用，避免阻塞事件循环
-        # 传递易错词列表给 speech_recognition 函数
-        result_json = await asyncio.to_thread(speech_recognition, audio_url, vocabulary)
-        result = json.loads(result_json)
+        if request.get("incremental"):
+            chunk_seconds = request.get("chunk_seconds", SPEECH_CHUNK_SECONDS)
+            chunk_overlap = request.get("chunk_overlap", SPEECH_CHUNK_OVERLAP_SECONDS)
+            if not isinstance(chunk_seconds, (int, float)) or not isinstance(chunk_overlap, (int, float)) \
+                    or chunk_seconds <= 0 or not 0 <= chunk_overlap < chunk_seconds:
+                raise HTTPException(status_code=400, detail="chunk_seconds 须大于 0，chunk_overlap 须满足 0 <= chunk_overlap < chunk_seconds")
+            # 增量模式：分块识别，每块完成后通过WebSocket推送 speech_recognition_partial
+            result = await run_incremental_speech_recognition(
+                client_session_id,
+                audio_url,
+                vocabulary,
+                chunk_seconds=chunk_seconds,
+                overlap_seconds=chunk_overlap
+            )
+        else:
+            # 使用线程池执行同步调用，避免阻塞事件循环
+            # 传递易错词列表给 speech_recognition 函数
+            result_json = await asyncio.to_thread(speech_recognition, audio_url, vocabulary)
+            result = json.loads(result_json)
         
         # 检查是否有错误
         if "error" in result:
             raise HTTPException(status_code=500, detail=result["error"])
         
+        session_transcripts[client_session_id] = Transcript.from_sentences(result)
+        
         # 通过WebSocket发送操作记录给特定客户端
         speech_notification = {
             "type": "speech_recognition_complete",
@@ -570,9 +714,33 @@ async def speech_recognition_endpoint(request: dict):
         print(error_msg)
         raise HTTPException(status_code=500, detail=error_msg)
 
+@app.post("/api/update_transcript")
+async def update_transcript_endpoint(request: dict):
+    """保存用户编辑后的语音识别结果，请求未携带 audio_transcript 时回退到该版本"""
+    client_session_id = request.get("client_session_id")
+    if not client_session_id:
+        raise HTTPException(status_code=400, detail="缺少 client_session_id 参数")
+    sentences = request.get("sentences")
+    if not isinstance(sentences, list):
+        raise HTTPException(status_code=400, detail="缺少 sentences 参数")
+    update_session_activity(client_session_id)
+    session_transcripts[client_session_id] = Transcript.from_sentences(sentences)
+    return {"success": True, "sentence_count": len(sentences)}
+
 @app.post("/api/video_understanding")
 async def video_understanding_endpoint(request: dict):
-    """视频理解API端点"""
+    """视频理解API端点（相同请求执行中时合并）"""
+    client_session_id = request.get("client_session_id") or request.get("session_id")
+    key = request_key("video_understanding", {
+        "video_url": request.get("video_url"),
+        "prompt": request.get("prompt"),
+        "fps": request.get("fps", 2),
+        "audio_transcript": resolve_audio_transcript(client_session_id, request.get("audio_transcript"))
+    })
+    return await singleflight.do(key, client_session_id, lambda: video_understanding(request))
+
+async def video_understanding(request: dict):
+    """视频理解"""
     try:
         video_url = request.get("video_url")
         prompt = request.get("prompt")
@@ -589,7 +757,7 @@ async def video_understanding_endpoint(request: dict):
         # 验证视频URL是否可访问
         try:
             import requests
-            response = requests.head(video_url, timeout=10)
+            response = await asyncio.to_thread(requests.head, video_url, timeout=10)
             if response.status_code != 200:
                 raise HTTPException(status_code=400, detail=f"视频文件无法访问，状态码: {response.status_code}")
         except requests.RequestException as e:
@@ -607,9 +775,10 @@ async def video_understanding_endpoint(request: dict):
         if client_session_id:
             update_session_activity(client_session_id)
         
-        # 使用线程池执行同步调用
-        result_json = await asyncio.to_thread(
-            video_understanding,
+        audio_transcript = resolve_audio_transcript(client_session_id, audio_transcript)
+        
+        # 原生异步调用（共享连接池）
+        result_json = await video_understanding_async(
             video_url=video_url,
             prompt=prompt,
             fps=fps,
@@ -633,7 +802,7 @@ async def video_understanding_endpoint(request: dict):
         
         # 发送给特定客户端
         if client_session_id:
-            await manager.send_to_client(client_session_id, json.dumps(video_notification))
+            await singleflight.notify(client_session_id, json.dumps(video_notification))
         
         return {"success": True, "result": result.get("result", "")}
         
@@ -698,8 +867,232 @@ async def get_video_duration_endpoint(request: dict):
         raise HTTPException(status_code=500, detail=error_msg)
 
 
+# ---------- 视频理解流水线（阶段 DAG）：短视频上传后整体理解，长视频边切割边理解后整合 ----------
+VIDEO_PIPELINE = StageDAG("video_understanding_long")
+
+
+def _duration_text(duration_sec: float) -> str:
+    minutes = int(duration_sec // 60)
+    seconds = int(duration_sec % 60)
+    return f"{minutes}分{seconds}秒" if minutes > 0 else f"{seconds}秒"
+
+
+@VIDEO_PIPELINE.stage(
+    inputs=("video_path", "split_threshold"), outputs=("duration_sec", "is_long"),
+    done_status=("length_detected", lambda ctx: (
+        f"视频时长 {_duration_text(ctx['duration_sec'])}，将分段" if ctx["is_long"]
+        else f"视频时长 {_duration_text(ctx['duration_sec'])}，不分段"
+    ))
+)
+async def probe_duration(video_path, split_threshold):
+    """获取时长，决定是否分段"""
+    duration_sec = await asyncio.to_thread(get_video_duration, video_path, True)
+    is_long = duration_sec > split_threshold * 60
+    print(f"DEBUG: 视频时长检测 - duration_sec: {duration_sec}, split_threshold: {split_threshold}, split_threshold*60: {split_threshold * 60}, is_long: {is_long}")
+    return {"duration_sec": duration_sec, "is_long": is_long}
+
+
+@VIDEO_PIPELINE.stage(
+    inputs=("video_path", "client_session_id", "is_long"), outputs=("video_url",),
+    when=lambda ctx: not ctx["is_long"],
+    start_status=("upload_start", "开始上传压缩视频"), done_status=("upload_done", "压缩视频上传完成")
+)
+async def upload_compressed_video(video_path, client_session_id, is_long):
+    """短视频：上传压缩视频到OSS（长视频直接使用本地文件切割）"""
+    from oss_manager import upload_file_to_oss
+    video_url = await asyncio.to_thread(upload_file_to_oss, video_path, f"{client_session_id}/compressed_video.mp4")
+    return {"video_url": video_url}
+
+
+@VIDEO_PIPELINE.stage(
+    inputs=("video_url", "prompt", "fps", "audio_transcript", "client_session_id"), outputs=("result",),
+    start_status=("understanding_start", "开始视频理解(短视频)")
+)
+async def understand_short_video(video_url, prompt, fps, audio_transcript, client_session_id):
+    """短视频：直接调用Qwen3-VL-Plus输出完整草稿(含标题/摘要/关键词)"""
+    result = json.loads(await video_understanding_async(video_url, prompt, fps, audio_transcript))
+    if "error" in result:
+        raise HTTPException(status_code=500, detail=result["error"])
+
+    # 通过WebSocket发送完成
+    await singleflight.notify(client_session_id, json.dumps({
+        "type": "video_understanding_complete",
+        "video_url": video_url,
+        "result": result.get("result", ""),
+        "fps": fps,
+        "has_audio_context": bool(audio_transcript),
+        "message": "短视频理解完成"
+    }))
+    return {"result": result.get("result", "")}
+
+
+@VIDEO_PIPELINE.stage(
+    inputs=("prompt", "req_lang", "is_long", "checkpoint"), outputs=("segment_prompt", "integration_prompt"),
+    when=lambda ctx: ctx["is_long"],
+    start_status=("splitting_prompt", "正在分析提示词...")
+)
+async def split_prompt(prompt, req_lang, is_long, checkpoint):
+    """长视频：拆分提示词（命中缓存或断点时无需调用模型），与切割并行"""
+    if checkpoint.prompt_split:
+        return dict(checkpoint.prompt_split)
+    prompt_split_result = await split_prompt_for_long_video_async(prompt, req_lang)
+    segment_prompt = prompt_split_result.get("segment_prompt", "")
+    integration_prompt = prompt_split_result.get("integration_prompt", "")
+    checkpoint.save_prompt_split(segment_prompt, integration_prompt)
+    return {"segment_prompt": segment_prompt, "integration_prompt": integration_prompt}
+
+
+@VIDEO_PIPELINE.stage(
+    inputs=("video_path", "duration_sec", "segment_length", "segment_overlap", "fps", "audio_transcript",
+            "client_session_id", "is_long", "checkpoint"),
+    lazy_inputs=("segment_prompt",), outputs=("segment_results",),
+    when=lambda ctx: ctx["is_long"],
+    start_status=("segmenting", "正在分段...")
+)
+async def understand_segments(video_path, duration_sec, segment_length, segment_overlap, fps, audio_transcript,
+                              client_session_id, is_long, checkpoint, segment_prompt):
+    """长视频：逐段切割，每段就绪且提示词拆分完成后立即开始理解；断点中已完成的片段直接重放结果"""
+    async def process_segment(seg):
+        cached = checkpoint.segment_result(seg['segment_id'])
+        if cached:
+            await singleflight.notify(client_session_id, json.dumps({
+                "type": "segment_completed",
+                "segment_id": cached['segment_id'],
+                "time_range": cached['time_range'],
+                "result": cached['result'],
+                "resumed": True
+            }))
+            return cached
+
+        # 片段理解属于批量任务，在模型调用排队时让位于交互式对话
+        current_priority.set(PRIORITY_BATCH)
+        # 格式化时间段信息为 mm:ss 格式
+        def format_time_mmss(seconds):
+            mins = int(seconds) // 60
+            secs = int(seconds) % 60
+            return f"{mins:02d}:{secs:02d}"
+        
+        start_time_str = format_time_mmss(seg['start_time'])
+        end_time_str = format_time_mmss(seg['end_time'])
+        time_range_formatted = f"{start_time_str}-{end_time_str}"
+        
+        # 通知开始
+        await singleflight.notify(client_session_id, json.dumps({
+            "type": "segment_processing",
+            "segment_id": seg['segment_id'],
+            "time_range": time_range_formatted
+        }))
+        
+        # 在片段提示词前添加时间段信息
+        segment_prompt_with_context = f"""你获得的视频片段是完整视频的{time_range_formatted}部分。
+
+{await segment_prompt}"""
+
+        # 超过近期片段延迟分位数仍未完成时发起对冲请求，取先成功的结果
+        res_json = await segment_hedger.call(
+            lambda: video_understanding_async(
+                seg['url'],
+                segment_prompt_with_context,  # 使用包含时间段信息的提示词
+                fps,
+                audio_transcript
+            ),
+            is_error=lambda result: '"error"' in result
+        )
+        res = json.loads(res_json)
+        text = res.get("result", "") if "error" not in res else f"[error] {res.get('error')}"
+        await singleflight.notify(client_session_id, json.dumps({
+            "type": "segment_completed",
+            "segment_id": seg['segment_id'],
+            "time_range": time_range_formatted,
+            "result": text
+        }))
+        result = {
+            "segment_id": seg['segment_id'],
+            "time_range": time_range_formatted,
+            "start_time": seg['start_time'],
+            "end_time": seg['end_time'],
+            "result": text
+        }
+        checkpoint.save_segment_result(result)
+        return result
+
+    completed = 0
+    # 按计划的片段总数计算进度（片段边切割边理解，已创建的任务数仍在增长）
+    planned = max(1, len(plan_segment_ranges(duration_sec, segment_length*60, segment_overlap*60)))
+
+    async def process_and_report(seg):
+        nonlocal completed
+        result = await process_segment(seg)
+        completed += 1
+        # 整合阶段约占剩余 10%
+        await report_progress(completed * 90 / planned, f"已完成 {completed}/{planned} 个片段")
+        return result
+
+    # 边切割边理解：每个片段上传完成即启动理解任务，切割、上传与模型推理在片段间重叠
+    segment_tasks = []
+    try:
+        async for seg in stream_video_segments(
+            video_path, client_session_id, duration_sec, segment_length*60, segment_overlap*60, True,
+            checkpoint.reusable_segments()
+        ):
+            checkpoint.save_segment(seg)
+            segment_tasks.append(asyncio.create_task(process_and_report(seg)))
+        checkpoint.mark_segments_complete()
+
+        await singleflight.notify(client_session_id, json.dumps({
+            "type": "status", "stage": "segments_running", "message": f"已切割 {len(segment_tasks)} 个片段，等待全部理解完成"
+        }))
+        return {"segment_results": await asyncio.gather(*segment_tasks)}
+    except BaseException:
+        for task in segment_tasks:
+            task.cancel()
+        raise
+
+
+@VIDEO_PIPELINE.stage(
+    inputs=("segment_results", "integration_prompt", "audio_transcript", "client_session_id", "checkpoint"),
+    outputs=("integrated",),
+    start_status=("integrating", "正在整合片段结果...")
+)
+async def integrate_segments(segment_results, integration_prompt, audio_transcript, client_session_id, checkpoint):
+    """长视频：整合片段结果（片段结果未变化时复用断点中的整合结果）；失败也继续返回片段结果，供前端展示"""
+    async def on_integration_level(level, group_count, input_count):
+        await singleflight.notify(client_session_id, json.dumps({
+            "type": "status", "stage": "integrating",
+            "message": f"分层整合第{level}层：{input_count} 个结果分为 {group_count} 组并行合并..."
+        }))
+
+    integrated = checkpoint.integrated_for(segment_results)
+    if integrated is None:
+        integrated = await integrate_sop_segments_async(
+            segment_results, 
+            audio_transcript or "",
+            integration_prompt,  # 传递拆分后的整合提示词
+            on_level=on_integration_level
+        )
+        if not (isinstance(integrated, str) and integrated.startswith('{') and '"error"' in integrated):
+            checkpoint.save_integrated(segment_results, integrated)
+    await singleflight.notify(client_session_id, json.dumps({
+        "type": "integration_completed",
+        "result": integrated
+    }))
+    return {"integrated": integrated}
+
+
 @app.post("/api/video_understanding_long")
 async def video_understanding_long_endpoint(request: dict):
+    """处理视频的完整流程(短/长统一入口，相同请求执行中时合并)"""
+    client_session_id = request.get("client_session_id")
+    from local_storage_manager import get_local_video_path
+    compressed_video_path = get_local_video_path(client_session_id, "compressed_video.mp4") if client_session_id else None
+    # 处理的是会话自己的压缩视频，键包含会话ID与文件指纹
+    params = {k: v for k, v in request.items() if k != "audio_transcript"}
+    params["session"] = client_session_id
+    params["audio_transcript"] = resolve_audio_transcript(client_session_id, request.get("audio_transcript"))
+    key = request_key("video_understanding_long", params, [compressed_video_path])
+    return await singleflight.do(key, client_session_id, lambda: video_understanding_long(request))
+
+async def video_understanding_long(request: dict):
     """处理视频的完整流程(短/长统一入口)"""
     try:
         prompt = request.get("prompt")
@@ -719,13 +1112,10 @@ async def video_understanding_long_endpoint(request: dict):
 
         if not client_session_id:
             raise HTTPException(status_code=400, detail="缺少 client_session_id 参数")
+        audio_transcript = resolve_audio_transcript(client_session_id, audio_transcript)
         # 若 prompt 为空，使用内置默认提示词，避免因大请求或前端状态异常导致400
         if not prompt or (isinstance(prompt, str) and not prompt.strip()):
-            prompt = (
-                "Please analyze the instructional video and generate a SOP draft including title, abstract, keywords, materials/tools, and step-by-step operations."
-                if str(req_lang).lower().startswith("en")
-                else "请分析教学视频并生成SOP草稿，包含标题、摘要、关键词、材料/工具清单与详细操作步骤。"
-            )
+            prompt = DEFAULT_LONG_VIDEO_PROMPTS[normalize_lang(req_lang)]
 
         # 检查压缩视频是否存在
         from local_storage_manager import get_local_video_path
@@ -733,11 +1123,10 @@ async def video_understanding_long_endpoint(request: dict):
         
         # 等待压缩文件短暂就绪（最多10秒），降低竞态导致的400
         if not os.path.exists(compressed_video_path):
-            import time
             max_wait_s = 10
             waited = 0
             while waited < max_wait_s and not os.path.exists(compressed_video_path):
-                time.sleep(0.5)
+                await asyncio.sleep(0.5)
                 waited += 0.5
         if not os.path.exists(compressed_video_path):
             raise HTTPException(
@@ -745,189 +1134,52 @@ async def video_understanding_long_endpoint(request: dict):
                 detail=f"压缩视频尚未完成或不存在 (session={client_session_id})"
             )
         
-        # 使用压缩视频而不是原始视频
-        local_video_path = compressed_video_path
-
-        # 第二步：获取时长（先获取时长，再决定是否需要上传）
-        duration_sec = await asyncio.to_thread(get_video_duration, local_video_path, True)
-        is_long = duration_sec > split_threshold * 60
-        
-        # 调试日志
-        print(f"DEBUG: 视频时长检测 - duration_sec: {duration_sec}, split_threshold: {split_threshold}, split_threshold*60: {split_threshold * 60}, is_long: {is_long}")
-        
-        # 根据视频长度决定处理方式
-        video_for_processing = local_video_path  # 用于后续处理的视频路径
-        video_url = None  # 用于短视频AI处理的视频URL
-        
-        if not is_long:
-            # 短视频：上传压缩视频到OSS
-            await manager.send_to_client(client_session_id, json.dumps({
-                "type": "status", "stage": "upload_start", "message": "开始上传压缩视频"
-            }))
-            
-            from oss_manager import upload_file_to_oss
-            video_oss_key = f"{client_session_id}/compressed_video.mp4"
-            video_url = await asyncio.to_thread(
-                upload_file_to_oss,
-                local_video_path,  # 此时 local_video_path 已是 compressed_video_path
-                video_oss_key
-            )
-            
-            await manager.send_to_client(client_session_id, json.dumps({
-                "type": "status", "stage": "upload_done", "message": "压缩视频上传完成"
-            }))
-        # 长视频不需要上传，直接使用本地文件
-        
-        if client_session_id:
-            # 格式化时长为分钟和秒
-            minutes = int(duration_sec // 60)
-            seconds = int(duration_sec % 60)
-            duration_text = f"{minutes}分{seconds}秒" if minutes > 0 else f"{seconds}秒"
-            
-            await manager.send_to_client(client_session_id, json.dumps({
-                "type": "status",
-                "stage": "length_detected",
-                "message": (
-                    f"视频时长 {duration_text}，将分段" if is_long else f"视频时长 {duration_text}，不分段"
-                )
-            }))
-
         # 更新会话活跃
-        if client_session_id:
-            update_session_activity(client_session_id)
-
-        if not is_long:
-            # 短视频：直接调用Qwen3-VL-Plus输出完整草稿(含标题/摘要/关键词)
-            if client_session_id:
-                await manager.send_to_client(client_session_id, json.dumps({
-                    "type": "status", "stage": "understanding_start", "message": "开始视频理解(短视频)"
-                }))
-            result_json = await asyncio.to_thread(
-                video_understanding,
-                video_url,
-                prompt,
-                int(fps),
-                audio_transcript
-            )
-            result = json.loads(result_json)
-            if "error" in result:
-                raise HTTPException(status_code=500, detail=result["error"])
-
-            # 通过WebSocket发送完成
-            if client_session_id:
-                await manager.send_to_client(client_session_id, json.dumps({
-                    "type": "video_understanding_complete",
-                    "video_url": video_url,
-                    "result": result.get("result", ""),
-                    "fps": int(fps),
-                    "has_audio_context": bool(audio_transcript),
-                    "message": "短视频理解完成"
-                }))
-            return {"success": True, "result": result.get("result", "")}
+        update_session_activity(client_session_id)
 
-        # 长视频：分段并行
-        # 拆分提示词
-        from prompt_splitter_tool import split_prompt_for_long_video
-        
-        if client_session_id:
-            await manager.send_to_client(client_session_id, json.dumps({
-                "type": "status", "stage": "splitting_prompt", "message": "正在分析提示词..."
+        async def on_stage_status(stage, message):
+            await report_progress(message=message)
+            await singleflight.notify(client_session_id, json.dumps({
+                "type": "status", "stage": stage, "message": message
             }))
-        
-        prompt_split_result = await asyncio.to_thread(
-            split_prompt_for_long_video, 
-            prompt
-        )
-        segment_prompt_user = prompt_split_result.get("segment_prompt", "")
-        integration_prompt_user = prompt_split_result.get("integration_prompt", "")
-        
-        if client_session_id:
-            await manager.send_to_client(client_session_id, json.dumps({
-                "type": "status", "stage": "segmenting", "message": "正在分段..."
-            }))
-        segments = await asyncio.to_thread(
-            split_video_segments, video_for_processing, client_session_id, duration_sec, segment_length*60, segment_overlap*60, True
-        )
-
-        # 逐段并行处理
-        async def process_segment(seg):
-            # 格式化时间段信息为 mm:ss 格式
-            def format_time_mmss(seconds):
-                mins = int(seconds) // 60
-                secs = int(seconds) % 60
-                return f"{mins:02d}:{secs:02d}"
-            
-            start_time_str = format_time_mmss(seg['start_time'])
-            end_time_str = format_time_mmss(seg['end_time'])
-            time_range_formatted = f"{start_time_str}-{end_time_str}"
-            
-            # 通知开始
-            if client_session_id:
-                await manager.send_to_client(client_session_id, json.dumps({
-                    "type": "segment_processing",
-                    "segment_id": seg['segment_id'],
-                    "time_range": time_range_formatted
-                }))
-            
-            # 在片段提示词前添加时间段信息
-            segment_prompt_with_context = f"""你获得的视频片段是完整视频的{time_range_formatted}部分。
 
-{segment_prompt_user}"""
-
-            res_json = await asyncio.to_thread(
-                video_understanding,
-                seg['url'],
-                segment_prompt_with_context,  # 使用包含时间段信息的提示词
-                int(fps),
-                audio_transcript
-            )
-            res = json.loads(res_json)
-            text = res.get("result", "") if "error" not in res else f"[error] {res.get('error')}"
-            if client_session_id:
-                await manager.send_to_client(client_session_id, json.dumps({
-                    "type": "segment_completed",
-                    "segment_id": seg['segment_id'],
-                    "time_range": time_range_formatted,
-                    "result": text
-                }))
-            return {
-                "segment_id": seg['segment_id'],
-                "time_range": time_range_formatted,
-                "result": text
-            }
-
-        if client_session_id:
-            await manager.send_to_client(client_session_id, json.dumps({
-                "type": "status", "stage": "segments_running", "message": f"已启动 {len(segments)} 个片段并行理解"
-            }))
-        segment_results = await asyncio.gather(*[process_segment(seg) for seg in segments])
-
-        # 整合
-        if client_session_id:
-            await manager.send_to_client(client_session_id, json.dumps({
-                "type": "status", "stage": "integrating", "message": "正在整合片段结果..."
-            }))
-        integrated = await asyncio.to_thread(
-            integrate_sop_segments, 
-            segment_results, 
-            audio_transcript or "",
-            integration_prompt_user  # 传递拆分后的整合提示词
+        # 断点：相同输入重试时从上次完成的阶段继续（输入变化时重新开始）
+        checkpoint = JobCheckpoint(
+            get_local_video_path(client_session_id, CHECKPOINT_FILENAME),
+            request_key("video_understanding_long_job", {
+                "prompt": prompt, "fps": int(fps), "audio_transcript": audio_transcript, "lang": req_lang,
+                "split_threshold": split_threshold, "segment_length": segment_length, "segment_overlap": segment_overlap
+            }, [compressed_video_path])
         )
-        if isinstance(integrated, str) and integrated.startswith('{') and '"error"' in integrated:
-            # 失败也继续返回片段结果，供前端展示
-            if client_session_id:
-                await manager.send_to_client(client_session_id, json.dumps({
-                    "type": "integration_completed",
-                    "result": integrated
-                }))
-        else:
-            if client_session_id:
-                await manager.send_to_client(client_session_id, json.dumps({
-                    "type": "integration_completed",
-                    "result": integrated
-                }))
+        if checkpoint.resumed:
+            await on_stage_status("resuming", f"从断点继续：已完成 {checkpoint.completed_segment_count} 个片段")
+
+        # 使用压缩视频而不是原始视频
+        run = await VIDEO_PIPELINE.run({
+            "client_session_id": client_session_id,
+            "video_path": compressed_video_path,
+            "prompt": prompt,
+            "fps": int(fps),
+            "audio_transcript": audio_transcript,
+            "req_lang": req_lang,
+            "split_threshold": split_threshold,
+            "segment_length": segment_length,
+            "segment_overlap": segment_overlap,
+            "checkpoint": checkpoint
+        }, on_status=on_stage_status)
+        context = run.context
 
-        return {"success": True, "segments": segment_results, "integrated": integrated}
+        if not context["is_long"]:
+            return {"success": True, "result": context["result"], "timings": run.timings}
+        # 整合成功后断点失效；整合失败时保留断点，重试时复用片段结果
+        if checkpoint.integrated_for(context["segment_results"]) is not None:
+            checkpoint.mark_completed()
+        return {
+            "success": True,
+            "segments": context["segment_results"],
+            "integrated": context["integrated"],
+            "timings": run.timings
+        }
     except HTTPException:
         raise
     except Exception as e:
@@ -935,9 +1187,32 @@ async def video_understanding_long_endpoint(request: dict):
         print(error_msg)
         raise HTTPException(status_code=500, detail=error_msg)
 
+def make_sop_block_sender(client_session_id: Optional[str], operation: str):
+    """
+    构造逐块推送回调：每个区块就绪时发送 sop_block 消息（order 按字典序即为文档顺序）。
+    在合并执行的请求内时，即使发起者没有会话也推送给所有挂上来的会话。
+    """
+    if not client_session_id and not singleflight.in_flight():
+        return None
+    
+    async def send_block(block: Dict[str, Any], order: tuple):
+        await singleflight.notify(client_session_id, json.dumps({
+            "type": "sop_block",
+            "operation": operation,
+            "order": list(order),
+            "block": block
+        }))
+    
+    return send_block
+
 @app.post("/api/parse_sop")
 async def parse_sop_endpoint(request: dict):
-    """SOP解析API端点"""
+    """SOP解析API端点（相同请求执行中时合并）"""
+    key = request_key("parse_sop", {"manuscript": request.get("manuscript"), "chunked": request.get("chunked")})
+    return await singleflight.do(key, request.get("client_session_id"), lambda: parse_sop(request))
+
+async def parse_sop(request: dict):
+    """SOP解析"""
     try:
         manuscript = request.get("manuscript")
         client_session_id = request.get("client_session_id")
@@ -948,8 +1223,10 @@ async def parse_sop_endpoint(request: dict):
         if client_session_id:
             update_session_activity(client_session_id)
         
-        # 使用线程池执行同步调用
-        result_json = await asyncio.to_thread(sop_parser, manuscript)
+        # chunked: 整篇交给大模型时是否分块并行（缺省按长度自动决定）
+        result_json = await sop_parser_async(
+            manuscript, request.get("chunked"), make_sop_block_sender(client_session_id, "parse")
+        )
         result = json.loads(result_json)
         
         # 检查是否有错误
@@ -965,7 +1242,7 @@ async def parse_sop_endpoint(request: dict):
         
         # 发送给特定客户端
         if client_session_id:
-            await manager.send_to_client(client_session_id, json.dumps(parse_notification))
+            await singleflight.notify(client_session_id, json.dumps(parse_notification))
         
         return {"success": True, "result": result}
         
@@ -976,113 +1253,11 @@ async def parse_sop_endpoint(request: dict):
         print(error_msg)
         raise HTTPException(status_code=500, detail=error_msg)
 
-def refine_sop_blocks(blocks, user_notes):
-    """直接调用DashScope API进行SOP精修，避免LangChain工具包装问题"""
-    try:
-        # 构建提示词
-        system_prompt = """你是一个专业的SOP文档精修专家。请根据用户的批注和建议，对SOP区块数组进行精修改进。
-
-精修原则：
-1. 保持原有的区块结构和类型分类
-2. 根据用户批注改进文本内容，使其更加专业、准确、易读
-3. 保持时间戳信息不变
-4. 确保技术术语的准确性和一致性
-5. 改进语言表达，使其符合标准SOP文档规范
-6. 保持逻辑清晰和操作步骤的完整性
-
-请严格按照以下JSON格式返回精修结果：
-{
-  "blocks": [
-    {
-      "id": "保持原ID",
-      "type": "保持原类型",
-      "content": "精修后的文本内容",
-      "start_time": 保持原时间戳,
-      "end_time": 保持原时间戳,
-      "show_play_button": 保持原设置
-    }
-  ]
-}"""
-
-        user_prompt = f"""请根据以下用户批注精修SOP区块：
-
-用户批注：
-{user_notes}
-
-原始区块数据：
-{json.dumps(blocks, ensure_ascii=False, indent=2)}
-
-要求：
-1. 根据用户批注改进相关内容
-2. 保持区块的ID、type、时间戳和show_play_button字段不变
-3. 主要精修content字段的文本内容
-4. 确保精修后的内容更加专业和准确
-5. 只返回JSON格式，不要添加其他文字说明"""
-
-        # 调用qwen-plus
-        response = dashscope.Generation.call(
-            api_key=os.getenv('DASHSCOPE_API_KEY'),
-            model="qwen-plus",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            result_format='message',
-            temperature=0.3
-        )
-        
-        if response.status_code == 200:
-            result = response.output.choices[0].message.content
-            
-            # 尝试解析JSON结果
-            try:
-                # 提取JSON部分（可能包含在```json```代码块中）
-                import re
-                json_match = re.search(r'```json\s*(.*?)\s*```', result, re.DOTALL)
-                if json_match:
-                    json_str = json_match.group(1)
-                else:
-                    # 尝试直接解析
-                    json_str = result
-                
-                parsed_result = json.loads(json_str)
-                
-                # 验证结果格式
-                if 'blocks' in parsed_result and isinstance(parsed_result['blocks'], list):
-                    # 确保精修后的区块保持原有结构
-                    refined_blocks = parsed_result['blocks']
-                    
-                    # 验证每个区块都有必需的字段，如果缺失则从原区块复制
-                    for i, refined_block in enumerate(refined_blocks):
-                        if i < len(blocks):
-                            original_block = blocks[i]
-                            # 确保关键字段存在
-                            if 'id' not in refined_block:
-                                refined_block['id'] = original_block.get('id', f"block_{i+1}")
-                            if 'type' not in refined_block:
-                                refined_block['type'] = original_block.get('type', 'unknown')
-                            if 'start_time' not in refined_block:
-                                refined_block['start_time'] = original_block.get('start_time')
-                            if 'end_time' not in refined_block:
-                                refined_block['end_time'] = original_block.get('end_time')
-                            if 'show_play_button' not in refined_block:
-                                refined_block['show_play_button'] = original_block.get('show_play_button', False)
-                            if 'content' not in refined_block:
-                                refined_block['content'] = original_block.get('content', '')
-                    
-                    return parsed_result
-                else:
-                    return {"error": "精修结果格式不正确", "blocks": blocks}
-                    
-            except json.JSONDecodeError as e:
-                # 如果JSON解析失败，返回原始区块（表示精修失败）
-                return {"error": f"JSON解析失败: {str(e)}", "blocks": blocks}
-        else:
-            return {"error": f"API调用失败: {response.message}", "blocks": blocks}
-            
-    except Exception as e:
-        # 发生错误时返回原始区块
-        return {"error": str(e), "blocks": blocks}
+async def refine_sop_blocks(blocks, user_notes, target_block_ids=None, client_session_id=None):
+    """SOP精修：能定位到批注针对的区块时只精修这些区块，否则整篇精修；精修好的区块逐块推送"""
+    return await refine_sop_blocks_async(
+        blocks, user_notes, target_block_ids, on_block=make_sop_block_sender(client_session_id, "refine")
+    )
 
 @app.post("/api/refine_sop")
 async def refine_sop_endpoint(request: dict):
@@ -1090,6 +1265,8 @@ async def refine_sop_endpoint(request: dict):
     try:
         blocks = request.get("blocks")
         user_notes = request.get("user_notes", "")
+        # SOPEditor 中选中的区块ID（可选），用于局部精修
+        target_block_ids = request.get("target_block_ids") or None
         client_session_id = request.get("client_session_id")
         
         if not blocks:
@@ -1099,19 +1276,25 @@ async def refine_sop_endpoint(request: dict):
         if client_session_id:
             update_session_activity(client_session_id)
         
-        # 使用线程池执行同步调用
-        result = await asyncio.to_thread(refine_sop_blocks, blocks, user_notes)
+        result = await refine_sop_blocks(blocks, user_notes, target_block_ids, client_session_id)
         
         # 检查是否有错误
         if "error" in result:
             raise HTTPException(status_code=500, detail=result["error"])
         
+        # 局部精修时只统计被精修的区块
+        refined_count = len(result.get("refined_block_ids", result.get("blocks", [])))
+        failed_count = len(result.get("failed_blocks", []))
+        
         # 通过WebSocket发送精修完成通知给特定客户端
         refine_notification = {
             "type": "sop_refine_complete",
             "blocks_count": len(result.get("blocks", [])),
             "has_user_notes": bool(user_notes),
-            "message": f"SOP精修完成，共处理 {len(result.get('blocks', []))} 个区块"
+            "refined_blocks_count": refined_count,
+            "failed_blocks_count": failed_count,
+            "message": f"SOP精修完成，共处理 {refined_count} 个区块"
+                       + (f"，{failed_count} 个区块精修失败" if failed_count else "")
         }
         
         # 发送给特定客户端
@@ -1131,23 +1314,54 @@ async def refine_sop_endpoint(request: dict):
 async def get_session_stats():
     """获取会话统计信息"""
     cleanup_expired_sessions()  # 先清理过期会话
+    last_active = dict(session_last_active.items())
+    now = datetime.now()
     
     return {
         "active_sessions": len(session_histories),
         "agent_pool_size": len(agent_pool),
         "timeout_hours": SESSION_TIMEOUT_HOURS,
+        "state_backend": type(state_backend).__name__,
         "sessions": [
             {
                 "client_session_id": sid[:16] + "...",
                 "message_count": len(session["history"]),
+                "history": session["history"].stats(),
                 "agent_index": session["agent_index"],
-                "last_active": session["last_active"].isoformat(),
-                "inactive_minutes": (datetime.now() - session["last_active"]).total_seconds() / 60
+                "last_active": last_active.get(sid, now).isoformat(),
+                "inactive_minutes": (now - last_active.get(sid, now)).total_seconds() / 60
             }
             for sid, session in session_histories.items()
         ]
     }
 
+@app.get("/api/metrics/model_calls")
+async def get_model_call_metrics():
+    """模型调用调度指标：各模型的限额余量、排队数（按优先级）、等待时间、重试与限流次数，以及片段理解的对冲统计与相同请求合并统计"""
+    return {
+        "models": get_rate_limit_stats(),
+        "segment_hedging": segment_hedger.stats(),
+        "request_coalescing": singleflight.stats()
+    }
+
+@app.get("/api/metrics/system")
+async def get_system_metrics(limit: Optional[int] = None):
+    """系统资源历史：后台按固定间隔采集的 CPU、内存、磁盘与 ffmpeg 进程占用（旧到新），及其汇总"""
+    return system_metrics.report(limit)
+
+@app.get("/api/metrics/event_loop")
+async def get_event_loop_metrics():
+    """事件循环调度延迟：分位数、直方图，调试模式下还有最近几次卡顿时的调用栈"""
+    return loop_monitor.stats()
+
+@app.get("/api/metrics/websocket")
+async def get_websocket_metrics():
+    """WebSocket 指标：本 worker 的连接数、发送队列深度与发送延迟，以及跨 worker 消息总线的发布/投递计数和投递延迟"""
+    return {
+        **manager.stats(),
+        "bus": manager.bus.stats()
+    }
+
 @app.post("/api/mark_session_keep_video")
 async def mark_session_keep_video(request: dict):
     """标记会话视频保留"""
@@ -1200,34 +1414,98 @@ async def check_disconnected_sessions():
                 to_cleanup.append(client_session_id)
         
         for client_session_id in to_cleanup:
+            # 先移除断连记录再清理：多个 worker 同时检查时只有一个执行清理
+            if websocket_disconnect_tracker.pop(client_session_id, None) is None:
+                continue
             print(f"清理断线超过5分钟的会话: {client_session_id}")
             
             # 清理OSS文件
             from oss_manager import delete_session_files
-            delete_session_files(client_session_id)
+            await asyncio.to_thread(delete_session_files, client_session_id)
             
             # 清理本地文件
             from local_storage_manager import delete_session_local_files
-            delete_session_local_files(client_session_id)
+            await asyncio.to_thread(delete_session_local_files, client_session_id)
             
             # 清理会话历史
-            if client_session_id in session_histories:
-                del session_histories[client_session_id]
-            
-            del websocket_disconnect_tracker[client_session_id]
+            session_histories.pop(client_session_id, None)
+            session_last_active.pop(client_session_id, None)
+            session_transcripts.pop(client_session_id, None)
+            session_write_locks.pop(client_session_id, None)
 
 async def daily_cleanup_task():
     """每天清理超过24小时的本地文件"""
     while True:
         await asyncio.sleep(86400)  # 24小时
         from local_storage_manager import cleanup_old_local_files
-        result = cleanup_old_local_files(hours=24)
-        print(f"定期清理完成: {result}")
+        result = await asyncio.to_thread(cleanup_old_local_files, hours=24)
+        removed_jobs = await job_queue.cleanup()
+        print(f"定期清理完成: {result}，清理任务记录 {removed_jobs} 条")
+
+# 可提交到后台任务队列的任务类型：参数与对应同步端点的请求体相同。
+# 注册未经请求合并包装的实现：取消任务时直接取消模型调用（合并执行的任务只会取消等待者）
+job_queue.register("video_understanding", video_understanding)
+job_queue.register("video_understanding_long", video_understanding_long)
+job_queue.register("speech_recognition", speech_recognition_endpoint)
+job_queue.register("parse_sop", parse_sop)
+job_queue.register("refine_sop", refine_sop_endpoint)
+
+@app.post("/api/jobs/{kind}")
+async def submit_job(kind: str, request: dict):
+    """提交后台任务，立即返回任务ID；执行过程中的WebSocket推送与同步端点一致"""
+    if kind not in job_queue.handlers:
+        raise HTTPException(status_code=404, detail=f"未知任务类型: {kind}")
+    client_session_id = request.get("client_session_id")
+    if client_session_id:
+        update_session_activity(client_session_id)
+    job_id = await job_queue.submit(kind, request, client_session_id)
+    return {"success": True, "job_id": job_id, "status": "queued"}
+
+@app.get("/api/jobs")
+async def list_jobs(client_session_id: Optional[str] = None, limit: int = 50):
+    """列出任务（可按会话过滤，不含结果）"""
+    return {"success": True, "jobs": await job_queue.list(client_session_id, limit), "stats": job_queue.stats()}
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """查询任务状态、进度与结果"""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return {"success": True, "job": job}
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """取消排队中或执行中的任务"""
+    if not await job_queue.cancel(job_id):
+        return {"success": False, "message": "任务不存在或已结束"}
+    return {"success": True, "message": "任务已取消"}
 
 @app.on_event("startup")
 async def startup_event():
+    # 连接跨 worker 消息总线
+    await manager.bus.start(manager.deliver_from_bus)
+    # 启动后台任务队列（恢复服务重启前未完成的任务）
+    await job_queue.start()
+    # 后台采样系统资源（心跳读取最近一次采样）
+    await system_metrics.start()
+    # 事件循环调度延迟监控（LOOP_DEBUG=true 时记录阻塞处的调用栈）
+    await loop_monitor.start()
     asyncio.create_task(check_disconnected_sessions())
     asyncio.create_task(daily_cleanup_task())
+    # 后台预计算预设提示词的拆分结果，不阻塞启动
+    asyncio.create_task(warm_prompt_split_cache())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # 停止任务队列（执行中的任务下次启动时恢复）
+    await job_queue.stop()
+    await system_metrics.stop()
+    await loop_monitor.stop()
+    await manager.close_all()
+    await manager.bus.close()
+    # 关闭 DashScope 共享连接池
+    await close_http_client()
 
 @app.get("/")
 async def root():
@@ -1235,7 +1513,7 @@ async def root():
     return {"message": "LangGraph Agent Chat API", "version": "1.0.0"}
 
 # 设置 OSS 路由
-setup_oss_routes(app, manager)
+setup_oss_routes(app, manager, job_queue)
 
 if __name__ == "__main__":
     import uvicorn
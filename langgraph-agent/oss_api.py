@@ -5,6 +5,8 @@ import os
 import tempfile
 import requests
 import json
+import asyncio
+import threading
 from typing import Dict, Any
 from fastapi import HTTPException, UploadFile, File, Form
 from fastapi.responses import FileResponse
@@ -22,117 +24,159 @@ from oss_manager import (
     ENDPOINT
 )
 from audio_extractor import extract_audio_from_video, check_ffmpeg_available
+from state_backend import SharedCancelFlag, SharedDict, get_state_backend, request_cancel
 
-# 全局变量存储压缩任务和取消标志
+# 全局变量存储压缩任务和取消标志（取消标志保存在共享状态后端，任一 worker 均可取消）
 compression_tasks = {}
-compression_cancel_flags = {}
+compression_cancel_flags = SharedDict(get_state_backend(), "compression_cancel_flags")
 
-async def start_compression_task(client_session_id: str, local_video_path: str, target_resolution: str = "720p", connection_manager=None):
-    """启动视频压缩任务的独立函数"""
+async def run_compression(client_session_id: str, local_video_path: str, target_resolution: str = "720p", connection_manager=None):
+    """执行视频压缩（等待完成），进度与结果通过WebSocket推送；作为后台任务队列的 compression 任务执行"""
+    import asyncio
+    from video_processor import compress_and_overlay_video, check_video_metadata
+    from local_storage_manager import get_local_video_path
+    from job_queue import report_progress
+    
+    # 创建取消标志
+    cancel_flag = SharedCancelFlag(compression_cancel_flags, client_session_id)
+    compressed_video_path = get_local_video_path(client_session_id, "compressed_video.mp4")
+    
     try:
-        import asyncio
-        from video_processor import compress_and_overlay_video, check_video_metadata
-        from local_storage_manager import get_local_video_path
+        if not os.path.exists(local_video_path) and os.path.exists(compressed_video_path):
+            # 任务重新执行（如服务重启后恢复）时原视频已处理完毕
+            return {"compressed_filename": "compressed_video.mp4"}
         
-        # 创建取消标志
-        cancel_flag = type('CancelFlag', (), {'cancelled': False})()
-        compression_cancel_flags[client_session_id] = cancel_flag
+        # 检查视频是否已经是压缩过的
+        is_already_compressed = await asyncio.to_thread(
+            check_video_metadata,
+            local_video_path
+        )
         
-        async def compress_task():
-            # 检查视频是否已经是压缩过的
-            is_already_compressed = await asyncio.to_thread(
-                check_video_metadata,
-                local_video_path
-            )
+        if is_already_compressed:
+            # 视频已经是压缩过的，直接重命名
+            if connection_manager and client_session_id:
+                await connection_manager.send_to_client(client_session_id, json.dumps({
+                    "type": "compression_started",
+                    "message": "检测到已压缩视频，跳过压缩..."
+                }))
             
-            if is_already_compressed:
-                # 视频已经是压缩过的，直接重命名
-                compressed_video_path = get_local_video_path(client_session_id, "compressed_video.mp4")
-                
-                if connection_manager and client_session_id:
-                    await connection_manager.send_to_client(client_session_id, json.dumps({
-                        "type": "compression_started",
-                        "message": "检测到已压缩视频，跳过压缩..."
-                    }))
-                
-                # 重命名原视频为压缩视频
-                import shutil
-                shutil.move(local_video_path, compressed_video_path)
-                print(f"已重命名原视频为压缩视频: {compressed_video_path}")
-                
-                if connection_manager and client_session_id:
-                    await connection_manager.send_to_client(client_session_id, json.dumps({
-                        "type": "compression_completed",
-                        "message": "视频无需压缩，已准备就绪",
-                        "compressed_filename": "compressed_video.mp4"
-                    }))
-            else:
-                # 需要压缩
-                if connection_manager and client_session_id:
-                    await connection_manager.send_to_client(client_session_id, json.dumps({
-                        "type": "compression_started",
-                        "message": "开始压缩视频..."
-                    }))
-                
+            # 重命名原视频为压缩视频
+            import shutil
+            shutil.move(local_video_path, compressed_video_path)
+            print(f"已重命名原视频为压缩视频: {compressed_video_path}")
+            
+            if connection_manager and client_session_id:
+                await connection_manager.send_to_client(client_session_id, json.dumps({
+                    "type": "compression_completed",
+                    "message": "视频无需压缩，已准备就绪",
+                    "compressed_filename": "compressed_video.mp4"
+                }))
+            return {"compressed_filename": "compressed_video.mp4", "skipped": True}
+        
+        # 需要压缩
+        if connection_manager and client_session_id:
+            await connection_manager.send_to_client(client_session_id, json.dumps({
+                "type": "compression_started",
+                "message": "开始压缩视频..."
+            }))
+        
+        try:
+            # 定义进度回调函数
+            async def send_progress(current_frame, total_frames):
                 try:
-                    # 定义进度回调函数
-                    async def send_progress(current_frame, total_frames):
-                        try:
-                            if connection_manager and client_session_id:
-                                percentage = int((current_frame / total_frames) * 100) if total_frames > 0 else 0
-                                await connection_manager.send_to_client(client_session_id, json.dumps({
-                                    "type": "compression_progress",
-                                    "current_frame": current_frame,
-                                    "total_frames": total_frames,
-                                    "percentage": percentage,
-                                    "message": f"压缩中... {current_frame}/{total_frames} 帧 ({percentage}%)"
-                                }))
-                        except Exception as e:
-                            print(f"发送压缩进度异常: {e}")
-                    
-                    # 获取当前事件循环
-                    loop = asyncio.get_event_loop()
-                    
-                    # 包装为同步回调（因为compress_and_overlay_video是同步函数）
-                    def progress_callback(current_frame, total_frames):
-                        try:
-                            # 使用asyncio.run_coroutine_threadsafe在事件循环中运行
-                            future = asyncio.run_coroutine_threadsafe(send_progress(current_frame, total_frames), loop)
-                            # 不等待结果，避免阻塞压缩过程
-                        except Exception as e:
-                            print(f"进度回调异常: {e}")
-                    
-                    compressed_path = await asyncio.to_thread(
-                        compress_and_overlay_video,
-                        local_video_path,
-                        client_session_id,
-                        "compressed_video.mp4",
-                        target_resolution,  # 传入目标分辨率
-                        progress_callback,  # 传入回调
-                        cancel_flag  # 传入取消标志
-                    )
-                    
-                    # 压缩完成后删除原视频
-                    if os.path.exists(local_video_path):
-                        os.remove(local_video_path)
-                        print(f"已删除原视频: {local_video_path}")
-                    
+                    percentage = int((current_frame / total_frames) * 100) if total_frames > 0 else 0
+                    await report_progress(percentage, f"{current_frame}/{total_frames} 帧")
                     if connection_manager and client_session_id:
                         await connection_manager.send_to_client(client_session_id, json.dumps({
-                            "type": "compression_completed",
-                            "message": f"视频压缩完成({target_resolution})，已删除原视频",
-                            "compressed_filename": "compressed_video.mp4"
+                            "type": "compression_progress",
+                            "current_frame": current_frame,
+                            "total_frames": total_frames,
+                            "percentage": percentage,
+                            "message": f"压缩中... {current_frame}/{total_frames} 帧 ({percentage}%)"
                         }))
                 except Exception as e:
-                    if connection_manager and client_session_id:
-                        await connection_manager.send_to_client(client_session_id, json.dumps({
-                            "type": "compression_error",
-                            "message": f"视频压缩失败: {str(e)}"
-                        }))
-                finally:
-                    # 清理取消标志
-                    if client_session_id in compression_cancel_flags:
-                        del compression_cancel_flags[client_session_id]
+                    print(f"发送压缩进度异常: {e}")
+            
+            # 获取当前事件循环
+            loop = asyncio.get_running_loop()
+            # 最新进度；事件循环尚未处理上一次进度时只更新数值，不再调度新的协程
+            latest_progress = {"frames": None, "scheduled": False}
+            progress_lock = threading.Lock()
+            
+            async def send_latest_progress():
+                with progress_lock:
+                    current_frame, total_frames = latest_progress["frames"]
+                    latest_progress["scheduled"] = False
+                await send_progress(current_frame, total_frames)
+            
+            # 包装为同步回调（因为compress_and_overlay_video是同步函数）
+            def progress_callback(current_frame, total_frames):
+                try:
+                    with progress_lock:
+                        latest_progress["frames"] = (current_frame, total_frames)
+                        if latest_progress["scheduled"]:
+                            return
+                        latest_progress["scheduled"] = True
+                    # 使用asyncio.run_coroutine_threadsafe在事件循环中运行
+                    asyncio.run_coroutine_threadsafe(send_latest_progress(), loop)
+                    # 不等待结果，避免阻塞压缩过程
+                except Exception as e:
+                    print(f"进度回调异常: {e}")
+            
+            await asyncio.to_thread(
+                compress_and_overlay_video,
+                local_video_path,
+                client_session_id,
+                "compressed_video.mp4",
+                target_resolution,  # 传入目标分辨率
+                progress_callback,  # 传入回调
+                cancel_flag  # 传入取消标志
+            )
+            
+            # 压缩完成后删除原视频
+            if os.path.exists(local_video_path):
+                os.remove(local_video_path)
+                print(f"已删除原视频: {local_video_path}")
+            
+            if connection_manager and client_session_id:
+                await connection_manager.send_to_client(client_session_id, json.dumps({
+                    "type": "compression_completed",
+                    "message": f"视频压缩完成({target_resolution})，已删除原视频",
+                    "compressed_filename": "compressed_video.mp4"
+                }))
+            return {"compressed_filename": "compressed_video.mp4", "target_resolution": target_resolution}
+        except Exception as e:
+            if connection_manager and client_session_id:
+                await connection_manager.send_to_client(client_session_id, json.dumps({
+                    "type": "compression_error",
+                    "message": f"视频压缩失败: {str(e)}"
+                }))
+            raise
+    except asyncio.CancelledError:
+        # 任务被取消（如 /api/jobs/{id}/cancel）只会取消等待的协程，需设置取消标志使线程中的压缩停止
+        cancel_flag.cancelled = True
+        raise
+    finally:
+        # 清理取消标志
+        cancel_flag.release()
+
+async def start_compression_task(client_session_id: str, local_video_path: str, target_resolution: str = "720p",
+                                 connection_manager=None, job_queue=None):
+    """启动视频压缩任务（不等待完成）：提供任务队列时作为持久化任务提交，否则直接在后台执行"""
+    try:
+        import asyncio
+        if job_queue is not None:
+            return await job_queue.submit("compression", {
+                "client_session_id": client_session_id,
+                "local_video_path": local_video_path,
+                "target_resolution": target_resolution
+            }, client_session_id)
+        
+        async def compress_task():
+            try:
+                await run_compression(client_session_id, local_video_path, target_resolution, connection_manager)
+            except Exception as e:
+                print(f"视频压缩失败: {e}")
         
         # 启动压缩任务（不等待完成）
         asyncio.create_task(compress_task())
@@ -162,8 +206,16 @@ class ExtractAudioRequest(BaseModel):
     session_id: str
     client_session_id: str = None
 
-def setup_oss_routes(app, connection_manager=None):
-    """设置 OSS 相关的路由"""
+def setup_oss_routes(app, connection_manager=None, job_queue=None):
+    """设置 OSS 相关的路由；提供 job_queue 时视频压缩作为持久化后台任务执行"""
+    
+    if job_queue is not None:
+        async def compression_job(params: Dict[str, Any]):
+            return await run_compression(
+                params["client_session_id"], params["local_video_path"],
+                params.get("target_resolution", "720p"), connection_manager
+            )
+        job_queue.register("compression", compression_job, lane="compression")
     
     # 废弃：不再需要单独生成session_id
     # @app.post("/api/generate_session_id")
@@ -252,28 +304,31 @@ def setup_oss_routes(app, connection_manager=None):
             if not check_ffmpeg_available():
                 raise HTTPException(status_code=500, detail="FFmpeg not available")
             
-            with tempfile.TemporaryDirectory() as temp_dir:
-                video_path = os.path.join(temp_dir, "input_video.mp4")
-                
-                # 下载视频文件
-                video_response = requests.get(request.video_url, timeout=300)
-                video_response.raise_for_status()
-                
-                with open(video_path, 'wb') as f:
-                    f.write(video_response.content)
-                
-                # 提取音频
-                audio_path = extract_audio_from_video(video_path)
-                
-                # 上传音频到 OSS
-                oss_key = f"{request.session_id}/audio.mp3"
-                audio_url = upload_file_to_oss(audio_path, oss_key)
-                
-                return {
-                    "success": True,
-                    "audio_url": audio_url,
-                    "session_id": request.session_id
-                }
+            def download_extract_upload() -> str:
+                # 下载、ffmpeg 提取与上传均为阻塞调用，整体在线程中执行
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    video_path = os.path.join(temp_dir, "input_video.mp4")
+                    
+                    # 下载视频文件
+                    video_response = requests.get(request.video_url, timeout=300)
+                    video_response.raise_for_status()
+                    
+                    with open(video_path, 'wb') as f:
+                        f.write(video_response.content)
+                    
+                    # 提取音频
+                    audio_path = extract_audio_from_video(video_path)
+                    
+                    # 上传音频到 OSS
+                    oss_key = f"{request.session_id}/audio.mp3"
+                    return upload_file_to_oss(audio_path, oss_key)
+            
+            audio_url = await asyncio.to_thread(download_extract_upload)
+            return {
+                "success": True,
+                "audio_url": audio_url,
+                "session_id": request.session_id
+            }
                 
         except requests.RequestException as e:
             raise HTTPException(status_code=500, detail=f"Failed to download video: {str(e)}")
@@ -302,7 +357,7 @@ def setup_oss_routes(app, connection_manager=None):
             oss_key = f"{session_id}/{file_type}.{file_extension}"
             
             bucket = get_bucket()
-            result = bucket.put_object(oss_key, file_content)
+            result = await asyncio.to_thread(bucket.put_object, oss_key, file_content)
             
             if result.status != 200:
                 raise HTTPException(status_code=500, detail="Failed to upload to OSS")
@@ -347,12 +402,12 @@ def setup_oss_routes(app, connection_manager=None):
                     }
                 )
             
-            # 4. 提取音频
-            audio_path = extract_audio_from_video(local_video_path)
+            # 4. 提取音频（ffmpeg 子进程，在线程中等待）
+            audio_path = await asyncio.to_thread(extract_audio_from_video, local_video_path)
             
             # 5. 上传音频到OSS（使用client_session_id作为路径）
             audio_oss_key = f"{client_session_id}/audio/extracted_audio.mp3"
-            audio_url = upload_file_to_oss(audio_path, audio_oss_key)
+            audio_url = await asyncio.to_thread(upload_file_to_oss, audio_path, audio_oss_key)
             
             # 6. 删除临时音频文件
             if os.path.exists(audio_path):
@@ -368,113 +423,10 @@ def setup_oss_routes(app, connection_manager=None):
                     "auto_start_speech_recognition": True  # 新增：标记触发自动语音识别
                 }))
             
-            # 8. 启动异步压缩任务
-            import asyncio
-            from video_processor import compress_and_overlay_video, check_video_metadata
-            from local_storage_manager import get_local_video_path
-            
-            # 创建取消标志
-            cancel_flag = type('CancelFlag', (), {'cancelled': False})()
-            compression_cancel_flags[client_session_id] = cancel_flag
-            
-            async def compress_task():
-                # 检查视频是否已经是压缩过的
-                is_already_compressed = await asyncio.to_thread(
-                    check_video_metadata,
-                    local_video_path
-                )
-                
-                if is_already_compressed:
-                    # 视频已经是压缩过的，直接重命名
-                    compressed_video_path = get_local_video_path(client_session_id, "compressed_video.mp4")
-                    
-                    if connection_manager and client_session_id:
-                        await connection_manager.send_to_client(client_session_id, json.dumps({
-                            "type": "compression_started",
-                            "message": "检测到已压缩视频，跳过压缩..."
-                        }))
-                    
-                    # 重命名原视频为压缩视频
-                    import shutil
-                    shutil.move(local_video_path, compressed_video_path)
-                    print(f"已重命名原视频为压缩视频: {compressed_video_path}")
-                    
-                    if connection_manager and client_session_id:
-                        await connection_manager.send_to_client(client_session_id, json.dumps({
-                            "type": "compression_completed",
-                            "message": "视频无需压缩，已准备就绪",
-                            "compressed_filename": "compressed_video.mp4"
-                        }))
-                else:
-                    # 需要压缩
-                    if connection_manager and client_session_id:
-                        await connection_manager.send_to_client(client_session_id, json.dumps({
-                            "type": "compression_started",
-                            "message": "开始压缩视频..."
-                        }))
-                    
-                    try:
-                        # 定义进度回调函数
-                        async def send_progress(current_frame, total_frames):
-                            try:
-                                if connection_manager and client_session_id:
-                                    percentage = int((current_frame / total_frames) * 100) if total_frames > 0 else 0
-                                    await connection_manager.send_to_client(client_session_id, json.dumps({
-                                        "type": "compression_progress",
-                                        "current_frame": current_frame,
-                                        "total_frames": total_frames,
-                                        "percentage": percentage,
-                                        "message": f"压缩中... {current_frame}/{total_frames} 帧 ({percentage}%)"
-                                    }))
-                            except Exception as e:
-                                print(f"发送压缩进度异常: {e}")
-                        
-                        # 获取当前事件循环
-                        loop = asyncio.get_event_loop()
-                        
-                        # 包装为同步回调（因为compress_and_overlay_video是同步函数）
-                        def progress_callback(current_frame, total_frames):
-                            try:
-                                # 使用asyncio.run_coroutine_threadsafe在事件循环中运行
-                                future = asyncio.run_coroutine_threadsafe(send_progress(current_frame, total_frames), loop)
-                                # 不等待结果，避免阻塞压缩过程
-                            except Exception as e:
-                                print(f"进度回调异常: {e}")
-                        
-                        compressed_path = await asyncio.to_thread(
-                            compress_and_overlay_video,
-                            local_video_path,
-                            client_session_id,
-                            "compressed_video.mp4",
-                            target_resolution,  # 传入目标分辨率
-                            progress_callback,  # 传入回调
-                            cancel_flag  # 传入取消标志
-                        )
-                        
-                        # 压缩完成后删除原视频
-                        if os.path.exists(local_video_path):
-                            os.remove(local_video_path)
-                            print(f"已删除原视频: {local_video_path}")
-                        
-                        if connection_manager and client_session_id:
-                            await connection_manager.send_to_client(client_session_id, json.dumps({
-                                "type": "compression_completed",
-                                "message": f"视频压缩完成({target_resolution})，已删除原视频",
-                                "compressed_filename": "compressed_video.mp4"
-                            }))
-                    except Exception as e:
-                        if connection_manager and client_session_id:
-                            await connection_manager.send_to_client(client_session_id, json.dumps({
-                                "type": "compression_error",
-                                "message": f"视频压缩失败: {str(e)}"
-                            }))
-                    finally:
-                        # 清理取消标志
-                        if client_session_id in compression_cancel_flags:
-                            del compression_cancel_flags[client_session_id]
-            
-            # 启动压缩任务（不等待完成）
-            asyncio.create_task(compress_task())
+            # 8. 启动异步压缩任务（提交到后台任务队列）
+            compression_job_id = await start_compression_task(
+                client_session_id, local_video_path, target_resolution, connection_manager, job_queue
+            )
             
             # 9. 通过WebSocket通知上传完成（仅返回client_session_id）
             if connection_manager and client_session_id:
@@ -488,7 +440,8 @@ def setup_oss_routes(app, connection_manager=None):
             return {
                 "success": True,
                 "session_id": client_session_id,  # 返回client_session_id，字段名保持session_id兼容
-                "audio_url": audio_url  # 返回音频URL供语音识别使用
+                "audio_url": audio_url,  # 返回音频URL供语音识别使用
+                "compression_job_id": compression_job_id
             }
             
         except HTTPException:
@@ -557,11 +510,14 @@ def setup_oss_routes(app, connection_manager=None):
             if not session_id:
                 raise HTTPException(status_code=400, detail="缺少session_id参数")
                 
-            if session_id in compression_cancel_flags:
-                # 设置取消标志
-                compression_cancel_flags[session_id].cancelled = True
+            if request_cancel(compression_cancel_flags, session_id):
+                # 已设置取消标志
                 print(f"已取消会话 {session_id} 的压缩任务")
                 return {"success": True, "message": "压缩任务已取消"}
+            elif job_queue is not None and await job_queue.cancel_session_jobs(session_id, "compression"):
+                # 压缩任务尚在队列中排队
+                print(f"已取消会话 {session_id} 排队中的压缩任务")
+                return {"success": True, "message": "压缩任务已取消"}
             else:
                 return {"success": False, "message": "未找到正在进行的压缩任务"}
         except Exception as e:
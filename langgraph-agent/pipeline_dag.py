@@ -0,0 +1,191 @@
+"""
+流水线阶段 DAG 执行器：每个阶段声明输入与输出，输入全部就绪即启动，互不依赖的阶段并发执行。
+
+- inputs：阶段启动前必须就绪的值，按名称作为关键字参数传入
+- lazy_inputs：不阻塞阶段启动，以 Future 形式传入，阶段内部在需要时 await（用于部分重叠，如边切割边等待提示词拆分）
+- when：条件判断，返回 False 时跳过该阶段；依赖被跳过阶段输出的阶段同样跳过
+- start_status / done_status：阶段开始/结束时通过 on_status 回调发出的 (stage, message)，message 可为 context -> str 的函数
+
+执行结果记录每个阶段的状态与耗时。
+"""
+
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+StatusMessage = Union[str, Callable[[Dict[str, Any]], str]]
+StatusCallback = Callable[[str, str], Awaitable[None]]
+
+
+class StageSkipped(Exception):
+    """被跳过阶段的输出（lazy 输入 await 时抛出）"""
+
+
+class Stage:
+    """流水线中的一个阶段"""
+
+    def __init__(self, name: str, fn: Callable[..., Awaitable[Dict[str, Any]]], inputs: Iterable[str] = (),
+                 outputs: Iterable[str] = (), lazy_inputs: Iterable[str] = (),
+                 when: Optional[Callable[[Dict[str, Any]], bool]] = None,
+                 start_status: Optional[Tuple[str, StatusMessage]] = None,
+                 done_status: Optional[Tuple[str, StatusMessage]] = None):
+        self.name = name
+        self.fn = fn
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.lazy_inputs = tuple(lazy_inputs)
+        self.when = when
+        self.start_status = start_status
+        self.done_status = done_status
+
+
+class DAGRun:
+    """一次执行的结果：上下文（初始值 + 各阶段输出）、阶段状态与耗时"""
+
+    def __init__(self, context: Dict[str, Any]):
+        self.context = context
+        self.states: Dict[str, str] = {}
+        self.timings: Dict[str, float] = {}
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            name: {"state": state, "seconds": self.timings.get(name)}
+            for name, state in self.states.items()
+        }
+
+
+class StageDAG:
+    """阶段 DAG 定义，可多次执行"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.stages: List[Stage] = []
+        self._producers: Dict[str, Stage] = {}
+
+    def stage(self, inputs: Iterable[str] = (), outputs: Iterable[str] = (), lazy_inputs: Iterable[str] = (),
+              when: Optional[Callable[[Dict[str, Any]], bool]] = None,
+              start_status: Optional[Tuple[str, StatusMessage]] = None,
+              done_status: Optional[Tuple[str, StatusMessage]] = None, name: Optional[str] = None):
+        """装饰器：注册阶段函数。阶段函数接收输入作为关键字参数，返回 {输出名: 值}"""
+        def decorator(fn):
+            self.add(Stage(name or fn.__name__, fn, inputs, outputs, lazy_inputs, when, start_status, done_status))
+            return fn
+        return decorator
+
+    def add(self, stage: Stage):
+        for output in stage.outputs:
+            if output in self._producers:
+                raise ValueError(f"输出 {output} 已由阶段 {self._producers[output].name} 产生")
+            self._producers[output] = stage
+        self.stages.append(stage)
+
+    def _validate(self, initial: Dict[str, Any]):
+        for stage in self.stages:
+            for name in stage.inputs + stage.lazy_inputs:
+                if name not in initial and name not in self._producers:
+                    raise ValueError(f"阶段 {stage.name} 的输入 {name} 没有来源")
+
+    @staticmethod
+    def _message(message: StatusMessage, context: Dict[str, Any]) -> str:
+        return message(context) if callable(message) else message
+
+    async def run(self, initial: Dict[str, Any], on_status: Optional[StatusCallback] = None) -> DAGRun:
+        """执行 DAG；任一阶段失败时取消其余阶段并抛出该异常"""
+        self._validate(initial)
+        loop = asyncio.get_running_loop()
+        run = DAGRun(dict(initial))
+        context = run.context
+        pending = list(self.stages)
+        running: Dict[asyncio.Task, Stage] = {}
+        started_at: Dict[str, float] = {}
+        unavailable = set()  # 被跳过阶段的输出
+        lazy_futures = {
+            name: loop.create_future()
+            for stage in self.stages for name in stage.lazy_inputs if name not in initial
+        }
+        for name, value in initial.items():
+            if name in lazy_futures:
+                lazy_futures[name].set_result(value)
+
+        def resolve_lazy(names: Iterable[str], value_of: Callable[[str], Any] = None, skipped: bool = False):
+            for name in names:
+                future = lazy_futures.get(name)
+                if future is None or future.done():
+                    continue
+                if skipped:
+                    future.set_exception(StageSkipped(name))
+                    future.exception()  # 标记为已读取，无人 await 时不告警
+                else:
+                    future.set_result(value_of(name))
+
+        async def emit(status: Optional[Tuple[str, StatusMessage]]):
+            if status and on_status:
+                await on_status(status[0], self._message(status[1], context))
+
+        try:
+            while True:
+                progressed = True
+                while progressed:
+                    progressed = False
+                    for stage in list(pending):
+                        if any(name in unavailable for name in stage.inputs):
+                            skip = True
+                        elif all(name in context for name in stage.inputs):
+                            skip = bool(stage.when and not stage.when(context))
+                        else:
+                            continue
+                        pending.remove(stage)
+                        progressed = True
+                        if skip:
+                            run.states[stage.name] = "skipped"
+                            unavailable.update(stage.outputs)
+                            resolve_lazy(stage.outputs, skipped=True)
+                            continue
+                        run.states[stage.name] = "running"
+                        started_at[stage.name] = time.monotonic()
+                        await emit(stage.start_status)
+                        kwargs = {name: context[name] for name in stage.inputs}
+                        kwargs.update({name: lazy_futures.get(name) or _done_future(loop, context[name])
+                                       for name in stage.lazy_inputs})
+                        running[asyncio.create_task(stage.fn(**kwargs))] = stage
+
+                if not running:
+                    break
+
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    stage = running.pop(task)
+                    run.timings[stage.name] = round(time.monotonic() - started_at[stage.name], 3)
+                    if task.exception() is not None:
+                        run.states[stage.name] = "failed"
+                        raise task.exception()
+                    result = task.result() or {}
+                    for name in stage.outputs:
+                        if name not in result:
+                            raise ValueError(f"阶段 {stage.name} 未产生输出 {name}")
+                        context[name] = result[name]
+                    resolve_lazy(stage.outputs, context.__getitem__)
+                    run.states[stage.name] = "done"
+                    await emit(stage.done_status)
+
+            if pending:
+                raise ValueError(f"{self.name}: 存在无法满足依赖的阶段 {[s.name for s in pending]}")
+            return run
+        finally:
+            for task, stage in running.items():
+                run.states[stage.name] = "cancelled"
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+            for future in lazy_futures.values():
+                if not future.done():
+                    future.cancel()
+            print(f"[{self.name}] 阶段耗时: " + ", ".join(
+                f"{name}={run.timings[name]}s({state})" if name in run.timings else f"{name}({state})"
+                for name, state in run.states.items()))
+
+
+def _done_future(loop: asyncio.AbstractEventLoop, value: Any) -> asyncio.Future:
+    future = loop.create_future()
+    future.set_result(value)
+    return future
@@ -1,32 +1,34 @@
 """
 提示词拆分工具：使用 Qwen-Plus 智能拆分用户提示词为片段理解提示词和整合提示词。
+
+拆分结果按 (规范化提示词, 语言, 模型, 拆分提示词版本) 持久化缓存（TTL + LRU），
+内置默认提示词和前端预设提示词在服务启动时预先计算，长视频流程通常无需等待拆分调用。
 """
 
 import os
+import re
 import json
-from typing import Dict
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
 import dashscope
 from dotenv import load_dotenv
+from dashscope_client import generation_call, run_sync
 
 load_dotenv()
 dashscope.api_key = os.getenv('DASHSCOPE_API_KEY')
 
+SPLITTER_MODEL = "qwen-plus"
 
-def split_prompt_for_long_video(user_prompt: str) -> Dict[str, str]:
-    """
-    使用Qwen-Plus智能拆分用户提示词，用于长视频处理流程。
-    
-    Args:
-        user_prompt: 用户的原始提示词
-        
-    Returns:
-        {
-            "segment_prompt": "给片段理解模型的提示词",
-            "integration_prompt": "给整合模型的提示词"
-        }
-    """
-    try:
-        system_prompt = """你是一个提示词分析专家。你的任务是将用户提供的视频理解提示词拆分为片段理解提示词和整合提示词。
+# 缓存配置（可通过环境变量调整）
+PROMPT_SPLIT_CACHE_PATH = os.getenv('PROMPT_SPLIT_CACHE_PATH', '/root/video2sop/temp/cache/prompt_split_cache.json')
+PROMPT_SPLIT_CACHE_TTL_SECONDS = int(os.getenv('PROMPT_SPLIT_CACHE_TTL_SECONDS', str(30 * 24 * 3600)))
+PROMPT_SPLIT_CACHE_MAX_ENTRIES = int(os.getenv('PROMPT_SPLIT_CACHE_MAX_ENTRIES', '256'))
+
+SPLITTER_SYSTEM_PROMPT = """你是一个提示词分析专家。你的任务是将用户提供的视频理解提示词拆分为片段理解提示词和整合提示词。
 片段理解提示词将会被交给多个片段理解模型，整合提示词将会被交给一个整合模型。
 
 1. **片段理解提示词** - 用于理解单个视频片段，应包括：
@@ -56,14 +58,165 @@ def split_prompt_for_long_video(user_prompt: str) -> Dict[str, str]:
 
 只返回JSON，不要添加其他文字说明。"""
 
-        user_analysis_prompt = f"""{user_prompt}"""
+# 拆分提示词版本：修改 SPLITTER_SYSTEM_PROMPT 后旧缓存自动失效
+SPLITTER_PROMPT_VERSION = hashlib.sha256(SPLITTER_SYSTEM_PROMPT.encode('utf-8')).hexdigest()[:12]
+
+# video_understanding_long 在请求未携带提示词时使用的内置默认提示词
+DEFAULT_LONG_VIDEO_PROMPTS = {
+    "zh": "请分析教学视频并生成SOP草稿，包含标题、摘要、关键词、材料/工具清单与详细操作步骤。",
+    "en": "Please analyze the instructional video and generate a SOP draft including title, abstract, keywords, materials/tools, and step-by-step operations.",
+}
+
+# 前端预设提示词（与 chat-frontend/src/components/VideoUnderstandingPanel.tsx 中的 DEFAULT_PROMPT_ZH / DEFAULT_PROMPT_EN 保持一致）
+FRONTEND_PRESET_PROMPTS = {
+    "zh": """1. 提供给你的是一个实验室仪器或实验处理的操作教学视频和它的语音识别结果，请按照这些内容去理解视频内演示者的操作，写一个标准操作流程（SOP）草稿。这个草稿包含标题、摘要、关键词、材料试剂工具设备清单、操作步骤和也许其他内容。其他内容请你合理地整理成一个或多个段落。
+
+2. 这份草稿的操作步骤越具体越好。操作步骤中适当分段，每一段包含"目的"和"操作"两个层级，"操作"是时间上相邻的多个操作，各放一行，"目的"是这些相邻的多个操作的共同目的。每个目的的开头带有一个时间起终范围，格式为(mm:ss-mm:ss)，而操作不要带时间起终范围。
+
+3. 演示者讲的话一定是操作重点，不过细节可能偶尔讲错。同时，语音识别结果也可能有错误，一般是被错误识别为读音相近的字。请你结合上下文来理解。
+
+4. 最终以中文、纯文本格式输出，不使用Markdown语法。
+
+5. 生成一些问题请用户澄清一些重要细节。""",
+    "en": """1. You are given an instructional video of a lab instrument or process, along with its speech recognition transcript. Understand the presenter's actions and write a draft SOP (Standard Operating Procedure). The draft should include: title, abstract, keywords, materials/reagents/tools/equipment list, operation steps, and possibly other relevant content. Organize any other content into one or more paragraphs.
+
+2. The operation steps should be as specific as possible. Split steps appropriately. For each step, include two levels: "Purpose" and "Operations". "Operations" are multiple time-adjacent actions (one per line). "Purpose" is the common purpose of those adjacent actions. Prefix each purpose with a time range in the format (mm:ss-mm:ss). Do NOT add time ranges to the operations.
+
+3. The presenter's speech is the key for understanding, but details may occasionally be incorrect. The transcript can also contain recognition errors (often homophones). Use context to infer the correct meaning.
+
+4. Output in English, plain text only. Do not use Markdown.
+
+5. Generate a few clarification questions for the user about important details.""",
+}
+
+_WHITESPACE_PATTERN = re.compile(r'[ \t\u3000]+')
+
+
+def normalize_prompt(user_prompt: str) -> str:
+    """规范化提示词：统一换行、去除行首尾空白、合并连续空格和空行"""
+    lines = [_WHITESPACE_PATTERN.sub(' ', line).strip() for line in (user_prompt or '').replace('\r\n', '\n').split('\n')]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+
+
+def normalize_lang(lang: Optional[str]) -> str:
+    return "en" if str(lang or "").lower().startswith("en") else "zh"
+
+
+def make_cache_key(user_prompt: str, lang: Optional[str] = "zh", model: str = SPLITTER_MODEL) -> str:
+    """缓存键：(规范化提示词, 语言, 模型, 拆分提示词版本) 的哈希"""
+    raw = json.dumps([normalize_prompt(user_prompt), normalize_lang(lang), model, SPLITTER_PROMPT_VERSION], ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class PromptSplitCache:
+    """持久化的提示词拆分结果缓存（JSON 文件，TTL 过期 + LRU 淘汰）"""
+
+    def __init__(self, path: str = PROMPT_SPLIT_CACHE_PATH,
+                 ttl_seconds: int = PROMPT_SPLIT_CACHE_TTL_SECONDS,
+                 max_entries: int = PROMPT_SPLIT_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
 
-        response = dashscope.Generation.call(
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"提示词拆分缓存读取失败，将重建: {e}")
+            return
+        # 按最近使用时间恢复 LRU 顺序
+        for key, entry in sorted(data.get("entries", {}).items(), key=lambda item: item[1].get("last_used", 0)):
+            self._entries[key] = entry
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"entries": self._entries}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"提示词拆分缓存写入失败: {e}")
+
+    def _expired(self, entry: Dict, now: float) -> bool:
+        return now - entry.get("created_at", 0) > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[Dict[str, str]]:
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            now = time.time()
+            if entry is None or self._expired(entry, now):
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            # 命中只在内存中更新 LRU 顺序，随下次 put 一并落盘（读取路径不写文件）
+            entry["last_used"] = now
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry["result"])
+
+    def put(self, key: str, result: Dict[str, str]):
+        """写入并落盘（同步文件写入，异步代码中应在线程中调用）"""
+        with self._lock:
+            self._load()
+            now = time.time()
+            self._entries[key] = {"result": result, "created_at": now, "last_used": now}
+            self._entries.move_to_end(key)
+            # 先清理过期条目，再按 LRU 淘汰
+            for stale in [k for k, e in self._entries.items() if self._expired(e, now)]:
+                del self._entries[stale]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._save()
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            return entry is not None and not self._expired(entry, time.time())
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            self._load()
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+prompt_split_cache = PromptSplitCache()
+
+# 进行中的拆分请求（相同提示词并发请求时共享一次调用）
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+def _fallback(user_prompt: str) -> Dict[str, str]:
+    """降级处理：返回原始提示词"""
+    return {
+        "segment_prompt": user_prompt,
+        "integration_prompt": user_prompt
+    }
+
+
+async def _call_splitter(user_prompt: str) -> Optional[Dict[str, str]]:
+    """调用 Qwen-Plus 拆分提示词，失败时返回 None（失败结果不写入缓存）"""
+    try:
+        response = await generation_call(
             api_key=os.getenv('DASHSCOPE_API_KEY'),
-            model="qwen-plus",
+            model=SPLITTER_MODEL,
             messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_analysis_prompt}
+                {"role": "system", "content": SPLITTER_SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt}
             ],
             result_format='message',
             temperature=0.1,
@@ -89,31 +242,81 @@ def split_prompt_for_long_video(user_prompt: str) -> Dict[str, str]:
             # 验证结果
             if "segment_prompt" not in result or "integration_prompt" not in result:
                 print(f"警告: 提示词拆分结果缺少必要字段，使用原始提示词")
-                return {
-                    "segment_prompt": user_prompt,
-                    "integration_prompt": user_prompt
-                }
+                return None
             
             print(f"提示词拆分成功:")
             print(f"片段提示词长度: {len(result['segment_prompt'])} 字符")
             print(f"整合提示词长度: {len(result['integration_prompt'])} 字符")
             
-            return result
-        else:
-            print(f"提示词拆分API调用失败: status={response.status_code}")
-            # 降级处理：返回原始提示词
             return {
-                "segment_prompt": user_prompt,
-                "integration_prompt": user_prompt
+                "segment_prompt": result["segment_prompt"],
+                "integration_prompt": result["integration_prompt"]
             }
+        else:
+            print(f"提示词拆分API调用失败: status={response.status_code}")
+            return None
             
     except Exception as e:
         print(f"提示词拆分异常: {str(e)}")
-        # 降级处理：返回原始提示词
-        return {
-            "segment_prompt": user_prompt,
-            "integration_prompt": user_prompt
+        return None
+
+
+async def split_prompt_for_long_video_async(user_prompt: str, lang: Optional[str] = "zh") -> Dict[str, str]:
+    """
+    使用Qwen-Plus智能拆分用户提示词，用于长视频处理流程（异步，复用共享连接池）。
+    结果命中缓存时直接返回；相同提示词的并发请求只调用一次模型。
+    
+    Args:
+        user_prompt: 用户的原始提示词
+        lang: 界面语言（zh/en），参与缓存键
+        
+    Returns:
+        {
+            "segment_prompt": "给片段理解模型的提示词",
+            "integration_prompt": "给整合模型的提示词"
         }
+    """
+    key = make_cache_key(user_prompt, lang)
+    cached = prompt_split_cache.get(key)
+    if cached is not None:
+        print(f"提示词拆分命中缓存: {key[:12]}")
+        return cached
+
+    future = _inflight.get(key)
+    if future is not None:
+        result = await asyncio.shield(future)
+        return dict(result) if result else _fallback(user_prompt)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        result = await _call_splitter(user_prompt)
+        if result:
+            await asyncio.to_thread(prompt_split_cache.put, key, result)
+        future.set_result(result)
+    finally:
+        if not future.done():
+            future.set_result(None)
+        _inflight.pop(key, None)
+    return dict(result) if result else _fallback(user_prompt)
+
+
+async def warm_prompt_split_cache() -> int:
+    """预先计算内置默认提示词和前端预设提示词的拆分结果（服务启动时在后台调用），返回新计算的条目数"""
+    presets = [(prompt, lang) for lang, prompt in DEFAULT_LONG_VIDEO_PROMPTS.items()]
+    presets += [(prompt, lang) for lang, prompt in FRONTEND_PRESET_PROMPTS.items()]
+    missing = [(prompt, lang) for prompt, lang in presets if make_cache_key(prompt, lang) not in prompt_split_cache]
+    if not missing:
+        return 0
+    await asyncio.gather(*(split_prompt_for_long_video_async(prompt, lang) for prompt, lang in missing))
+    warmed = sum(1 for prompt, lang in missing if make_cache_key(prompt, lang) in prompt_split_cache)
+    print(f"提示词拆分缓存预热完成: {warmed}/{len(missing)}")
+    return warmed
+
+
+def split_prompt_for_long_video(user_prompt: str, lang: Optional[str] = "zh") -> Dict[str, str]:
+    """split_prompt_for_long_video_async 的同步版本（用于脚本和测试）"""
+    return run_sync(split_prompt_for_long_video_async(user_prompt, lang))
 
 
 def test_split_prompt():
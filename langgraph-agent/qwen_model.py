@@ -4,10 +4,12 @@ from typing import Any, AsyncIterator, Iterator, List, Optional, Dict
 from dotenv import load_dotenv
 import dashscope
 from langchain_core.language_models.chat_models import BaseChatModel
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage, ToolMessage
-from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, AIMessageChunk, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
 from langchain_core.callbacks import CallbackManagerForLLMRun, AsyncCallbackManagerForLLMRun
 from langchain_core.tools import BaseTool
+from dashscope_client import generation_call, generation_stream
+from rate_limiter import PRIORITY_INTERACTIVE
 
 # 加载环境变量
 load_dotenv()
@@ -137,9 +139,50 @@ class QwenChatModel(BaseChatModel):
         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
         **kwargs: Any,
     ) -> ChatResult:
-        """异步生成方法"""
-        # 对于异步，我们使用同步方法（dashscope 库可能不支持原生异步）
-        return self._generate(messages, stop, run_manager, **kwargs)
+        """异步生成方法（原生异步 HTTP，复用共享连接池）"""
+        dashscope_messages = [self._convert_message_to_dict(msg) for msg in messages]
+        
+        response = await generation_call(
+            api_key=self.api_key,
+            model=self.model_name,
+            messages=dashscope_messages,
+            result_format='message',
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            stop=stop,
+            priority=kwargs.pop('priority', PRIORITY_INTERACTIVE),
+            **kwargs
+        )
+        
+        if response.status_code == 200:
+            content = response.output.choices[0].message.content
+            tool_calls = self._extract_tool_calls(content)
+            
+            message = AIMessage(content=content)
+            if tool_calls:
+                message.tool_calls = tool_calls
+            
+            return ChatResult(generations=[ChatGeneration(message=message)])
+        else:
+            raise Exception(f"API call failed: {response.message}")
+    
+    def _tool_call_chunk(self, full_content: str) -> Optional[ChatGenerationChunk]:
+        """流式结束后根据完整内容检测工具调用，生成只包含工具调用的增量块"""
+        tool_calls = self._extract_tool_calls(full_content)
+        if not tool_calls:
+            return None
+        return ChatGenerationChunk(message=AIMessageChunk(
+            content="",
+            tool_call_chunks=[
+                {
+                    "name": tool_call["name"],
+                    "args": json.dumps(tool_call["args"], ensure_ascii=False),
+                    "id": tool_call["id"],
+                    "index": i
+                }
+                for i, tool_call in enumerate(tool_calls)
+            ]
+        ))
     
     def _stream(
         self,
@@ -147,12 +190,12 @@ class QwenChatModel(BaseChatModel):
         stop: Optional[List[str]] = None,
         run_manager: Optional[CallbackManagerForLLMRun] = None,
         **kwargs: Any,
-    ) -> Iterator[ChatGeneration]:
-        """流式生成方法"""
+    ) -> Iterator[ChatGenerationChunk]:
+        """流式生成方法：使用增量输出，每次只产出新增文本"""
         # 转换消息格式
         dashscope_messages = [self._convert_message_to_dict(msg) for msg in messages]
         
-        # 调用 dashscope API 流式接口
+        # 调用 dashscope API 流式接口（incremental_output 使每个响应只包含新增内容）
         responses = dashscope.Generation.call(
             api_key=self.api_key,
             model=self.model_name,
@@ -161,6 +204,7 @@ class QwenChatModel(BaseChatModel):
             temperature=self.temperature,
             max_tokens=self.max_tokens,
             stream=True,
+            incremental_output=True,
             **kwargs
         )
         
@@ -169,22 +213,17 @@ class QwenChatModel(BaseChatModel):
         for response in responses:
             if response.status_code == 200:
                 if hasattr(response.output, 'choices') and response.output.choices:
-                    content = response.output.choices[0].message.content
-                    full_content += content
-                    
-                    # 检查是否需要工具调用（在流式结束时）
-                    message = AIMessage(content=full_content)
-                    
-                    # 只在流式结束时检查工具调用
-                    if content.endswith('\n') or not content:  # 流式结束标志
-                        tool_calls = self._extract_tool_calls(full_content)
-                        if tool_calls:
-                            message.tool_calls = tool_calls
-                    
-                    generation = ChatGeneration(message=message)
-                    yield generation
+                    delta = response.output.choices[0].message.content or ""
+                    if delta:
+                        full_content += delta
+                        yield ChatGenerationChunk(message=AIMessageChunk(content=delta))
             else:
                 raise Exception(f"Stream API call failed: {response.message}")
+        
+        # 流式结束时检查工具调用
+        tool_chunk = self._tool_call_chunk(full_content)
+        if tool_chunk:
+            yield tool_chunk
     
     async def _astream(
         self,
@@ -192,8 +231,34 @@ class QwenChatModel(BaseChatModel):
         stop: Optional[List[str]] = None,
         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
         **kwargs: Any,
-    ) -> AsyncIterator[ChatGeneration]:
-        """异步流式生成方法"""
-        # 对于异步流式，我们使用同步流式方法
-        for generation in self._stream(messages, stop, run_manager, **kwargs):
-            yield generation
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        """异步流式生成方法（原生异步 SSE，复用共享连接池，增量输出）"""
+        dashscope_messages = [self._convert_message_to_dict(msg) for msg in messages]
+        
+        responses = generation_stream(
+            api_key=self.api_key,
+            model=self.model_name,
+            messages=dashscope_messages,
+            result_format='message',
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            stop=stop,
+            priority=kwargs.pop('priority', PRIORITY_INTERACTIVE),
+            incremental_output=True,
+            **kwargs
+        )
+        
+        full_content = ""
+        async for response in responses:
+            if response.status_code == 200:
+                if response.output.get('choices'):
+                    delta = response.output.choices[0].message.content or ""
+                    if delta:
+                        full_content += delta
+                        yield ChatGenerationChunk(message=AIMessageChunk(content=delta))
+            else:
+                raise Exception(f"Stream API call failed: {response.message}")
+        
+        tool_chunk = self._tool_call_chunk(full_content)
+        if tool_chunk:
+            yield tool_chunk
@@ -0,0 +1,234 @@
+"""
+模型调用调度器：按模型的令牌桶限制每分钟请求数（RPM）与 token 数（TPM），
+等待中的调用按优先级排队（交互式对话优先于批量片段任务），限流或瞬时错误时按指数退避+抖动重试。
+
+限额通过环境变量配置：
+    DASHSCOPE_RATE_LIMITS="qwen-plus=600:1000000,qwen3-vl-plus=60:500000"   # 模型=RPM:TPM
+    DASHSCOPE_DEFAULT_RPM / DASHSCOPE_DEFAULT_TPM                            # 未单独配置的模型
+"""
+
+import os
+import time
+import heapq
+import random
+import asyncio
+import itertools
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+# 调用优先级：数值越小越优先
+PRIORITY_INTERACTIVE = 0   # 对话
+PRIORITY_NORMAL = 5        # 用户直接触发的单次操作（解析、精修、短视频理解等）
+PRIORITY_BATCH = 10        # 长视频片段等批量任务
+PRIORITY_BACKGROUND = 20   # 后台维护任务（对话摘要等），不得延迟用户可见的调用
+
+# 当前上下文的调用优先级（在任务内设置，对该任务发起的所有模型调用生效）
+current_priority: ContextVar[int] = ContextVar('dashscope_call_priority', default=PRIORITY_NORMAL)
+
+DEFAULT_RPM = int(os.getenv('DASHSCOPE_DEFAULT_RPM', '300'))
+DEFAULT_TPM = int(os.getenv('DASHSCOPE_DEFAULT_TPM', '1000000'))
+# 未指定 max_tokens 时预估的输出 token 数
+DEFAULT_OUTPUT_TOKENS = int(os.getenv('DASHSCOPE_DEFAULT_OUTPUT_TOKENS', '2000'))
+# 每个视频/图片输入预估的 token 数（无法从文本估算）
+MEDIA_INPUT_TOKENS = int(os.getenv('DASHSCOPE_MEDIA_INPUT_TOKENS', '8000'))
+MAX_RETRIES = int(os.getenv('DASHSCOPE_MAX_RETRIES', '4'))
+RETRY_BASE_DELAY = float(os.getenv('DASHSCOPE_RETRY_BASE_DELAY', '1.0'))
+RETRY_MAX_DELAY = float(os.getenv('DASHSCOPE_RETRY_MAX_DELAY', '30.0'))
+
+# 可重试的 HTTP 状态码（限流与服务端瞬时错误）
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def parse_rate_limits(spec: str) -> Dict[str, tuple]:
+    """解析 "模型=RPM:TPM,..." 格式的限额配置"""
+    limits = {}
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        model, values = item.split("=", 1)
+        rpm, _, tpm = values.partition(":")
+        try:
+            limits[model.strip()] = (int(rpm), int(tpm) if tpm else DEFAULT_TPM)
+        except ValueError:
+            print(f"忽略无效的限额配置: {item}")
+    return limits
+
+
+RATE_LIMITS = parse_rate_limits(os.getenv('DASHSCOPE_RATE_LIMITS', ''))
+
+
+def estimate_request_tokens(messages: List[Dict], parameters: Dict[str, Any]) -> int:
+    """估算一次调用消耗的 token 数（输入文本 + 媒体 + 预期输出）"""
+    chars = 0
+    media = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            for part in content:
+                if isinstance(part, dict):
+                    chars += len(part.get("text") or "")
+                    media += 1 if ("video" in part or "image" in part) else 0
+    output = parameters.get("max_tokens") or DEFAULT_OUTPUT_TOKENS
+    # 中文约1字1 token，英文约4字符1 token，这里取保守估计
+    return chars + media * MEDIA_INPUT_TOKENS + int(output)
+
+
+def backoff_delay(attempt: int) -> float:
+    """第 attempt 次重试前的等待秒数：指数退避 + 全抖动"""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+class TokenBucket:
+    """令牌桶：容量为每分钟限额，按秒匀速补充"""
+
+    def __init__(self, per_minute: int, clock: Callable[[], float] = time.monotonic):
+        self.capacity = max(1, per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = float(self.capacity)
+        self.updated = clock()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """距离可取出 amount 还需等待的秒数（amount 超过容量时按容量计）"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, delta: float):
+        """按实际用量修正（delta 为正表示多用，可使余量为负）"""
+        self.level = min(self.capacity, self.level - delta)
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "tokens", "future", "enqueued")
+
+    def __init__(self, priority: int, seq: int, tokens: int, enqueued: float):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.future: Optional[asyncio.Future] = None
+        self.enqueued = enqueued
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class ModelRateLimiter:
+    """单个模型的限流器：请求桶 + token 桶 + 优先级等待队列"""
+
+    def __init__(self, model: str, rpm: int, tpm: int, clock: Callable[[], float] = time.monotonic):
+        self.model = model
+        # 时钟可注入（测试中用可控时钟代替真实时间）
+        self.clock = clock
+        self.requests = TokenBucket(rpm, clock)
+        self.tokens = TokenBucket(tpm, clock)
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        self.in_flight = 0
+        self.granted = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _wake_head(self):
+        if self._waiters:
+            future = self._waiters[0].future
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    async def acquire(self, tokens: int, priority: int):
+        """等待直到本次调用可以发出（队首且两个桶余量充足）"""
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(priority, next(self._seq), tokens, self.clock())
+        heapq.heappush(self._waiters, waiter)
+        # 新的更高优先级调用成为队首时，唤醒它重新检查
+        self._wake_head()
+        try:
+            while True:
+                timeout = None
+                if self._waiters[0] is waiter:
+                    now = self.clock()
+                    timeout = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+                    if timeout == 0:
+                        heapq.heappop(self._waiters)
+                        self.requests.take(1)
+                        self.tokens.take(tokens)
+                        break
+                waiter.future = loop.create_future()
+                try:
+                    await asyncio.wait_for(waiter.future, timeout)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+                self._wake_head()
+            raise
+
+        waited = self.clock() - waiter.enqueued
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        self.granted += 1
+        self.in_flight += 1
+        # 后续调用可能已有余量
+        self._wake_head()
+
+    def release(self, estimated_tokens: int, actual_tokens: Optional[int] = None):
+        """调用结束：按实际用量修正 token 桶"""
+        self.in_flight = max(0, self.in_flight - 1)
+        if actual_tokens:
+            self.tokens.adjust(actual_tokens - min(estimated_tokens, self.tokens.capacity))
+        self._wake_head()
+
+    def stats(self) -> Dict[str, Any]:
+        now = self.clock()
+        self.requests._refill(now)
+        self.tokens._refill(now)
+        waiting: Dict[int, int] = {}
+        for waiter in self._waiters:
+            waiting[waiter.priority] = waiting.get(waiter.priority, 0) + 1
+        return {
+            "rpm_limit": self.requests.capacity,
+            "tpm_limit": self.tokens.capacity,
+            "requests_available": round(self.requests.level, 1),
+            "tokens_available": round(self.tokens.level),
+            "queued": len(self._waiters),
+            "queued_by_priority": waiting,
+            "oldest_wait_seconds": round(max((now - w.enqueued for w in self._waiters), default=0.0), 3),
+            "in_flight": self.in_flight,
+            "granted": self.granted,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "failed": self.failed,
+            "avg_wait_seconds": round(self.total_wait / self.granted, 3) if self.granted else 0.0,
+            "max_wait_seconds": round(self.max_wait, 3)
+        }
+
+
+_limiters: Dict[str, ModelRateLimiter] = {}
+
+
+def get_limiter(model: str) -> ModelRateLimiter:
+    """获取模型对应的限流器（进程内共享，所有会话的调用共同受限）"""
+    limiter = _limiters.get(model)
+    if limiter is None:
+        rpm, tpm = RATE_LIMITS.get(model, (DEFAULT_RPM, DEFAULT_TPM))
+        limiter = ModelRateLimiter(model, rpm, tpm)
+        _limiters[model] = limiter
+    return limiter
+
+
+def get_rate_limit_stats() -> Dict[str, Any]:
+    """所有模型的队列与限流指标"""
+    return {model: limiter.stats() for model, limiter in _limiters.items()}
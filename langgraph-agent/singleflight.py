@@ -0,0 +1,123 @@
+"""
+相同请求合并（singleflight）：以 (接口, 规范化参数, 引用文件指纹) 的哈希为键，
+相同请求仍在执行时，后到的请求挂到同一个执行结果上，不再重复调用模型。
+
+执行期间通过 notify() 发送的 WebSocket 通知会发给所有挂上来的会话；
+后加入的会话先补发此前已发送的通知再登记（与 notify 互斥），保证每个会话都按顺序收到完整且不重复的通知序列。
+"""
+
+import os
+import json
+import asyncio
+import hashlib
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+# 参与键计算时忽略的会话相关字段
+SESSION_FIELDS = ("client_session_id", "session_id")
+
+
+def file_fingerprint(path: Optional[str]) -> Optional[Dict[str, Any]]:
+    """文件指纹（路径 + 大小 + 修改时间），文件被替换后键随之变化"""
+    if not path or not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def request_key(endpoint: str, params: Dict[str, Any], artifacts: Iterable[Optional[str]] = ()) -> str:
+    """规范化请求的哈希键：忽略会话字段和空值，键排序后序列化"""
+    canonical = {
+        "endpoint": endpoint,
+        "params": {k: v for k, v in params.items() if k not in SESSION_FIELDS and v is not None},
+        "artifacts": [file_fingerprint(path) for path in artifacts]
+    }
+    payload = json.dumps(canonical, ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=str)
+    return f"{endpoint}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+class Flight:
+    """一次正在执行的请求"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.sessions: List[str] = []
+        self.messages: List[str] = []
+        self.waiters = 0
+        self.task: Optional[asyncio.Task] = None
+        # 补发与新通知互斥
+        self.lock = asyncio.Lock()
+
+
+# 当前任务所属的请求（在合并执行的任务内设置）
+_current_flight: ContextVar[Optional[Flight]] = ContextVar('singleflight_current_flight', default=None)
+
+
+class SingleFlight:
+    """按请求键合并正在执行的相同请求"""
+
+    def __init__(self, send: Callable[[str, str], Awaitable[Any]]):
+        self._send = send
+        self._flights: Dict[str, Flight] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, client_session_id: Optional[str], fn: Callable[[], Awaitable[Any]]) -> Any:
+        """执行 fn()；相同键的请求正在执行时直接等待其结果"""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = Flight(key)
+            if client_session_id:
+                flight.sessions.append(client_session_id)
+            self._flights[key] = flight
+            self.started += 1
+            flight.task = asyncio.create_task(self._run(flight, fn))
+            # 所有等待者都已取消时避免 "exception was never retrieved" 警告
+            flight.task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        else:
+            self.coalesced += 1
+            print(f"合并相同请求: {key[:48]}...（已有 {flight.waiters} 个等待者）")
+            if client_session_id:
+                async with flight.lock:
+                    if client_session_id not in flight.sessions:
+                        for message in flight.messages:
+                            await self._send(client_session_id, message)
+                        flight.sessions.append(client_session_id)
+
+        flight.waiters += 1
+        try:
+            # shield：某个等待者断开或被取消时，不影响其他等待者
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+
+    async def _run(self, flight: Flight, fn: Callable[[], Awaitable[Any]]) -> Any:
+        _current_flight.set(flight)
+        try:
+            return await fn()
+        finally:
+            self._flights.pop(flight.key, None)
+
+    async def notify(self, client_session_id: Optional[str], message: str):
+        """发送通知：在合并执行的任务内发给所有挂上来的会话，否则只发给 client_session_id"""
+        flight = _current_flight.get()
+        if flight is None:
+            if client_session_id:
+                await self._send(client_session_id, message)
+            return
+        async with flight.lock:
+            flight.messages.append(message)
+            for session_id in list(flight.sessions):
+                await self._send(session_id, message)
+
+    def in_flight(self) -> bool:
+        """当前任务是否在合并执行的请求内（此时通知会发给所有挂上来的会话）"""
+        return _current_flight.get() is not None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._flights),
+            "started": self.started,
+            "coalesced": self.coalesced,
+            "waiting_sessions": sum(len(f.sessions) for f in self._flights.values())
+        }
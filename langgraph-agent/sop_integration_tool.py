@@ -1,41 +1,244 @@
 """
 SOP 片段结果整合工具：使用 qwen-plus(可启用 thinking) 将多片段理解结果与语音全文整合为完整SOP草稿。
+
+片段较多或提示词过长时启用分层整合（map-reduce）：相邻片段按组并行合并（每组只附带对应时间窗口的语音文本），
+逐层归并直到结果足够小，再做一次最终整合。
 """
 
 import os
+import re
 import json
-from typing import List, Dict
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 
 import dashscope
 from dotenv import load_dotenv
+from dashscope_client import generation_call, run_sync
+from chat_history import estimate_tokens
+from transcript import Transcript
 
 load_dotenv()
 dashscope.api_key = os.getenv('DASHSCOPE_API_KEY')
 
+INTEGRATION_MODEL = "qwen-plus"
+# 整合模式：auto（超过阈值自动分层）/ flat（始终单次整合）/ hierarchical（始终分层）
+INTEGRATION_MODE = os.getenv('INTEGRATION_MODE', 'auto').lower()
+# 每组合并的相邻片段数
+INTEGRATION_FAN_IN = int(os.getenv('INTEGRATION_FAN_IN', '4'))
+# 每层单次调用的提示词 token 预算（片段结果 + 语音窗口）
+INTEGRATION_LEVEL_TOKENS = int(os.getenv('INTEGRATION_LEVEL_TOKENS', '24000'))
+# auto 模式下启用分层整合的片段数阈值
+INTEGRATION_HIERARCHY_MIN_SEGMENTS = int(os.getenv('INTEGRATION_HIERARCHY_MIN_SEGMENTS', '8'))
+# auto 模式下启用分层整合的提示词 token 阈值
+INTEGRATION_HIERARCHY_MIN_TOKENS = int(os.getenv('INTEGRATION_HIERARCHY_MIN_TOKENS', '32000'))
+# 中间层合并是否启用 thinking（最终整合始终启用）
+INTEGRATION_MERGE_THINKING = os.getenv('INTEGRATION_MERGE_THINKING', 'false').lower() == 'true'
+# 分层整合的最大层数（防止预算设置过小时无法收敛）
+INTEGRATION_MAX_LEVELS = 6
 
-def integrate_sop_segments(
-    segment_results: List[Dict], 
+MERGE_PROMPT = """以下是视频中相邻几个片段的理解结果，以及这段时间（{time_range}）内的语音识别文本。
+请将它们合并为一份连续的阶段性操作记录：
+- 按时间顺序保留全部操作步骤及其时间标注（mm:ss）
+- 删除相邻片段重叠部分造成的重复内容
+- 用语音识别文本补充或纠正操作细节
+- 不要生成标题、摘要和关键词，只输出操作内容（纯文本，不含Markdown语法）
+
+【片段理解结果】
+{segments}
+
+【本时段语音识别文本】
+{transcript}"""
+
+_TIME_RANGE_PATTERN = re.compile(r'(\d+):(\d{2})\s*-\s*(\d+):(\d{2})')
+
+# 分层整合进度回调：on_level(层号, 本层分组数, 本层输入结果数)
+LevelCallback = Callable[[int, int, int], Awaitable[None]]
+
+
+def _segment_seconds(seg: Dict) -> Tuple[Optional[float], Optional[float]]:
+    """片段起止秒数：优先使用 start_time/end_time，否则从 "mm:ss-mm:ss" 格式的 time_range 解析"""
+    if seg.get("start_time") is not None and seg.get("end_time") is not None:
+        return float(seg["start_time"]), float(seg["end_time"])
+    match = _TIME_RANGE_PATTERN.search(str(seg.get("time_range", "")))
+    if not match:
+        return None, None
+    return (int(match.group(1)) * 60 + int(match.group(2)),
+            int(match.group(3)) * 60 + int(match.group(4)))
+
+
+def _format_mmss(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+
+def _format_segments(segment_results: List[Dict]) -> str:
+    segments_text = []
+    for seg in segment_results:
+        seg_id = seg.get("segment_id")
+        time_range = seg.get("time_range")
+        result_text = seg.get("result", "")
+        segments_text.append(f"[片段 {seg_id} | {time_range}]\n{result_text}")
+    return "\n\n".join(segments_text)
+
+
+def _window_text(transcript: Optional[Transcript], group: List[Dict]) -> str:
+    """一组相邻片段对应时间窗口内的语音文本"""
+    if not transcript:
+        return ""
+    starts, ends = zip(*(_segment_seconds(seg) for seg in group))
+    if None in starts or None in ends:
+        return transcript.to_text()
+    return transcript.window_seconds(min(starts), max(ends)).to_text()
+
+
+def group_segments(segment_results: List[Dict], transcript: Optional[Transcript],
+                   fan_in: int, token_budget: int) -> List[List[Dict]]:
+    """
+    将相邻片段贪心分组：每组最多 fan_in 个，且组内结果与语音窗口的 token 估算不超过预算（单个片段超预算时独立成组）。
+    """
+    fan_in = max(2, fan_in)
+    groups: List[List[Dict]] = []
+    current: List[Dict] = []
+    for seg in segment_results:
+        candidate = current + [seg]
+        tokens = estimate_tokens(_format_segments(candidate)) + estimate_tokens(_window_text(transcript, candidate))
+        if current and (len(candidate) > fan_in or tokens > token_budget):
+            groups.append(current)
+            current = [seg]
+        else:
+            current = candidate
+    if current:
+        groups.append(current)
+    return groups
+
+
+def should_use_hierarchy(segment_results: List[Dict], audio_transcript: str, mode: str = INTEGRATION_MODE) -> bool:
+    """判断是否启用分层整合"""
+    if mode == "flat":
+        return False
+    if mode == "hierarchical":
+        return len(segment_results) > 1
+    if len(segment_results) <= max(2, INTEGRATION_FAN_IN):
+        return False
+    tokens = estimate_tokens(_format_segments(segment_results)) + estimate_tokens(audio_transcript or "")
+    return (len(segment_results) >= INTEGRATION_HIERARCHY_MIN_SEGMENTS
+            or tokens >= INTEGRATION_HIERARCHY_MIN_TOKENS)
+
+
+async def _call_model(user_prompt: str, enable_thinking: bool) -> Tuple[Optional[str], Dict]:
+    """调用整合模型，返回 (文本, 错误信息)；成功时错误信息为空字典"""
+    response = await generation_call(
+        api_key=os.getenv('DASHSCOPE_API_KEY'),
+        model=INTEGRATION_MODEL,
+        messages=[
+            {"role": "user", "content": user_prompt}
+        ],
+        result_format='message',
+        temperature=0.3,
+        enable_thinking=enable_thinking
+    )
+    if response.status_code == 200:
+        return response.output.choices[0].message.content, {}
+    return None, {
+        "error": f"整合API失败: status={response.status_code}",
+        "message": getattr(response, 'message', '')
+    }
+
+
+async def _merge_group(group: List[Dict], transcript: Optional[Transcript], level: int, index: int) -> Dict:
+    """合并一组相邻片段；失败时退化为拼接原结果，不中断整体整合"""
+    starts, ends = zip(*(_segment_seconds(seg) for seg in group))
+    if None in starts or None in ends:
+        time_range = f"{group[0].get('time_range', '')} ~ {group[-1].get('time_range', '')}"
+        start_time = end_time = None
+    else:
+        start_time, end_time = min(starts), max(ends)
+        time_range = f"{_format_mmss(start_time)}-{_format_mmss(end_time)}"
+    segments_text = _format_segments(group)
+
+    content = None
+    try:
+        content, error = await _call_model(
+            MERGE_PROMPT.format(time_range=time_range, segments=segments_text,
+                                transcript=_window_text(transcript, group) or "（无）"),
+            INTEGRATION_MERGE_THINKING
+        )
+        if content is None:
+            print(f"第{level}层第{index + 1}组合并失败，使用原片段结果: {error}")
+    except Exception as e:
+        print(f"第{level}层第{index + 1}组合并异常，使用原片段结果: {e}")
+
+    return {
+        "segment_id": f"L{level}-{index + 1}",
+        "time_range": time_range,
+        "start_time": start_time,
+        "end_time": end_time,
+        "result": content if content else segments_text
+    }
+
+
+async def reduce_segments_async(
+    segment_results: List[Dict],
+    transcript: Optional[Transcript],
+    fan_in: int = INTEGRATION_FAN_IN,
+    token_budget: int = INTEGRATION_LEVEL_TOKENS,
+    on_level: Optional[LevelCallback] = None
+) -> List[Dict]:
+    """
+    逐层并行合并相邻片段，直到结果数不超过 fan_in 且总量不超过单层预算。
+
+    Returns: 归并后的片段结果列表（保持时间顺序）
+    """
+    items = list(segment_results)
+    for level in range(1, INTEGRATION_MAX_LEVELS + 1):
+        if len(items) <= 1:
+            break
+        if len(items) <= fan_in and estimate_tokens(_format_segments(items)) <= token_budget:
+            break
+        groups = group_segments(items, transcript, fan_in, token_budget)
+        if len(groups) == len(items):
+            # 单个结果已超过预算，继续分组无法收敛
+            break
+        if on_level:
+            await on_level(level, len(groups), len(items))
+        print(f"分层整合第{level}层：{len(items)} 个结果分为 {len(groups)} 组并行合并")
+        items = await asyncio.gather(*[
+            _merge_group(group, transcript, level, i) if len(group) > 1 else asyncio.sleep(0, group[0])
+            for i, group in enumerate(groups)
+        ])
+    return items
+
+
+async def integrate_sop_segments_async(
+    segment_results: List[Dict],
     audio_transcript: str,
-    user_integration_prompt: str = ""
+    user_integration_prompt: str = "",
+    mode: Optional[str] = None,
+    on_level: Optional[LevelCallback] = None
 ) -> str:
     """
-    将多个片段理解结果与语音全文整合为完整SOP草稿。
-    
+    将多个片段理解结果与语音全文整合为完整SOP草稿（异步，复用共享连接池）。
+
     Args:
-        segment_results: 片段理解结果列表
+        segment_results: 片段理解结果列表（可含 start_time/end_time 秒数，否则从 time_range 解析）
         audio_transcript: 完整语音识别文本
         user_integration_prompt: 用户的整合提示词（由提示词拆分工具生成）
+        mode: 整合模式（auto/flat/hierarchical），默认使用 INTEGRATION_MODE
+        on_level: 分层整合时每层开始前的进度回调
 
     Returns: 原样返回文本(纯文本，不含Markdown语法)。如失败，返回JSON字符串包含 error。
     """
     try:
-        segments_text = []
-        for seg in segment_results:
-            seg_id = seg.get("segment_id")
-            time_range = seg.get("time_range")
-            result_text = seg.get("result", "")
-            segments_text.append(f"[片段 {seg_id} | {time_range}]\n{result_text}")
-        segments_joined = "\n\n".join(segments_text)
+        audio_transcript = audio_transcript or ""
+        if should_use_hierarchy(segment_results, audio_transcript, mode or INTEGRATION_MODE):
+            transcript = Transcript.from_text(audio_transcript) if audio_transcript else None
+            segment_results = await reduce_segments_async(segment_results, transcript, on_level=on_level)
+            segments_joined = _format_segments(segment_results)
+            # 中间层已按时间窗口融合语音文本，最终整合只在预算允许时附带全文
+            if estimate_tokens(segments_joined) + estimate_tokens(audio_transcript) > INTEGRATION_LEVEL_TOKENS:
+                audio_transcript = "（语音识别文本已在各片段合并时按时间段融合）"
+        else:
+            segments_joined = _format_segments(segment_results)
 
         user_prompt = f"""
 以下是多个视频片段的理解结果和完整的语音识别文本。
@@ -49,27 +252,18 @@ def integrate_sop_segments(
 {user_integration_prompt}
 """
 
-        response = dashscope.Generation.call(
-            api_key=os.getenv('DASHSCOPE_API_KEY'),
-            model="qwen-plus",
-            messages=[
-                {"role": "user", "content": user_prompt}
-            ],
-            result_format='message',
-            temperature=0.3,
-            enable_thinking=True
-        )
-
-        if response.status_code == 200:
-            content = response.output.choices[0].message.content
+        content, error = await _call_model(user_prompt, True)
+        if content is not None:
             return content
-        else:
-            return json.dumps({
-                "error": f"整合API失败: status={response.status_code}",
-                "message": getattr(response, 'message', '')
-            })
+        return json.dumps(error)
     except Exception as e:
         return json.dumps({"error": str(e)})
 
 
-
+def integrate_sop_segments(
+    segment_results: List[Dict],
+    audio_transcript: str,
+    user_integration_prompt: str = ""
+) -> str:
+    """integrate_sop_segments_async 的同步版本（用于脚本和测试）"""
+    return run_sync(integrate_sop_segments_async(segment_results, audio_transcript, user_integration_prompt))
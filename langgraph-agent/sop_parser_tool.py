@@ -1,21 +1,151 @@
 import os
 import json
 import re
-from typing import List, Dict, Any
+import asyncio
+from typing import List, Dict, Any, Optional
 from langchain_core.tools import tool
 from dotenv import load_dotenv
-import dashscope
+from dashscope_client import generation_stream, run_sync
+from sop_rule_parser import parse_sop_rules, split_manuscript, BLOCK_TYPES, DEFAULT_MIN_CONFIDENCE
+from stream_json import BlockCallback, collect_streamed_blocks
 
 # 加载环境变量
 load_dotenv()
 
-@tool
-def sop_parser(manuscript: str) -> str:
+# 解析模式：auto（规则优先，必要时回退大模型）/ rules（仅规则）/ llm（仅大模型）
+SOP_PARSER_MODE = os.getenv('SOP_PARSER_MODE', 'auto').lower()
+# 规则解析置信度低于该值时整篇交给大模型
+SOP_RULE_MIN_CONFIDENCE = float(os.getenv('SOP_RULE_MIN_CONFIDENCE', str(DEFAULT_MIN_CONFIDENCE)))
+# 大模型解析时超过该长度的草稿按章节/步骤边界分块并行解析
+SOP_PARSE_CHUNK_CHARS = int(os.getenv('SOP_PARSE_CHUNK_CHARS', '4000'))
+# 分块并行解析的最大并发数
+SOP_PARSE_MAX_CONCURRENCY = int(os.getenv('SOP_PARSE_MAX_CONCURRENCY', '8'))
+
+
+def _fill_block_defaults(block: Dict[str, Any], index: int) -> Dict[str, Any]:
+    """确保区块包含必需的字段"""
+    if 'id' not in block:
+        block['id'] = f"block_{index+1}"
+    if block.get('type') not in BLOCK_TYPES:
+        block['type'] = 'unknown'
+    if 'content' not in block:
+        block['content'] = ''
+    if 'show_play_button' not in block:
+        block['show_play_button'] = bool(block.get('start_time') and block.get('end_time'))
+    return block
+
+
+def _assign_block_ids(blocks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """按文档顺序重新分配稳定的区块ID"""
+    for i, block in enumerate(blocks):
+        block["id"] = f"block_{i+1}"
+    return blocks
+
+
+async def chunked_sop_parser_async(manuscript: str, max_chars: int = SOP_PARSE_CHUNK_CHARS,
+                                   on_block: Optional[BlockCallback] = None) -> str:
     """
-    将SOP草稿文本解析为结构化的区块数组。
+    将长草稿在顶层章节/步骤边界处分块，并发调用大模型解析后按原文顺序合并。
+    输出 token 延迟占主导，N 个分块并行约可将耗时缩短为 1/N。
+    """
+    chunks = split_manuscript(manuscript, max_chars)
+    if len(chunks) <= 1:
+        return await llm_sop_parser_async(manuscript, on_block)
+
+    print(f"长草稿分块并行解析: {len(manuscript)} 字符，{len(chunks)} 个分块")
+    semaphore = asyncio.Semaphore(SOP_PARSE_MAX_CONCURRENCY)
+
+    async def parse_chunk(chunk_index: int, chunk: str) -> Dict[str, Any]:
+        async with semaphore:
+            return json.loads(await llm_sop_parser_async(chunk, on_block, (chunk_index,)))
+
+    results = await asyncio.gather(*(parse_chunk(i, chunk) for i, chunk in enumerate(chunks)))
+
+    blocks: List[Dict[str, Any]] = []
+    errors = []
+    for result in results:
+        blocks.extend(result.get("blocks", []))
+        if "error" in result:
+            errors.append(result["error"])
+
+    merged: Dict[str, Any] = {"blocks": _assign_block_ids(blocks)}
+    # 全部分块失败时才视为解析失败；部分失败的分块以原文区块保留
+    if len(errors) == len(chunks):
+        merged["error"] = errors[0]
+    return json.dumps(merged, ensure_ascii=False)
+
+
+async def _llm_parse_document(manuscript: str, chunked: Optional[bool] = None,
+                              on_block: Optional[BlockCallback] = None) -> str:
+    """整篇交给大模型解析；长草稿默认分块并行"""
+    if chunked is None:
+        chunked = len(manuscript) > SOP_PARSE_CHUNK_CHARS
+    if chunked:
+        return await chunked_sop_parser_async(manuscript, on_block=on_block)
+    return await llm_sop_parser_async(manuscript, on_block)
+
+
+async def sop_parser_async(manuscript: str, chunked: Optional[bool] = None,
+                           on_block: Optional[BlockCallback] = None) -> str:
+    """
+    将SOP草稿文本解析为结构化的区块数组（异步）。
+    
+    优先使用规则解析；置信度低时整篇交给大模型，否则只把无法归类的片段交给大模型。
+    
+    Args:
+        manuscript: 原始SOP草稿文本内容
+        chunked: 整篇交给大模型时是否分块并行解析（None 表示按长度自动决定）
+        on_block: 每个区块就绪时的回调 on_block(区块, 排序键)，用于逐块推送；最终结果以返回值为准
+        
+    Returns:
+        JSON字符串，包含区块数组（结构见 llm_sop_parser_async）
+    """
+    if SOP_PARSER_MODE == 'llm':
+        return await _llm_parse_document(manuscript, chunked, on_block)
+
+    parsed = parse_sop_rules(manuscript)
+    if SOP_PARSER_MODE != 'rules' and parsed["confidence"] < SOP_RULE_MIN_CONFIDENCE:
+        print(f"规则解析置信度 {parsed['confidence']} 低于阈值，回退到大模型解析")
+        return await _llm_parse_document(manuscript, chunked, on_block)
+
+    blocks = parsed["blocks"]
+    unclassified = parsed["unclassified"] if SOP_PARSER_MODE != 'rules' else []
+    if on_block:
+        # 规则识别的区块立即推送；大模型解析的片段在其流式输出中推送
+        for i, block in enumerate(blocks):
+            if i not in unclassified:
+                await on_block(block, (i,))
+    if unclassified:
+        # 只把无法归类的片段交给大模型，并发执行
+        print(f"规则解析置信度 {parsed['confidence']}，{len(unclassified)} 个片段交给大模型解析")
+        llm_results = await asyncio.gather(*(
+            llm_sop_parser_async(blocks[i]["content"], on_block, (i,)) for i in unclassified
+        ))
+        replacements = {}
+        for i, result_json in zip(unclassified, llm_results):
+            result = json.loads(result_json)
+            if "error" not in result and result.get("blocks"):
+                replacements[i] = result["blocks"]
+        merged = []
+        for i, block in enumerate(blocks):
+            merged.extend(replacements.get(i, [block]))
+        blocks = merged
+    else:
+        print(f"规则解析完成，置信度 {parsed['confidence']}，共 {len(blocks)} 个区块")
+
+    # 重新分配ID，保持文档顺序
+    return json.dumps({"blocks": _assign_block_ids(blocks)}, ensure_ascii=False)
+
+
+async def llm_sop_parser_async(manuscript: str, on_block: Optional[BlockCallback] = None,
+                               order_prefix: tuple = ()) -> str:
+    """
+    使用大模型将SOP草稿文本解析为结构化的区块数组（异步流式，复用共享连接池）。
     
     Args:
         manuscript: 原始SOP草稿文本内容
+        on_block: 每个区块在流式输出中闭合时的回调
+        order_prefix: 回调排序键的前缀（分块解析时为分块序号）
         
     Returns:
         JSON字符串，包含区块数组，每个区块包含：
@@ -42,8 +172,7 @@ def sop_parser(manuscript: str) -> str:
 - keywords: 关键词部分
 - materials: 材料试剂工具设备清单
 - step: 操作步骤（包含完整步骤及其所有子步骤）
-- question: 问题澄清请求
-- unknown: 其他类型内容
+- unknown: 其他类型内容（包括问题澄清请求）
 
 时间戳提取规则：
 - 查找形如"(0:05 - 0:08)"、"时间范围：0:03 - 0:21"等时间范围标记
@@ -97,8 +226,8 @@ def sop_parser(manuscript: str) -> str:
 
 应该解析为一个区块，content包含完整内容。"""
 
-        # 调用qwen-plus，开启reasoning功能
-        response = dashscope.Generation.call(
+        # 流式调用qwen-plus，开启reasoning功能；区块在输出中闭合时立即回调
+        responses = generation_stream(
             api_key=os.getenv('DASHSCOPE_API_KEY'),
             model="qwen-plus",
             messages=[
@@ -107,11 +236,19 @@ def sop_parser(manuscript: str) -> str:
             ],
             result_format='message',
             temperature=0.1,
-            enable_thinking=True  # 开启思考过程，但不参与后续处理
+            enable_thinking=True,  # 开启思考过程，但不参与后续处理
+            incremental_output=True
+        )
+
+        async def emit(block: Dict[str, Any], order: tuple):
+            await on_block(_fill_block_defaults(dict(block), order[-1]), order)
+
+        status_code, error_message, result = await collect_streamed_blocks(
+            responses, emit if on_block else None, tuple(order_prefix)
         )
         
-        if response.status_code == 200:
-            result = response.output.choices[0].message.content
+        if status_code == 200:
+            # 流结束后对完整输出做原有的解析与修复
             
             # 尝试解析JSON结果
             try:
@@ -129,14 +266,7 @@ def sop_parser(manuscript: str) -> str:
                 if 'blocks' in parsed_result and isinstance(parsed_result['blocks'], list):
                     # 确保每个区块都有必需的字段
                     for i, block in enumerate(parsed_result['blocks']):
-                        if 'id' not in block:
-                            block['id'] = f"block_{i+1}"
-                        if 'type' not in block:
-                            block['type'] = 'unknown'
-                        if 'content' not in block:
-                            block['content'] = ''
-                        if 'show_play_button' not in block:
-                            block['show_play_button'] = bool(block.get('start_time') and block.get('end_time'))
+                        _fill_block_defaults(block, i)
                     
                     return json.dumps(parsed_result, ensure_ascii=False)
                 else:
@@ -155,7 +285,7 @@ def sop_parser(manuscript: str) -> str:
                     }]
                 }, ensure_ascii=False)
         else:
-            raise Exception(f"API调用失败: {response.message}")
+            raise Exception(f"API调用失败: {error_message}")
             
     except Exception as e:
         # 发生错误时返回基本的区块结构
@@ -170,3 +300,17 @@ def sop_parser(manuscript: str) -> str:
                 "show_play_button": False
             }]
         }, ensure_ascii=False)
+
+
+@tool
+def sop_parser(manuscript: str) -> str:
+    """
+    将SOP草稿文本解析为结构化的区块数组。
+    
+    Args:
+        manuscript: 原始SOP草稿文本内容
+        
+    Returns:
+        JSON字符串，包含区块数组（结构见 sop_parser_async）
+    """
+    return run_sync(sop_parser_async(manuscript))
@@ -1,38 +1,24 @@
 import os
+import re
 import json
-from typing import List, Dict, Any
+import asyncio
+from typing import List, Dict, Any, Optional
 from langchain_core.tools import tool
 from dotenv import load_dotenv
-import dashscope
+from dashscope_client import generation_call, generation_stream, run_sync
+from stream_json import BlockCallback, collect_streamed_blocks
 
 # 加载环境变量
 load_dotenv()
 
-@tool
-def sop_refine(blocks_json: str, user_notes: str) -> str:
-    """
-    根据用户批注精修SOP区块数组。
-    
-    Args:
-        blocks_json: 区块数组的JSON字符串
-        user_notes: 用户的批注和修改建议
-        
-    Returns:
-        JSON字符串，包含精修后的区块数组，保持相同的结构：
-        - id: 唯一标识符
-        - type: 区块类型
-        - content: 精修后的文本内容
-        - start_time: 开始时间(秒，可选)
-        - end_time: 结束时间(秒，可选)  
-        - show_play_button: 是否显示播放按钮
-    """
-    try:
-        # 解析输入的区块数组
-        blocks_data = json.loads(blocks_json)
-        blocks = blocks_data.get('blocks', [])
-        
-        # 构建提示词
-        system_prompt = """你是一个专业的SOP文档精修专家。请根据用户的批注和建议，对SOP区块数组进行精修改进。
+# 目标区块占比超过该值时整篇精修（局部精修节省有限）
+SOP_REFINE_MAX_SCOPED_RATIO = float(os.getenv('SOP_REFINE_MAX_SCOPED_RATIO', '0.5'))
+# 局部精修的最大并发数
+SOP_REFINE_MAX_CONCURRENCY = int(os.getenv('SOP_REFINE_MAX_CONCURRENCY', '8'))
+# 局部精修时提供给模型的相邻区块上下文长度（字符）
+SOP_REFINE_CONTEXT_CHARS = 200
+
+REFINE_SYSTEM_PROMPT = """你是一个专业的SOP文档精修专家。请根据用户的批注和建议，对SOP区块数组进行精修改进。
 
 精修原则：
 1. 保持原有的区块结构和类型分类
@@ -56,13 +42,150 @@ def sop_refine(blocks_json: str, user_notes: str) -> str:
   ]
 }"""
 
+BLOCK_REFINE_SYSTEM_PROMPT = """你是一个专业的SOP文档精修专家。请根据用户的批注和建议，精修SOP文档中的一个区块。
+
+精修原则：
+1. 只修改待精修区块的文本内容，上下文仅供参考，不要输出上下文
+2. 根据用户批注改进文本内容，使其更加专业、准确、易读
+3. 确保技术术语的准确性和一致性，保持原有的层级结构和编号
+4. 批注中与该区块无关的要求请忽略
+
+请严格按照以下JSON格式返回精修结果：
+{"content": "精修后的文本内容"}"""
+
+# 批注涉及全文时不做局部精修
+_GLOBAL_NOTE_PATTERN = re.compile(r'全文|全部|所有|整体|整篇|通篇|每个|每一|统一|格式|whole|entire|overall|all\s+(?:blocks|steps|sections)|every', re.IGNORECASE)
+_CN_DIGITS = {'零': 0, '〇': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+_STEP_REF_PATTERN = re.compile(r'(?:第\s*([\d一二三四五六七八九十两]+)\s*步|步骤\s*([\d一二三四五六七八九十两]+)|step\s*(\d+))', re.IGNORECASE)
+_BLOCK_REF_PATTERN = re.compile(r'(?:第\s*([\d一二三四五六七八九十两]+)\s*(?:个)?区块|block\s*#?\s*(\d+))', re.IGNORECASE)
+_TIME_REF_PATTERN = re.compile(r'(\d{1,2}):(\d{2})')
+_TYPE_REF_PATTERNS = {
+    'title': re.compile(r'标题|title', re.IGNORECASE),
+    'abstract': re.compile(r'摘要|abstract|summary', re.IGNORECASE),
+    'keywords': re.compile(r'关键词|关键字|keywords?', re.IGNORECASE),
+    'materials': re.compile(r'材料|试剂|工具|设备清单|materials?|reagents?|equipment', re.IGNORECASE),
+}
+_CJK_RUN_PATTERN = re.compile(r'[一-鿿]+')
+_WORD_PATTERN = re.compile(r'[A-Za-z][A-Za-z\-]{2,}|\d+(?:\.\d+)+')
+# 批注中常见但不指向具体内容的词
+_NOTE_STOPWORDS = {'修改', '改为', '改成', '一下', '请把', '应该', '需要', '增加', '添加', '删除', '补充', '更加', '内容',
+                   '描述', '这个', '那个', '这里', '其中', '以及', '并且', '进行', '可以', '不要', '专业', '详细', '准确',
+                   'please', 'should', 'the', 'and', 'change', 'make', 'more', 'add', 'remove'}
+
+
+def _cn_to_int(value: str) -> Optional[int]:
+    """解析阿拉伯数字或一到九十九的中文数字"""
+    if value.isdigit():
+        return int(value)
+    if value == '十':
+        return 10
+    if '十' in value:
+        tens, _, ones = value.partition('十')
+        return (_CN_DIGITS.get(tens, 1) if tens else 1) * 10 + (_CN_DIGITS.get(ones, 0) if ones else 0)
+    return _CN_DIGITS.get(value)
+
+
+def _note_terms(user_notes: str) -> set:
+    """批注中的检索词：中文二元组 + 英文单词/编号"""
+    terms = set()
+    for run in _CJK_RUN_PATTERN.findall(user_notes):
+        terms.update(run[i:i + 2] for i in range(len(run) - 1))
+    terms.update(word.lower() for word in _WORD_PATTERN.findall(user_notes))
+    return {term for term in terms if term not in _NOTE_STOPWORDS}
+
+
+def select_target_blocks(blocks: List[Dict[str, Any]], user_notes: str,
+                         target_ids: Optional[List[str]] = None) -> Optional[List[int]]:
+    """
+    确定批注针对的区块下标。优先使用前端传入的区块ID，其次按批注中的步骤序号、区块类型、时间点和词语重合度匹配。
+    返回 None 表示需要整篇精修（批注涉及全文或无法定位）。
+    """
+    if target_ids:
+        wanted = set(target_ids)
+        indices = [i for i, block in enumerate(blocks) if block.get('id') in wanted]
+        return indices or None
+
+    notes = (user_notes or '').strip()
+    if not notes or _GLOBAL_NOTE_PATTERN.search(notes):
+        return None
+
+    targets = set()
+    step_indices = [i for i, block in enumerate(blocks) if block.get('type') == 'step']
+
+    for match in _STEP_REF_PATTERN.finditer(notes):
+        number = _cn_to_int(next(group for group in match.groups() if group))
+        if number and 1 <= number <= len(step_indices):
+            targets.add(step_indices[number - 1])
+    for match in _BLOCK_REF_PATTERN.finditer(notes):
+        number = _cn_to_int(next(group for group in match.groups() if group))
+        if number and 1 <= number <= len(blocks):
+            targets.add(number - 1)
+    for i, block in enumerate(blocks):
+        if block.get('id') and block['id'] in notes:
+            targets.add(i)
+    for block_type, pattern in _TYPE_REF_PATTERNS.items():
+        if pattern.search(notes):
+            targets.update(i for i, block in enumerate(blocks) if block.get('type') == block_type)
+    for match in _TIME_REF_PATTERN.finditer(notes):
+        seconds = int(match.group(1)) * 60 + int(match.group(2))
+        targets.update(
+            i for i, block in enumerate(blocks)
+            if block.get('start_time') is not None and block.get('end_time') is not None
+            and block['start_time'] <= seconds <= block['end_time']
+        )
+    if targets:
+        return sorted(targets)
+
+    # 词语重合度：选出与批注重合最多的区块
+    terms = _note_terms(notes)
+    if not terms:
+        return None
+    scores = []
+    for block in blocks:
+        content = (block.get('content') or '').lower()
+        scores.append(sum(1 for term in terms if term in content) / len(terms))
+    best = max(scores) if scores else 0
+    if best < 0.2:
+        return None
+    return [i for i, score in enumerate(scores) if score >= best * 0.6]
+
+
+def _extract_json(content: str) -> Dict[str, Any]:
+    """提取模型输出中的JSON（可能包含在```json```代码块中）"""
+    json_match = re.search(r'```(?:json)?\s*(.*?)\s*```', content, re.DOTALL)
+    return json.loads(json_match.group(1) if json_match else content)
+
+
+def _restore_fields(refined_blocks: List[Dict[str, Any]], blocks: List[Dict[str, Any]]):
+    """验证每个区块都有必需的字段，如果缺失则从原区块复制"""
+    for i, refined_block in enumerate(refined_blocks):
+        if i < len(blocks):
+            original_block = blocks[i]
+            if 'id' not in refined_block:
+                refined_block['id'] = original_block.get('id', f"block_{i+1}")
+            if 'type' not in refined_block:
+                refined_block['type'] = original_block.get('type', 'unknown')
+            if 'start_time' not in refined_block:
+                refined_block['start_time'] = original_block.get('start_time')
+            if 'end_time' not in refined_block:
+                refined_block['end_time'] = original_block.get('end_time')
+            if 'show_play_button' not in refined_block:
+                refined_block['show_play_button'] = original_block.get('show_play_button', False)
+            if 'content' not in refined_block:
+                refined_block['content'] = original_block.get('content', '')
+
+
+async def refine_blocks_full_async(blocks: List[Dict[str, Any]], user_notes: str, enable_thinking: bool = False,
+                                   on_block: Optional[BlockCallback] = None) -> Dict[str, Any]:
+    """整篇精修：发送全部区块，模型流式返回全部区块，每个区块闭合时回调 on_block"""
+    try:
         user_prompt = f"""请根据以下用户批注精修SOP区块：
 
 用户批注：
 {user_notes}
 
 原始区块数据：
-{json.dumps(blocks, ensure_ascii=False, indent=2)}
+{json.dumps(blocks, ensure_ascii=False, separators=(',', ':'))}
 
 要求：
 1. 根据用户批注改进相关内容
@@ -71,84 +194,169 @@ def sop_refine(blocks_json: str, user_notes: str) -> str:
 4. 确保精修后的内容更加专业和准确
 5. 只返回JSON格式，不要添加其他文字说明"""
 
-        # 调用qwen-plus，开启reasoning功能
-        response = dashscope.Generation.call(
+        responses = generation_stream(
             api_key=os.getenv('DASHSCOPE_API_KEY'),
             model="qwen-plus",
             messages=[
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": REFINE_SYSTEM_PROMPT},
                 {"role": "user", "content": user_prompt}
             ],
             result_format='message',
             temperature=0.3,
-            enable_thinking=True  # 开启思考过程，但不参与后续处理
+            enable_thinking=enable_thinking or None,
+            incremental_output=True
         )
-        
-        if response.status_code == 200:
-            result = response.output.choices[0].message.content
-            
-            # 尝试解析JSON结果
-            try:
-                # 提取JSON部分（可能包含在```json```代码块中）
-                import re
-                json_match = re.search(r'```json\s*(.*?)\s*```', result, re.DOTALL)
-                if json_match:
-                    json_str = json_match.group(1)
-                else:
-                    # 尝试直接解析
-                    json_str = result
-                
-                parsed_result = json.loads(json_str)
-                
-                # 验证结果格式
-                if 'blocks' in parsed_result and isinstance(parsed_result['blocks'], list):
-                    # 确保精修后的区块保持原有结构
-                    refined_blocks = parsed_result['blocks']
-                    
-                    # 验证每个区块都有必需的字段，如果缺失则从原区块复制
-                    for i, refined_block in enumerate(refined_blocks):
-                        if i < len(blocks):
-                            original_block = blocks[i]
-                            # 确保关键字段存在
-                            if 'id' not in refined_block:
-                                refined_block['id'] = original_block.get('id', f"block_{i+1}")
-                            if 'type' not in refined_block:
-                                refined_block['type'] = original_block.get('type', 'unknown')
-                            if 'start_time' not in refined_block:
-                                refined_block['start_time'] = original_block.get('start_time')
-                            if 'end_time' not in refined_block:
-                                refined_block['end_time'] = original_block.get('end_time')
-                            if 'show_play_button' not in refined_block:
-                                refined_block['show_play_button'] = original_block.get('show_play_button', False)
-                            if 'content' not in refined_block:
-                                refined_block['content'] = original_block.get('content', '')
-                    
-                    return json.dumps(parsed_result, ensure_ascii=False)
-                else:
-                    raise ValueError("精修结果格式不正确")
-                    
-            except json.JSONDecodeError as e:
-                # 如果JSON解析失败，返回原始区块（表示精修失败）
-                return json.dumps({
-                    "error": f"JSON解析失败: {str(e)}",
-                    "blocks": blocks
-                }, ensure_ascii=False)
-        else:
-            raise Exception(f"API调用失败: {response.message}")
-            
+
+        async def emit(block: Dict[str, Any], order: tuple):
+            # 逐块推送前先按位置补全原区块字段
+            refined = [dict(block)]
+            _restore_fields(refined, blocks[order[-1]:order[-1] + 1])
+            await on_block(refined[0], order)
+
+        status_code, error_message, content = await collect_streamed_blocks(responses, emit if on_block else None)
+
+        if status_code != 200:
+            return {"error": f"API调用失败: {error_message}", "blocks": blocks}
+
+        # 流结束后对完整输出做原有的解析与修复
+        try:
+            parsed_result = _extract_json(content)
+        except json.JSONDecodeError as e:
+            # 如果JSON解析失败，返回原始区块（表示精修失败）
+            return {"error": f"JSON解析失败: {str(e)}", "blocks": blocks}
+
+        if 'blocks' in parsed_result and isinstance(parsed_result['blocks'], list):
+            _restore_fields(parsed_result['blocks'], blocks)
+            return parsed_result
+        return {"error": "精修结果格式不正确", "blocks": blocks}
+
     except Exception as e:
         # 发生错误时返回原始区块
-        try:
-            blocks_data = json.loads(blocks_json)
-            return json.dumps({
-                "error": str(e),
-                "blocks": blocks_data.get('blocks', [])
-            }, ensure_ascii=False)
-        except:
-            return json.dumps({
-                "error": str(e),
-                "blocks": []
-            }, ensure_ascii=False)
+        return {"error": str(e), "blocks": blocks}
+
+
+def _context_snippet(block: Optional[Dict[str, Any]]) -> str:
+    if not block:
+        return "（无）"
+    content = block.get('content') or ''
+    if len(content) > SOP_REFINE_CONTEXT_CHARS:
+        content = content[:SOP_REFINE_CONTEXT_CHARS] + "…"
+    return content
+
+
+async def _refine_single_block(blocks: List[Dict[str, Any]], index: int, user_notes: str, enable_thinking: bool) -> str:
+    """精修单个区块，只发送该区块和相邻区块的片段作为上下文，返回精修后的内容"""
+    block = blocks[index]
+    title = next((b.get('content', '') for b in blocks if b.get('type') == 'title'), '')
+    user_prompt = f"""用户批注：
+{user_notes}
+
+文档标题：{title or '（无）'}
+上一区块（仅供参考）：{_context_snippet(blocks[index - 1] if index > 0 else None)}
+下一区块（仅供参考）：{_context_snippet(blocks[index + 1] if index + 1 < len(blocks) else None)}
+
+待精修区块（类型：{block.get('type', 'unknown')}）：
+{block.get('content', '')}
+
+只返回JSON格式，不要添加其他文字说明。"""
+
+    response = await generation_call(
+        api_key=os.getenv('DASHSCOPE_API_KEY'),
+        model="qwen-plus",
+        messages=[
+            {"role": "system", "content": BLOCK_REFINE_SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ],
+        result_format='message',
+        temperature=0.3,
+        enable_thinking=enable_thinking or None
+    )
+    if response.status_code != 200:
+        raise Exception(f"API调用失败: {response.message}")
+    parsed = _extract_json(response.output.choices[0].message.content)
+    if isinstance(parsed, dict) and isinstance(parsed.get('content'), str):
+        return parsed['content']
+    if isinstance(parsed, dict) and parsed.get('blocks'):
+        return parsed['blocks'][0].get('content', block.get('content', ''))
+    raise ValueError("精修结果格式不正确")
+
+
+async def refine_sop_blocks_async(blocks: List[Dict[str, Any]], user_notes: str,
+                                  target_ids: Optional[List[str]] = None,
+                                  enable_thinking: bool = False,
+                                  on_block: Optional[BlockCallback] = None) -> Dict[str, Any]:
+    """
+    根据用户批注精修SOP区块（异步）。
+
+    能定位到批注针对的区块时只精修这些区块（并发执行，每个区块附带最少的上下文），
+    结果合并回未修改的文档；否则整篇精修。每个区块精修完成时回调 on_block(区块, (下标,))。
+
+    Returns:
+        {"blocks": 精修后的完整区块数组, "refined_block_ids": 被精修的区块ID（仅局部精修）}，失败时包含 "error"；
+        局部精修中部分区块失败时，这些区块保持原内容，并附带 "failed_blocks"（[{"id", "error"}]）和 "warning"
+    """
+    targets = select_target_blocks(blocks, user_notes, target_ids)
+    if targets is None or (not target_ids and len(targets) > max(1, len(blocks) * SOP_REFINE_MAX_SCOPED_RATIO)):
+        return await refine_blocks_full_async(blocks, user_notes, enable_thinking, on_block)
+
+    print(f"局部精修: {len(targets)}/{len(blocks)} 个区块")
+    semaphore = asyncio.Semaphore(SOP_REFINE_MAX_CONCURRENCY)
+
+    async def refine(index: int):
+        async with semaphore:
+            content = await _refine_single_block(blocks, index, user_notes, enable_thinking)
+        if on_block:
+            await on_block({**blocks[index], "content": content}, (index,))
+        return content
+
+    results = await asyncio.gather(*(refine(i) for i in targets), return_exceptions=True)
 
+    refined_blocks = [dict(block) for block in blocks]
+    refined_ids = []
+    failed_blocks = []
+    for index, result in zip(targets, results):
+        if isinstance(result, Exception):
+            print(f"区块 {blocks[index].get('id')} 精修失败: {result}")
+            failed_blocks.append({"id": blocks[index].get('id'), "error": str(result)})
+            continue
+        refined_blocks[index]['content'] = result
+        refined_ids.append(blocks[index].get('id'))
 
+    if not refined_ids:
+        return {"error": failed_blocks[0]["error"] if failed_blocks else "精修失败", "blocks": blocks,
+                "failed_blocks": failed_blocks}
+    output = {"blocks": refined_blocks, "refined_block_ids": refined_ids}
+    if failed_blocks:
+        output["failed_blocks"] = failed_blocks
+        output["warning"] = f"{len(failed_blocks)} 个区块精修失败，已保持原内容"
+    return output
+
+
+@tool
+def sop_refine(blocks_json: str, user_notes: str) -> str:
+    """
+    根据用户批注精修SOP区块数组。
+
+    Args:
+        blocks_json: 区块数组的JSON字符串
+        user_notes: 用户的批注和修改建议
+
+    Returns:
+        JSON字符串，包含精修后的区块数组，保持相同的结构：
+        - id: 唯一标识符
+        - type: 区块类型
+        - content: 精修后的文本内容
+        - start_time: 开始时间(秒，可选)
+        - end_time: 结束时间(秒，可选)
+        - show_play_button: 是否显示播放按钮
+    """
+    try:
+        # 解析输入的区块数组
+        blocks_data = json.loads(blocks_json)
+        blocks = blocks_data.get('blocks', [])
+    except Exception as e:
+        return json.dumps({"error": str(e), "blocks": []}, ensure_ascii=False)
 
+    # 开启思考过程，但不参与后续处理
+    result = run_sync(refine_sop_blocks_async(blocks, user_notes, enable_thinking=True))
+    return json.dumps(result, ensure_ascii=False)
@@ -0,0 +1,294 @@
+"""
+基于规则的SOP草稿解析器：用预编译正则识别标题、摘要、关键词、材料清单、步骤标题、子步骤和时间范围，
+输出与 sop_parser 一致的区块数组，并给出置信度。置信度低或存在无法归类的内容时由调用方回退到大模型。
+"""
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# 区块类型（与前端 SOPBlock.type 一致，其他类型一律按 unknown 处理）
+BLOCK_TYPES = ('title', 'abstract', 'keywords', 'materials', 'step', 'unknown')
+
+# ---------- 时间范围 ----------
+
+_TIME = r'(\d{1,2}:\d{2}(?::\d{2})?)'
+_DASH = r'\s*(?:-|–|—|~|～|至|到|to)\s*'
+# (0:05 - 0:08) / （00:05-00:08） / [0:05-0:08] / 0:05-0:08 / 时间范围：0:03 - 0:21
+TIME_RANGE_PATTERN = re.compile(
+    r'(?:(?:时间范围|时间|time(?:\s*range)?)\s*[:：]\s*)?'
+    r'[(（\[【]?\s*' + _TIME + _DASH + _TIME + r'\s*[)）\]】]?',
+    re.IGNORECASE
+)
+# 整行只有时间范围（可带前缀），用于判断时间戳独占一行
+TIME_ONLY_LINE_PATTERN = re.compile(r'^\s*' + TIME_RANGE_PATTERN.pattern + r'\s*[。.;；,，]?\s*$', re.IGNORECASE)
+
+# ---------- 章节标题 ----------
+
+_SEP = r'\s*(?:[:：]|$)\s*'
+SECTION_PATTERNS: List[Tuple[str, re.Pattern]] = [
+    ('title', re.compile(r'^(?:sop\s*)?(?:标题|题目|title)' + _SEP + r'(.*)$', re.IGNORECASE)),
+    ('abstract', re.compile(r'^(?:摘要|概述|简介|abstract|summary|overview)' + _SEP + r'(.*)$', re.IGNORECASE)),
+    ('keywords', re.compile(r'^(?:关键词|关键字|key\s*words?)' + _SEP + r'(.*)$', re.IGNORECASE)),
+    ('materials', re.compile(
+        r'^(?:[一-龥、/]{0,8}(?:材料|试剂|工具|设备|仪器)[一-龥、/]{0,8}(?:清单|列表)?'
+        r'|(?:materials?|reagents?|tools?|equipment)[\w\s,/&]{0,40}(?:list)?)' + _SEP + r'(.*)$',
+        re.IGNORECASE
+    )),
+    ('steps', re.compile(r'^(?:标准)?(?:操作步骤|操作流程|实验步骤|步骤|(?:operation\s+|operating\s+)?(?:steps|procedures?))' + _SEP + r'(.*)$', re.IGNORECASE)),
+    ('question', re.compile(
+        r'^(?:问题澄清|待澄清(?:的)?问题|澄清问题|需要澄清的问题|问题|(?:clarification\s+)?questions?(?:\s+for\s+clarification)?|clarifications?)'
+        + _SEP + r'(.*)$',
+        re.IGNORECASE
+    )),
+]
+# 其他可识别的段落标题（"注意事项：" 等），作为 unknown 区块但视为已识别
+OTHER_SECTION_PATTERN = re.compile(r'^[一-龥A-Za-z][一-龥A-Za-z\s/、]{0,15}[:：]\s*$')
+
+# ---------- 步骤 ----------
+
+_CN_NUM = r'[一二三四五六七八九十百零〇两\d]+'
+# 第一步：xxx / 步骤1：xxx / Step 1: xxx / 1. xxx / 一、xxx / 目的：xxx
+STEP_HEADING_PATTERN = re.compile(
+    r'^(?:第' + _CN_NUM + r'步|步骤\s*' + _CN_NUM + r'|step\s*\d+'
+    r'|\d{1,3}\s*[.、)）](?!\d)|[一二三四五六七八九十]+\s*[、.]'
+    r'|(?:目的|purpose)\s*(?:\d+\s*)?[:：])',
+    re.IGNORECASE
+)
+# 1.1 xxx / - xxx / • xxx / (1) xxx / a) xxx / 操作：xxx
+SUB_STEP_PATTERN = re.compile(
+    r'^(?:\d{1,3}(?:\.\d{1,3})+\s*[.、)）]?|[-•*·●▪]\s*|[(（]\d{1,3}[)）]|[a-z][.)]\s'
+    r'|(?:操作|operations?|actions?)\s*(?:\d+\s*)?[:：])',
+    re.IGNORECASE
+)
+
+_MARKDOWN_PATTERN = re.compile(r'^\s*(?:#{1,6}\s+|>\s*)|\*\*|__')
+
+# 置信度低于该值时整体回退到大模型
+DEFAULT_MIN_CONFIDENCE = 0.6
+
+
+def time_to_seconds(value: str) -> int:
+    """将 m:ss / mm:ss / h:mm:ss 转换为秒数"""
+    parts = [int(p) for p in value.split(':')]
+    seconds = 0
+    for part in parts:
+        seconds = seconds * 60 + part
+    return seconds
+
+
+def extract_time_range(text: str) -> Tuple[Optional[int], Optional[int], str]:
+    """提取文本中的第一个时间范围，返回 (开始秒, 结束秒, 去掉时间戳后的文本)"""
+    match = TIME_RANGE_PATTERN.search(text)
+    if not match:
+        return None, None, text
+    start, end = time_to_seconds(match.group(1)), time_to_seconds(match.group(2))
+    if end < start:
+        return None, None, text
+    stripped = (text[:match.start()] + text[match.end():]).strip()
+    stripped = re.sub(r'\s{2,}', ' ', stripped).strip(' ,，;；')
+    return start, end, stripped
+
+
+def _clean_line(line: str) -> str:
+    return _MARKDOWN_PATTERN.sub('', line).rstrip()
+
+
+def _match_section(line: str) -> Tuple[Optional[str], str]:
+    """识别章节标题行，返回 (区块类型, 标题后的同行内容)"""
+    for block_type, pattern in SECTION_PATTERNS:
+        match = pattern.match(line)
+        if match:
+            return block_type, match.group(1).strip()
+    return None, ''
+
+
+class _Block:
+    __slots__ = ('type', 'lines', 'start_time', 'end_time', 'recognized')
+
+    def __init__(self, block_type: str, recognized: bool = True):
+        self.type = block_type
+        self.lines: List[str] = []
+        self.start_time: Optional[int] = None
+        self.end_time: Optional[int] = None
+        self.recognized = recognized
+
+    def set_time(self, start: Optional[int], end: Optional[int]):
+        if start is None:
+            return
+        if self.start_time is None:
+            self.start_time, self.end_time = start, end
+        else:
+            # 多个时间戳时取整体范围
+            self.start_time = min(self.start_time, start)
+            self.end_time = max(self.end_time, end)
+
+    def to_dict(self) -> Dict[str, Any]:
+        has_time = self.start_time is not None and self.end_time is not None
+        return {
+            "type": self.type,
+            "content": "\n".join(self.lines).strip(),
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "show_play_button": has_time
+        }
+
+
+def parse_sop_rules(manuscript: str) -> Dict[str, Any]:
+    """
+    使用规则解析SOP草稿。
+
+    Returns:
+        {
+            "blocks": 区块数组（字段与 sop_parser 一致，id 为 block_N）,
+            "confidence": 0~1，已识别内容占全文的比例（未识别到步骤时减半）,
+            "unclassified": 无法归类的区块下标列表
+        }
+    """
+    blocks: List[_Block] = []
+    current: Optional[_Block] = None
+    section: Optional[str] = None
+    pending_time: Tuple[Optional[int], Optional[int]] = (None, None)
+
+    def start_block(block_type: str, recognized: bool = True) -> _Block:
+        block = _Block(block_type, recognized)
+        blocks.append(block)
+        return block
+
+    for raw_line in (manuscript or '').splitlines():
+        line = _clean_line(raw_line)
+        stripped = line.strip()
+        if not stripped:
+            continue
+
+        # 独占一行的时间戳：当前步骤没有时间则属于当前步骤（时间戳在末尾），否则属于下一个步骤
+        if TIME_ONLY_LINE_PATTERN.match(stripped):
+            start, end, _ = extract_time_range(stripped)
+            if current is not None and current.type == 'step' and current.start_time is None:
+                current.set_time(start, end)
+            else:
+                pending_time = (start, end)
+            continue
+
+        block_type, rest = _match_section(stripped)
+        if block_type == 'steps':
+            section = 'steps'
+            current = None
+            if rest:
+                current = start_block('step')
+                start, end, rest = extract_time_range(rest)
+                current.set_time(start, end)
+                current.lines.append(rest)
+            continue
+        if block_type == 'question':
+            # 问题澄清不是独立的区块类型，作为 unknown 区块保留原标题
+            section = 'question'
+            current = start_block('unknown')
+            current.lines.append(stripped)
+            continue
+        if block_type is not None:
+            section = block_type
+            current = start_block(block_type)
+            if rest:
+                current.lines.append(rest)
+                # 标题只占一行
+                if block_type == 'title':
+                    current = None
+            continue
+
+        if OTHER_SECTION_PATTERN.match(stripped) and not STEP_HEADING_PATTERN.match(stripped) \
+                and not SUB_STEP_PATTERN.match(stripped):
+            section = 'other'
+            current = start_block('unknown', recognized=True)
+            current.lines.append(stripped)
+            continue
+
+        if section == 'steps' or (section is None and STEP_HEADING_PATTERN.match(stripped) and TIME_RANGE_PATTERN.search(stripped)):
+            section = 'steps'
+            start, end, text = extract_time_range(stripped)
+            # 步骤标题：编号/"第N步"/"目的："开头，或以时间范围开头的行（"(00:05-00:08) 准备样品"）
+            is_heading = (bool(STEP_HEADING_PATTERN.match(stripped)) and not SUB_STEP_PATTERN.match(stripped)) or \
+                (start is not None and bool(TIME_RANGE_PATTERN.match(stripped)))
+            if is_heading or current is None or current.type != 'step':
+                current = start_block('step', recognized=is_heading or bool(SUB_STEP_PATTERN.match(stripped)))
+                if pending_time[0] is not None:
+                    current.set_time(*pending_time)
+                    pending_time = (None, None)
+            if start is not None:
+                current.set_time(start, end)
+                current.lines.append(text)
+            else:
+                current.lines.append(stripped)
+            continue
+
+        if current is None:
+            # 文档开头、没有标题前缀的短行视为标题
+            if not blocks and len(stripped) <= 60 and not stripped.endswith(('。', '.', '；', ';')):
+                current = start_block('title')
+                current.lines.append(stripped)
+                current = None
+                continue
+            current = start_block('unknown', recognized=False)
+        current.lines.append(stripped)
+        if current.type == 'title':
+            current = None
+
+    results = [b for b in blocks if b.lines and "\n".join(b.lines).strip()]
+
+    total_chars = sum(len(line) for b in results for line in b.lines) or 1
+    recognized_chars = sum(len(line) for b in results if b.recognized for line in b.lines)
+    confidence = recognized_chars / total_chars
+    if not any(b.type == 'step' for b in results):
+        confidence *= 0.5
+    if not results:
+        confidence = 0.0
+
+    output = []
+    unclassified = []
+    for i, block in enumerate(results):
+        output.append({"id": f"block_{i + 1}", **block.to_dict()})
+        if not block.recognized:
+            unclassified.append(i)
+
+    return {
+        "blocks": output,
+        "confidence": round(confidence, 3),
+        "unclassified": unclassified
+    }
+
+
+def split_manuscript(manuscript: str, max_chars: int) -> List[str]:
+    """
+    在顶层边界（章节标题、步骤标题）处将草稿切分为不超过 max_chars 的若干片段，保持原文顺序。
+    单个章节或步骤超过 max_chars 时不再细分。
+    """
+    lines = (manuscript or '').splitlines()
+    segments: List[List[str]] = [[]]
+    section: Optional[str] = None
+    for raw_line in lines:
+        stripped = _clean_line(raw_line).strip()
+        boundary = False
+        if stripped:
+            block_type, _ = _match_section(stripped)
+            if block_type is not None:
+                section = block_type
+                boundary = True
+            elif section == 'steps' and not SUB_STEP_PATTERN.match(stripped) and (
+                    STEP_HEADING_PATTERN.match(stripped) or TIME_RANGE_PATTERN.match(stripped)):
+                boundary = True
+        if boundary and any(line.strip() for line in segments[-1]):
+            segments.append([])
+        segments[-1].append(raw_line)
+
+    chunks: List[str] = []
+    current: List[str] = []
+    current_len = 0
+    for segment in segments:
+        text = "\n".join(segment)
+        if current and current_len + len(text) + 1 > max_chars:
+            chunks.append("\n".join(current))
+            current, current_len = [], 0
+        current.append(text)
+        current_len += len(text) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
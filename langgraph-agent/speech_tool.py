@@ -1,12 +1,16 @@
 import json
 import os
 import re
+import shutil
+import tempfile
 import requests
 from typing import List, Dict, Any, Optional
 from http import HTTPStatus
 import dashscope
 from dashscope.audio.asr import Transcription, VocabularyService
 from dotenv import load_dotenv
+from audio_extractor import split_audio_into_chunks
+from oss_manager import upload_file_to_oss
 
 # 加载环境变量
 load_dotenv()
@@ -30,6 +34,134 @@ def detect_language(word: str) -> str:
     return 'en'
 
 
+def create_vocabulary(service: VocabularyService, vocabulary: Optional[List[str]]) -> Optional[str]:
+    """
+    根据易错词列表创建 Paraformer 易错词表
+    
+    Args:
+        service: VocabularyService 实例
+        vocabulary: 易错词列表，每行一个词
+        
+    Returns:
+        易错词表 ID；未提供易错词或创建失败时返回 None
+    """
+    if not vocabulary:
+        return None
+    
+    # 过滤空词，构建易错词表数据
+    vocabulary_data = []
+    for word in vocabulary:
+        word = word.strip()
+        if word:  # 只处理非空词
+            vocabulary_data.append({
+                "text": word,
+                "weight": 3,  # 默认权重为3
+                "lang": detect_language(word)  # 自动识别语言
+            })
+    
+    if not vocabulary_data:
+        return None
+    
+    try:
+        vocabulary_id = service.create_vocabulary(
+            prefix="video2sop",  # 自定义前缀
+            target_model="paraformer-v2",  # 目标模型
+            vocabulary=vocabulary_data
+        )
+        print(f"易错词表创建成功，ID: {vocabulary_id}")
+        return vocabulary_id
+    except Exception as e:
+        print(f"创建易错词表失败: {e}，继续使用无易错词表的识别")
+        return None
+
+
+def delete_vocabulary(service: VocabularyService, vocabulary_id: Optional[str]):
+    """删除易错词表（失败不影响识别结果）"""
+    if not vocabulary_id:
+        return
+    try:
+        service.delete_vocabulary(vocabulary_id)
+        print(f"易错词表已删除: {vocabulary_id}")
+    except Exception as e:
+        print(f"删除易错词表失败: {e}，但不影响识别结果")
+
+
+def transcribe_file(file_url: str, vocabulary_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    提交单个音频文件的 Paraformer-V2 转录任务并等待完成。
+    
+    Args:
+        file_url: 音频文件的公开访问 URL
+        vocabulary_id: 易错词表 ID（可选）
+        
+    Returns:
+        成功时返回 {"sentences": [...]}，失败时返回 {"error": "..."}
+    """
+    # 调用 Paraformer-V2 API 进行异步转录
+    # 构建调用参数
+    call_kwargs = {
+        'model': 'paraformer-v2',
+        'file_urls': [file_url]
+    }
+    # 使用 vocabulary_id 作为直接参数（测试发现比 phrase_id 更可靠）
+    if vocabulary_id:
+        call_kwargs['vocabulary_id'] = vocabulary_id
+    
+    task_response = Transcription.async_call(**call_kwargs)
+    
+    # 检查响应是否有效
+    if not task_response:
+        return {"error": "转录任务提交失败：响应为空"}
+    
+    if task_response.status_code != HTTPStatus.OK:
+        return {
+            "error": f"转录任务提交失败，状态码: {task_response.status_code}, 消息: {getattr(task_response, 'message', '未知错误')}"
+        }
+    
+    if not task_response.output or not hasattr(task_response.output, 'task_id'):
+        return {"error": f"转录任务提交失败：响应中缺少 task_id，响应: {task_response}"}
+    
+    task_id = task_response.output.task_id
+    if not task_id:
+        return {"error": "转录任务提交失败：task_id 为空"}
+    
+    # 等待转录任务完成
+    transcribe_response = Transcription.wait(task=task_id)
+    
+    if transcribe_response.status_code != HTTPStatus.OK:
+        return {"error": f"转录任务失败，状态码: {transcribe_response.status_code}"}
+    
+    # 处理转录结果
+    sentences = []
+    
+    for result in transcribe_response.output.results:
+        if result.get("subtask_status") == "SUCCEEDED":
+            try:
+                # 从 transcription_url 下载 JSON 文件
+                response = requests.get(result.get("transcription_url"))
+                response.raise_for_status()
+                transcription_data = response.json()
+                
+                # 提取 sentences 字段
+                for transcript in transcription_data.get("transcripts", []):
+                    for sentence in transcript.get("sentences", []):
+                        sentences.append({
+                            "sentence_id": sentence.get('sentence_id', 0),
+                            "text": sentence.get('text', ''),
+                            "begin_time": sentence.get('begin_time', 0),
+                            "end_time": sentence.get('end_time', 0)
+                        })
+                        
+            except requests.RequestException as e:
+                return {"error": f"下载转录结果失败: {str(e)}"}
+            except json.JSONDecodeError as e:
+                return {"error": f"解析转录结果失败: {str(e)}"}
+        else:
+            return {"error": f"音频文件转录失败: {result.get('file_url', 'N/A')}"}
+    
+    return {"sentences": sentences}
+
+
 def speech_recognition(file_url: str, vocabulary: Optional[List[str]] = None) -> str:
     """
     使用 Paraformer-V2 模型转录音频文件。
@@ -46,128 +178,166 @@ def speech_recognition(file_url: str, vocabulary: Optional[List[str]] = None) ->
     
     try:
         # 创建易错词表（如果提供了易错词）
-        if vocabulary and len(vocabulary) > 0:
-            # 过滤空词，构建易错词表数据
-            vocabulary_data = []
-            for word in vocabulary:
-                word = word.strip()
-                if word:  # 只处理非空词
-                    vocabulary_data.append({
-                        "text": word,
-                        "weight": 3,  # 默认权重为3
-                        "lang": detect_language(word)  # 自动识别语言
-                    })
-            
-            if vocabulary_data:
-                try:
-                    vocabulary_id = service.create_vocabulary(
-                        prefix="video2sop",  # 自定义前缀
-                        target_model="paraformer-v2",  # 目标模型
-                        vocabulary=vocabulary_data
-                    )
-                    print(f"易错词表创建成功，ID: {vocabulary_id}")
-                except Exception as e:
-                    print(f"创建易错词表失败: {e}，继续使用无易错词表的识别")
-                    vocabulary_id = None
+        vocabulary_id = create_vocabulary(service, vocabulary)
         
-        # 调用 Paraformer-V2 API 进行异步转录
-        # 构建调用参数
-        call_kwargs = {
-            'model': 'paraformer-v2',
-            'file_urls': [file_url]
-        }
-        # 使用 vocabulary_id 作为直接参数（测试发现比 phrase_id 更可靠）
-        if vocabulary_id:
-            call_kwargs['vocabulary_id'] = vocabulary_id
-        
-        task_response = Transcription.async_call(**call_kwargs)
-        
-        # 检查响应是否有效
-        if not task_response:
-            return json.dumps({
-                "error": "转录任务提交失败：响应为空"
-            })
+        result = transcribe_file(file_url, vocabulary_id)
+        if "error" in result:
+            return json.dumps(result)
         
-        if task_response.status_code != HTTPStatus.OK:
-            return json.dumps({
-                "error": f"转录任务提交失败，状态码: {task_response.status_code}, 消息: {getattr(task_response, 'message', '未知错误')}"
-            })
-        
-        if not task_response.output or not hasattr(task_response.output, 'task_id'):
-            return json.dumps({
-                "error": f"转录任务提交失败：响应中缺少 task_id，响应: {task_response}"
-            })
-        
-        task_id = task_response.output.task_id
-        if not task_id:
-            return json.dumps({
-                "error": "转录任务提交失败：task_id 为空"
-            })
-        
-        # 等待转录任务完成
-        transcribe_response = Transcription.wait(task=task_id)
-        
-        if transcribe_response.status_code != HTTPStatus.OK:
-            return json.dumps({
-                "error": f"转录任务失败，状态码: {transcribe_response.status_code}"
-            })
+        # 返回仅包含 sentences 的 JSON
+        return json.dumps(result["sentences"])
         
-        # 处理转录结果
-        sentences = []
+    except Exception as e:
+        return json.dumps({
+            "error": f"语音识别处理异常: {str(e)}"
+        })
+    finally:
+        # 在转录完成后删除易错词表（确保转录任务已经完成，不再需要易错词表）
+        delete_vocabulary(service, vocabulary_id)
+
+
+def plan_audio_chunks(duration_sec: float, chunk_seconds: int = 300, overlap_seconds: int = 10) -> List[Dict]:
+    """
+    规划增量识别的音频分块。
+    
+    相邻分块重叠 overlap_seconds 秒，避免句子在切点处被截断；每个分块只"拥有"
+    [keep_from, keep_until) 范围内的句子（以重叠区中点为界），
+    因此各分块的识别结果可以独立推送给前端而不会重复。
+    
+    Args:
+        duration_sec: 音频总时长（秒）
+        chunk_seconds: 每个分块时长（秒）
+        overlap_seconds: 相邻分块重叠（秒）
         
-        for result in transcribe_response.output.results:
-            if result.get("subtask_status") == "SUCCEEDED":
-                try:
-                    # 从 transcription_url 下载 JSON 文件
-                    response = requests.get(result.get("transcription_url"))
-                    response.raise_for_status()
-                    transcription_data = response.json()
-                    
-                    # 提取 sentences 字段
-                    for transcript in transcription_data.get("transcripts", []):
-                        for sentence in transcript.get("sentences", []):
-                            sentences.append({
-                                "sentence_id": sentence.get('sentence_id', 0),
-                                "text": sentence.get('text', ''),
-                                "begin_time": sentence.get('begin_time', 0),
-                                "end_time": sentence.get('end_time', 0)
-                            })
-                            
-                except requests.RequestException as e:
-                    return json.dumps({
-                        "error": f"下载转录结果失败: {str(e)}"
-                    })
-                except json.JSONDecodeError as e:
-                    return json.dumps({
-                        "error": f"解析转录结果失败: {str(e)}"
-                    })
-            else:
-                return json.dumps({
-                    "error": f"音频文件转录失败: {result.get('file_url', 'N/A')}"
-                })
+    Returns:
+        [{chunk_index, start_time, end_time, keep_from, keep_until}]，
+        start_time/end_time 单位为秒，keep_from/keep_until 单位为毫秒（与句子时间一致）
+    
+    Raises:
+        ValueError: chunk_seconds <= 0，或 overlap_seconds 不在 [0, chunk_seconds) 内
+    """
+    if chunk_seconds <= 0 or not 0 <= overlap_seconds < chunk_seconds:
+        raise ValueError(f"分块参数无效: chunk_seconds={chunk_seconds}, overlap_seconds={overlap_seconds}")
+    chunk_seconds = max(1, int(chunk_seconds))
+    overlap_seconds = max(0, min(int(overlap_seconds), chunk_seconds // 2))
+    
+    chunks: List[Dict] = []
+    start = 0
+    index = 0
+    while start < duration_sec:
+        end = min(start + chunk_seconds, duration_sec)
+        chunks.append({
+            "chunk_index": index,
+            "start_time": start,
+            "end_time": end
+        })
+        if end >= duration_sec:
+            break
+        start = end - overlap_seconds
+        index += 1
+    
+    for i, chunk in enumerate(chunks):
+        if i == 0:
+            chunk["keep_from"] = 0
+        else:
+            chunk["keep_from"] = chunks[i - 1]["keep_until"]
+        if i == len(chunks) - 1:
+            chunk["keep_until"] = None  # 最后一块保留到结尾
+        else:
+            chunk["keep_until"] = int((chunk["end_time"] - overlap_seconds / 2) * 1000)
+    
+    return chunks
+
+
+def select_chunk_sentences(sentences: List[Dict], chunk: Dict) -> List[Dict]:
+    """
+    将分块内的句子时间换算为整段音频的绝对时间，并只保留该分块拥有的句子。
+    
+    Args:
+        sentences: 分块转录得到的句子（时间相对分块起点，毫秒）
+        chunk: plan_audio_chunks 返回的分块信息
         
-        # 返回仅包含 sentences 的 JSON
-        result = json.dumps(sentences)
+    Returns:
+        绝对时间的句子列表
+    """
+    offset_ms = int(chunk["start_time"] * 1000)
+    selected = []
+    for sentence in sentences:
+        begin_time = sentence.get("begin_time", 0) + offset_ms
+        end_time = sentence.get("end_time", 0) + offset_ms
+        midpoint = (begin_time + end_time) / 2
+        if midpoint < chunk["keep_from"]:
+            continue
+        if chunk["keep_until"] is not None and midpoint >= chunk["keep_until"]:
+            continue
+        selected.append({
+            "sentence_id": sentence.get("sentence_id", 0),
+            "text": sentence.get("text", ""),
+            "begin_time": begin_time,
+            "end_time": end_time
+        })
+    return selected
+
+
+def merge_chunk_sentences(batches: List[List[Dict]], tolerance_ms: int = 1000) -> List[Dict]:
+    """
+    合并各分块的句子：按时间排序，去除重叠区重复识别的句子，并重新编号 sentence_id。
+    
+    Args:
+        batches: 各分块经 select_chunk_sentences 处理后的句子列表
+        tolerance_ms: 文本相同且起始时间相差不超过该值的句子视为重复
         
-        # 在转录完成后删除易错词表（确保转录任务已经完成，不再需要易错词表）
-        if vocabulary_id:
-            try:
-                service.delete_vocabulary(vocabulary_id)
-                print(f"易错词表已删除: {vocabulary_id}")
-            except Exception as e:
-                print(f"删除易错词表失败: {e}，但不影响识别结果")
+    Returns:
+        合并后的句子列表
+    """
+    all_sentences = sorted(
+        (sentence for batch in batches for sentence in batch),
+        key=lambda s: (s["begin_time"], s["end_time"])
+    )
+    
+    merged: List[Dict] = []
+    for sentence in all_sentences:
+        text = sentence.get("text", "").strip()
+        if not text:
+            continue
+        if merged:
+            last = merged[-1]
+            if last["text"].strip() == text and abs(sentence["begin_time"] - last["begin_time"]) <= tolerance_ms:
+                continue
+        merged.append(dict(sentence))
+    
+    for i, sentence in enumerate(merged, start=1):
+        sentence["sentence_id"] = i
+    
+    return merged
+
+
+def prepare_audio_chunks(audio_url: str, client_session_id: str, chunks: List[Dict]) -> List[Dict]:
+    """
+    下载完整音频，按分块规划切分并上传到OSS。
+    
+    Args:
+        audio_url: 完整音频的公开访问 URL
+        client_session_id: 会话ID，用于确定OSS路径
+        chunks: plan_audio_chunks 返回的分块信息
         
-        return result
+    Returns:
+        在分块信息基础上增加 url 字段的列表
+    """
+    temp_dir = tempfile.mkdtemp(prefix="speech_chunks_")
+    try:
+        audio_path = os.path.join(temp_dir, "full_audio.mp3")
+        response = requests.get(audio_url, timeout=300)
+        response.raise_for_status()
+        with open(audio_path, 'wb') as f:
+            f.write(response.content)
         
-    except Exception as e:
-        # 如果发生错误，也要尝试删除易错词表
-        if vocabulary_id:
-            try:
-                service.delete_vocabulary(vocabulary_id)
-                print(f"发生错误后删除易错词表: {vocabulary_id}")
-            except Exception as del_e:
-                print(f"删除易错词表失败: {del_e}")
+        chunk_paths = split_audio_into_chunks(audio_path, chunks, temp_dir)
         
-        return json.dumps({
-            "error": f"语音识别处理异常: {str(e)}"
-        })
+        prepared = []
+        for chunk, chunk_path in zip(chunks, chunk_paths):
+            oss_key = f"{client_session_id}/audio/chunks/chunk_{chunk['chunk_index']:03d}.mp3"
+            prepared.append({**chunk, "url": upload_file_to_oss(chunk_path, oss_key)})
+        return prepared
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
@@ -0,0 +1,390 @@
+"""
+共享状态后端：会话、视频保留标记、断连计时与压缩取消标志等协调状态的存储，多个 uvicorn worker 通过共享后端看到同一份状态。
+
+- memory：进程内字典（默认，单 worker），值按原样保存，不做序列化
+- sqlite：SQLite（WAL 模式）文件，同一台机器上的多个 worker 共享
+- redis：Redis 协议服务（Redis / KeyDB / Valkey 等），需安装 redis 包，可跨机器共享
+
+状态按命名空间组织为键值表（值须可 JSON 序列化）与集合；SharedDict / SharedSet 提供与 dict / set 相同的用法，
+共享后端下读取得到的是副本，修改后需重新赋值写回。
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections.abc import MutableMapping, MutableSet
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# 状态后端类型：memory / sqlite / redis
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')
+# SQLite 后端数据库路径
+STATE_SQLITE_PATH = os.getenv('STATE_SQLITE_PATH', '/root/video2sop/temp/state.db')
+# Redis 后端地址与键前缀
+STATE_REDIS_URL = os.getenv('STATE_REDIS_URL', 'redis://localhost:6379/0')
+STATE_REDIS_PREFIX = os.getenv('STATE_REDIS_PREFIX', 'video2sop')
+# 共享取消标志的最短重新读取间隔（秒），压缩循环每帧检查标志，避免每帧访问后端
+CANCEL_FLAG_POLL_SECONDS = float(os.getenv('CANCEL_FLAG_POLL_SECONDS', '0.5'))
+
+
+class StateBackend(ABC):
+    """状态后端接口"""
+
+    # 是否跨进程共享（共享后端的值经过 JSON 序列化）
+    shared = True
+
+    @abstractmethod
+    def get(self, ns: str, key: str, default: Any = None) -> Any:
+        ...
+
+    @abstractmethod
+    def set(self, ns: str, key: str, value: Any):
+        ...
+
+    @abstractmethod
+    def delete(self, ns: str, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    def contains(self, ns: str, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    def items(self, ns: str) -> List[Tuple[str, Any]]:
+        ...
+
+    @abstractmethod
+    def count(self, ns: str) -> int:
+        ...
+
+    @abstractmethod
+    def sadd(self, ns: str, member: str):
+        ...
+
+    @abstractmethod
+    def srem(self, ns: str, member: str) -> bool:
+        ...
+
+    @abstractmethod
+    def sismember(self, ns: str, member: str) -> bool:
+        ...
+
+    @abstractmethod
+    def smembers(self, ns: str) -> List[str]:
+        ...
+
+    def close(self):
+        pass
+
+
+class MemoryStateBackend(StateBackend):
+    """进程内状态（单 worker）"""
+
+    shared = False
+
+    def __init__(self):
+        self._maps: Dict[str, Dict[str, Any]] = {}
+        self._sets: Dict[str, set] = {}
+
+    def get(self, ns, key, default=None):
+        return self._maps.get(ns, {}).get(key, default)
+
+    def set(self, ns, key, value):
+        self._maps.setdefault(ns, {})[key] = value
+
+    def delete(self, ns, key):
+        return self._maps.get(ns, {}).pop(key, _MISSING) is not _MISSING
+
+    def contains(self, ns, key):
+        return key in self._maps.get(ns, {})
+
+    def items(self, ns):
+        return list(self._maps.get(ns, {}).items())
+
+    def count(self, ns):
+        return len(self._maps.get(ns, {}))
+
+    def sadd(self, ns, member):
+        self._sets.setdefault(ns, set()).add(member)
+
+    def srem(self, ns, member):
+        members = self._sets.get(ns, set())
+        if member in members:
+            members.remove(member)
+            return True
+        return False
+
+    def sismember(self, ns, member):
+        return member in self._sets.get(ns, set())
+
+    def smembers(self, ns):
+        return list(self._sets.get(ns, set()))
+
+
+_MISSING = object()
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS state_kv (
+    ns TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (ns, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS state_set (
+    ns TEXT NOT NULL,
+    member TEXT NOT NULL,
+    PRIMARY KEY (ns, member)
+) WITHOUT ROWID;
+"""
+
+
+class SQLiteStateBackend(StateBackend):
+    """SQLite（WAL 模式）状态：同机多进程共享，每个线程使用独立连接"""
+
+    def __init__(self, path: str = STATE_SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._conn().executescript(_SQLITE_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def get(self, ns, key, default=None):
+        row = self._conn().execute("SELECT value FROM state_kv WHERE ns=? AND key=?", (ns, key)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, ns, key, value):
+        self._conn().execute("INSERT OR REPLACE INTO state_kv (ns, key, value) VALUES (?, ?, ?)",
+                             (ns, key, json.dumps(value, ensure_ascii=False)))
+
+    def delete(self, ns, key):
+        return self._conn().execute("DELETE FROM state_kv WHERE ns=? AND key=?", (ns, key)).rowcount > 0
+
+    def contains(self, ns, key):
+        return self._conn().execute("SELECT 1 FROM state_kv WHERE ns=? AND key=?", (ns, key)).fetchone() is not None
+
+    def items(self, ns):
+        rows = self._conn().execute("SELECT key, value FROM state_kv WHERE ns=?", (ns,)).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def count(self, ns):
+        return self._conn().execute("SELECT COUNT(*) FROM state_kv WHERE ns=?", (ns,)).fetchone()[0]
+
+    def sadd(self, ns, member):
+        self._conn().execute("INSERT OR IGNORE INTO state_set (ns, member) VALUES (?, ?)", (ns, member))
+
+    def srem(self, ns, member):
+        return self._conn().execute("DELETE FROM state_set WHERE ns=? AND member=?", (ns, member)).rowcount > 0
+
+    def sismember(self, ns, member):
+        return self._conn().execute(
+            "SELECT 1 FROM state_set WHERE ns=? AND member=?", (ns, member)).fetchone() is not None
+
+    def smembers(self, ns):
+        return [row[0] for row in self._conn().execute("SELECT member FROM state_set WHERE ns=?", (ns,))]
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+
+class RedisStateBackend(StateBackend):
+    """Redis 协议服务上的状态：键值表对应 hash，集合对应 set"""
+
+    def __init__(self, url: str = STATE_REDIS_URL, prefix: str = STATE_REDIS_PREFIX, client=None):
+        if client is None:
+            import redis  # 可选依赖，仅使用 redis 后端时需要
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, ns: str) -> str:
+        return f"{self.prefix}:{ns}"
+
+    def get(self, ns, key, default=None):
+        value = self.client.hget(self._key(ns), key)
+        return json.loads(value) if value is not None else default
+
+    def set(self, ns, key, value):
+        self.client.hset(self._key(ns), key, json.dumps(value, ensure_ascii=False))
+
+    def delete(self, ns, key):
+        return bool(self.client.hdel(self._key(ns), key))
+
+    def contains(self, ns, key):
+        return bool(self.client.hexists(self._key(ns), key))
+
+    def items(self, ns):
+        return [(key, json.loads(value)) for key, value in self.client.hgetall(self._key(ns)).items()]
+
+    def count(self, ns):
+        return self.client.hlen(self._key(ns))
+
+    def sadd(self, ns, member):
+        self.client.sadd(self._key(f"set:{ns}"), member)
+
+    def srem(self, ns, member):
+        return bool(self.client.srem(self._key(f"set:{ns}"), member))
+
+    def sismember(self, ns, member):
+        return bool(self.client.sismember(self._key(f"set:{ns}"), member))
+
+    def smembers(self, ns):
+        return list(self.client.smembers(self._key(f"set:{ns}")))
+
+    def close(self):
+        self.client.close()
+
+
+def create_state_backend(kind: str = STATE_BACKEND) -> StateBackend:
+    """按类型创建状态后端"""
+    if kind == "memory":
+        return MemoryStateBackend()
+    if kind == "sqlite":
+        return SQLiteStateBackend()
+    if kind == "redis":
+        return RedisStateBackend()
+    raise ValueError(f"未知状态后端: {kind}")
+
+
+_backend: Optional[StateBackend] = None
+
+
+def get_state_backend() -> StateBackend:
+    """进程内共用的状态后端（按 STATE_BACKEND 创建）"""
+    global _backend
+    if _backend is None:
+        _backend = create_state_backend()
+        print(f"状态后端: {STATE_BACKEND}")
+    return _backend
+
+
+class SharedDict(MutableMapping):
+    """命名空间键值表的 dict 视图；encode/decode 在共享后端下转换不可 JSON 序列化的值"""
+
+    def __init__(self, backend: StateBackend, ns: str,
+                 encode: Optional[Callable[[Any], Any]] = None, decode: Optional[Callable[[Any], Any]] = None):
+        self.backend = backend
+        self.ns = ns
+        self._encode = encode if backend.shared and encode else None
+        self._decode = decode if backend.shared and decode else None
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.backend.get(self.ns, key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return self._decode(value) if self._decode else value
+
+    def __setitem__(self, key: str, value: Any):
+        self.backend.set(self.ns, key, self._encode(value) if self._encode else value)
+
+    def __delitem__(self, key: str):
+        if not self.backend.delete(self.ns, key):
+            raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and self.backend.contains(self.ns, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter([key for key, _ in self.backend.items(self.ns)])
+
+    def __len__(self) -> int:
+        return self.backend.count(self.ns)
+
+    def items(self) -> List[Tuple[str, Any]]:
+        """一次读取全部键值（避免逐键访问后端）"""
+        pairs = self.backend.items(self.ns)
+        return [(key, self._decode(value)) for key, value in pairs] if self._decode else pairs
+
+    def pop(self, key: str, default: Any = _MISSING) -> Any:
+        try:
+            value = self[key]
+        except KeyError:
+            if default is _MISSING:
+                raise
+            return default
+        self.backend.delete(self.ns, key)
+        return value
+
+
+class SharedSet(MutableSet):
+    """命名空间集合的 set 视图"""
+
+    def __init__(self, backend: StateBackend, ns: str):
+        self.backend = backend
+        self.ns = ns
+
+    def __contains__(self, member: object) -> bool:
+        return isinstance(member, str) and self.backend.sismember(self.ns, member)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.backend.smembers(self.ns))
+
+    def __len__(self) -> int:
+        return len(self.backend.smembers(self.ns))
+
+    def add(self, member: str):
+        self.backend.sadd(self.ns, member)
+
+    def discard(self, member: str):
+        self.backend.srem(self.ns, member)
+
+
+class SharedCancelFlag:
+    """保存在 SharedDict 中的取消标志：任一 worker 设置 cancelled 后，执行任务的 worker 在下次检查时看到。
+
+    标志值为 {"owner": 创建者令牌, "cancelled": bool}，任务结束时仅删除自己创建的标志。
+    """
+
+    def __init__(self, flags: SharedDict, key: str, poll_seconds: float = CANCEL_FLAG_POLL_SECONDS):
+        self.flags = flags
+        self.key = key
+        self.owner = f"{os.getpid()}:{id(self)}:{time.monotonic()}"
+        self.poll_seconds = poll_seconds
+        self._cancelled = False
+        self._checked_at = 0.0
+        flags[key] = {"owner": self.owner, "cancelled": False}
+
+    @property
+    def cancelled(self) -> bool:
+        now = time.monotonic()
+        if not self._cancelled and now - self._checked_at >= self.poll_seconds:
+            self._checked_at = now
+            self._cancelled = bool((self.flags.get(self.key) or {}).get("cancelled"))
+        return self._cancelled
+
+    @cancelled.setter
+    def cancelled(self, value: bool):
+        self._cancelled = bool(value)
+        self.flags[self.key] = {"owner": self.owner, "cancelled": self._cancelled}
+
+    def release(self):
+        """任务结束时删除标志（已被新任务替换时保留）"""
+        if (self.flags.get(self.key) or {}).get("owner") == self.owner:
+            self.flags.pop(self.key, None)
+
+
+def request_cancel(flags: SharedDict, key: str) -> bool:
+    """设置指定键的取消标志；没有进行中的任务时返回 False"""
+    flag = flags.get(key)
+    if not flag:
+        return False
+    flags[key] = {**flag, "cancelled": True}
+    return True
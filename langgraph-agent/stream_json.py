@@ -0,0 +1,108 @@
+"""
+流式JSON区块解析：逐段消费模型输出的文本增量，在 "blocks" 数组中的每个对象闭合时立即产出该对象。
+
+只做增量扫描（每个字符只扫描一次），不做完整校验；流结束后仍应对完整文本做原有的解析与修复。
+"""
+
+import re
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+_ARRAY_START_PATTERN = re.compile(r'"blocks"\s*:\s*\[')
+
+
+class BlockStreamParser:
+    """从流式文本中提取 {"blocks": [...]} 里已闭合的区块对象"""
+
+    def __init__(self):
+        self.text = ""
+        self._seek_from = 0
+        self._in_array = False
+        self._done = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._object_start = -1
+        self.emitted = 0
+
+    def feed(self, delta: str) -> List[Dict[str, Any]]:
+        """追加一段文本增量，返回本次新闭合的区块对象"""
+        if not delta or self._done:
+            self.text += delta or ""
+            return []
+        self.text += delta
+
+        if not self._in_array:
+            match = _ARRAY_START_PATTERN.search(self.text, self._seek_from)
+            if not match:
+                # 保留可能被截断的键名
+                self._seek_from = max(0, len(self.text) - 16)
+                return []
+            self._in_array = True
+            self._pos = match.end()
+
+        blocks = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch == '{' or ch == '[':
+                if self._depth == 0 and ch == '{':
+                    self._object_start = i
+                self._depth += 1
+            elif ch == '}' or ch == ']':
+                if self._depth == 0:
+                    # 数组结束
+                    self._done = True
+                    self._pos = i + 1
+                    return blocks
+                self._depth -= 1
+                if self._depth == 0 and ch == '}' and self._object_start >= 0:
+                    try:
+                        block = json.loads(text[self._object_start:i + 1])
+                    except ValueError:
+                        block = None
+                    if isinstance(block, dict):
+                        blocks.append(block)
+                        self.emitted += 1
+                    self._object_start = -1
+        self._pos = len(text)
+        return blocks
+
+
+# 区块闭合时的回调：on_block(区块, 排序键)。排序键为整数元组，按字典序即为文档顺序
+BlockCallback = Callable[[Dict[str, Any], Tuple[int, ...]], Awaitable[None]]
+
+
+async def collect_streamed_blocks(responses: AsyncIterator, on_block: Optional[BlockCallback] = None,
+                                  order_prefix: Tuple[int, ...] = ()) -> Tuple[int, str, str]:
+    """
+    消费 generation_stream（incremental_output=True）的增量输出，每个区块闭合时回调 on_block。
+
+    Returns:
+        (状态码, 错误信息, 完整输出文本)
+    """
+    parser = BlockStreamParser()
+    async for response in responses:
+        if response.status_code != 200:
+            return response.status_code, response.message, parser.text
+        choices = response.output.get('choices')
+        if not choices:
+            continue
+        delta = choices[0].get('message', {}).get('content') or ''
+        blocks = parser.feed(delta)
+        if on_block:
+            first_index = parser.emitted - len(blocks)
+            for offset, block in enumerate(blocks):
+                await on_block(block, order_prefix + (first_index + offset,))
+    return 200, '', parser.text
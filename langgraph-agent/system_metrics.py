@@ -0,0 +1,157 @@
+"""
+系统资源后台采样：按固定间隔采集 CPU、内存、磁盘以及各 ffmpeg 进程的占用，写入环形缓冲区。
+
+- 心跳（ping / register）直接读取最近一次采样，不在 WebSocket 处理协程里阻塞测量 CPU
+- CPU 占用使用两次采样之间的差值（psutil 的非阻塞模式），采集本身在线程中执行
+- /api/metrics/system 返回最近的历史记录与汇总，用于容量规划
+"""
+
+import os
+import time
+import asyncio
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+import psutil
+
+# 采样间隔（秒）
+SYSTEM_METRICS_INTERVAL_SECONDS = float(os.getenv('SYSTEM_METRICS_INTERVAL_SECONDS', '5'))
+# 环形缓冲区保留的采样数（默认 5 秒 × 720 = 1 小时）
+SYSTEM_METRICS_HISTORY = int(os.getenv('SYSTEM_METRICS_HISTORY', '720'))
+# 统计磁盘占用的路径（上传与压缩视频所在分区）
+SYSTEM_METRICS_DISK_PATH = os.getenv('SYSTEM_METRICS_DISK_PATH', '/root/video2sop/temp')
+
+_GB = 1024 ** 3
+_MB = 1024 ** 2
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class SystemMetricsSampler:
+    """后台采样任务与环形缓冲区"""
+
+    def __init__(self, interval: float = SYSTEM_METRICS_INTERVAL_SECONDS, history: int = SYSTEM_METRICS_HISTORY,
+                 disk_path: str = SYSTEM_METRICS_DISK_PATH):
+        self.interval = interval
+        self.disk_path = disk_path
+        self.history: Deque[Dict[str, Any]] = deque(maxlen=history)
+        # pid -> Process：保留对象才能得到两次采样之间的进程 CPU 占用
+        self._processes: Dict[int, psutil.Process] = {}
+        self._task: Optional[asyncio.Task] = None
+        # 首次调用只建立基准，返回值无意义
+        psutil.cpu_percent(interval=None)
+
+    async def start(self):
+        if self._task is None:
+            self.history.append(await asyncio.to_thread(self.sample))
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.history.append(await asyncio.to_thread(self.sample))
+            except Exception as e:
+                print(f"系统资源采样失败: {e}")
+
+    def sample(self) -> Dict[str, Any]:
+        """采集一次（同步，在线程中调用）"""
+        memory = psutil.virtual_memory()
+        snapshot = {
+            "timestamp": datetime.now().isoformat(),
+            "cpu_count": os.cpu_count() or 1,
+            "cpu_percent": round(psutil.cpu_percent(interval=None), 1),
+            "memory_total_gb": round(memory.total / _GB),
+            "memory_percent": round(memory.percent, 1),
+            "memory_available_gb": round(memory.available / _GB, 2)
+        }
+        try:
+            disk = psutil.disk_usage(self.disk_path)
+            snapshot["disk_percent"] = round(disk.percent, 1)
+            snapshot["disk_free_gb"] = round(disk.free / _GB, 2)
+        except OSError:
+            snapshot["disk_percent"] = None
+            snapshot["disk_free_gb"] = None
+        snapshot["ffmpeg"] = self._sample_ffmpeg()
+        return snapshot
+
+    def _sample_ffmpeg(self) -> Dict[str, Any]:
+        processes = []
+        alive = set()
+        for proc in psutil.process_iter(["name"]):
+            if not (proc.info.get("name") or "").startswith("ffmpeg"):
+                continue
+            alive.add(proc.pid)
+            tracked = self._processes.setdefault(proc.pid, proc)
+            try:
+                with tracked.oneshot():
+                    processes.append({
+                        "pid": tracked.pid,
+                        "cpu_percent": round(tracked.cpu_percent(interval=None), 1),
+                        "memory_mb": round(tracked.memory_info().rss / _MB, 1),
+                        "running_seconds": round(time.time() - tracked.create_time())
+                    })
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                alive.discard(proc.pid)
+        for pid in list(self._processes):
+            if pid not in alive:
+                del self._processes[pid]
+        return {
+            "count": len(processes),
+            "cpu_percent": round(sum(p["cpu_percent"] for p in processes), 1),
+            "memory_mb": round(sum(p["memory_mb"] for p in processes), 1),
+            "processes": processes
+        }
+
+    def latest(self) -> Dict[str, Any]:
+        """最近一次采样；尚未开始采样时立即采集一次（非阻塞的 CPU 测量）"""
+        if not self.history:
+            self.history.append(self.sample())
+        return self.history[-1]
+
+    def resources(self) -> Dict[str, Any]:
+        """心跳响应中的系统资源信息（字段与前端约定一致）"""
+        latest = self.latest()
+        return {
+            "cpu_count": latest["cpu_count"],
+            "cpu_percent": latest["cpu_percent"],
+            "memory_total_gb": latest["memory_total_gb"],
+            "memory_percent": latest["memory_percent"]
+        }
+
+    def report(self, limit: Optional[int] = None) -> Dict[str, Any]:
+        """最近的历史记录（旧到新）与汇总"""
+        history = list(self.history)
+        if limit is not None:
+            history = history[-limit:] if limit > 0 else []
+        cpu = [s["cpu_percent"] for s in history]
+        memory = [s["memory_percent"] for s in history]
+        ffmpeg = [s["ffmpeg"]["count"] for s in history]
+        return {
+            "interval_seconds": self.interval,
+            "samples": len(history),
+            "summary": {
+                "cpu_percent": {"p50": _percentile(cpu, 0.5), "p95": _percentile(cpu, 0.95), "max": max(cpu, default=None)},
+                "memory_percent": {"p50": _percentile(memory, 0.5), "max": max(memory, default=None)},
+                "ffmpeg_processes": {"max": max(ffmpeg, default=None)}
+            },
+            "history": history
+        }
+
+
+system_metrics = SystemMetricsSampler()
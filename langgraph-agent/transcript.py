@@ -0,0 +1,231 @@
+"""
+列式语音转录结构：开始/结束时间数组 + 按偏移索引的文本缓冲区，支持二分查找时间窗口、O(1) 切片和快速序列化
+"""
+
+import json
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+# 前端拼接的语音文本格式： "1. [00:05-00:08] 文本"
+_TEXT_LINE_PATTERN = re.compile(r'^\s*(?:\d+\.\s*)?\[(\d+):(\d{2})(?::(\d{2}))?\s*-\s*(\d+):(\d{2})(?::(\d{2}))?\]\s?(.*)$')
+
+
+def _to_ms(a: str, b: str, c: Optional[str]) -> int:
+    """将 mm:ss 或 hh:mm:ss 转换为毫秒"""
+    if c is None:
+        return (int(a) * 60 + int(b)) * 1000
+    return (int(a) * 3600 + int(b) * 60 + int(c)) * 1000
+
+
+def _format_mmss(milliseconds: int) -> str:
+    """毫秒转 mm:ss（与前端 formatTimeForTranscript 一致）"""
+    seconds = milliseconds // 1000
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+
+class Transcript:
+    """
+    列式存储的语音转录结果。
+
+    句子按 begin_time 排序存储；时间单位为毫秒。切片与窗口查询返回共享底层缓冲区的视图，不复制数据。
+    """
+
+    __slots__ = ("_begin", "_end", "_max_end", "_offsets", "_text", "_lo", "_hi")
+
+    def __init__(self, begin_times: array, end_times: array, offsets: array, text: str,
+                 max_end: Optional[array] = None, lo: int = 0, hi: Optional[int] = None):
+        self._begin = begin_times
+        self._end = end_times
+        self._offsets = offsets
+        self._text = text
+        # 结束时间的前缀最大值，用于按时间窗口二分查找（结束时间不保证单调）
+        if max_end is None:
+            max_end = array('q')
+            current = -1
+            for value in end_times:
+                current = value if value > current else current
+                max_end.append(current)
+        self._max_end = max_end
+        self._lo = lo
+        self._hi = len(begin_times) if hi is None else hi
+
+    # ---------- 构造 ----------
+
+    @classmethod
+    def from_sentences(cls, sentences: List[Dict[str, Any]]) -> "Transcript":
+        """从句子字典列表构造（sentence_id/text/begin_time/end_time，可含 editedText）"""
+        ordered = sorted(sentences, key=lambda s: (s.get("begin_time", 0), s.get("end_time", 0)))
+        begin_times = array('q')
+        end_times = array('q')
+        offsets = array('q', [0])
+        parts = []
+        position = 0
+        for sentence in ordered:
+            text = sentence.get("editedText") or sentence.get("text", "")
+            begin_times.append(int(sentence.get("begin_time", 0)))
+            end_times.append(int(sentence.get("end_time", 0)))
+            parts.append(text)
+            position += len(text)
+            offsets.append(position)
+        return cls(begin_times, end_times, offsets, "".join(parts))
+
+    @classmethod
+    def from_text(cls, transcript_text: str) -> "Transcript":
+        """解析前端拼接的 "N. [mm:ss-mm:ss] 文本" 格式；无法识别的行会并入上一句"""
+        sentences: List[Dict[str, Any]] = []
+        for line in transcript_text.splitlines():
+            match = _TEXT_LINE_PATTERN.match(line)
+            if match:
+                sentences.append({
+                    "begin_time": _to_ms(match.group(1), match.group(2), match.group(3)),
+                    "end_time": _to_ms(match.group(4), match.group(5), match.group(6)),
+                    "text": match.group(7).strip()
+                })
+            elif line.strip() and sentences:
+                sentences[-1]["text"] += "\n" + line.strip()
+        return cls.from_sentences(sentences)
+
+    @classmethod
+    def from_columns(cls, data: Dict[str, Any]) -> "Transcript":
+        """从 to_columns() 的结果还原"""
+        return cls(
+            array('q', data["begin"]),
+            array('q', data["end"]),
+            array('q', data["offsets"]),
+            data["text"]
+        )
+
+    @classmethod
+    def from_json(cls, payload: Union[str, bytes]) -> "Transcript":
+        """从 JSON 还原，兼容列式格式与句子列表格式"""
+        data = json.loads(payload)
+        if isinstance(data, dict) and "offsets" in data:
+            return cls.from_columns(data)
+        if isinstance(data, list):
+            return cls.from_sentences(data)
+        raise ValueError("无法识别的转录JSON格式")
+
+    @classmethod
+    def from_msgpack(cls, payload: bytes) -> "Transcript":
+        """从 msgpack 还原（需要安装 msgpack）"""
+        try:
+            import msgpack
+        except ImportError:
+            raise ImportError("msgpack 未安装，请执行 pip install msgpack")
+        return cls.from_columns(msgpack.unpackb(payload, raw=False))
+
+    @classmethod
+    def coerce(cls, value: Any) -> Optional["Transcript"]:
+        """将接口参数（句子列表 / JSON字符串 / 拼接文本 / Transcript）统一转换为 Transcript"""
+        if value is None or isinstance(value, Transcript):
+            return value
+        if isinstance(value, list):
+            return cls.from_sentences(value)
+        if isinstance(value, str):
+            stripped = value.lstrip()
+            if stripped.startswith('[') and not _TEXT_LINE_PATTERN.match(stripped.splitlines()[0]):
+                try:
+                    return cls.from_json(stripped)
+                except (ValueError, TypeError):
+                    pass
+            return cls.from_text(value)
+        raise TypeError(f"不支持的转录类型: {type(value).__name__}")
+
+    # ---------- 访问 ----------
+
+    def __len__(self) -> int:
+        return self._hi - self._lo
+
+    def __bool__(self) -> bool:
+        return self._hi > self._lo
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError("Transcript 切片不支持步长")
+            return self._view(self._lo + start, self._lo + max(start, stop))
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("Transcript index out of range")
+        return self._sentence(self._lo + key, key + 1)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for i in range(self._lo, self._hi):
+            yield self._sentence(i, i - self._lo + 1)
+
+    def _view(self, lo: int, hi: int) -> "Transcript":
+        return Transcript(self._begin, self._end, self._offsets, self._text, self._max_end, lo, hi)
+
+    def _sentence(self, i: int, sentence_id: int) -> Dict[str, Any]:
+        return {
+            "sentence_id": sentence_id,
+            "text": self.text_at(i - self._lo),
+            "begin_time": self._begin[i],
+            "end_time": self._end[i]
+        }
+
+    def text_at(self, index: int) -> str:
+        """第 index 句的文本（相对当前视图）"""
+        i = self._lo + index
+        return self._text[self._offsets[i]:self._offsets[i + 1]]
+
+    @property
+    def begin_time(self) -> int:
+        return self._begin[self._lo] if self else 0
+
+    @property
+    def end_time(self) -> int:
+        return self._max_end[self._hi - 1] if self else 0
+
+    # ---------- 查询 ----------
+
+    def window(self, start_ms: int, end_ms: int) -> "Transcript":
+        """返回与 [start_ms, end_ms) 时间窗口重叠的句子视图，O(log n)"""
+        lo = bisect_right(self._max_end, start_ms, self._lo, self._hi)
+        hi = bisect_left(self._begin, end_ms, lo, self._hi)
+        return self._view(lo, max(lo, hi))
+
+    def window_seconds(self, start_sec: float, end_sec: float) -> "Transcript":
+        """按秒查询时间窗口（视频分段使用秒）"""
+        return self.window(int(start_sec * 1000), int(end_sec * 1000))
+
+    # ---------- 序列化 ----------
+
+    def to_sentences(self) -> List[Dict[str, Any]]:
+        """转换为与 speech_recognition 返回值一致的句子列表"""
+        return list(self)
+
+    def to_text(self) -> str:
+        """转换为前端使用的 "N. [mm:ss-mm:ss] 文本" 格式，供模型提示词使用"""
+        return "\n".join(
+            f"{i - self._lo + 1}. [{_format_mmss(self._begin[i])}-{_format_mmss(self._end[i])}] "
+            f"{self._text[self._offsets[i]:self._offsets[i + 1]]}"
+            for i in range(self._lo, self._hi)
+        )
+
+    def to_columns(self) -> Dict[str, Any]:
+        """列式字典（偏移量相对当前视图重新计算）"""
+        base = self._offsets[self._lo]
+        return {
+            "begin": self._begin[self._lo:self._hi].tolist(),
+            "end": self._end[self._lo:self._hi].tolist(),
+            "offsets": [o - base for o in self._offsets[self._lo:self._hi + 1]] if self else [0],
+            "text": self._text[base:self._offsets[self._hi]]
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_columns(), ensure_ascii=False, separators=(',', ':'))
+
+    def to_msgpack(self) -> bytes:
+        try:
+            import msgpack
+        except ImportError:
+            raise ImportError("msgpack 未安装，请执行 pip install msgpack")
+        return msgpack.packb(self.to_columns(), use_bin_type=True)
+
+    def __repr__(self) -> str:
+        return f"Transcript(sentences={len(self)}, span={self.begin_time}-{self.end_time}ms)"
@@ -7,7 +7,9 @@ import json
 import tempfile
 import subprocess
 import time
-from typing import List, Dict, Optional, Tuple, Callable
+import asyncio
+import threading
+from typing import AsyncIterator, Iterator, List, Dict, Optional, Tuple, Callable
 
 import requests
 
@@ -387,25 +389,79 @@ def compress_and_overlay_video(
     return output_path
 
 
-def split_video_segments(
+def _cut_and_upload_segment(input_path: str, start: float, duration: int, seg_id: int, oss_key: str) -> str:
+    """切割单个片段并上传到OSS，返回URL"""
+    fd, seg_path = tempfile.mkstemp(suffix=f"_seg{seg_id}.mp4")
+    os.close(fd)
+
+    try:
+        # 使用 -ss -t + re-encode 可最稳定；这里先尝试流拷贝以速度优先
+        cmd = [
+            'ffmpeg',
+            '-ss', str(int(start)),
+            '-t', str(duration),
+            '-i', input_path,
+            '-c', 'copy',
+            '-avoid_negative_ts', 'make_zero',  # 处理负时间戳
+            '-y',
+            seg_path
+        ]
+        code, out, err = _run_cmd(cmd, timeout=1800)
+        if code != 0 or not os.path.exists(seg_path) or os.path.getsize(seg_path) == 0:
+            # 回退到重编码以避免关键帧切割失败
+            cmd = [
+                'ffmpeg',
+                '-ss', str(int(start)),
+                '-t', str(duration),
+                '-i', input_path,
+                '-c:v', 'libx264',
+                '-c:a', 'aac',
+                '-y',
+                seg_path
+            ]
+            code2, out2, err2 = _run_cmd(cmd, timeout=1800)
+            if code2 != 0:
+                raise RuntimeError(f"ffmpeg segment failed: {err2}")
+
+        return upload_file_to_oss(seg_path, oss_key)
+    finally:
+        try:
+            os.remove(seg_path)
+        except Exception:
+            pass
+
+
+def plan_segment_ranges(duration_sec: float, segment_seconds: int = 15 * 60,
+                        overlap_seconds: int = 120) -> List[Tuple[float, float]]:
+    """计算各片段的起止时间（秒），切割前即可得到片段总数"""
+    ranges = []
+    start = 0
+    while start < duration_sec:
+        end = min(start + segment_seconds, duration_sec)
+        if int(end - start) <= 0:
+            break
+        ranges.append((start, end))
+        if end >= duration_sec:
+            break
+        # 与下一个片段重叠：下一片段从 (end - overlap) 开始
+        start = max(0, end - overlap_seconds)
+    return ranges
+
+
+def iter_video_segments(
     video_source: str,
-    client_session_id: str,  # 改用client_session_id
+    client_session_id: str,
     duration_sec: float,
-    segment_seconds: int = 15 * 60, 
+    segment_seconds: int = 15 * 60,
     overlap_seconds: int = 120,
-    is_local_file: bool = False
-) -> List[Dict]:
+    is_local_file: bool = False,
+    existing: Optional[Dict[int, Dict]] = None
+) -> Iterator[Dict]:
     """
-    将视频分割为多个片段并上传到OSS。
-    Args:
-        video_source: 源视频URL或本地路径
-        client_session_id: 会话ID
-        duration_sec: 总时长(秒)
-        segment_seconds: 每段时长(默认15分钟)
-        overlap_seconds: 相邻片段重叠(默认120秒)
-        is_local_file: 是否为本地文件
-    Returns:
-        [{segment_id, start_time, end_time, url}]
+    逐段切割视频并上传到OSS，每个片段上传完成后立即产出（参数与 split_video_segments 相同）。
+    existing: 已上传的片段 {segment_id: 片段}，起止时间一致时直接复用，不再切割上传。
+    Yields:
+        {segment_id, start_time, end_time, url}
     """
     oss_dir = f"{client_session_id}/segments"
 
@@ -415,69 +471,22 @@ def split_video_segments(
             input_path = video_source
         else:
             input_path = _download_to_temp(video_source, ".mp4")
-        segments: List[Dict] = []
 
-        start = 0
-        seg_id = 1
-        while start < duration_sec:
-            end = min(start + segment_seconds, duration_sec)
-            # 与下一个片段重叠：下一片段从 (end - overlap) 开始
+        for seg_id, (start, end) in enumerate(plan_segment_ranges(duration_sec, segment_seconds, overlap_seconds), 1):
             duration = int(end - start)
-            if duration <= 0:
-                break
-
-            fd, seg_path = tempfile.mkstemp(suffix=f"_seg{seg_id}.mp4")
-            os.close(fd)
+            reused = existing.get(seg_id) if existing else None
+            if reused and reused.get("url") and reused.get("start_time") == int(start) and reused.get("end_time") == int(end):
+                # 断点中已上传的片段直接复用
+                url = reused["url"]
+            else:
+                url = _cut_and_upload_segment(input_path, start, duration, seg_id, f"{oss_dir}/segment_{seg_id:02d}.mp4")
 
-            # 使用 -ss -t + re-encode 可最稳定；这里先尝试流拷贝以速度优先
-            cmd = [
-                'ffmpeg',
-                '-ss', str(int(start)),
-                '-t', str(duration),
-                '-i', input_path,
-                '-c', 'copy',
-                '-avoid_negative_ts', 'make_zero',  # 处理负时间戳
-                '-y',
-                seg_path
-            ]
-            code, out, err = _run_cmd(cmd, timeout=1800)
-            if code != 0 or not os.path.exists(seg_path) or os.path.getsize(seg_path) == 0:
-                # 回退到重编码以避免关键帧切割失败
-                cmd = [
-                    'ffmpeg',
-                    '-ss', str(int(start)),
-                    '-t', str(duration),
-                    '-i', input_path,
-                    '-c:v', 'libx264',
-                    '-c:a', 'aac',
-                    '-y',
-                    seg_path
-                ]
-                code2, out2, err2 = _run_cmd(cmd, timeout=1800)
-                if code2 != 0:
-                    raise RuntimeError(f"ffmpeg segment failed: {err2}")
-
-            oss_key = f"{oss_dir}/segment_{seg_id:02d}.mp4"
-            url = upload_file_to_oss(seg_path, oss_key)
-            segments.append({
+            yield {
                 "segment_id": seg_id,
                 "start_time": int(start),
                 "end_time": int(end),
                 "url": url
-            })
-
-            # 下一段起点：当前end - overlap
-            if end >= duration_sec:
-                break
-            start = max(0, end - overlap_seconds)
-            seg_id += 1
-
-            try:
-                os.remove(seg_path)
-            except Exception:
-                pass
-
-        return segments
+            }
     finally:
         # 只删除临时下载的文件，不删除本地存储的原始视频
         if not is_local_file and input_path and os.path.exists(input_path):
@@ -487,3 +496,76 @@ def split_video_segments(
                 pass
 
 
+def split_video_segments(
+    video_source: str,
+    client_session_id: str,  # 改用client_session_id
+    duration_sec: float,
+    segment_seconds: int = 15 * 60, 
+    overlap_seconds: int = 120,
+    is_local_file: bool = False
+) -> List[Dict]:
+    """
+    将视频分割为多个片段并上传到OSS。
+    Args:
+        video_source: 源视频URL或本地路径
+        client_session_id: 会话ID
+        duration_sec: 总时长(秒)
+        segment_seconds: 每段时长(默认15分钟)
+        overlap_seconds: 相邻片段重叠(默认120秒)
+        is_local_file: 是否为本地文件
+    Returns:
+        [{segment_id, start_time, end_time, url}]
+    """
+    return list(iter_video_segments(
+        video_source, client_session_id, duration_sec, segment_seconds, overlap_seconds, is_local_file
+    ))
+
+
+async def stream_video_segments(
+    video_source: str,
+    client_session_id: str,
+    duration_sec: float,
+    segment_seconds: int = 15 * 60,
+    overlap_seconds: int = 120,
+    is_local_file: bool = False,
+    existing: Optional[Dict[int, Dict]] = None
+) -> AsyncIterator[Dict]:
+    """
+    异步逐段产出视频片段：切割与上传在后台线程中进行，每个片段上传完成即产出，
+    调用方可以在后续片段仍在切割/上传时开始处理已就绪的片段。
+
+    调用方提前停止迭代（异常或 break）时，后台线程在当前片段完成后停止切割。
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        segments = iter_video_segments(
+            video_source, client_session_id, duration_sec, segment_seconds, overlap_seconds, is_local_file, existing
+        )
+        try:
+            for seg in segments:
+                loop.call_soon_threadsafe(queue.put_nowait, seg)
+                if stop.is_set():
+                    break
+        except BaseException as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            segments.close()
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    producer = loop.run_in_executor(None, produce)
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # 不等待后台线程结束（可能仍在上传当前片段），避免阻塞调用方的异常处理
+        producer.add_done_callback(lambda f: f.exception())
@@ -3,8 +3,8 @@ import os
 from typing import Optional
 from dotenv import load_dotenv
 import dashscope
-from dashscope import MultiModalConversation
 from http import HTTPStatus
+from dashscope_client import multimodal_call, run_sync
 
 # 加载环境变量
 load_dotenv()
@@ -13,14 +13,14 @@ load_dotenv()
 dashscope.api_key = os.getenv('DASHSCOPE_API_KEY')
 
 
-def video_understanding(
+async def video_understanding_async(
     video_url: str, 
     prompt: str, 
     fps: int = 2, 
     audio_transcript: Optional[str] = None
 ) -> str:
     """
-    使用 Qwen3-VL-Plus 模型进行视频理解分析。
+    使用 Qwen3-VL-Plus 模型进行视频理解分析（异步，复用共享连接池）。
     
     Args:
         video_url: 视频文件的公开访问 URL
@@ -55,7 +55,7 @@ def video_understanding(
         ]
         
         # 调用 Qwen3-VL-Plus API
-        response = MultiModalConversation.call(
+        response = await multimodal_call(
             api_key=dashscope.api_key,
             model='qwen3-vl-plus',
             messages=messages
@@ -71,7 +71,7 @@ def video_understanding(
         # 提取结果
         try:
             result_text = response.output.choices[0].message.content[0]["text"]
-        except (KeyError, IndexError, TypeError) as e:
+        except (KeyError, IndexError, TypeError, AttributeError) as e:
             return json.dumps({
                 "error": f"解析API响应失败: {str(e)}",
                 "raw_response": str(response)
@@ -97,6 +97,16 @@ def video_understanding(
         })
 
 
+def video_understanding(
+    video_url: str, 
+    prompt: str, 
+    fps: int = 2, 
+    audio_transcript: Optional[str] = None
+) -> str:
+    """video_understanding_async 的同步版本（用于脚本和测试）"""
+    return run_sync(video_understanding_async(video_url, prompt, fps, audio_transcript))
+
+
 def test_video_understanding():
     """测试视频理解功能"""
     # 测试用的视频URL（不是真的视频URL，需要替换为实际可访问的URL）
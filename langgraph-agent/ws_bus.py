@@ -0,0 +1,353 @@
+"""
+跨 worker 的 WebSocket 消息总线：客户端连接只在某一个 worker 上，其他 worker 产生的推送（压缩进度、片段结果等）
+按 client_session_id 发布到总线，由持有该连接的 worker 订阅后转发。
+
+- local：进程内（单 worker，默认），没有其他 worker 时发布即丢弃
+- unix：同机多 worker 通过 Unix 套接字连接一个轻量中转进程；中转由第一个获得文件锁的 worker 在进程内运行，
+  该 worker 退出后其余 worker 重新竞选并重新订阅
+- redis：外部 Redis 协议服务的发布/订阅（需安装 redis 包），可跨机器
+
+每条消息携带发布时间，订阅端记录投递延迟（同机时钟）。
+"""
+
+import os
+import json
+import time
+import asyncio
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Set
+
+# 消息总线类型：local / unix / redis
+WS_BUS = os.getenv('WS_BUS', 'local')
+# unix 总线的套接字路径（同目录下的 .lock 文件用于竞选中转进程）
+WS_BUS_SOCKET_PATH = os.getenv('WS_BUS_SOCKET_PATH', '/root/video2sop/temp/ws_bus.sock')
+# redis 总线地址与频道前缀
+WS_BUS_REDIS_URL = os.getenv('WS_BUS_REDIS_URL', 'redis://localhost:6379/0')
+WS_BUS_REDIS_PREFIX = os.getenv('WS_BUS_REDIS_PREFIX', 'video2sop:ws')
+# 中转进程为单个订阅连接缓存的最大字节数（订阅端过慢时丢弃消息，不拖慢其他 worker）
+WS_BUS_MAX_BUFFER_BYTES = int(os.getenv('WS_BUS_MAX_BUFFER_BYTES', str(8 * 1024 * 1024)))
+# 与中转断开后的重连间隔（秒）
+WS_BUS_RECONNECT_SECONDS = float(os.getenv('WS_BUS_RECONNECT_SECONDS', '0.5'))
+# 投递延迟统计保留的样本数
+WS_BUS_LATENCY_SAMPLES = 2000
+
+DeliverCallback = Callable[[str, str], Awaitable[None]]
+
+
+class MessageBus(ABC):
+    """消息总线接口：订阅本 worker 持有的会话，发布给其他 worker 持有的会话"""
+
+    def __init__(self):
+        self.subscriptions: Set[str] = set()
+        self.on_message: Optional[DeliverCallback] = None
+        self._latencies: Deque[float] = deque(maxlen=WS_BUS_LATENCY_SAMPLES)
+        self._counts = {"published": 0, "delivered": 0, "dropped": 0}
+
+    async def start(self, on_message: DeliverCallback):
+        """开始接收订阅会话的消息，on_message(client_session_id, message) 负责发给本地连接"""
+        self.on_message = on_message
+
+    async def close(self):
+        pass
+
+    def subscribe(self, client_session_id: str):
+        self.subscriptions.add(client_session_id)
+
+    def unsubscribe(self, client_session_id: str):
+        self.subscriptions.discard(client_session_id)
+
+    @abstractmethod
+    def publish(self, client_session_id: str, message: str) -> bool:
+        """发布消息（不等待投递）；无法发出时返回 False"""
+
+    async def _deliver(self, frame: Dict):
+        """收到总线消息：记录延迟后交给本地连接"""
+        if frame["sid"] not in self.subscriptions or self.on_message is None:
+            self._counts["dropped"] += 1
+            return
+        self._latencies.append(max(0.0, time.time() - frame["ts"]))
+        self._counts["delivered"] += 1
+        try:
+            await self.on_message(frame["sid"], frame["msg"])
+        except Exception as e:
+            print(f"总线消息投递失败: {e}")
+
+    @staticmethod
+    def _frame(client_session_id: str, message: str) -> Dict:
+        return {"op": "pub", "sid": client_session_id, "msg": message, "ts": time.time()}
+
+    def stats(self) -> Dict:
+        latencies = sorted(self._latencies)
+
+        def pct(q):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000, 3) if latencies else None
+
+        return {
+            "bus": type(self).__name__,
+            "subscriptions": len(self.subscriptions),
+            **self._counts,
+            "latency_ms": {"p50": pct(0.5), "p90": pct(0.9), "p99": pct(0.99), "max": pct(1.0)}
+        }
+
+
+class LocalMessageBus(MessageBus):
+    """进程内总线（单 worker）"""
+
+    def publish(self, client_session_id, message):
+        if client_session_id not in self.subscriptions:
+            return False
+        self._counts["published"] += 1
+        asyncio.get_running_loop().create_task(self._deliver(self._frame(client_session_id, message)))
+        return True
+
+
+# unix 总线的行协议（制表符分隔，中转只解析帧头，不解码消息体）：
+#   S\t<会话>\n            订阅
+#   U\t<会话>\n            取消订阅
+#   P\t<会话>\t<发布时间>\t<JSON 字符串形式的消息>\n   发布（中转原样转发给订阅者）
+
+
+def _encode_line(op: bytes, client_session_id: str, *fields: str) -> bytes:
+    return b"\t".join((op, client_session_id.encode(), *(f.encode() for f in fields))) + b"\n"
+
+
+class _UnixBroker:
+    """Unix 套接字中转：按会话转发发布的消息给订阅该会话的连接"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.subscribers: Dict[bytes, Set[asyncio.StreamWriter]] = {}
+        self.connections: Set[asyncio.StreamWriter] = set()
+        self.forwarded = 0
+        self.dropped = 0
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)  # 上一个中转进程遗留的套接字文件
+        self.server = await asyncio.start_unix_server(self._handle, path=self.path)
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            for writer in list(self.connections):
+                writer.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        subscribed: Set[bytes] = set()
+        self.connections.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                op, sid, *_ = line.rstrip(b"\n").split(b"\t", 2)
+                if op == b"S":
+                    self.subscribers.setdefault(sid, set()).add(writer)
+                    subscribed.add(sid)
+                elif op == b"U":
+                    self._remove(sid, writer)
+                    subscribed.discard(sid)
+                elif op == b"P":
+                    for target in self.subscribers.get(sid, ()):
+                        if target.transport.get_write_buffer_size() > WS_BUS_MAX_BUFFER_BYTES:
+                            self.dropped += 1
+                            continue
+                        target.write(line)
+                        self.forwarded += 1
+        except (ConnectionError, ValueError) as e:
+            print(f"总线中转连接异常: {e}")
+        except asyncio.CancelledError:
+            pass  # 中转关闭（连接处理任务的异常会被 asyncio 当作未处理错误打印）
+        finally:
+            for sid in subscribed:
+                self._remove(sid, writer)
+            self.connections.discard(writer)
+            writer.close()
+
+    def _remove(self, sid: bytes, writer: asyncio.StreamWriter):
+        writers = self.subscribers.get(sid)
+        if writers is not None:
+            writers.discard(writer)
+            if not writers:
+                del self.subscribers[sid]
+
+
+class UnixSocketBus(MessageBus):
+    """同机多 worker 总线：连接 Unix 套接字中转，获得文件锁的 worker 同时运行中转"""
+
+    def __init__(self, path: str = WS_BUS_SOCKET_PATH):
+        super().__init__()
+        self.path = path
+        self.broker: Optional[_UnixBroker] = None
+        self._lock_file = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._connected = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, on_message, timeout: float = 5.0):
+        await super().start(on_message)
+        self._task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout)
+        except asyncio.TimeoutError:
+            print("消息总线连接超时，稍后自动重试")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._writer is not None:
+            self._writer.close()
+        await self._release_broker()
+
+    def _try_become_broker(self) -> bool:
+        """非阻塞获取竞选锁；获得锁的 worker 运行中转直到退出"""
+        import fcntl
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        lock_file = open(f"{self.path}.lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    async def _release_broker(self):
+        if self.broker is not None:
+            await self.broker.close()
+            self.broker = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    async def _run(self):
+        while True:
+            try:
+                if self.broker is None and self._try_become_broker():
+                    self.broker = _UnixBroker(self.path)
+                    await self.broker.start()
+                    print(f"消息总线中转已在本进程启动: {self.path}")
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except (OSError, ConnectionError):
+                await self._release_broker()
+                await asyncio.sleep(WS_BUS_RECONNECT_SECONDS)
+                continue
+
+            self._writer = writer
+            for sid in self.subscriptions:
+                writer.write(_encode_line(b"S", sid))
+            self._connected.set()
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    _, sid, ts, payload = line.rstrip(b"\n").split(b"\t", 3)
+                    await self._deliver({"sid": sid.decode(), "ts": float(ts), "msg": json.loads(payload)})
+            except (ConnectionError, ValueError) as e:
+                print(f"消息总线连接异常: {e}")
+            finally:
+                self._connected.clear()
+                self._writer = None
+                writer.close()
+            print("消息总线连接断开，重新连接")
+            await asyncio.sleep(WS_BUS_RECONNECT_SECONDS)
+
+    def _send(self, line: bytes) -> bool:
+        if self._writer is None or self._writer.is_closing():
+            return False
+        self._writer.write(line)
+        return True
+
+    def subscribe(self, client_session_id):
+        super().subscribe(client_session_id)
+        self._send(_encode_line(b"S", client_session_id))
+
+    def unsubscribe(self, client_session_id):
+        super().unsubscribe(client_session_id)
+        self._send(_encode_line(b"U", client_session_id))
+
+    def publish(self, client_session_id, message):
+        line = _encode_line(b"P", client_session_id, repr(time.time()), json.dumps(message, ensure_ascii=False))
+        if not self._send(line):
+            self._counts["dropped"] += 1
+            return False
+        self._counts["published"] += 1
+        return True
+
+    def stats(self):
+        stats = super().stats()
+        stats["connected"] = self._connected.is_set()
+        stats["is_broker"] = self.broker is not None
+        if self.broker is not None:
+            stats["broker"] = {
+                "sessions": len(self.broker.subscribers),
+                "forwarded": self.broker.forwarded,
+                "dropped": self.broker.dropped
+            }
+        return stats
+
+
+class RedisMessageBus(MessageBus):
+    """外部 Redis 协议服务的发布/订阅：每个会话一个频道"""
+
+    def __init__(self, url: str = WS_BUS_REDIS_URL, prefix: str = WS_BUS_REDIS_PREFIX):
+        super().__init__()
+        import redis.asyncio as aioredis  # 可选依赖，仅使用 redis 总线时需要
+        self.client = aioredis.Redis.from_url(url, decode_responses=True)
+        self.pubsub = self.client.pubsub()
+        self.prefix = prefix
+        self._task: Optional[asyncio.Task] = None
+
+    def _channel(self, client_session_id: str) -> str:
+        return f"{self.prefix}:{client_session_id}"
+
+    async def start(self, on_message):
+        await super().start(on_message)
+        self._task = asyncio.create_task(self._listen())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self.pubsub.close()
+        await self.client.close()
+
+    async def _listen(self):
+        while True:
+            if not self.pubsub.subscribed:
+                await asyncio.sleep(0.05)
+                continue
+            item = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            if item and item.get("type") == "message":
+                await self._deliver(json.loads(item["data"]))
+
+    def subscribe(self, client_session_id):
+        super().subscribe(client_session_id)
+        asyncio.get_running_loop().create_task(self.pubsub.subscribe(self._channel(client_session_id)))
+
+    def unsubscribe(self, client_session_id):
+        super().unsubscribe(client_session_id)
+        asyncio.get_running_loop().create_task(self.pubsub.unsubscribe(self._channel(client_session_id)))
+
+    def publish(self, client_session_id, message):
+        self._counts["published"] += 1
+        frame = json.dumps(self._frame(client_session_id, message), ensure_ascii=False)
+        asyncio.get_running_loop().create_task(self.client.publish(self._channel(client_session_id), frame))
+        return True
+
+
+def create_message_bus(kind: str = WS_BUS) -> MessageBus:
+    """按类型创建消息总线"""
+    if kind == "local":
+        return LocalMessageBus()
+    if kind == "unix":
+        return UnixSocketBus()
+    if kind == "redis":
+        return RedisMessageBus()
+    raise ValueError(f"未知消息总线: {kind}")
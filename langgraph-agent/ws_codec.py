@@ -0,0 +1,76 @@
+"""
+WebSocket 推送的帧编码协商：客户端在握手时通过子协议声明支持的编码，服务端选择其一。
+
+- v2s.msgpack：二进制帧，首字节为标志位（0 = msgpack，1 = 原始 deflate 压缩后的 msgpack），
+  超过 WS_COMPRESS_THRESHOLD_BYTES 的消息才压缩（需安装 msgpack 包）
+- v2s.json：与未声明子协议的旧客户端相同，JSON 文本帧
+
+服务端只编码下行推送；客户端发来的消息仍为 JSON 文本。
+"""
+
+import os
+import json
+import zlib
+from typing import Any, Iterable, Optional
+
+# 二进制编码的子协议名与 JSON 回退的子协议名
+BINARY_SUBPROTOCOL = "v2s.msgpack"
+JSON_SUBPROTOCOL = "v2s.json"
+# 超过该字节数的二进制帧进行 deflate 压缩
+WS_COMPRESS_THRESHOLD_BYTES = int(os.getenv('WS_COMPRESS_THRESHOLD_BYTES', '1024'))
+# deflate 压缩级别（1 最快，9 最小）
+WS_COMPRESS_LEVEL = int(os.getenv('WS_COMPRESS_LEVEL', '6'))
+# 是否允许二进制编码（关闭后所有客户端回退到 JSON 文本帧）
+WS_BINARY_ENABLED = os.getenv('WS_BINARY_ENABLED', 'true').lower() == 'true'
+
+FLAG_PLAIN = 0
+FLAG_DEFLATE = 1
+
+_msgpack = None
+
+
+def _load_msgpack():
+    global _msgpack
+    if _msgpack is None:
+        try:
+            import msgpack
+            _msgpack = msgpack
+        except ImportError:
+            print("未安装 msgpack 包，WebSocket 推送使用 JSON 文本帧")
+            _msgpack = False
+    return _msgpack
+
+
+def negotiate(requested: Iterable[str]) -> Optional[str]:
+    """从客户端声明的子协议中选择一个；客户端未声明时返回 None（JSON 文本帧）
+
+    客户端声明了子协议时必须回应其中之一，否则浏览器会拒绝连接，因此无法使用二进制编码时回应 JSON 子协议。
+    """
+    requested = list(requested)
+    if BINARY_SUBPROTOCOL in requested and WS_BINARY_ENABLED and _load_msgpack():
+        return BINARY_SUBPROTOCOL
+    if JSON_SUBPROTOCOL in requested:
+        return JSON_SUBPROTOCOL
+    return None
+
+
+def is_binary(subprotocol: Optional[str]) -> bool:
+    return subprotocol == BINARY_SUBPROTOCOL
+
+
+def encode_frame(message: str, threshold: int = WS_COMPRESS_THRESHOLD_BYTES,
+                 level: int = WS_COMPRESS_LEVEL) -> bytes:
+    """把 JSON 文本消息编码为二进制帧；消息不是合法 JSON 时抛出 ValueError"""
+    payload = _load_msgpack().packb(json.loads(message), use_bin_type=True)
+    if len(payload) > threshold:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return bytes([FLAG_DEFLATE]) + compressor.compress(payload) + compressor.flush()
+    return bytes([FLAG_PLAIN]) + payload
+
+
+def decode_frame(frame: bytes) -> Any:
+    """解码二进制帧（与前端 useWebSocket 的解码一致，用于测试与基准）"""
+    payload = frame[1:]
+    if frame[0] == FLAG_DEFLATE:
+        payload = zlib.decompress(payload, -zlib.MAX_WBITS)
+    return _load_msgpack().unpackb(payload, raw=False)
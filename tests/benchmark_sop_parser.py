@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+规则解析器与大模型解析器的对比基准（使用 test_step_grouping.py 的测试文档）
+
+用法：
+    python tests/benchmark_sop_parser.py            # 仅规则解析耗时
+    DASHSCOPE_API_KEY=... python tests/benchmark_sop_parser.py --llm   # 同时调用大模型对比
+"""
+
+import sys
+import os
+import json
+import time
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sop_rule_parser import parse_sop_rules
+from test_step_grouping import TEST_MANUSCRIPT
+from test_sop_rule_parser import check_blocks
+
+
+def benchmark_rules(iterations: int = 1000):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        parse_sop_rules(TEST_MANUSCRIPT)
+    elapsed = (time.perf_counter() - start) / iterations
+    print(f"规则解析: 平均 {elapsed * 1000:.3f} ms/次（{iterations} 次）")
+    return elapsed
+
+
+def benchmark_llm():
+    from sop_parser_tool import llm_sop_parser_async
+    from dashscope_client import run_sync
+
+    start = time.perf_counter()
+    result = json.loads(run_sync(llm_sop_parser_async(TEST_MANUSCRIPT)))
+    elapsed = time.perf_counter() - start
+    problems = check_blocks(result.get("blocks", []))
+    print(f"大模型解析: {elapsed:.2f} s/次，区块数 {len(result.get('blocks', []))}")
+    print("  不符合项: " + ("无" if not problems else "; ".join(problems)))
+
+    rule_blocks = parse_sop_rules(TEST_MANUSCRIPT)["blocks"]
+    same_type = sum(1 for a, b in zip(rule_blocks, result.get("blocks", [])) if a["type"] == b.get("type"))
+    print(f"  与规则解析类型一致的区块: {same_type}/{max(len(rule_blocks), len(result.get('blocks', [])))}")
+    return elapsed
+
+
+if __name__ == "__main__":
+    rule_elapsed = benchmark_rules()
+    if "--llm" in sys.argv:
+        llm_elapsed = benchmark_llm()
+        print(f"加速比: {llm_elapsed / rule_elapsed:.0f}x")
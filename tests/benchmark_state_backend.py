@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+状态后端操作延迟基准：对各后端测量会话状态常用操作（读写、存在性检查、全量读取、集合操作）的 p50/p99 延迟，
+以及多个进程同时读写 SQLite 后端时的延迟。
+
+用法：
+    python tests/benchmark_state_backend.py                              # memory + sqlite
+    python tests/benchmark_state_backend.py --redis redis://localhost:6379/15   # 同时测试 Redis 协议后端（需安装 redis 包）
+"""
+
+import sys
+import os
+import time
+import tempfile
+import multiprocessing
+from datetime import datetime
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+
+from state_backend import MemoryStateBackend, SQLiteStateBackend, RedisStateBackend, SharedDict, SharedSet
+
+SESSIONS = 100
+ITERATIONS = 2000
+WORKERS = 4
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def measure(fn, iterations=ITERATIONS):
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return percentile(samples, 0.5), percentile(samples, 0.99)
+
+
+def run_operations(backend):
+    """返回 {操作: (p50 微秒, p99 微秒)}"""
+    tracker = SharedDict(backend, "bench_tracker", lambda d: d.timestamp(), datetime.fromtimestamp)
+    sessions = SharedDict(backend, "bench_sessions")
+    keep = SharedSet(backend, "bench_keep")
+    session_value = {"agent_index": 1, "history": {"summary": "摘要" * 200, "recent": [["human", "问题" * 50, 104]] * 6}}
+    for i in range(SESSIONS):
+        sessions[f"s{i}"] = session_value
+        tracker[f"s{i}"] = datetime.now()
+
+    return {
+        "disconnect_tracker[s] = now": measure(lambda i: tracker.__setitem__(f"s{i % SESSIONS}", datetime.now())),
+        "s in disconnect_tracker": measure(lambda i: f"s{i % SESSIONS}" in tracker),
+        "session_histories[s] (约3KB)": measure(lambda i: sessions[f"s{i % SESSIONS}"]),
+        "session_histories[s] = session": measure(lambda i: sessions.__setitem__(f"s{i % SESSIONS}", session_value)),
+        f"disconnect_tracker.items() ({SESSIONS}项)": measure(lambda i: tracker.items(), ITERATIONS // 10),
+        "keep_sessions.add(s)": measure(lambda i: keep.add(f"s{i % SESSIONS}")),
+        "s in keep_sessions": measure(lambda i: f"s{i % SESSIONS}" in keep),
+    }
+
+
+def _contention_worker(path, iterations, queue):
+    backend = SQLiteStateBackend(path)
+    flags = SharedDict(backend, "bench_flags")
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        flags[f"w{os.getpid()}_{i % 10}"] = {"cancelled": False}
+        flags.get(f"w{os.getpid()}_{(i + 5) % 10}")
+        samples.append((time.perf_counter() - start) * 1e6)
+    queue.put(samples)
+
+
+def run_sqlite_contention(path, workers=WORKERS, iterations=ITERATIONS):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    processes = [ctx.Process(target=_contention_worker, args=(path, iterations, queue)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    samples = [s for _ in processes for s in queue.get()]
+    for process in processes:
+        process.join()
+    return percentile(samples, 0.5), percentile(samples, 0.99)
+
+
+def main():
+    backends = [
+        ("memory", MemoryStateBackend()),
+        ("sqlite", SQLiteStateBackend(os.path.join(tempfile.mkdtemp(), "state.db"))),
+    ]
+    if "--redis" in sys.argv:
+        url = sys.argv[sys.argv.index("--redis") + 1]
+        backends.append(("redis", RedisStateBackend(url, prefix="video2sop_bench")))
+
+    for name, backend in backends:
+        print(f"\n[{name}] 单进程操作延迟（微秒，p50 / p99）")
+        for operation, (p50, p99) in run_operations(backend).items():
+            print(f"  {operation:<36} {p50:>9.1f} / {p99:>9.1f}")
+        backend.close()
+
+    path = os.path.join(tempfile.mkdtemp(), "state.db")
+    SQLiteStateBackend(path).close()
+    p50, p99 = run_sqlite_contention(path)
+    print(f"\n[sqlite] {WORKERS} 个进程并发写+读（微秒）: p50 {p50:.1f} / p99 {p99:.1f}")
+
+
+if __name__ == "__main__":
+    main()
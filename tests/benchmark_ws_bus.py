@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+跨 worker 消息总线投递延迟基准：多个“worker”进程各自订阅一批会话，其余进程按固定速率向所有会话发布
+压缩进度大小的消息，统计不同负载下从发布到订阅端收到的延迟（p50 / p99 / max）。
+
+用法：
+    python tests/benchmark_ws_bus.py                 # unix 总线，默认负载档位
+    python tests/benchmark_ws_bus.py 2000 10000      # 指定每秒发布消息数
+"""
+
+import sys
+import os
+import json
+import time
+import asyncio
+import tempfile
+import multiprocessing
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+
+import ws_bus
+from ws_bus import UnixSocketBus
+
+# 保留全部延迟样本（默认只保留最近的样本用于指标接口）
+ws_bus.WS_BUS_LATENCY_SAMPLES = 10 ** 7
+
+WORKERS = 4
+SESSIONS_PER_WORKER = 50
+PUBLISHERS = 2
+DURATION_SECONDS = 3
+MESSAGE = json.dumps({
+    "type": "compression_progress", "current_frame": 12345, "total_frames": 54321, "percentage": 22,
+    "message": "压缩中... 12345/54321 帧 (22%)"
+}, ensure_ascii=False)
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else float("nan")
+
+
+def subscriber(path, index, ready, done, results):
+    async def run():
+        async def on_message(sid, message):
+            pass
+
+        bus = UnixSocketBus(path)
+        await bus.start(on_message)
+        for s in range(SESSIONS_PER_WORKER):
+            bus.subscribe(f"w{index}_s{s}")
+        await asyncio.sleep(0.2)
+        ready.set()
+        # 发布结束后再留 0.5 秒接收在途消息
+        while not done.is_set():
+            await asyncio.sleep(0.1)
+        await asyncio.sleep(0.5)
+        delivered = bus.stats()["delivered"]
+        latencies = list(bus._latencies)
+        results.put((delivered, latencies))
+        await bus.close()
+
+    asyncio.run(run())
+
+
+def publisher(path, rate, start, results):
+    async def run():
+        bus = UnixSocketBus(path)
+        await bus.start(lambda sid, message: asyncio.sleep(0))
+        start.wait()
+        sessions = [f"w{w}_s{s}" for w in range(WORKERS) for s in range(SESSIONS_PER_WORKER)]
+        interval = 1.0 / rate
+        began = time.monotonic()
+        sent = 0
+        while time.monotonic() - began < DURATION_SECONDS:
+            # 按目标速率分批发布，每 10ms 让出一次事件循环
+            due = int((time.monotonic() - began) / interval)
+            while sent < due:
+                bus.publish(sessions[sent % len(sessions)], MESSAGE)
+                sent += 1
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.2)
+        results.put(sent)
+        await bus.close()
+
+    asyncio.run(run())
+
+
+def run_load(rate):
+    ctx = multiprocessing.get_context("spawn")
+    path = os.path.join(tempfile.mkdtemp(), "ws_bus.sock")
+    start = ctx.Event()
+    done = ctx.Event()
+    results = ctx.Queue()
+    sent_results = ctx.Queue()
+
+    # 第一个 worker 获得锁并运行中转，先启动它
+    readies = [ctx.Event() for _ in range(WORKERS)]
+    subscribers = [ctx.Process(target=subscriber, args=(path, i, readies[i], done, results)) for i in range(WORKERS)]
+    subscribers[0].start()
+    readies[0].wait(10)
+    for process in subscribers[1:]:
+        process.start()
+    for ready in readies:
+        ready.wait(10)
+    publishers = [ctx.Process(target=publisher, args=(path, rate / PUBLISHERS, start, sent_results))
+                  for _ in range(PUBLISHERS)]
+    for process in publishers:
+        process.start()
+    time.sleep(0.5)
+    start.set()
+
+    sent = sum(sent_results.get() for _ in publishers)
+    done.set()
+    delivered, latencies = 0, []
+    for _ in subscribers:
+        count, samples = results.get()
+        delivered += count
+        latencies.extend(samples)
+    for process in publishers + subscribers:
+        process.join()
+    return sent, delivered, [l * 1000 for l in latencies]
+
+
+def main():
+    rates = [int(arg) for arg in sys.argv[1:]] or [1000, 5000, 20000]
+    print(f"{WORKERS} 个订阅 worker × {SESSIONS_PER_WORKER} 个会话，{PUBLISHERS} 个发布进程，每档 {DURATION_SECONDS} 秒")
+    print(f"{'目标速率/秒':>12} {'已发布':>8} {'已投递':>8} {'p50(ms)':>9} {'p99(ms)':>9} {'max(ms)':>9}")
+    for rate in rates:
+        sent, delivered, latencies = run_load(rate)
+        print(f"{rate:>12} {sent:>8} {delivered:>8} {percentile(latencies, 0.5):>9.3f} "
+              f"{percentile(latencies, 0.99):>9.3f} {max(latencies, default=float('nan')):>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
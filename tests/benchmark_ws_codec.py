@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+WebSocket 帧编码基准：对真实形态的大消息（语音识别完整句子列表、片段理解结果、长视频整合稿件）比较
+JSON 文本帧、JSON + deflate（相当于传输层 permessage-deflate）、msgpack、msgpack + deflate（ws_codec 二进制帧）
+的线上字节数与编码 CPU 时间。
+
+二进制帧的编码时间包含从 JSON 文本解析（ConnectionManager 收到的是 json.dumps 后的文本）。
+
+用法：
+    python tests/benchmark_ws_codec.py            # 默认 1 小时音频的转录
+    python tests/benchmark_ws_codec.py 3          # 指定音频时长（小时）
+"""
+
+import sys
+import os
+import json
+import time
+import zlib
+import random
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+
+import msgpack
+from ws_codec import encode_frame, decode_frame, WS_COMPRESS_THRESHOLD_BYTES
+
+ITERATIONS = 50
+PHRASES = [
+    "首先把工件放到夹具上", "确认定位销已经完全插入", "然后用扭力扳手按对角顺序拧紧四颗螺栓",
+    "扭矩设定为二十五牛米", "检查密封圈有没有破损", "如果发现毛刺需要先用锉刀处理",
+    "接下来打开气阀", "观察压力表读数稳定在零点六兆帕", "记录批次号和操作人员",
+    "这个步骤一定要戴好防护手套", "把合格的零件放到右侧周转箱", "不合格品贴红色标签单独存放"
+]
+
+
+def speech_result(hours: float):
+    """语音识别完成消息：约每 4 秒一句"""
+    random.seed(0)
+    sentences = []
+    begin = 0
+    for i in range(int(hours * 3600 / 4)):
+        duration = random.randint(2000, 6000)
+        text = "，".join(random.sample(PHRASES, random.randint(1, 3))) + "。"
+        sentences.append({"sentence_id": i + 1, "text": text, "begin_time": begin, "end_time": begin + duration})
+        begin += duration + random.randint(100, 800)
+    return {"type": "speech_recognition_complete", "audio_url": "https://example-bucket.oss-cn-beijing.aliyuncs.com/audio/a.mp3",
+            "result": sentences, "message": "语音识别已完成"}
+
+
+def manuscript(blocks: int) -> str:
+    random.seed(1)
+    lines = []
+    for i in range(blocks):
+        lines.append(f"## 步骤 {i + 1}：{random.choice(PHRASES)}")
+        lines.append(f"- 时间：{i * 40 // 60:02d}:{i * 40 % 60:02d} - {(i + 1) * 40 // 60:02d}:{(i + 1) * 40 % 60:02d}")
+        lines.append("- 操作：" + "；".join(random.sample(PHRASES, 4)) + "。")
+        lines.append("- 注意事项：" + random.choice(PHRASES) + "。")
+    return "\n".join(lines)
+
+
+def messages(hours: float):
+    return {
+        "speech_recognition_complete": speech_result(hours),
+        "segment_completed": {"type": "segment_completed", "segment_id": 3, "time_range": "00:10:00 - 00:15:00",
+                              "result": manuscript(8)},
+        "integration_completed": {"type": "integration_completed", "result": manuscript(int(hours * 90))},
+        "compression_progress": {"type": "compression_progress", "current_frame": 12345, "total_frames": 54321,
+                                 "percentage": 22, "message": "压缩中... 12345/54321 帧 (22%)"},
+    }
+
+
+def cpu_us(fn, iterations=ITERATIONS):
+    start = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - start) / iterations * 1e6
+
+
+def deflate(data: bytes) -> bytes:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    print(f"音频时长 {hours} 小时，压缩阈值 {WS_COMPRESS_THRESHOLD_BYTES} 字节，编码时间为每条消息的 CPU 微秒")
+    print(f"{'消息':<30} {'编码':<16} {'字节':>10} {'相对JSON':>9} {'编码CPU(us)':>12}")
+    for name, message in messages(hours).items():
+        text = json.dumps(message)  # 与 main.py 一致（ensure_ascii 默认开启）
+        frame = encode_frame(text)
+        assert decode_frame(frame) == message
+        rows = [
+            ("json", len(text.encode("utf-8")), cpu_us(lambda: json.dumps(message).encode("utf-8"))),
+            ("json+deflate", len(deflate(text.encode("utf-8"))),
+             cpu_us(lambda: deflate(json.dumps(message).encode("utf-8")))),
+            ("msgpack", len(msgpack.packb(json.loads(text), use_bin_type=True)) + 1,
+             cpu_us(lambda: msgpack.packb(json.loads(text), use_bin_type=True))),
+            ("ws_codec 二进制帧", len(frame), cpu_us(lambda: encode_frame(text))),
+        ]
+        base = rows[0][1]
+        for encoding, size, cpu in rows:
+            print(f"{name:<30} {encoding:<16} {size:>10} {size / base:>8.0%} {cpu:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
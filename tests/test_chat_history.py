@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+测试按 token 预算管理的会话历史与滚动摘要
+"""
+
+import sys
+import os
+import asyncio
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from chat_history import ChatHistoryManager, estimate_tokens
+from rate_limiter import PRIORITY_BACKGROUND
+
+
+class FakeSummaryModel:
+    """模拟摘要模型：记录调用次数并返回固定摘要"""
+
+    def __init__(self, during_call=None):
+        self.calls = 0
+        self.priorities = []
+        # 模拟摘要进行期间发生的操作（如新一轮对话）
+        self.during_call = during_call
+
+    async def ainvoke(self, messages, priority=None):
+        self.calls += 1
+        self.priorities.append(priority)
+        await asyncio.sleep(0)
+        if self.during_call:
+            self.during_call()
+        return AIMessage(content=f"第{self.calls}次摘要")
+
+
+def _fill(history: ChatHistoryManager, turns: int, start: int = 0):
+    for i in range(start, start + turns):
+        history.append(HumanMessage(content=f"问题{i} " + "内容" * 50))
+        history.append(AIMessage(content=f"回答{i} " + "内容" * 50))
+
+
+def test_recent_window_and_prompt_budget():
+    """测试最近窗口预算、提示词预算与内存上限"""
+    history = ChatHistoryManager(recent_tokens=300, prompt_tokens=600, summary_tokens=100, pending_tokens=1000)
+    _fill(history, 20)
+
+    assert len(history) == 40
+    prompt = history.prompt_messages()
+    total = sum(estimate_tokens(m.content) + 4 for m in prompt)
+    assert total <= 600
+    # 最近一轮对话原样保留在末尾
+    assert prompt[-1].content.startswith("回答19")
+    assert isinstance(prompt[0], HumanMessage)
+    # 待折叠队列受内存上限约束
+    assert history.retained_tokens <= 300 + 1000 + 100
+    assert history.dropped_messages > 0
+    print("✅ 历史预算控制正确")
+
+
+def test_rolling_summary():
+    """测试较早对话折叠为摘要后以系统消息出现在提示词开头"""
+    history = ChatHistoryManager(recent_tokens=300, prompt_tokens=600, summary_tokens=100, pending_tokens=1000)
+    model = FakeSummaryModel()
+    _fill(history, 5)
+    assert history.needs_summary()
+
+    assert asyncio.run(history.summarize(model))
+    assert not history.needs_summary()
+    prompt = history.prompt_messages()
+    assert isinstance(prompt[0], SystemMessage) and "第1次摘要" in prompt[0].content
+    assert prompt[-1].content.startswith("回答4")
+    assert model.priorities == [PRIORITY_BACKGROUND]
+    print("✅ 滚动摘要正确")
+
+
+def test_summary_keeps_messages_added_during_call():
+    """测试摘要期间待折叠队列发生淘汰与追加时，只移除本批已折叠的消息"""
+    history = ChatHistoryManager(recent_tokens=300, prompt_tokens=600, summary_tokens=100, pending_tokens=500)
+    _fill(history, 4)
+    batch = [message.content for message, _ in history._pending]
+
+    def new_turns():
+        # 新对话使部分本批消息因内存上限被丢弃，同时加入未折叠的新消息
+        _fill(history, 3, start=100)
+
+    model = FakeSummaryModel(during_call=new_turns)
+    assert asyncio.run(history.summarize(model))
+    remaining = [message.content for message, _ in history._pending]
+    assert remaining and not set(remaining) & set(batch)
+    assert history.dropped_messages > 0
+    assert history._pending_tokens == sum(tokens for _, tokens in history._pending)
+    print("✅ 摘要期间新增的待折叠消息被保留")
+
+
+def test_merge_summary_into_newer_copy():
+    """测试共享后端下摘要完成后合并到会话的最新副本：保留摘要期间新增的对话，只移除已折叠的消息"""
+    history = ChatHistoryManager(recent_tokens=300, prompt_tokens=600, summary_tokens=100, pending_tokens=1000)
+    _fill(history, 5)
+    snapshot = ChatHistoryManager.from_dict(history.to_dict())
+    latest = ChatHistoryManager.from_dict(history.to_dict())
+
+    # 摘要在一份副本上进行，期间另一份副本写入了新一轮对话
+    assert asyncio.run(snapshot.summarize(FakeSummaryModel()))
+    _fill(latest, 1, start=100)
+    folded = {message.content for message, _ in history._pending}
+
+    assert latest.merge_summary(snapshot)
+    assert latest.summary == "第1次摘要" and len(latest) == 12
+    assert not {message.content for message, _ in latest._pending} & folded
+    assert latest.prompt_messages()[-1].content.startswith("回答100")
+    # 较旧的摘要不会覆盖已合并的摘要，序列化后仍保留摘要进度
+    assert not latest.merge_summary(snapshot) and not latest.merge_summary(history)
+    restored = ChatHistoryManager.from_dict(latest.to_dict())
+    assert restored.summarized_through == latest.summarized_through
+    assert not restored.merge_summary(snapshot)
+    print("✅ 摘要合并到最新副本正确")
+
+
+if __name__ == "__main__":
+    test_recent_window_and_prompt_budget()
+    test_rolling_summary()
+    test_summary_keeps_messages_added_during_call()
+    test_merge_summary_into_newer_copy()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+测试 WebSocket 连接管理器：连接与会话双向索引、慢客户端不阻塞发送方、队列溢出策略、发送顺序与延迟指标、
+进度类消息的合并与最短发送间隔、二进制帧编码协商
+"""
+
+import sys
+import os
+import json
+import asyncio
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+
+from connection_manager import ConnectionManager
+from ws_bus import LocalMessageBus
+import ws_codec
+
+
+class FakeWebSocket:
+    """记录收到的消息；delay 模拟慢客户端，fail 模拟已断开的客户端"""
+
+    def __init__(self, delay=0.0, fail=False, subprotocols=()):
+        self.delay = delay
+        self.fail = fail
+        self.scope = {"subprotocols": list(subprotocols)}
+        self.subprotocol = None
+        self.sent = []
+        self.closed = False
+
+    async def accept(self, subprotocol=None):
+        self.subprotocol = subprotocol
+
+    async def send_text(self, message):
+        if self.fail:
+            raise RuntimeError("connection closed")
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sent.append(message)
+
+    async def send_bytes(self, data):
+        await self.send_text(data)
+
+    async def close(self):
+        self.closed = True
+
+
+async def drain():
+    await asyncio.sleep(0.01)
+
+
+def test_indexes_and_disconnect():
+    """测试注册、重连、换会话与断开时两个方向的索引保持一致"""
+    async def run():
+        disconnected = []
+        manager = ConnectionManager(LocalMessageBus(), on_session_disconnected=disconnected.append)
+        ws1, ws2 = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(ws1)
+        await manager.connect(ws2)
+        manager.register_client("s1", ws1)
+        manager.register_client("s2", ws1)  # 同一连接换会话
+        assert "s1" not in manager.client_sessions and manager.connections[ws1].session_id == "s2"
+
+        manager.register_client("s2", ws2)  # 会话重连到新连接
+        manager.disconnect(ws1)  # 旧连接断开不影响新连接上的会话
+        assert manager.client_sessions == {"s2": ws2} and disconnected == []
+
+        manager.disconnect(ws2)
+        manager.disconnect(ws2)  # 重复断开无副作用
+        assert manager.connections == {} and manager.client_sessions == {}
+        assert disconnected == ["s2"] and manager.bus.subscriptions == set()
+
+    asyncio.run(run())
+    print("✅ 双向索引正确")
+
+
+def test_slow_client_does_not_block_sender():
+    """测试慢客户端不阻塞发送方，且每个连接内按入队顺序发送"""
+    async def run():
+        manager = ConnectionManager()
+        slow, fast = FakeWebSocket(delay=0.05), FakeWebSocket()
+        for ws, sid in ((slow, "slow"), (fast, "fast")):
+            await manager.connect(ws)
+            manager.register_client(sid, ws)
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for i in range(20):
+            await manager.send_to_client("slow", f"m{i}")
+            await manager.send_to_client("fast", f"m{i}")
+        elapsed = loop.time() - started
+        await drain()
+        fast_sent = list(fast.sent)
+        stats = manager.stats()
+        await manager.close_all()
+        return elapsed, fast_sent, slow.sent, stats
+
+    elapsed, fast_sent, slow_sent, stats = asyncio.run(run())
+    assert elapsed < 0.05
+    assert fast_sent == [f"m{i}" for i in range(20)]
+    assert slow_sent == [f"m{i}" for i in range(len(slow_sent))]
+    assert stats["max_queue_depth"] >= 18 and stats["send_latency_ms"]["p50"] is not None
+    print("✅ 慢客户端不阻塞发送方")
+
+
+def test_overflow_policies():
+    """测试队列满时 drop_oldest / drop_newest / disconnect 三种策略"""
+    async def run(policy):
+        manager = ConnectionManager(queue_size=3, overflow_policy=policy)
+        ws = FakeWebSocket(delay=10)
+        await manager.connect(ws)
+        manager.register_client("s", ws)
+        await manager.send_to_client("s", "m0")
+        await drain()  # 写任务取走第一条后卡在发送上
+        for i in range(1, 6):
+            await manager.send_to_client("s", f"m{i}")
+        queued = [m for m, _, _ in manager.connections[ws].queue] if ws in manager.connections else None
+        await drain()
+        stats = manager.stats()
+        await manager.close_all()
+        return queued, stats, ws.closed
+
+    queued, stats, _ = asyncio.run(run("drop_oldest"))
+    assert queued == ["m3", "m4", "m5"] and stats["dropped"] == 2
+    queued, stats, _ = asyncio.run(run("drop_newest"))
+    assert queued == ["m1", "m2", "m3"] and stats["dropped"] == 2
+    queued, stats, closed = asyncio.run(run("disconnect"))
+    assert queued is None and stats["overflow_disconnects"] == 1 and closed
+    print("✅ 溢出策略正确")
+
+
+def test_send_failure_disconnects():
+    """测试发送失败或超时的连接被移除，并关闭套接字使客户端重连"""
+    async def run(ws, **options):
+        disconnected = []
+        manager = ConnectionManager(on_session_disconnected=disconnected.append, **options)
+        await manager.connect(ws)
+        manager.register_client("s", ws)
+        await manager.send_to_client("s", "m")
+        await asyncio.sleep(0.1)
+        return manager.stats(), disconnected
+
+    failed = FakeWebSocket(fail=True)
+    stats, disconnected = asyncio.run(run(failed))
+    assert stats["connections"] == 0 and stats["send_failures"] == 1 and disconnected == ["s"]
+    assert failed.closed
+
+    slow = FakeWebSocket(delay=1)
+    stats, disconnected = asyncio.run(run(slow, send_timeout=0.02))
+    assert stats["connections"] == 0 and stats["send_failures"] == 1 and disconnected == ["s"]
+    assert slow.closed and slow.sent == []
+    print("✅ 发送失败或超时时关闭连接")
+
+
+def progress(frame):
+    return json.dumps({"type": "compression_progress", "current_frame": frame, "total_frames": 100})
+
+
+def test_coalesce_queued_progress():
+    """测试队列中未发出的同键消息被最新一条原位替换，不同阶段的状态分别保留"""
+    async def run():
+        manager = ConnectionManager(min_intervals="")
+        ws = FakeWebSocket(delay=10)
+        await manager.connect(ws)
+        manager.register_client("s", ws)
+        await manager.send_to_client("s", "first")
+        await drain()  # 写任务卡在第一条上
+        await manager.send_to_client("s", progress(1))
+        await manager.send_to_client("s", json.dumps({"type": "status", "stage": "split", "message": "开始"}))
+        await manager.send_to_client("s", progress(2))
+        await manager.send_to_client("s", json.dumps({"type": "status", "stage": "split", "message": "完成"}))
+        await manager.send_to_client("s", json.dumps({"type": "status", "stage": "merge", "message": "开始"}))
+        await manager.send_to_client("s", json.dumps({"type": "status", "status": "processing"}))
+        await manager.send_to_client("s", json.dumps({"type": "status", "status": "processing"}))
+        await manager.send_to_client("s", progress(3))
+        queued = [json.loads(m) for m, _, _ in manager.connections[ws].queue]
+        stats = manager.stats()
+        await manager.close_all()
+        return queued, stats
+
+    queued, stats = asyncio.run(run())
+    assert [m.get("current_frame") or m.get("message") or m.get("status") for m in queued] == \
+        [3, "完成", "开始", "processing", "processing"]
+    assert stats["coalesced"] == 3 and stats["queued_messages"] == 5
+    print("✅ 队列中的进度消息合并正确")
+
+
+def test_min_send_interval():
+    """测试最短发送间隔内只发出最新一条，其他消息入队前先发出暂存的进度"""
+    async def run():
+        manager = ConnectionManager(min_intervals="compression_progress=0.1")
+        ws = FakeWebSocket()
+        await manager.connect(ws)
+        manager.register_client("s", ws)
+        for frame in range(1, 6):
+            await manager.send_to_client("s", progress(frame))
+        await drain()
+        early = list(ws.sent)
+        await asyncio.sleep(0.15)  # 间隔到期后发出最新一条
+        after_interval = list(ws.sent)
+        await manager.send_to_client("s", progress(6))
+        await manager.send_to_client("s", progress(7))
+        await manager.send_to_client("s", json.dumps({"type": "compression_completed"}))
+        await drain()
+        stats = manager.stats()
+        await manager.close_all()
+        return early, after_interval, ws.sent, stats
+
+    early, after_interval, sent, stats = asyncio.run(run())
+    frames = [json.loads(m).get("current_frame") for m in sent]
+    assert [json.loads(m)["current_frame"] for m in early] == [1]
+    assert [json.loads(m)["current_frame"] for m in after_interval] == [1, 5]
+    assert frames == [1, 5, 7, None] and stats["throttled_messages"] == 0
+    print("✅ 最短发送间隔正确")
+
+
+def test_binary_protocol_negotiation():
+    """测试子协议协商：声明 msgpack 的客户端收到二进制帧（大消息压缩），其余客户端收到 JSON 文本"""
+    async def run():
+        manager = ConnectionManager()
+        clients = {
+            "binary": FakeWebSocket(subprotocols=[ws_codec.BINARY_SUBPROTOCOL, ws_codec.JSON_SUBPROTOCOL]),
+            "json": FakeWebSocket(subprotocols=[ws_codec.JSON_SUBPROTOCOL]),
+            "legacy": FakeWebSocket()
+        }
+        for sid, ws in clients.items():
+            await manager.connect(ws)
+            manager.register_client(sid, ws)
+        small = {"type": "segment_processing", "segment_id": 1}
+        large = {"type": "speech_recognition_complete",
+                 "sentences": [{"begin_time": i * 1000, "text": f"第{i}句：把零件放入夹具并拧紧螺丝"} for i in range(200)]}
+        for sid in clients:
+            await manager.send_to_client(sid, json.dumps(small, ensure_ascii=False))
+            await manager.send_to_client(sid, json.dumps(large, ensure_ascii=False))
+            await manager.send_to_client(sid, "not json")
+        await drain()
+        stats = manager.stats()
+        await manager.close_all()
+        return clients, small, large, stats
+
+    clients, small, large, stats = asyncio.run(run())
+    binary = clients["binary"]
+    assert binary.subprotocol == ws_codec.BINARY_SUBPROTOCOL
+    assert clients["json"].subprotocol == ws_codec.JSON_SUBPROTOCOL and clients["legacy"].subprotocol is None
+    assert binary.sent[0][0] == ws_codec.FLAG_PLAIN and binary.sent[1][0] == ws_codec.FLAG_DEFLATE
+    assert [ws_codec.decode_frame(f) for f in binary.sent[:2]] == [small, large]
+    assert binary.sent[2] == "not json"
+    assert [json.loads(m) for m in clients["legacy"].sent[:2]] == [small, large]
+    assert stats["binary_connections"] == 1 and stats["binary_bytes"] < stats["binary_payload_json_bytes"] / 3
+    print("✅ 二进制帧协商与编码正确")
+
+
+if __name__ == "__main__":
+    test_indexes_and_disconnect()
+    test_slow_client_does_not_block_sender()
+    test_overflow_policies()
+    test_send_failure_disconnects()
+    test_coalesce_queued_progress()
+    test_min_send_interval()
+    test_binary_protocol_negotiation()
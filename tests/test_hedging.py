@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+测试对冲请求：超过延迟分位数时发起副本、取先成功的结果并取消另一份、额外开销受比例上限约束
+"""
+
+import sys
+import os
+import asyncio
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+
+from hedging import Hedger, LatencyTracker
+
+
+def make_hedger(**kwargs):
+    options = dict(percentile=0.9, min_samples=3, min_delay=0.0, max_ratio=0.5, max_concurrent=2)
+    options.update(kwargs)
+    hedger = Hedger("test", **options)
+    for _ in range(5):
+        hedger.latency.record(0.05)
+    return hedger
+
+
+def test_percentile():
+    """测试延迟分位数"""
+    tracker = LatencyTracker()
+    for value in range(1, 11):
+        tracker.record(value)
+    assert tracker.percentile(0.5) in (5, 6)
+    assert tracker.percentile(0.9) == 9
+    assert LatencyTracker().percentile(0.9) is None
+    print("✅ 延迟分位数正确")
+
+
+def test_straggler_is_hedged():
+    """测试慢请求触发对冲，副本先完成时胜出并取消原请求"""
+    hedger = make_hedger()
+    calls = []
+    cancelled = []
+
+    async def request():
+        index = len(calls)
+        calls.append(index)
+        try:
+            await asyncio.sleep(1.0 if index == 0 else 0.05)
+            return f"result{index}"
+        except asyncio.CancelledError:
+            cancelled.append(index)
+            raise
+
+    async def run():
+        result = await hedger.call(request)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == "result1"
+    assert cancelled == [0]
+    stats = hedger.stats()
+    assert stats["hedges_issued"] == 1 and stats["hedges_won"] == 1
+    print("✅ 慢请求对冲正确")
+
+
+def test_failed_hedge_does_not_win():
+    """测试先完成但失败的副本不会胜出"""
+    hedger = make_hedger()
+    calls = []
+
+    async def request():
+        index = len(calls)
+        calls.append(index)
+        if index == 0:
+            await asyncio.sleep(0.2)
+            return '{"result": "ok"}'
+        return '{"error": "boom"}'
+
+    result = asyncio.run(hedger.call(request, is_error=lambda r: '"error"' in r))
+    assert result == '{"result": "ok"}'
+    assert hedger.stats()["hedges_won"] == 0
+    print("✅ 失败副本不胜出")
+
+
+def test_hedge_budget():
+    """测试对冲次数受比例上限约束，未对冲的快请求计入延迟样本"""
+    hedger = make_hedger(max_ratio=0.0)
+
+    async def slow():
+        await asyncio.sleep(0.1)
+        return "slow"
+
+    async def run():
+        return await asyncio.gather(*[hedger.call(slow) for _ in range(4)])
+
+    assert asyncio.run(run()) == ["slow"] * 4
+    stats = hedger.stats()
+    assert stats["hedges_issued"] == 1  # 至少允许一次
+    assert stats["hedges_skipped_budget"] == 3
+    assert stats["latency_samples"] == 5 + 3
+    print("✅ 对冲额度限制正确")
+
+
+def test_caller_cancel_cancels_requests():
+    """测试调用方在对冲前后取消时，主请求与对冲请求都被取消"""
+    async def run(cancel_after):
+        hedger = make_hedger()
+        started = []
+        cancelled = []
+
+        async def request():
+            started.append(1)
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+
+        call = asyncio.create_task(hedger.call(request))
+        await asyncio.sleep(cancel_after)
+        call.cancel()
+        try:
+            await call
+        except asyncio.CancelledError:
+            pass
+        await asyncio.sleep(0)
+        return len(started), len(cancelled), hedger.stats()["active_hedges"]
+
+    # 等待对冲触发期间取消（只有主请求）
+    assert asyncio.run(run(0.01)) == (1, 1, 0)
+    # 对冲发出后取消
+    assert asyncio.run(run(0.2)) == (2, 2, 0)
+    print("✅ 调用方取消时请求被取消")
+
+
+if __name__ == "__main__":
+    test_percentile()
+    test_straggler_is_hedged()
+    test_failed_hedge_does_not_win()
+    test_hedge_budget()
+    test_caller_cancel_cancels_requests()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+测试分层整合：相邻片段分组、按时间窗口截取语音文本、逐层并行合并与自动启用阈值
+"""
+
+import sys
+import os
+import json
+import asyncio
+
+import pytest
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+
+import sop_integration_tool
+from sop_integration_tool import group_segments, should_use_hierarchy
+from transcript import Transcript
+
+
+def make_segments(count, length=300):
+    """构造 count 个每段 length 秒的片段结果"""
+    return [{
+        "segment_id": i + 1,
+        "time_range": f"{i * length // 60:02d}:{i * length % 60:02d}-{(i + 1) * length // 60:02d}:{(i + 1) * length % 60:02d}",
+        "start_time": i * length,
+        "end_time": (i + 1) * length,
+        "result": f"片段{i + 1}的操作步骤"
+    } for i in range(count)]
+
+
+TRANSCRIPT_TEXT = "\n".join(
+    f"{i + 1}. [{i * 150 // 60:02d}:{i * 150 % 60:02d}-{(i * 150 + 10) // 60:02d}:{(i * 150 + 10) % 60:02d}] 第{i + 1}句讲解"
+    for i in range(20)
+)
+
+
+def test_group_segments():
+    """测试按 fan-in 与 token 预算对相邻片段分组"""
+    segments = make_segments(10)
+    transcript = Transcript.from_text(TRANSCRIPT_TEXT)
+    groups = group_segments(segments, transcript, 4, 100000)
+    assert [len(g) for g in groups] == [4, 4, 2]
+    assert [s["segment_id"] for g in groups for s in g] == list(range(1, 11))
+    # 预算很小时每组至少包含一个片段
+    groups = group_segments(segments, transcript, 4, 10)
+    assert [len(g) for g in groups] == [1] * 10
+    print("✅ 片段分组正确")
+
+
+def test_auto_threshold():
+    """测试 auto 模式按片段数阈值启用分层整合"""
+    assert not should_use_hierarchy(make_segments(3), TRANSCRIPT_TEXT, "auto")
+    assert should_use_hierarchy(make_segments(12), TRANSCRIPT_TEXT, "auto")
+    assert not should_use_hierarchy(make_segments(12), TRANSCRIPT_TEXT, "flat")
+    assert should_use_hierarchy(make_segments(3), TRANSCRIPT_TEXT, "hierarchical")
+    print("✅ 自动启用阈值正确")
+
+
+def test_hierarchical_integration(monkeypatch):
+    """测试逐层合并：每组只附带对应时间窗口的语音文本，最终整合按时间顺序"""
+    prompts = []
+
+    async def fake_call_model(user_prompt, enable_thinking):
+        prompts.append(user_prompt)
+        await asyncio.sleep(0)
+        if "阶段性操作记录" in user_prompt:
+            return "合并结果", {}
+        return "最终草稿", {}
+
+    monkeypatch.setattr(sop_integration_tool, "_call_model", fake_call_model)
+    levels = []
+
+    async def on_level(level, group_count, input_count):
+        levels.append((level, group_count, input_count))
+
+    result = asyncio.run(sop_integration_tool.integrate_sop_segments_async(
+        make_segments(12), TRANSCRIPT_TEXT, "请输出标题", mode="hierarchical", on_level=on_level))
+
+    assert result == "最终草稿"
+    assert levels == [(1, 3, 12)]
+    merge_prompts = prompts[:-1]
+    assert len(merge_prompts) == 3
+    # 第一组覆盖 00:00-20:00，只包含该时间窗口内的语音句子
+    first = merge_prompts[0]
+    assert "00:00-20:00" in first
+    assert "第1句讲解" in first and "第8句讲解" in first and "第9句讲解" not in first
+    final = prompts[-1]
+    assert final.index("L1-1") < final.index("L1-2") < final.index("L1-3")
+    assert "请输出标题" in final
+    print("✅ 分层整合正确")
+
+
+def test_merge_failure_falls_back(monkeypatch):
+    """测试中间层合并失败时保留原片段结果"""
+    async def fake_call_model(user_prompt, enable_thinking):
+        if "阶段性操作记录" in user_prompt:
+            return None, {"error": "整合API失败: status=500", "message": ""}
+        return user_prompt, {}
+
+    monkeypatch.setattr(sop_integration_tool, "_call_model", fake_call_model)
+    result = asyncio.run(sop_integration_tool.integrate_sop_segments_async(
+        make_segments(6), "", mode="hierarchical"))
+    assert all(f"片段{i}的操作步骤" in result for i in range(1, 7))
+
+    async def failing_call_model(user_prompt, enable_thinking):
+        return None, {"error": "整合API失败: status=500", "message": "boom"}
+
+    monkeypatch.setattr(sop_integration_tool, "_call_model", failing_call_model)
+    result = json.loads(asyncio.run(sop_integration_tool.integrate_sop_segments_async(make_segments(2), "")))
+    assert result["error"] == "整合API失败: status=500"
+    print("✅ 合并失败回退正确")
+
+
+if __name__ == "__main__":
+    test_group_segments()
+    test_auto_threshold()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_hierarchical_integration(monkeypatch)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_merge_failure_falls_back(monkeypatch)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+测试长视频任务断点：保存与恢复、输入变化时重新开始、失败结果不保存、片段URL复用时限与整合结果复用
+"""
+
+import sys
+import os
+import time
+import tempfile
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+
+import job_checkpoint
+from job_checkpoint import JobCheckpoint
+
+SEGMENTS = [
+    {"segment_id": 1, "start_time": 0, "end_time": 900, "url": "https://oss/segment_01.mp4"},
+    {"segment_id": 2, "start_time": 780, "end_time": 1500, "url": "https://oss/segment_02.mp4"},
+]
+
+
+def make_result(seg, text):
+    return {"segment_id": seg["segment_id"], "time_range": "00:00-15:00",
+            "start_time": seg["start_time"], "end_time": seg["end_time"], "result": text}
+
+
+def test_resume_from_checkpoint():
+    """测试断点保存后以相同输入恢复，输入变化时从头开始"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "session", "checkpoint.json")
+        checkpoint = JobCheckpoint(path, "key-1")
+        assert not checkpoint.resumed
+        checkpoint.save_prompt_split("片段提示词", "整合提示词")
+        for seg in SEGMENTS:
+            checkpoint.save_segment(seg)
+        checkpoint.save_segment_result(make_result(SEGMENTS[0], "第一段结果"))
+        checkpoint.save_segment_result(make_result(SEGMENTS[1], "[error] 超时"))
+
+        resumed = JobCheckpoint(path, "key-1")
+        assert resumed.resumed
+        assert resumed.prompt_split == {"segment_prompt": "片段提示词", "integration_prompt": "整合提示词"}
+        assert resumed.segment_result(1)["result"] == "第一段结果"
+        assert resumed.segment_result(2) is None  # 失败结果不保存，重试时重新理解
+        assert resumed.completed_segment_count == 1
+        assert set(resumed.reusable_segments()) == {1, 2}
+
+        fresh = JobCheckpoint(path, "key-2")
+        assert not fresh.resumed and fresh.prompt_split is None
+    print("✅ 断点保存与恢复正确")
+
+
+def test_segment_url_ttl():
+    """测试超过复用时限的片段URL不再复用（已有理解结果的片段除外）"""
+    with tempfile.TemporaryDirectory() as tmp:
+        checkpoint = JobCheckpoint(os.path.join(tmp, "checkpoint.json"), "key")
+        for seg in SEGMENTS:
+            checkpoint.save_segment(seg)
+        checkpoint.save_segment_result(make_result(SEGMENTS[0], "第一段结果"))
+        for seg in checkpoint.data["segments"].values():
+            seg["uploaded_at"] = time.time() - job_checkpoint.LONG_VIDEO_CHECKPOINT_SEGMENT_TTL - 1
+        assert set(checkpoint.reusable_segments()) == {1}
+    print("✅ 片段URL复用时限正确")
+
+
+def test_integrated_reuse():
+    """测试片段结果不变时复用整合结果，变化时重新整合"""
+    with tempfile.TemporaryDirectory() as tmp:
+        checkpoint = JobCheckpoint(os.path.join(tmp, "checkpoint.json"), "key")
+        results = [make_result(SEGMENTS[0], "第一段结果"), make_result(SEGMENTS[1], "第二段结果")]
+        checkpoint.save_integrated(results, "整合草稿")
+        assert JobCheckpoint(checkpoint.path, "key").integrated_for(results) == "整合草稿"
+        changed = [results[0], make_result(SEGMENTS[1], "重新理解的第二段")]
+        assert checkpoint.integrated_for(changed) is None
+    print("✅ 整合结果复用正确")
+
+
+def test_completed_checkpoint_not_resumed():
+    """测试任务完成后相同输入重新处理，不再返回旧结果"""
+    with tempfile.TemporaryDirectory() as tmp:
+        checkpoint = JobCheckpoint(os.path.join(tmp, "checkpoint.json"), "key")
+        results = [make_result(SEGMENTS[0], "第一段结果")]
+        checkpoint.save_segment_result(results[0])
+        checkpoint.save_integrated(results, "整合草稿")
+        assert JobCheckpoint(checkpoint.path, "key").resumed
+        checkpoint.mark_completed()
+
+        rerun = JobCheckpoint(checkpoint.path, "key")
+        assert not rerun.resumed
+        assert rerun.integrated_for(results) is None and rerun.completed_segment_count == 0
+    print("✅ 已完成的断点不再恢复")
+
+
+if __name__ == "__main__":
+    test_resume_from_checkpoint()
+    test_segment_url_ttl()
+    test_integrated_reuse()
+    test_completed_checkpoint_not_resumed()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+测试持久化后台任务队列：提交立即返回、worker 数量限制、进度与结果查询、失败与取消、重启后恢复未完成任务、
+多个服务 worker 共用数据库时的领取、取消与接管
+"""
+
+import sys
+import os
+import time
+import asyncio
+import tempfile
+
+import pytest
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+
+import job_queue as jq
+from job_queue import JobQueue, report_progress
+from state_backend import MemoryStateBackend, SharedDict
+
+
+def new_db_path():
+    return os.path.join(tempfile.mkdtemp(), "jobs.db")
+
+
+def test_submit_progress_and_result(monkeypatch):
+    """测试提交立即返回任务ID，任务并发数受 worker 数量限制，进度与结果可查询"""
+    monkeypatch.setattr(jq, "JOB_PROGRESS_PERSIST_INTERVAL", 0)
+    sent = []
+
+    async def notify(session_id, message):
+        sent.append((session_id, message))
+
+    queue = JobQueue(new_db_path(), workers=2, notify=notify)
+    active = []
+    peak = []
+
+    async def work(params):
+        active.append(1)
+        peak.append(len(active))
+        await report_progress(50, "处理中")
+        await asyncio.sleep(0.05)
+        active.pop()
+        return {"echo": params["value"]}
+
+    queue.register("echo", work)
+
+    async def run():
+        await queue.start()
+        started = time.monotonic()
+        job_ids = [await queue.submit("echo", {"value": i}, "s1") for i in range(4)]
+        submit_seconds = time.monotonic() - started
+        await asyncio.sleep(0.02)
+        running = await queue.get(job_ids[0])
+        while any(job["status"] != "succeeded" for job in [await queue.get(job_id) for job_id in job_ids]):
+            await asyncio.sleep(0.01)
+        jobs = [await queue.get(job_id) for job_id in job_ids]
+        listed = await queue.list("s1")
+        await queue.stop()
+        return submit_seconds, running, jobs, listed
+
+    submit_seconds, running, jobs, listed = asyncio.run(run())
+    assert submit_seconds < 0.5
+    assert running["status"] == "running" and running["progress"] == 50 and running["message"] == "处理中"
+    assert [job["result"] for job in jobs] == [{"echo": i} for i in range(4)]
+    assert all(job["progress"] == 100 for job in jobs)
+    assert max(peak) == 2
+    assert len(listed) == 4 and "result" not in listed[0]
+    assert sum('"succeeded"' in message for _, message in sent) == 4
+    assert queue.stats()["succeeded"] == 4
+    print("✅ 任务提交、进度与结果查询正确")
+
+
+def test_failure_and_cancel():
+    """测试失败任务记录错误（HTTPException 取 detail），排队中与执行中的任务均可取消"""
+    queue = JobQueue(new_db_path(), workers=1)
+
+    class FakeHTTPException(Exception):
+        def __init__(self, detail):
+            self.detail = detail
+
+    async def fail(params):
+        raise FakeHTTPException({"error": "no_audio_stream"})
+
+    async def slow(params):
+        await asyncio.sleep(10)
+
+    queue.register("fail", fail)
+    queue.register("slow", slow)
+
+    async def run():
+        await queue.start()
+        failed = await queue.submit("fail", {})
+        running = await queue.submit("slow", {}, "s1")
+        queued = await queue.submit("slow", {}, "s1")
+        await asyncio.sleep(0.05)
+        assert (await queue.get(running))["status"] == "running"
+        assert await queue.cancel_session_jobs("s1", "slow") == 2
+        await asyncio.sleep(0.05)
+        result = [await queue.get(job_id) for job_id in (failed, running, queued)]
+        assert not await queue.cancel(failed)
+        await queue.stop()
+        return result
+
+    failed, running, queued = asyncio.run(run())
+    assert failed["status"] == "failed" and failed["error"] == {"error": "no_audio_stream"}
+    assert running["status"] == "cancelled" and queued["status"] == "cancelled"
+    try:
+        asyncio.run(queue.submit("unknown", {}))
+        assert False, "未知任务类型应当报错"
+    except ValueError:
+        pass
+    print("✅ 失败与取消处理正确")
+
+
+def test_recover_after_restart():
+    """测试服务关闭时执行中的任务在下次启动后重新执行"""
+    db_path = new_db_path()
+    runs = []
+
+    async def resumable(params):
+        runs.append(params["n"])
+        if len(runs) == 1:
+            await asyncio.sleep(10)  # 第一次执行时服务关闭
+        return params["n"] * 2
+
+    async def first_process():
+        queue = JobQueue(db_path, workers=1)
+        queue.register("resumable", resumable)
+        await queue.start()
+        job_id = await queue.submit("resumable", {"n": 21})
+        await asyncio.sleep(0.05)
+        await queue.stop()
+        return job_id
+
+    job_id = asyncio.run(first_process())
+
+    async def second_process():
+        queue = JobQueue(db_path, workers=1)
+        queue.register("resumable", resumable)
+        await queue.start()
+        while (await queue.get(job_id))["status"] != "succeeded":
+            await asyncio.sleep(0.01)
+        job = await queue.get(job_id)
+        stats = queue.stats()
+        await queue.stop()
+        return job, stats
+
+    job, stats = asyncio.run(second_process())
+    assert runs == [21, 21]
+    assert job["result"] == 42 and job["attempts"] == 2
+    assert stats["recovered"] == 1
+    print("✅ 重启后恢复未完成任务正确")
+
+
+def test_multiple_service_workers(monkeypatch):
+    """测试多个服务 worker：不重复执行仍在执行的任务，可取消其他 worker 上的任务，接管心跳超时的任务"""
+    monkeypatch.setattr(jq, "JOB_HEARTBEAT_SECONDS", 3600)
+    db_path = new_db_path()
+    cancel_flags = SharedDict(MemoryStateBackend(), "job_cancel_flags")
+    runs = []
+
+    async def slow(params):
+        runs.append(params["n"])
+        await asyncio.sleep(10)
+
+    async def run():
+        first = JobQueue(db_path, workers=1, cancel_flags=cancel_flags)
+        second = JobQueue(db_path, workers=1, cancel_flags=cancel_flags)
+        for queue in (first, second):
+            queue.register("slow", slow)
+        await first.start()
+        cancelled_job = await first.submit("slow", {"n": 1})
+        orphaned_job = await first.submit("slow", {"n": 2})
+        await asyncio.sleep(0.05)
+
+        # 另一个 worker 启动时不接管仍有心跳的任务，重复领取同一任务失败
+        await second.start()
+        await second._run(cancelled_job)
+        assert runs == [1] and not second.running
+
+        # 取消请求经共享标志转达给执行者
+        assert await second.cancel(cancelled_job)
+        while (await second.get(cancelled_job))["status"] != "cancelled":
+            await asyncio.sleep(0.05)
+
+        # 执行者心跳超时后，排队中的任务由其他 worker 接管执行
+        await asyncio.sleep(0.05)
+        assert runs == [1, 2]
+        # 模拟原执行者退出：worker 停止执行但未清除心跳，任务保持 running 状态
+        for task in first._worker_tasks + [first._heartbeat_task]:
+            task.cancel()
+        await asyncio.gather(*first._worker_tasks, first._heartbeat_task, return_exceptions=True)
+        await first._update("UPDATE jobs SET heartbeat_at=0 WHERE id=?", (orphaned_job,))
+        await second._recover()
+        await asyncio.sleep(0.05)
+        job = await second.get(orphaned_job)
+        stats = second.stats()
+        await first.stop()
+        await second.stop()
+        return job, stats
+
+    job, stats = asyncio.run(run())
+    assert runs == [1, 2, 2]
+    assert job["status"] == "running" and job["attempts"] == 2
+    assert stats["recovered"] == 1 and stats["running"] == 1
+    print("✅ 多个服务 worker 间任务领取、取消与接管正确")
+
+
+def test_dedicated_lane():
+    """测试独立通道的任务在默认通道 worker 全部占满时仍立即执行"""
+    queue = JobQueue(new_db_path(), workers=1, lanes={"compression": 1})
+    started = []
+
+    async def slow(params):
+        await asyncio.sleep(10)
+
+    async def compress(params):
+        started.append(params["n"])
+        return params["n"]
+
+    queue.register("long_video", slow)
+    queue.register("compression", compress, lane="compression")
+
+    async def run():
+        await queue.start()
+        for _ in range(3):
+            await queue.submit("long_video", {})
+        job_id = await queue.submit("compression", {"n": 1})
+        await asyncio.sleep(0.05)
+        job = await queue.get(job_id)
+        stats = queue.stats()
+        await queue.stop()
+        return job, stats
+
+    job, stats = asyncio.run(run())
+    assert job["status"] == "succeeded" and started == [1]
+    assert stats["lanes"]["default"] == {"workers": 1, "queued": 2}
+    assert stats["lanes"]["compression"]["queued"] == 0
+    try:
+        queue.register("other", compress, lane="missing")
+        assert False, "未知通道应当报错"
+    except ValueError:
+        pass
+    print("✅ 独立通道任务不被默认通道阻塞")
+
+
+if __name__ == "__main__":
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_submit_progress_and_result(monkeypatch)
+    test_failure_and_cancel()
+    test_recover_after_restart()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_multiple_service_workers(monkeypatch)
+    test_dedicated_lane()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+测试事件循环延迟监控：阻塞调用被计入延迟直方图与分位数，调试模式下记录阻塞处的调用栈
+"""
+
+import sys
+import os
+import time
+import asyncio
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+
+from loop_monitor import LoopLagMonitor
+
+
+def blocking_handler():
+    """模拟在协程中直接调用的同步阻塞函数"""
+    time.sleep(0.3)
+
+
+def test_lag_recorded():
+    """测试空闲时延迟很小，阻塞 300ms 时记录到对应分桶"""
+    async def run():
+        monitor = LoopLagMonitor(interval=0.01)
+        await monitor.start()
+        await asyncio.sleep(0.2)
+        idle = monitor.stats()
+        blocking_handler()
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+        return idle, monitor.stats()
+
+    idle, stats = asyncio.run(run())
+    assert idle["probes"] >= 5 and idle["lag_ms"]["p50"] < 20
+    assert 250 <= stats["lag_ms"]["max"] < 1000
+    assert stats["histogram"]["le_500ms"] == 1 and sum(stats["histogram"].values()) == stats["probes"]
+    assert stats["stall_count"] == 0  # 未开启调试模式
+    print(f"✅ 延迟统计正确（空闲 p50 {idle['lag_ms']['p50']:.2f}ms，阻塞 max {stats['lag_ms']['max']:.0f}ms）")
+
+
+def test_debug_stall_stack():
+    """测试调试模式下记录阻塞回调的调用栈，每次卡顿只记录一次"""
+    async def run():
+        monitor = LoopLagMonitor(interval=0.01, debug=True, slow_callback_seconds=0.05)
+        await monitor.start()
+        await asyncio.sleep(0.05)
+        blocking_handler()
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+        return monitor.stats()
+
+    stats = asyncio.run(run())
+    assert stats["stall_count"] == 1
+    stall = stats["recent_stalls"][0]
+    assert "blocking_handler" in stall["stack"] and stall["blocked_ms"] >= 50
+    print("✅ 调试模式记录阻塞调用栈")
+
+
+if __name__ == "__main__":
+    test_lag_recorded()
+    test_debug_stall_stack()
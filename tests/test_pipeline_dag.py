@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+测试流水线阶段 DAG：独立阶段并发、延迟输入、条件跳过与传播、阶段状态消息、失败取消与耗时记录
+"""
+
+import sys
+import os
+import time
+import asyncio
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+
+from pipeline_dag import StageDAG
+
+
+def build_dag(log):
+    dag = StageDAG("test")
+
+    @dag.stage(inputs=("video",), outputs=("duration", "is_long"),
+               done_status=("length_detected", lambda ctx: f"时长 {ctx['duration']}"))
+    async def probe(video):
+        await asyncio.sleep(0.02)
+        return {"duration": len(video), "is_long": len(video) > 3}
+
+    @dag.stage(inputs=("prompt", "is_long"), outputs=("segment_prompt",), when=lambda ctx: ctx["is_long"],
+               start_status=("splitting_prompt", "正在分析提示词..."))
+    async def split(prompt, is_long):
+        await asyncio.sleep(0.1)
+        log.append("split_done")
+        return {"segment_prompt": prompt + "/片段"}
+
+    @dag.stage(inputs=("duration", "is_long"), lazy_inputs=("segment_prompt",), outputs=("segments",),
+               when=lambda ctx: ctx["is_long"], start_status=("segmenting", "正在分段..."))
+    async def segments(duration, is_long, segment_prompt):
+        log.append("segmenting_started")  # 不等待提示词拆分即开始
+        await asyncio.sleep(0.1)
+        return {"segments": [f"{await segment_prompt}#{i}" for i in range(2)]}
+
+    @dag.stage(inputs=("segments",), outputs=("integrated",))
+    async def integrate(segments):
+        return {"integrated": "+".join(segments)}
+
+    @dag.stage(inputs=("is_long",), outputs=("short_result",), when=lambda ctx: not ctx["is_long"])
+    async def short(is_long):
+        return {"short_result": "短视频结果"}
+
+    return dag
+
+
+def test_long_path_runs_concurrently():
+    """测试长视频路径：提示词拆分与分段并行，状态消息按阶段发出"""
+    log = []
+    statuses = []
+
+    async def on_status(stage, message):
+        statuses.append((stage, message))
+
+    started = time.monotonic()
+    run = asyncio.run(build_dag(log).run({"video": "长视频文件", "prompt": "提示词"}, on_status))
+    elapsed = time.monotonic() - started
+
+    assert run.context["integrated"] == "提示词/片段#0+提示词/片段#1"
+    assert log.index("segmenting_started") < log.index("split_done")
+    assert elapsed < 0.2, elapsed  # 串行约需 0.22 秒
+    assert statuses[0] == ("length_detected", "时长 5")
+    assert {s for s, _ in statuses[1:]} == {"splitting_prompt", "segmenting"}
+    assert run.states == {"probe": "done", "short": "skipped", "split": "done", "segments": "done", "integrate": "done"}
+    assert set(run.timings) == {"probe", "split", "segments", "integrate"}
+    print("✅ 长视频路径并发执行正确")
+
+
+def test_short_path_skips_dependents():
+    """测试短视频路径：条件不满足的阶段及其下游被跳过"""
+    run = asyncio.run(build_dag([]).run({"video": "短", "prompt": "提示词"}))
+    assert run.context["short_result"] == "短视频结果"
+    assert "integrated" not in run.context
+    assert run.states["integrate"] == "skipped"
+    print("✅ 短视频路径跳过正确")
+
+
+def test_failure_cancels_running_stages():
+    """测试阶段失败时取消其余运行中的阶段并抛出异常"""
+    dag = StageDAG("failing")
+    cancelled = []
+
+    @dag.stage(outputs=("a",))
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    @dag.stage(outputs=("b",))
+    async def slow():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return {"b": 1}
+
+    try:
+        asyncio.run(dag.run({}))
+        assert False, "应当抛出异常"
+    except RuntimeError as e:
+        assert str(e) == "boom"
+    assert cancelled == [True]
+
+    try:
+        asyncio.run(build_dag([]).run({"video": "x"}))
+        assert False, "缺少输入来源时应当报错"
+    except ValueError:
+        pass
+    print("✅ 失败取消与依赖校验正确")
+
+
+if __name__ == "__main__":
+    test_long_path_runs_concurrently()
+    test_short_path_skips_dependents()
+    test_failure_cancels_running_stages()
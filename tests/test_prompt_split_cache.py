@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+测试提示词拆分结果的持久化缓存
+"""
+
+import sys
+import os
+import time
+import asyncio
+import tempfile
+
+import pytest
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+
+import prompt_splitter_tool
+from prompt_splitter_tool import PromptSplitCache, make_cache_key
+
+
+def test_cache_key_normalization():
+    """测试空白差异不影响缓存键，语言和模型参与缓存键"""
+    assert make_cache_key("第一行  \r\n第二行\n\n\n\n第三行 ") == make_cache_key("第一行\n第二行\n\n第三行")
+    assert make_cache_key("提示词", "zh") != make_cache_key("提示词", "en")
+    assert make_cache_key("提示词", "en-US") == make_cache_key("提示词", "en")
+    assert make_cache_key("提示词", model="qwen-plus") != make_cache_key("提示词", model="qwen-max")
+    print("✅ 缓存键规范化正确")
+
+
+def test_persistence_ttl_and_lru():
+    """测试缓存落盘后可恢复、过期失效以及 LRU 淘汰"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cache.json")
+        cache = PromptSplitCache(path, ttl_seconds=3600, max_entries=2)
+        cache.put("a", {"segment_prompt": "A1", "integration_prompt": "A2"})
+        cache.put("b", {"segment_prompt": "B1", "integration_prompt": "B2"})
+        mtime = os.stat(path).st_mtime_ns
+        assert cache.get("a")["segment_prompt"] == "A1"  # a 变为最近使用
+        assert os.stat(path).st_mtime_ns == mtime  # 命中不写文件
+        cache.put("c", {"segment_prompt": "C1", "integration_prompt": "C2"})
+
+        reloaded = PromptSplitCache(path, ttl_seconds=3600, max_entries=2)
+        assert "b" not in reloaded
+        assert reloaded.get("a") is not None and reloaded.get("c") is not None
+
+        expired = PromptSplitCache(path, ttl_seconds=0, max_entries=2)
+        time.sleep(0.01)
+        assert expired.get("a") is None
+    print("✅ 持久化、过期与LRU淘汰正确")
+
+
+def test_split_uses_cache_and_coalesces(monkeypatch):
+    """测试相同提示词只调用一次模型，失败结果不写入缓存"""
+    calls = []
+
+    async def fake_call(user_prompt):
+        calls.append(user_prompt)
+        await asyncio.sleep(0.01)
+        if "失败" in user_prompt:
+            return None
+        return {"segment_prompt": "片段:" + user_prompt, "integration_prompt": "整合:" + user_prompt}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        monkeypatch.setattr(prompt_splitter_tool, "prompt_split_cache", PromptSplitCache(os.path.join(tmp, "cache.json")))
+        monkeypatch.setattr(prompt_splitter_tool, "_call_splitter", fake_call)
+
+        async def run():
+            first = await asyncio.gather(*(prompt_splitter_tool.split_prompt_for_long_video_async("提示词") for _ in range(3)))
+            again = await prompt_splitter_tool.split_prompt_for_long_video_async("提示词 ")
+            failed = await prompt_splitter_tool.split_prompt_for_long_video_async("失败")
+            failed_again = await prompt_splitter_tool.split_prompt_for_long_video_async("失败")
+            return first, again, failed, failed_again
+
+        first, again, failed, failed_again = asyncio.run(run())
+
+    assert all(r["segment_prompt"] == "片段:提示词" for r in first)
+    assert again == first[0]
+    assert failed == failed_again == {"segment_prompt": "失败", "integration_prompt": "失败"}
+    assert calls == ["提示词", "失败", "失败"]
+    print("✅ 缓存命中与并发合并正确")
+
+
+if __name__ == "__main__":
+    test_cache_key_normalization()
+    test_persistence_ttl_and_lru()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_split_uses_cache_and_coalesces(monkeypatch)
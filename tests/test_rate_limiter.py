@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+测试模型调用调度：令牌桶限流、优先级排队、429/瞬时错误退避重试与队列指标
+"""
+
+import sys
+import os
+import asyncio
+
+import pytest
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+
+import dashscope_client
+from dashscope_client import DashScopeResponse, generation_call, generation_stream
+from rate_limiter import (
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    ModelRateLimiter,
+    TokenBucket,
+    estimate_request_tokens,
+    get_limiter,
+    parse_rate_limits,
+)
+
+
+def ok_response(content="ok", total_tokens=100):
+    return DashScopeResponse(200, {
+        "output": {"choices": [{"message": {"content": content}}]},
+        "usage": {"total_tokens": total_tokens}
+    })
+
+
+def test_token_bucket_and_config():
+    """测试令牌桶补充速度与限额配置解析"""
+    bucket = TokenBucket(60)
+    now = bucket.updated
+    bucket.take(60)
+    assert bucket.wait_time(1, now) == 1.0
+    assert bucket.wait_time(1, now + 1.0) == 0.0
+    assert parse_rate_limits("qwen-plus=600:1000000, bad, qwen3-vl-plus=60") == {
+        "qwen-plus": (600, 1000000), "qwen3-vl-plus": (60, 1000000)}
+    tokens = estimate_request_tokens(
+        [{"role": "user", "content": [{"video": "u"}, {"text": "描述视频"}]}], {"max_tokens": 100})
+    assert tokens > 100
+    print("✅ 令牌桶与限额配置正确")
+
+
+class FakeClock:
+    """可控时钟：只在测试推进时前进"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_priority_queue():
+    """测试限额耗尽时交互式调用先于更早排队的批量调用获得配额，每补充一个请求配额只放行一个调用"""
+    async def settle():
+        for _ in range(10):
+            await asyncio.sleep(0)
+
+    async def run():
+        clock = FakeClock()
+        limiter = ModelRateLimiter("test-model", 480, 1000000, clock=clock)  # 每0.125秒补充1个请求
+        limiter.requests.level = 0
+        order = []
+
+        async def call(name, priority):
+            await limiter.acquire(10, priority)
+            order.append(name)
+            limiter.release(10)
+
+        batch = [asyncio.create_task(call(f"batch{i}", PRIORITY_BATCH)) for i in range(3)]
+        await settle()
+        chat = asyncio.create_task(call("chat", PRIORITY_INTERACTIVE))
+        await settle()
+        assert order == [] and limiter.stats()["queued"] == 4
+
+        granted = []
+        for _ in range(4):
+            clock.now += 0.125
+            limiter._wake_head()
+            await settle()
+            granted.append(len(order))
+        await asyncio.gather(*batch, chat)
+        return order, granted, limiter.stats()
+
+    order, granted, stats = asyncio.run(run())
+    assert order == ["chat", "batch0", "batch1", "batch2"], order
+    assert granted == [1, 2, 3, 4], granted
+    assert stats["granted"] == 4 and stats["queued"] == 0 and stats["in_flight"] == 0
+    assert stats["max_wait_seconds"] == 0.5
+    print("✅ 优先级排队正确")
+
+
+def test_retry_on_throttle(monkeypatch):
+    """测试 429 与 5xx 自动退避重试，非重试类错误直接返回"""
+    statuses = [429, 503, 200]
+    calls = []
+
+    async def fake_post_once(path, model, messages, api_key, parameters):
+        calls.append(parameters.get("priority"))
+        status = statuses.pop(0)
+        return ok_response() if status == 200 else DashScopeResponse(status, {"code": "Throttling", "message": "limited"})
+
+    monkeypatch.setattr(dashscope_client, "_post_once", fake_post_once)
+    monkeypatch.setattr(dashscope_client, "backoff_delay", lambda attempt: 0)
+
+    response = asyncio.run(generation_call("retry-model", [{"role": "user", "content": "你好"}], priority=PRIORITY_INTERACTIVE))
+    assert response.status_code == 200
+    assert calls == [None, None, None]  # priority 不会发送给接口
+    stats = get_limiter("retry-model").stats()
+    assert stats["retries"] == 2 and stats["throttled"] == 1 and stats["granted"] == 3
+
+    statuses[:] = [400]
+    response = asyncio.run(generation_call("retry-model", [{"role": "user", "content": "你好"}]))
+    assert response.status_code == 400
+    print("✅ 退避重试正确")
+
+
+def test_stream_retry_before_output(monkeypatch):
+    """测试流式调用在产出内容前遇到限流时重试"""
+    attempts = []
+
+    async def fake_stream_once(path, model, messages, api_key, parameters):
+        attempts.append(1)
+        if len(attempts) == 1:
+            yield DashScopeResponse(429, {"code": "Throttling", "message": "limited"})
+            return
+        for piece in ("你", "好"):
+            yield ok_response(piece)
+
+    monkeypatch.setattr(dashscope_client, "_stream_once", fake_stream_once)
+    monkeypatch.setattr(dashscope_client, "backoff_delay", lambda attempt: 0)
+
+    async def run():
+        text = ""
+        async for response in generation_stream("stream-model", [{"role": "user", "content": "你好"}]):
+            assert response.status_code == 200
+            text += response.output.choices[0].message.content
+        return text
+
+    assert asyncio.run(run()) == "你好"
+    assert len(attempts) == 2
+    assert get_limiter("stream-model").stats()["in_flight"] == 0
+    print("✅ 流式重试正确")
+
+
+if __name__ == "__main__":
+    test_token_bucket_and_config()
+    test_priority_queue()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_retry_on_throttle(monkeypatch)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_stream_retry_before_output(monkeypatch)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+测试视频片段流式产出：片段切割上传完成即交给调用方，切割与后续处理重叠进行
+"""
+
+import sys
+import os
+import time
+import asyncio
+
+import pytest
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+
+import video_processor
+
+
+def fake_iter_video_segments(video_source, client_session_id, duration_sec, segment_seconds=900,
+                             overlap_seconds=120, is_local_file=False, existing=None):
+    """模拟逐段切割上传：每段耗时0.1秒"""
+    for i in range(int(duration_sec // segment_seconds)):
+        time.sleep(0.1)
+        yield {"segment_id": i + 1, "start_time": i * segment_seconds,
+               "end_time": (i + 1) * segment_seconds, "url": f"https://oss/segment_{i + 1:02d}.mp4"}
+
+
+def test_segments_overlap_with_processing(monkeypatch):
+    """测试第一个片段在全部切割完成前即开始处理，且总耗时体现流水线重叠"""
+    monkeypatch.setattr(video_processor, "iter_video_segments", fake_iter_video_segments)
+
+    async def run():
+        started = time.monotonic()
+        first_arrival = None
+        tasks = []
+
+        async def process(seg):
+            await asyncio.sleep(0.1)  # 模拟模型推理
+            return seg["segment_id"]
+
+        async for seg in video_processor.stream_video_segments("video.mp4", "session", 4 * 900, 900, 0, True):
+            if first_arrival is None:
+                first_arrival = time.monotonic() - started
+            tasks.append(asyncio.create_task(process(seg)))
+        results = await asyncio.gather(*tasks)
+        return first_arrival, time.monotonic() - started, results
+
+    first_arrival, total, results = asyncio.run(run())
+    assert results == [1, 2, 3, 4]
+    assert first_arrival < 0.2
+    # 串行执行约需 0.4（切割）+ 0.4（推理）秒，流水线约 0.5 秒
+    assert total < 0.7, total
+    print(f"✅ 片段流式产出正确（首段 {first_arrival:.2f}s，总计 {total:.2f}s）")
+
+
+def test_segment_error_propagates(monkeypatch):
+    """测试切割失败时异常传递给调用方"""
+    def failing_iter(*args, **kwargs):
+        yield {"segment_id": 1, "start_time": 0, "end_time": 900, "url": "u"}
+        raise RuntimeError("ffmpeg segment failed")
+
+    monkeypatch.setattr(video_processor, "iter_video_segments", failing_iter)
+
+    async def run():
+        received = []
+        try:
+            async for seg in video_processor.stream_video_segments("video.mp4", "session", 1800, 900, 0, True):
+                received.append(seg["segment_id"])
+        except RuntimeError as e:
+            return received, str(e)
+        return received, None
+
+    received, error = asyncio.run(run())
+    assert received == [1] and error == "ffmpeg segment failed"
+    print("✅ 切割异常传递正确")
+
+
+def test_plan_segment_ranges():
+    """测试切割前计算的片段起止时间与数量"""
+    assert video_processor.plan_segment_ranges(2000, 900, 120) == [(0, 900), (780, 1680), (1560, 2000)]
+    assert video_processor.plan_segment_ranges(900, 900, 120) == [(0, 900)]
+    assert video_processor.plan_segment_ranges(0, 900, 120) == []
+    print("✅ 片段规划正确")
+
+
+if __name__ == "__main__":
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_segments_overlap_with_processing(monkeypatch)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_segment_error_propagates(monkeypatch)
+    test_plan_segment_ranges()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+测试相同请求合并：规范化请求键、并发相同请求只执行一次、每个会话都收到完整通知
+"""
+
+import sys
+import os
+import asyncio
+import tempfile
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+
+from singleflight import SingleFlight, request_key
+
+
+def test_request_key():
+    """测试请求键与参数顺序、会话字段无关，与引用文件内容有关"""
+    a = request_key("parse_sop", {"manuscript": "草稿", "chunked": None, "client_session_id": "s1"})
+    b = request_key("parse_sop", {"client_session_id": "s2", "manuscript": "草稿"})
+    assert a == b
+    assert a != request_key("parse_sop", {"manuscript": "另一份草稿"})
+    assert a != request_key("video_understanding", {"manuscript": "草稿"})
+
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        f.write(b"v1")
+    try:
+        first = request_key("video_understanding_long", {"fps": 2}, [f.name])
+        assert first == request_key("video_understanding_long", {"fps": 2}, [f.name])
+        with open(f.name, "ab") as fh:
+            fh.write(b"v2")
+        assert first != request_key("video_understanding_long", {"fps": 2}, [f.name])
+    finally:
+        os.remove(f.name)
+    print("✅ 请求键规范化正确")
+
+
+def test_coalesced_requests_share_result_and_notifications():
+    """测试并发相同请求只执行一次，后加入的会话补收此前的通知"""
+    sent = []
+
+    async def send(session_id, message):
+        sent.append((session_id, message))
+
+    flights = SingleFlight(send)
+    runs = []
+
+    async def work():
+        runs.append(1)
+        await flights.notify("s1", "started")
+        await asyncio.sleep(0.05)
+        await flights.notify("s1", "done")
+        return {"success": True}
+
+    async def run():
+        first = asyncio.create_task(flights.do("k", "s1", work))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(flights.do("k", "s2", work))
+        third = asyncio.create_task(flights.do("k", "s1", work))  # 同一会话重复提交
+        return await asyncio.gather(first, second, third)
+
+    results = asyncio.run(run())
+    assert results == [{"success": True}] * 3
+    assert len(runs) == 1
+    assert [m for sid, m in sent if sid == "s1"] == ["started", "done"]
+    assert [m for sid, m in sent if sid == "s2"] == ["started", "done"]
+    assert flights.stats() == {"in_flight": 0, "started": 1, "coalesced": 2, "waiting_sessions": 0}
+
+    # 执行结束后相同请求会重新执行
+    asyncio.run(flights.do("k", "s1", work))
+    assert len(runs) == 2
+    print("✅ 相同请求合并正确")
+
+
+def test_late_joiner_receives_ordered_notifications():
+    """测试补发期间产生的新通知排在补发之后，且发起者没有会话时后加入的会话仍收到通知"""
+    received = []
+
+    async def send(session_id, message):
+        received.append((session_id, message))
+        await asyncio.sleep(0.01)  # 模拟较慢的发送
+
+    flights = SingleFlight(send)
+    inside = []
+
+    async def work():
+        inside.append(flights.in_flight())
+        for i in range(3):
+            await flights.notify(None, f"block{i}")
+        await asyncio.sleep(0.02)
+        await flights.notify(None, "block3")  # 在后加入会话的补发过程中产生
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    async def run():
+        first = asyncio.create_task(flights.do("k", None, work))
+        await asyncio.sleep(0.005)
+        joined = asyncio.create_task(flights.do("k", "s2", work))
+        return await asyncio.gather(first, joined)
+
+    assert asyncio.run(run()) == ["ok", "ok"]
+    assert inside == [True] and not flights.in_flight()
+    assert [m for sid, m in received if sid == "s2"] == ["block0", "block1", "block2", "block3"]
+    print("✅ 后加入会话按顺序收到完整通知")
+
+
+def test_errors_and_cancellation():
+    """测试异常传递给所有等待者，单个等待者取消不影响其他等待者"""
+    flights = SingleFlight(lambda sid, message: asyncio.sleep(0))
+
+    async def failing():
+        await asyncio.sleep(0.02)
+        raise ValueError("boom")
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    async def run():
+        errors = await asyncio.gather(flights.do("e", "s1", failing), flights.do("e", "s2", failing),
+                                      return_exceptions=True)
+        leader = asyncio.create_task(flights.do("c", "s1", slow))
+        follower = asyncio.create_task(flights.do("c", "s2", slow))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return errors, await follower
+
+    errors, result = asyncio.run(run())
+    assert all(isinstance(e, ValueError) for e in errors)
+    assert result == "ok"
+    print("✅ 异常与取消处理正确")
+
+
+if __name__ == "__main__":
+    test_request_key()
+    test_coalesced_requests_share_result_and_notifications()
+    test_late_joiner_receives_ordered_notifications()
+    test_errors_and_cancellation()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+测试长草稿分块并行解析：边界切分、并发执行与按原文顺序合并
+"""
+
+import sys
+import os
+import json
+import asyncio
+
+import pytest
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import sop_parser_tool
+from sop_rule_parser import split_manuscript
+from test_step_grouping import TEST_MANUSCRIPT
+
+
+def test_split_at_boundaries():
+    """测试分块只在章节/步骤边界切分，且不丢失内容"""
+    chunks = split_manuscript(TEST_MANUSCRIPT, 300)
+    assert len(chunks) > 1
+    assert "\n".join(chunks).strip() == TEST_MANUSCRIPT.strip()
+    for chunk in chunks[1:]:
+        first_line = chunk.strip().splitlines()[0]
+        assert first_line.startswith("第") or first_line.endswith("：")
+    # 子步骤不会与所属步骤分开
+    assert all("1.1" not in chunk or "第一步" in chunk for chunk in chunks)
+    print("✅ 分块边界正确")
+
+
+def test_chunked_parse_order_and_ids(monkeypatch):
+    """测试分块并发解析后保持原文顺序并重新分配ID"""
+    active = {"now": 0, "max": 0}
+
+    async def fake_llm_parse(chunk, on_block=None, order_prefix=()):
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        # 越靠前的分块越晚完成，验证合并不依赖完成顺序
+        await asyncio.sleep(0.05 if "标题" in chunk else 0.01)
+        active["now"] -= 1
+        first_line = chunk.strip().splitlines()[0]
+        return json.dumps({"blocks": [{"id": "x", "type": "step", "content": first_line, "show_play_button": False}]},
+                          ensure_ascii=False)
+
+    monkeypatch.setattr(sop_parser_tool, "llm_sop_parser_async", fake_llm_parse)
+    result = json.loads(asyncio.run(sop_parser_tool.chunked_sop_parser_async(TEST_MANUSCRIPT, max_chars=300)))
+
+    blocks = result["blocks"]
+    assert blocks[0]["content"].startswith("标题")
+    assert [b["id"] for b in blocks] == [f"block_{i + 1}" for i in range(len(blocks))]
+    assert active["max"] > 1
+    print("✅ 分块并行解析合并正确")
+
+
+if __name__ == "__main__":
+    test_split_at_boundaries()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_chunked_parse_order_and_ids(monkeypatch)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+测试SOP局部精修：批注目标区块定位与精修结果合并
+"""
+
+import sys
+import os
+import asyncio
+
+import pytest
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+
+import sop_refine_tool
+from sop_refine_tool import select_target_blocks
+
+BLOCKS = [
+    {"id": "block_1", "type": "title", "content": "手动压片机标准操作流程", "show_play_button": False},
+    {"id": "block_2", "type": "materials", "content": "- 手动液压压片机\n- 模具套", "show_play_button": False},
+    {"id": "block_3", "type": "step", "content": "第一步：设备准备和检查\n1.1 检查压力表", "start_time": 5, "end_time": 15, "show_play_button": True},
+    {"id": "block_4", "type": "step", "content": "第二步：模具组装\n2.1 将模具底座与模具套组装牢固", "start_time": 15, "end_time": 25, "show_play_button": True},
+    {"id": "block_5", "type": "step", "content": "第三步：压片操作\n3.1 缓慢增加压力至设定值", "start_time": 25, "end_time": 50, "show_play_button": True},
+]
+
+
+def test_select_target_blocks():
+    """测试按区块ID、步骤序号、类型、时间点和词语重合度定位目标区块"""
+    assert select_target_blocks(BLOCKS, "随便改改", ["block_4"]) == [3]
+    assert select_target_blocks(BLOCKS, "第二步写得更详细一些") == [3]
+    assert select_target_blocks(BLOCKS, "step 3 needs more detail") == [4]
+    assert select_target_blocks(BLOCKS, "标题改为英文") == [0]
+    assert select_target_blocks(BLOCKS, "00:30 处压力数值不对") == [4]
+    assert select_target_blocks(BLOCKS, "压力表的检查方法需要补充") == [2]
+    # 涉及全文或无法定位时整篇精修
+    assert select_target_blocks(BLOCKS, "全文改成英文") is None
+    assert select_target_blocks(BLOCKS, "") is None
+    print("✅ 目标区块定位正确")
+
+
+def test_scoped_refine_merge(monkeypatch):
+    """测试只精修目标区块，其余区块保持不变"""
+    calls = []
+
+    async def fake_refine(blocks, index, user_notes, enable_thinking):
+        calls.append(index)
+        return blocks[index]["content"] + "（已精修）"
+
+    monkeypatch.setattr(sop_refine_tool, "_refine_single_block", fake_refine)
+    result = asyncio.run(sop_refine_tool.refine_sop_blocks_async(BLOCKS, "第二步写得更详细一些"))
+
+    assert calls == [3]
+    assert result["refined_block_ids"] == ["block_4"]
+    assert result["blocks"][3]["content"].endswith("（已精修）")
+    assert result["blocks"][3]["start_time"] == 15
+    assert [b["content"] for i, b in enumerate(result["blocks"]) if i != 3] == \
+        [b["content"] for i, b in enumerate(BLOCKS) if i != 3]
+    assert not BLOCKS[3]["content"].endswith("（已精修）")  # 不修改输入
+    print("✅ 局部精修合并正确")
+
+
+def test_scoped_refine_reports_failed_blocks(monkeypatch):
+    """测试部分区块精修失败时返回失败区块与提示，成功的区块照常合并"""
+    async def fake_refine(blocks, index, user_notes, enable_thinking):
+        if index == 4:
+            raise ValueError("精修结果格式不正确")
+        return blocks[index]["content"] + "（已精修）"
+
+    monkeypatch.setattr(sop_refine_tool, "_refine_single_block", fake_refine)
+    result = asyncio.run(sop_refine_tool.refine_sop_blocks_async(BLOCKS, "随便改改", ["block_4", "block_5"]))
+
+    assert "error" not in result
+    assert result["refined_block_ids"] == ["block_4"]
+    assert result["failed_blocks"] == [{"id": "block_5", "error": "精修结果格式不正确"}]
+    assert result["warning"]
+    assert result["blocks"][4]["content"] == BLOCKS[4]["content"]
+
+    # 全部目标区块失败时整体返回错误
+    failed = asyncio.run(sop_refine_tool.refine_sop_blocks_async(BLOCKS, "随便改改", ["block_5"]))
+    assert failed["error"] == "精修结果格式不正确" and failed["failed_blocks"][0]["id"] == "block_5"
+    print("✅ 部分区块精修失败时返回失败区块")
+
+
+if __name__ == "__main__":
+    test_select_target_blocks()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_scoped_refine_merge(monkeypatch)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_scoped_refine_reports_failed_blocks(monkeypatch)
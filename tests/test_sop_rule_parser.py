@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+测试规则解析器的正确性（使用 test_step_grouping.py 的测试文档），以及区块类型与前端约定一致
+"""
+
+import sys
+import os
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sop_rule_parser import BLOCK_TYPES, parse_sop_rules
+from sop_parser_tool import _fill_block_defaults
+from test_step_grouping import TEST_MANUSCRIPT
+
+EXPECTED_TYPES = ["title", "abstract", "keywords", "materials", "step", "step", "step", "step", "step", "unknown"]
+EXPECTED_STEP_TIMES = [(5, 15), (15, 25), (25, 35), (35, 50), (50, 60)]
+STEP_ORDINALS = ["第一步", "第二步", "第三步", "第四步", "第五步"]
+
+
+def check_blocks(blocks):
+    """按 test_step_grouping 的分组规则检查区块，返回不符合项列表"""
+    problems = []
+    types = [b.get("type") for b in blocks]
+    if types != EXPECTED_TYPES:
+        problems.append(f"区块类型 {types}")
+    steps = [b for b in blocks if b.get("type") == "step"]
+    for i, block in enumerate(steps):
+        content = block.get("content", "")
+        if STEP_ORDINALS[i] not in content or f"{i + 1}.1" not in content:
+            problems.append(f"步骤{i + 1} 未包含主步骤和子步骤")
+        if "0:" in content:
+            problems.append(f"步骤{i + 1} 内容中残留时间戳")
+        if i < len(EXPECTED_STEP_TIMES) and (block.get("start_time"), block.get("end_time")) != EXPECTED_STEP_TIMES[i]:
+            problems.append(f"步骤{i + 1} 时间 {block.get('start_time')}-{block.get('end_time')}")
+        if not block.get("show_play_button"):
+            problems.append(f"步骤{i + 1} 缺少播放按钮")
+    return problems
+
+
+def test_rule_parser_matches_fixture():
+    """规则解析结果应满足步骤分组测试的全部要求"""
+    result = parse_sop_rules(TEST_MANUSCRIPT)
+    assert result["confidence"] >= 0.9
+    assert result["unclassified"] == []
+    assert check_blocks(result["blocks"]) == []
+    print("✅ 规则解析结果符合步骤分组要求")
+
+
+def test_question_section_is_unknown_block():
+    """测试问题澄清段落输出为 unknown 区块并保留原标题，不产生前端未定义的类型"""
+    blocks = parse_sop_rules(TEST_MANUSCRIPT)["blocks"]
+    assert all(b["type"] in BLOCK_TYPES for b in blocks)
+    question = blocks[-1]
+    assert question["type"] == "unknown" and question["content"].startswith("问题澄清：")
+    assert "是否需要定期校准压力表" in question["content"]
+    print("✅ 问题澄清段落输出为 unknown 区块")
+
+
+def test_llm_block_type_normalized():
+    """测试大模型输出的未定义类型归为 unknown"""
+    assert _fill_block_defaults({"type": "question", "content": "问题"}, 0)["type"] == "unknown"
+    assert _fill_block_defaults({"content": "其他"}, 1)["type"] == "unknown"
+    assert _fill_block_defaults({"type": "step", "content": "第一步"}, 2)["type"] == "step"
+    print("✅ 大模型区块类型归一化正确")
+
+
+if __name__ == "__main__":
+    test_rule_parser_matches_fixture()
+    test_question_section_is_unknown_block()
+    test_llm_block_type_normalized()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+测试增量语音识别的分块规划与结果合并
+"""
+
+import sys
+import os
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+
+from speech_tool import plan_audio_chunks, select_chunk_sentences, merge_chunk_sentences
+
+
+def test_plan_audio_chunks():
+    """测试分块规划：相邻分块重叠，且拥有区间首尾相接"""
+    chunks = plan_audio_chunks(700, chunk_seconds=300, overlap_seconds=10)
+
+    assert [c["start_time"] for c in chunks] == [0, 290, 580]
+    assert chunks[-1]["end_time"] == 700
+    assert chunks[0]["keep_from"] == 0
+    assert chunks[-1]["keep_until"] is None
+    for prev, cur in zip(chunks, chunks[1:]):
+        assert prev["keep_until"] == cur["keep_from"]
+
+    # 短音频只有一个分块
+    assert len(plan_audio_chunks(120, chunk_seconds=300)) == 1
+
+    # 无效参数（步长为零或负数）直接报错
+    for chunk_seconds, overlap_seconds in ((0, 0), (-10, 0), (300, 300), (300, -1)):
+        try:
+            plan_audio_chunks(700, chunk_seconds=chunk_seconds, overlap_seconds=overlap_seconds)
+        except ValueError:
+            continue
+        raise AssertionError(f"应拒绝 chunk_seconds={chunk_seconds}, overlap_seconds={overlap_seconds}")
+    print("✅ 分块规划正确")
+
+
+def test_merge_overlapping_chunks():
+    """测试重叠区的句子只保留一次，时间换算为绝对时间"""
+    chunks = plan_audio_chunks(600, chunk_seconds=300, overlap_seconds=10)
+
+    # 第一块：句子"交界"位于重叠区（293s-297s），中点在 295s 之前归第一块
+    first = select_chunk_sentences([
+        {"sentence_id": 1, "text": "开始", "begin_time": 0, "end_time": 1000},
+        {"sentence_id": 2, "text": "交界", "begin_time": 293000, "end_time": 296000},
+    ], chunks[0])
+    # 第二块从 290s 开始，同一句再次被识别
+    second = select_chunk_sentences([
+        {"sentence_id": 1, "text": "交界", "begin_time": 3000, "end_time": 6000},
+        {"sentence_id": 2, "text": "继续", "begin_time": 8000, "end_time": 9000},
+    ], chunks[1])
+
+    # 分块完成顺序不影响合并结果
+    merged = merge_chunk_sentences([second, first])
+
+    assert [s["text"] for s in merged] == ["开始", "交界", "继续"]
+    assert [s["sentence_id"] for s in merged] == [1, 2, 3]
+    assert merged[2]["begin_time"] == 298000
+    print("✅ 重叠区去重正确")
+
+
+if __name__ == "__main__":
+    test_plan_audio_chunks()
+    test_merge_overlapping_chunks()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+测试共享状态后端：各后端键值与集合语义一致、SQLite 后端跨进程可见、共享取消标志、会话历史与语音识别结果序列化
+"""
+
+import sys
+import os
+import tempfile
+import multiprocessing
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+
+from state_backend import (
+    StateBackend, MemoryStateBackend, SQLiteStateBackend, RedisStateBackend,
+    SharedDict, SharedSet, SharedCancelFlag, request_cancel
+)
+
+
+class FakeRedis:
+    """最小的 Redis 客户端替身（仅实现后端用到的 hash/set 命令）"""
+
+    def __init__(self):
+        self.data = {}
+
+    def hget(self, key, field):
+        return self.data.get(key, {}).get(field)
+
+    def hset(self, key, field, value):
+        self.data.setdefault(key, {})[field] = value
+
+    def hdel(self, key, field):
+        return 1 if self.data.get(key, {}).pop(field, None) is not None else 0
+
+    def hexists(self, key, field):
+        return field in self.data.get(key, {})
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def hlen(self, key):
+        return len(self.data.get(key, {}))
+
+    def sadd(self, key, member):
+        self.data.setdefault(key, set()).add(member)
+
+    def srem(self, key, member):
+        members = self.data.get(key, set())
+        if member in members:
+            members.remove(member)
+            return 1
+        return 0
+
+    def sismember(self, key, member):
+        return member in self.data.get(key, set())
+
+    def smembers(self, key):
+        return set(self.data.get(key, set()))
+
+
+def new_sqlite_path():
+    return os.path.join(tempfile.mkdtemp(), "state.db")
+
+
+def backends():
+    return [MemoryStateBackend(), SQLiteStateBackend(new_sqlite_path()), RedisStateBackend(client=FakeRedis())]
+
+
+def test_backends_share_semantics():
+    """测试三种后端的键值表与集合行为一致"""
+    for backend in backends():
+        sessions = SharedDict(backend, "sessions")
+        sessions["a"] = {"agent_index": 1}
+        sessions["b"] = {"agent_index": 2}
+        assert sessions["a"] == {"agent_index": 1}
+        assert "a" in sessions and "c" not in sessions and 123 not in sessions
+        assert len(sessions) == 2 and sorted(sessions) == ["a", "b"]
+        assert sorted(sessions.items()) == [("a", {"agent_index": 1}), ("b", {"agent_index": 2})]
+        assert sessions.pop("a") == {"agent_index": 1}
+        assert sessions.pop("a", None) is None
+        try:
+            del sessions["a"]
+            assert False, "删除不存在的键应当报错"
+        except KeyError:
+            pass
+
+        keep = SharedSet(backend, "keep")
+        keep.add("s1")
+        keep.add("s1")
+        assert "s1" in keep and "s2" not in keep and len(keep) == 1
+        keep.discard("s1")
+        assert "s1" not in keep
+        print(f"✅ {type(backend).__name__} 语义正确")
+
+
+def _child_writes(path):
+    backend = SQLiteStateBackend(path)
+    SharedDict(backend, "disconnects")["s1"] = 1700000000.0
+    SharedSet(backend, "keep").add("s1")
+    request_cancel(SharedDict(backend, "cancel_flags"), "s1")
+
+
+def test_backend_interface_is_abstract():
+    """测试后端基类不能直接实例化，缺少任一操作的子类同样不能实例化"""
+    class PartialBackend(StateBackend):
+        def get(self, ns, key, default=None):
+            return default
+
+    for cls in (StateBackend, PartialBackend):
+        try:
+            cls()
+        except TypeError:
+            continue
+        raise AssertionError(f"{cls.__name__} 不应能实例化")
+    print("✅ 后端基类为抽象接口")
+
+
+def test_sqlite_visible_across_processes():
+    """测试 SQLite 后端中另一个进程写入的状态与取消请求对当前进程可见"""
+    path = new_sqlite_path()
+    backend = SQLiteStateBackend(path)
+    flags = SharedDict(backend, "cancel_flags")
+    flag = SharedCancelFlag(flags, "s1", poll_seconds=0)
+    assert not flag.cancelled
+
+    process = multiprocessing.get_context("spawn").Process(target=_child_writes, args=(path,))
+    process.start()
+    process.join(30)
+    assert process.exitcode == 0
+
+    assert SharedDict(backend, "disconnects")["s1"] == 1700000000.0
+    assert "s1" in SharedSet(backend, "keep")
+    assert flag.cancelled
+    flag.release()
+    assert "s1" not in flags
+    print("✅ SQLite 后端跨进程共享正确")
+
+
+def test_cancel_flag_owner_and_codec():
+    """测试取消标志只由创建者删除，编解码仅在共享后端生效"""
+    from datetime import datetime
+    backend = MemoryStateBackend()
+    flags = SharedDict(backend, "flags")
+    old = SharedCancelFlag(flags, "s1", poll_seconds=0)
+    new = SharedCancelFlag(flags, "s1", poll_seconds=0)  # 同一会话开始新的任务
+    old.release()
+    assert "s1" in flags
+    assert request_cancel(flags, "s1") and new.cancelled
+    new.release()
+    assert not request_cancel(flags, "s1")
+
+    now = datetime.now()
+    for backend in (MemoryStateBackend(), SQLiteStateBackend(new_sqlite_path())):
+        tracker = SharedDict(backend, "tracker", lambda d: d.timestamp(), datetime.fromtimestamp)
+        tracker["s1"] = now
+        assert tracker["s1"] == now and tracker.items() == [("s1", now)]
+    print("✅ 取消标志与编解码正确")
+
+
+def test_chat_history_round_trip():
+    """测试会话历史序列化后恢复，提示词消息与统计不变"""
+    from langchain_core.messages import HumanMessage, AIMessage
+    from chat_history import ChatHistoryManager
+
+    history = ChatHistoryManager(recent_tokens=30, prompt_tokens=200)
+    for i in range(6):
+        history.append(HumanMessage(content=f"第{i}个问题：如何配置离心机的转速和温度"))
+        history.append(AIMessage(content=f"第{i}个回答：先设定转速，再设定温度"))
+    history.summary = "用户在询问离心机操作"
+
+    restored = ChatHistoryManager.from_dict(history.to_dict())
+    assert restored.stats() == {**history.stats(), "retained_tokens": restored.retained_tokens}
+    assert [(type(m), m.content) for m in restored.prompt_messages()] == \
+           [(type(m), m.content) for m in history.prompt_messages()]
+    print("✅ 会话历史序列化正确")
+
+
+
+def test_transcript_shared_between_workers():
+    """测试语音识别结果以列式字典保存在共享后端，另一个 worker 读取到相同内容"""
+    from transcript import Transcript
+
+    path = new_sqlite_path()
+    transcript = Transcript.from_sentences([
+        {"begin_time": 0, "end_time": 1500, "text": "打开离心机盖"},
+        {"begin_time": 1500, "end_time": 4000, "text": "放入样品管"}
+    ])
+    SharedDict(SQLiteStateBackend(path), "session_transcripts",
+               Transcript.to_columns, Transcript.from_columns)["s1"] = transcript
+
+    other = SharedDict(SQLiteStateBackend(path), "session_transcripts", Transcript.to_columns, Transcript.from_columns)
+    restored = other.get("s1")
+    assert isinstance(restored, Transcript) and restored.to_text() == transcript.to_text()
+    assert other.get("s2") is None
+    print("✅ 语音识别结果跨 worker 共享正确")
+
+
+if __name__ == "__main__":
+    test_backends_share_semantics()
+    test_backend_interface_is_abstract()
+    test_sqlite_visible_across_processes()
+    test_cancel_flag_owner_and_codec()
+    test_chat_history_round_trip()
+    test_transcript_shared_between_workers()
@@ -12,11 +12,8 @@ sys.path.append('/root/video2sop/langgraph-agent')
 
 from sop_parser_tool import sop_parser
 
-def test_step_grouping():
-    """测试步骤分组功能"""
-    
-    # 测试用例：包含层级步骤的SOP文档
-    test_manuscript = """
+# 测试用例：包含层级步骤的SOP文档
+TEST_MANUSCRIPT = """
 标题：手动压片机标准操作流程（SOP）草稿
 
 摘要：
@@ -70,6 +67,10 @@ def test_step_grouping():
 3. 是否需要定期校准压力表？
 """
 
+def test_step_grouping():
+    """测试步骤分组功能"""
+    test_manuscript = TEST_MANUSCRIPT
+
     print("🧪 测试SOP解析工具的步骤分组功能")
     print("=" * 60)
     
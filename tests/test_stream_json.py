@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+测试流式JSON区块解析：任意切分的文本增量中，区块闭合时立即产出
+"""
+
+import sys
+import os
+import json
+import asyncio
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+
+from stream_json import BlockStreamParser, collect_streamed_blocks
+
+BLOCKS = [
+    {"id": "block_1", "type": "title", "content": "含有 {花括号} 和 \"引号\" 与 ] 的标题"},
+    {"id": "block_2", "type": "step", "content": "第一步\n1.1 检查", "start_time": 5, "end_time": 15, "show_play_button": True},
+]
+OUTPUT = "```json\n" + json.dumps({"blocks": BLOCKS}, ensure_ascii=False, indent=2) + "\n```"
+
+
+class FakeResponse:
+    def __init__(self, content):
+        self.status_code = 200
+        self.message = ""
+        self.output = {"choices": [{"message": {"content": content}}]}
+
+
+def test_parser_any_split():
+    """测试任意切分方式下都能按顺序产出完整区块"""
+    for step in (1, 2, 5, 13, len(OUTPUT)):
+        parser = BlockStreamParser()
+        emitted = []
+        for i in range(0, len(OUTPUT), step):
+            emitted.extend(parser.feed(OUTPUT[i:i + step]))
+        assert emitted == BLOCKS, step
+        assert parser.text == OUTPUT
+    print("✅ 任意切分下区块产出正确")
+
+
+def test_block_emitted_before_stream_ends():
+    """测试第一个区块在流结束前即被回调"""
+    received = []
+    split = OUTPUT.index('"block_2"')
+
+    async def responses():
+        yield FakeResponse(OUTPUT[:split])
+        # 此时第一个区块已闭合
+        assert len(received) == 1
+        yield FakeResponse(OUTPUT[split:])
+
+    async def on_block(block, order):
+        received.append((order, block["id"]))
+
+    status, _, text = asyncio.run(collect_streamed_blocks(responses(), on_block, (3,)))
+    assert status == 200 and text == OUTPUT
+    assert received == [((3, 0), "block_1"), ((3, 1), "block_2")]
+    print("✅ 区块闭合即回调")
+
+
+if __name__ == "__main__":
+    test_parser_any_split()
+    test_block_emitted_before_stream_ends()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+测试系统资源后台采样：心跳读取不阻塞、环形缓冲区容量、ffmpeg 进程统计与历史汇总
+"""
+
+import sys
+import os
+import time
+import asyncio
+import tempfile
+import subprocess
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+
+from system_metrics import SystemMetricsSampler
+
+
+def test_resources_read_latest_snapshot():
+    """测试心跳读取最近一次采样，不做阻塞测量"""
+    sampler = SystemMetricsSampler(disk_path=tempfile.gettempdir())
+    resources = sampler.resources()
+    assert set(resources) == {"cpu_count", "cpu_percent", "memory_total_gb", "memory_percent"}
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        sampler.resources()
+    elapsed = time.perf_counter() - start
+    assert elapsed < 0.05, f"1000 次读取耗时 {elapsed:.3f}s"
+    assert len(sampler.history) == 1
+    print(f"✅ 心跳读取最近采样（1000 次 {elapsed * 1000:.1f}ms）")
+
+
+def test_background_sampling_ring_buffer():
+    """测试后台任务按间隔采样，缓冲区只保留最近的记录"""
+    async def run():
+        sampler = SystemMetricsSampler(interval=0.02, history=5, disk_path=tempfile.gettempdir())
+        await sampler.start()
+        await asyncio.sleep(0.3)
+        await sampler.stop()
+        return sampler
+
+    sampler = asyncio.run(run())
+    report = sampler.report()
+    timestamps = [s["timestamp"] for s in report["history"]]
+    assert report["samples"] == 5 and timestamps == sorted(timestamps)
+    assert report["summary"]["cpu_percent"]["max"] is not None
+    assert report["history"][-1]["disk_percent"] is not None
+    assert sampler.report(limit=2)["samples"] == 2 and sampler.report(limit=0)["samples"] == 0
+    print("✅ 后台采样与环形缓冲区正确")
+
+
+def test_ffmpeg_processes():
+    """测试 ffmpeg 进程被统计，退出后不再出现"""
+    ffmpeg = subprocess.run(["which", "ffmpeg"], capture_output=True, text=True).stdout.strip()
+    if not ffmpeg:
+        print("⚠️ 未安装 ffmpeg，跳过进程统计测试")
+        return
+    sampler = SystemMetricsSampler(disk_path=tempfile.gettempdir())
+    proc = subprocess.Popen([ffmpeg, "-loglevel", "quiet", "-f", "lavfi", "-i", "testsrc=size=320x240:rate=30",
+                             "-t", "30", "-f", "null", "-"])
+    try:
+        time.sleep(0.3)
+        sampler.sample()
+        time.sleep(0.3)
+        running = sampler.sample()["ffmpeg"]
+    finally:
+        proc.kill()
+        proc.wait()
+    assert proc.pid in [p["pid"] for p in running["processes"]]
+    assert proc.pid not in [p["pid"] for p in sampler.sample()["ffmpeg"]["processes"]]
+    print("✅ ffmpeg 进程统计正确")
+
+
+if __name__ == "__main__":
+    test_resources_read_latest_snapshot()
+    test_background_sampling_ring_buffer()
+    test_ffmpeg_processes()
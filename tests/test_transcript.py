@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+测试列式语音转录结构 Transcript
+"""
+
+import sys
+import os
+import json
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+
+from transcript import Transcript
+
+SENTENCES = [
+    {"sentence_id": 1, "text": "首先检查压片机", "begin_time": 5000, "end_time": 8000},
+    {"sentence_id": 2, "text": "然后组装模具", "begin_time": 9000, "end_time": 15000},
+    {"sentence_id": 3, "text": "最后清理台面", "begin_time": 3600000, "end_time": 3605000, "editedText": "最后清理工作台面"},
+]
+
+
+def test_round_trip():
+    """测试句子列表、拼接文本与JSON之间的往返转换"""
+    transcript = Transcript.from_sentences(SENTENCES)
+    assert len(transcript) == 3
+    assert transcript[2]["text"] == "最后清理工作台面"  # 优先使用编辑后的文本
+
+    text = transcript.to_text()
+    assert text.splitlines()[0] == "1. [00:05-00:08] 首先检查压片机"
+    assert Transcript.from_text(text).to_sentences() == transcript.to_sentences()
+
+    restored = Transcript.from_json(transcript.to_json())
+    assert restored.to_sentences() == transcript.to_sentences()
+    # 兼容 speech_recognition 返回的句子列表 JSON
+    assert len(Transcript.from_json(json.dumps(SENTENCES))) == 3
+    print("✅ 往返转换正确")
+
+
+def test_window_and_slice():
+    """测试时间窗口查询与切片视图"""
+    transcript = Transcript.from_sentences(SENTENCES)
+
+    window = transcript.window_seconds(7, 10)
+    assert [s["text"] for s in window] == ["首先检查压片机", "然后组装模具"]
+    assert len(transcript.window_seconds(20, 60)) == 0
+    assert len(transcript.window_seconds(3000, 4000)) == 1
+
+    tail = transcript[1:]
+    assert tail.begin_time == 9000
+    assert tail[0]["sentence_id"] == 1
+    assert Transcript.from_json(tail.to_json()).to_sentences() == tail.to_sentences()
+    print("✅ 窗口查询与切片正确")
+
+
+if __name__ == "__main__":
+    test_round_trip()
+    test_window_and_slice()
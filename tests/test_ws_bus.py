@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+测试跨 worker 消息总线：按会话订阅与转发、取消订阅、中转进程退出后重新竞选并恢复订阅、投递延迟统计
+"""
+
+import sys
+import os
+import asyncio
+import tempfile
+
+# 添加langgraph-agent目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'langgraph-agent'))
+
+import ws_bus
+from ws_bus import MessageBus, LocalMessageBus, UnixSocketBus
+
+ws_bus.WS_BUS_RECONNECT_SECONDS = 0.05
+
+
+def new_socket_path():
+    return os.path.join(tempfile.mkdtemp(), "ws_bus.sock")
+
+
+async def start_worker(path, inbox):
+    async def on_message(sid, message):
+        inbox.append((sid, message))
+
+    bus = UnixSocketBus(path)
+    await bus.start(on_message)
+    return bus
+
+
+async def wait_for(predicate, timeout=3.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "等待超时"
+        await asyncio.sleep(0.01)
+
+
+def test_unix_bus_routes_by_session():
+    """测试只有订阅该会话的 worker 收到消息，取消订阅后不再收到"""
+    path = new_socket_path()
+
+    async def run():
+        inbox_a, inbox_b, inbox_c = [], [], []
+        a = await start_worker(path, inbox_a)
+        b = await start_worker(path, inbox_b)
+        c = await start_worker(path, inbox_c)
+        assert a.stats()["is_broker"] and not b.stats()["is_broker"]
+
+        b.subscribe("s1")
+        c.subscribe("s2")
+        await asyncio.sleep(0.05)
+        assert a.publish("s1", '{"type": "compression_progress"}')
+        assert a.publish("s2", '{"type": "segment_completed"}')
+        await wait_for(lambda: inbox_b and inbox_c)
+
+        b.unsubscribe("s1")
+        await asyncio.sleep(0.05)
+        a.publish("s1", "late")
+        await asyncio.sleep(0.1)
+        stats = b.stats()
+        for bus in (c, b, a):
+            await bus.close()
+        return inbox_a, inbox_b, inbox_c, stats
+
+    inbox_a, inbox_b, inbox_c, stats = asyncio.run(run())
+    assert inbox_a == []
+    assert inbox_b == [("s1", '{"type": "compression_progress"}')]
+    assert inbox_c == [("s2", '{"type": "segment_completed"}')]
+    assert stats["delivered"] == 1 and stats["latency_ms"]["p50"] is not None
+    print("✅ 按会话订阅转发正确")
+
+
+def test_broker_failover_restores_subscriptions():
+    """测试运行中转的 worker 退出后，其余 worker 重新竞选中转并恢复订阅"""
+    path = new_socket_path()
+
+    async def run():
+        inbox_b, inbox_c = [], []
+        a = await start_worker(path, [])
+        b = await start_worker(path, inbox_b)
+        c = await start_worker(path, inbox_c)
+        b.subscribe("s1")
+        await a.close()  # 中转所在的 worker 退出
+
+        await wait_for(lambda: (b.broker or c.broker) and b.stats()["connected"] and c.stats()["connected"])
+        brokers = [bus.stats()["is_broker"] for bus in (b, c)]
+        await asyncio.sleep(0.05)
+        c.publish("s1", "after failover")
+        await wait_for(lambda: inbox_b)
+        await c.close()
+        await b.close()
+        return brokers, inbox_b
+
+    brokers, inbox_b = asyncio.run(run())
+    assert sorted(brokers) == [False, True]
+    assert inbox_b == [("s1", "after failover")]
+    print("✅ 中转重新竞选与订阅恢复正确")
+
+
+def test_local_bus():
+    """测试进程内总线只投递已订阅的会话"""
+    async def run():
+        inbox = []
+
+        async def on_message(sid, message):
+            inbox.append((sid, message))
+
+        bus = LocalMessageBus()
+        await bus.start(on_message)
+        bus.subscribe("s1")
+        assert bus.publish("s1", "m")
+        assert not bus.publish("s2", "m")
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        return inbox
+
+    assert asyncio.run(run()) == [("s1", "m")]
+    print("✅ 进程内总线正确")
+
+
+def test_bus_interface_is_abstract():
+    """测试总线基类与未实现 publish 的子类不能实例化"""
+    class SilentBus(MessageBus):
+        pass
+
+    for cls in (MessageBus, SilentBus):
+        try:
+            cls()
+        except TypeError:
+            continue
+        raise AssertionError(f"{cls.__name__} 不应能实例化")
+    print("✅ 总线基类为抽象接口")
+
+
+if __name__ == "__main__":
+    test_unix_bus_routes_by_session()
+    test_broker_failover_restores_subscriptions()
+    test_local_bus()
+    test_bus_interface_is_abstract()